@@ -0,0 +1,248 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, Callable, List, Optional, Tuple
+from src.models.management import InventoryAlert, db
+from src.services.notification_service import NotificationService
+
+
+class _RecipientWindow:
+    __slots__ = ('started_at', 'pending')
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.pending: List[Dict[str, Any]] = []
+
+
+class AlertDispatcher:
+    """
+    Envoi des alertes d'inventaire hors de la requête, avec récapitulatif en cas de rafale
+
+    La première alerte d'un destinataire part tout de suite. Les alertes suivantes
+    reçues pendant la fenêtre (digest_window_seconds) sont regroupées et envoyées
+    en un seul message à la fin de la fenêtre: un import CSV qui déclenche 5 000
+    alertes produit un récapitulatif par destinataire, pas 5 000 emails. Chaque
+    envoi part vers tous ses destinataires en parallèle (NotificationService.send_to_many).
+
+    Les fenêtres ne vivent qu'en mémoire, mais chaque alerte est en base sans
+    notified_at tant qu'elle n'est pas envoyée: la reprise (set_recovery)
+    renvoie périodiquement celles restées sans notification bien au-delà d'une
+    fenêtre (processus redémarré ou envoi échoué).
+    """
+
+    def __init__(self, digest_window_seconds: Optional[float] = None, tick_seconds: float = 1.0):
+        self.digest_window_seconds = digest_window_seconds or float(os.getenv('ALERT_DIGEST_WINDOW_SECONDS', 60))
+        self.tick_seconds = tick_seconds
+        self.orphan_after_seconds = 5 * self.digest_window_seconds
+        self.recovery: Optional[Callable[[float], int]] = None
+        self.last_recovery = 0.0
+
+        self.notification_service = NotificationService()
+
+        self.app = None
+        self.incoming: queue.Queue = queue.Queue()
+        self.windows: Dict[str, _RecipientWindow] = {}
+        self.thread: Optional[threading.Thread] = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.stats = {
+            'alerts_received': 0,
+            'immediate_messages': 0,
+            'digest_messages': 0,
+            'alerts_in_digests': 0,
+            'recipient_deliveries': 0,
+            'recipient_failures': 0,
+            'recovered_alerts': 0
+        }
+
+    def init_app(self, app):
+        """
+        Le thread d'envoi ouvre son propre contexte d'application pour marquer les alertes notifiées
+        """
+        self.app = app
+
+    def start(self):
+        self._ensure_started()
+
+    def set_recovery(self, recovery: Callable[[float], int]):
+        """
+        Fonction de reprise des alertes orphelines (reçoit l'âge minimal en secondes, renvoie le nombre renvoyé)
+        """
+        self.recovery = recovery
+
+    def submit(self, alert: Dict[str, Any], recipients: List[str]):
+        """
+        Confier une alerte au thread d'envoi (ne bloque pas la requête)
+
+        alert contient id, alert_type, severity, item_name, sku, current_stock et threshold.
+        """
+        if not recipients:
+            return
+        self._ensure_started()
+        self.incoming.put((alert, list(recipients)))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['open_windows'] = len(self.windows)
+            stats['alerts_waiting_for_digest'] = sum(len(window.pending) for window in self.windows.values())
+        stats['queued'] = self.incoming.qsize()
+        stats['digest_window_seconds'] = self.digest_window_seconds
+        return stats
+
+    def _ensure_started(self):
+        """
+        Démarrer le thread d'envoi dans ce processus (les threads ne survivent pas au fork)
+        """
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.incoming = queue.Queue()
+            self.windows = {}
+            self.thread = threading.Thread(target=self._run, name='inventory-alerts', daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def _run(self):
+        while True:
+            received = []
+            try:
+                received.append(self.incoming.get(timeout=self.tick_seconds))
+                # Vider ce qui est déjà arrivé: une rafale est traitée d'un bloc
+                while True:
+                    received.append(self.incoming.get_nowait())
+            except queue.Empty:
+                pass
+
+            try:
+                notified = self._route(received) if received else []
+                notified.extend(self._flush_digests())
+                if notified:
+                    self._mark_notified(notified)
+            except Exception as e:
+                print(f"Erreur envoi alertes inventaire: {e}")
+
+            if self.recovery is not None and time.monotonic() - self.last_recovery >= self.orphan_after_seconds:
+                self.last_recovery = time.monotonic()
+                self._recover()
+
+    def _recover(self):
+        with self.app.app_context():
+            try:
+                recovered = self.recovery(self.orphan_after_seconds)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Erreur reprise des alertes inventaire: {e}")
+                return
+        with self.lock:
+            self.stats['recovered_alerts'] += recovered
+
+    def _route(self, received: List[Tuple[Dict[str, Any], List[str]]]) -> List[int]:
+        """
+        Envoyer tout de suite aux destinataires hors fenêtre, mettre les autres en attente
+        """
+        now = time.monotonic()
+        immediate: Dict[int, Tuple[Dict[str, Any], List[str]]] = {}
+
+        with self.lock:
+            self.stats['alerts_received'] += len(received)
+            for alert, recipients in received:
+                for recipient in recipients:
+                    window = self.windows.get(recipient)
+                    if window is None:
+                        self.windows[recipient] = _RecipientWindow(now)
+                        immediate.setdefault(alert['id'], (alert, []))[1].append(recipient)
+                    else:
+                        window.pending.append(alert)
+
+        notified = []
+        for alert, recipients in immediate.values():
+            subject, message = self.notification_service.inventory_alert_content(
+                alert['alert_type'], alert['item_name'], alert['current_stock'], alert['threshold']
+            )
+            if self._deliver(recipients, subject, message, None, 'immediate_messages'):
+                notified.append(alert['id'])
+        return notified
+
+    def _flush_digests(self) -> List[int]:
+        """
+        Fenêtres échues: un récapitulatif par groupe de destinataires ayant les mêmes alertes
+        """
+        now = time.monotonic()
+        groups: Dict[Tuple[int, ...], Tuple[List[Dict[str, Any]], List[str]]] = {}
+
+        with self.lock:
+            for recipient, window in list(self.windows.items()):
+                if now - window.started_at < self.digest_window_seconds:
+                    continue
+                if not window.pending:
+                    del self.windows[recipient]
+                    continue
+
+                # La rafale continue: nouvelle fenêtre, le prochain récapitulatif suivra
+                alerts = list({alert['id']: alert for alert in window.pending}.values())
+                self.windows[recipient] = _RecipientWindow(now)
+                key = tuple(sorted(alert['id'] for alert in alerts))
+                groups.setdefault(key, (alerts, []))[1].append(recipient)
+
+        notified = []
+        for alerts, recipients in groups.values():
+            if len(alerts) == 1:
+                alert = alerts[0]
+                subject, message = self.notification_service.inventory_alert_content(
+                    alert['alert_type'], alert['item_name'], alert['current_stock'], alert['threshold']
+                )
+                delivered = self._deliver(recipients, subject, message, None, 'immediate_messages')
+            else:
+                subject, message, sms_message = self.notification_service.inventory_digest_content(alerts)
+                delivered = self._deliver(recipients, subject, message, sms_message, 'digest_messages')
+                with self.lock:
+                    self.stats['alerts_in_digests'] += len(alerts)
+            if delivered:
+                notified.extend(alert['id'] for alert in alerts)
+        return notified
+
+    def _deliver(self, recipients: List[str], subject: str, message: str, sms_message: Optional[str],
+                 counter: str) -> bool:
+        results = self.notification_service.send_to_many(recipients, subject, message, sms_message, priority='alert')
+        delivered = sum(1 for success in results.values() if success)
+
+        with self.lock:
+            self.stats[counter] += 1
+            self.stats['recipient_deliveries'] += delivered
+            self.stats['recipient_failures'] += len(results) - delivered
+        return delivered > 0
+
+    def _mark_notified(self, alert_ids: List[int]):
+        """
+        Marquer les alertes envoyées à au moins un destinataire (une requête par lot)
+        """
+        with self.app.app_context():
+            try:
+                now = datetime.utcnow()
+                for start in range(0, len(alert_ids), 500):
+                    InventoryAlert.query.filter(InventoryAlert.id.in_(alert_ids[start:start + 500])).update(
+                        {'notified_at': now}, synchronize_session=False
+                    )
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Erreur mise à jour des alertes notifiées: {e}")
+
+
+_alert_dispatcher = None
+
+
+def get_alert_dispatcher() -> AlertDispatcher:
+    """
+    Instance partagée de l'envoi des alertes d'inventaire
+    """
+    global _alert_dispatcher
+    if _alert_dispatcher is None:
+        _alert_dispatcher = AlertDispatcher()
+    return _alert_dispatcher
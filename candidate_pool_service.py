@@ -0,0 +1,305 @@
+import random
+import threading
+import time
+from array import array
+from typing import Dict, Any, List, Optional, Set, Tuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from src.models.conversation import Product, db
+from src.models.management import InventoryItem
+from src.services.trending_service import get_trending_service
+
+
+class CategoryCandidatePool:
+    """
+    Pools en mémoire des produits actifs et disponibles par catégorie
+
+    Chaque catégorie est un tableau contigu d'identifiants avec suppression en
+    O(1) (échange avec le dernier élément), ce qui permet un tirage aléatoire
+    en O(k) au lieu d'un ORDER BY RANDOM() sur toute la catégorie.
+    """
+
+    def __init__(self, reload_interval_seconds: int = 600, weights_ttl_seconds: int = 60):
+        self.reload_interval_seconds = reload_interval_seconds
+        self.weights_ttl_seconds = weights_ttl_seconds
+
+        self.pools: Dict[str, array] = {}
+        self.positions: Dict[int, int] = {}
+
+        # Tous les produits actifs (y compris en rupture) et leur catégorie
+        self.product_category: Dict[int, str] = {}
+        self.unavailable: Set[int] = set()
+        self.margins: Dict[int, float] = {}
+
+        # Tables d'alias pour le tirage pondéré: (catégorie, pondération) -> (version, date, ids, probas, alias)
+        self.alias_tables: Dict[Tuple[str, str], Tuple[int, float, array, array, array]] = {}
+        self.versions: Dict[str, int] = {}
+
+        self.lock = threading.RLock()
+        self.loaded_at: Optional[float] = None
+
+    def ensure_loaded(self):
+        """
+        Charger les pools au premier usage puis périodiquement (rattrapage des écarts)
+        """
+        if self.loaded_at and time.time() - self.loaded_at < self.reload_interval_seconds:
+            return
+        self.reload()
+
+    def reload(self) -> Dict[str, Any]:
+        """
+        Reconstruire les pools depuis la base
+        """
+        products = db.session.query(Product.id, Product.category)\
+                             .filter(Product.is_active == True).all()
+
+        inventory = db.session.query(
+            InventoryItem.product_id,
+            InventoryItem.is_active,
+            InventoryItem.available_stock,
+            InventoryItem.cost_price,
+            InventoryItem.selling_price
+        ).all()
+
+        unavailable = set()
+        margins = {}
+        for product_id, is_active, available_stock, cost_price, selling_price in inventory:
+            if not product_id.isdigit():
+                continue
+            if not is_active or available_stock <= 0:
+                unavailable.add(int(product_id))
+            if cost_price is not None and selling_price is not None:
+                margins[int(product_id)] = selling_price - cost_price
+
+        with self.lock:
+            self.pools = {}
+            self.positions = {}
+            self.product_category = {}
+            self.unavailable = unavailable
+            self.margins = margins
+            self.alias_tables = {}
+            self.versions = {}
+
+            for product_id, category in products:
+                if category:
+                    self.product_category[product_id] = category
+                    if product_id not in unavailable:
+                        self._insert(product_id, category)
+
+            self.loaded_at = time.time()
+
+        return {
+            'categories': len(self.pools),
+            'products': len(self.positions),
+            'unavailable': len(unavailable)
+        }
+
+    def sample(self, category: str, k: int, weighting: Optional[str] = None) -> List[int]:
+        """
+        Tirer k produits distincts d'une catégorie, uniformément ou pondérés ('popularity', 'margin')
+        """
+        self.ensure_loaded()
+
+        with self.lock:
+            pool = self.pools.get(category)
+            if not pool:
+                return []
+
+            if k >= len(pool):
+                product_ids = list(pool)
+                random.shuffle(product_ids)
+                return product_ids
+
+            if weighting is None:
+                return [pool[i] for i in random.sample(range(len(pool)), k)]
+
+            return self._sample_weighted(category, k, weighting)
+
+    def on_product_change(self, product_id: int, category: Optional[str], is_active: bool):
+        """
+        Répercuter la création, modification ou désactivation d'un produit
+        """
+        if not self.loaded_at:
+            return
+
+        with self.lock:
+            self._remove(product_id)
+            self.product_category.pop(product_id, None)
+
+            if is_active and category:
+                self.product_category[product_id] = category
+                if product_id not in self.unavailable:
+                    self._insert(product_id, category)
+
+    def on_inventory_change(self, product_id: str, is_active: bool, available_stock: int,
+                            cost_price: Optional[float] = None, selling_price: Optional[float] = None):
+        """
+        Répercuter une variation de stock (rupture ou retour en stock)
+        """
+        if not self.loaded_at or not product_id or not product_id.isdigit():
+            return
+
+        key = int(product_id)
+
+        with self.lock:
+            if cost_price is not None and selling_price is not None:
+                self.margins[key] = selling_price - cost_price
+
+            if not is_active or available_stock <= 0:
+                self.unavailable.add(key)
+                self._remove(key)
+            else:
+                self.unavailable.discard(key)
+                category = self.product_category.get(key)
+                if category and key not in self.positions:
+                    self._insert(key, category)
+
+    def _insert(self, product_id: int, category: str):
+        pool = self.pools.get(category)
+        if pool is None:
+            pool = self.pools[category] = array('q')
+        self.positions[product_id] = len(pool)
+        pool.append(product_id)
+        self.versions[category] = self.versions.get(category, 0) + 1
+
+    def _remove(self, product_id: int):
+        position = self.positions.pop(product_id, None)
+        if position is None:
+            return
+
+        category = self.product_category[product_id]
+        pool = self.pools[category]
+
+        # Échanger avec le dernier élément pour une suppression en O(1)
+        last_id = pool.pop()
+        if last_id != product_id:
+            pool[position] = last_id
+            self.positions[last_id] = position
+        self.versions[category] = self.versions.get(category, 0) + 1
+
+    def _sample_weighted(self, category: str, k: int, weighting: str) -> List[int]:
+        """
+        Tirage pondéré sans remise via une table d'alias (O(1) par tirage)
+        """
+        product_ids, probabilities, aliases = self._alias_table(category, weighting)
+        size = len(product_ids)
+
+        selected = []
+        seen = set()
+        attempts = 0
+
+        while len(selected) < k and attempts < 10 * k:
+            attempts += 1
+            column = random.randrange(size)
+            index = column if random.random() < probabilities[column] else aliases[column]
+            if index not in seen:
+                seen.add(index)
+                selected.append(product_ids[index])
+
+        return selected
+
+    def _alias_table(self, category: str, weighting: str) -> Tuple[array, array, array]:
+        """
+        Construire (ou réutiliser) la table d'alias de Vose pour une catégorie
+        """
+        version = self.versions.get(category, 0)
+        cached = self.alias_tables.get((category, weighting))
+        if cached and cached[0] == version and time.time() - cached[1] < self.weights_ttl_seconds:
+            return cached[2], cached[3], cached[4]
+
+        product_ids = array('q', self.pools[category])
+        weights = [self._weight(product_id, weighting) for product_id in product_ids]
+        size = len(product_ids)
+        total = sum(weights)
+
+        scaled = [weight * size / total for weight in weights]
+        probabilities = array('d', [0.0] * size)
+        aliases = array('q', range(size))
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+
+        while small and large:
+            less, more = small.pop(), large.pop()
+            probabilities[less] = scaled[less]
+            aliases[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+
+        for index in small + large:
+            probabilities[index] = 1.0
+
+        self.alias_tables[(category, weighting)] = (version, time.time(), product_ids, probabilities, aliases)
+        return product_ids, probabilities, aliases
+
+    def _weight(self, product_id: int, weighting: str) -> float:
+        # Un plancher garde une chance de tirage aux produits sans signal
+        if weighting == 'margin':
+            return max(self.margins.get(product_id, 0.0), 0.0) + 1.0
+        if weighting == 'popularity':
+            return get_trending_service().products.score(str(product_id), time.time()) + 1.0
+        return 1.0
+
+
+_candidate_pool = None
+
+
+def get_candidate_pool() -> CategoryCandidatePool:
+    """
+    Instance partagée par les services du processus
+    """
+    global _candidate_pool
+    if _candidate_pool is None:
+        _candidate_pool = CategoryCandidatePool()
+    return _candidate_pool
+
+
+def _defer(target, change: Tuple[str, tuple]):
+    """
+    Garder la modification dans la session: appliquée au commit, oubliée au rollback
+    """
+    session = object_session(target)
+    if session is None:
+        return
+    session.info.setdefault('candidate_pool_changes', []).append(change)
+
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+def _sync_product(mapper, connection, target):
+    _defer(target, ('product', (target.id, target.category, bool(target.is_active))))
+
+
+@event.listens_for(Product, 'after_delete')
+def _remove_product(mapper, connection, target):
+    _defer(target, ('product', (target.id, None, False)))
+
+
+@event.listens_for(InventoryItem, 'after_insert')
+@event.listens_for(InventoryItem, 'after_update')
+def _sync_inventory(mapper, connection, target):
+    _defer(target, ('inventory', (
+        target.product_id,
+        bool(target.is_active),
+        target.available_stock or 0,
+        target.cost_price,
+        target.selling_price
+    )))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop('candidate_pool_changes', None)
+    if not changes:
+        return
+
+    pool = get_candidate_pool()
+    for kind, arguments in changes:
+        if kind == 'product':
+            pool.on_product_change(*arguments)
+        else:
+            pool.on_inventory_change(*arguments)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('candidate_pool_changes', None)
@@ -1,13 +1,21 @@
 from flask import Blueprint, jsonify, request
 from src.models.management import AbandonedCart, AbandonedCartItem, CartRecoveryNotification, CartStatus, NotificationStatus, db
-from src.services.notification_service import NotificationService
+from src.services.notification_outbox import get_notification_outbox
+from src.services.message_templates import get_message_template_engine
+from src.services.trending_service import get_trending_service
 from datetime import datetime, timedelta
+import os
 import uuid
 
 cart_recovery_bp = Blueprint('cart_recovery', __name__)
 
-# Initialisation du service de notification
-notification_service = NotificationService()
+# File d'envoi des notifications (workers en arrière-plan)
+notification_outbox = get_notification_outbox()
+template_engine = get_message_template_engine()
+trending_service = get_trending_service()
+
+# Base des liens de récupération insérés dans les messages
+RECOVERY_LINK_BASE = os.getenv('RECOVERY_LINK_BASE', 'https://votre-site.com/recover-cart')
 
 @cart_recovery_bp.route('/abandoned-carts', methods=['GET'])
 def get_abandoned_carts():
@@ -94,6 +102,12 @@ def create_abandoned_cart():
         
         db.session.commit()
         
+        # Alimenter les tendances avec les produits mis au panier
+        trending_service.record_events([
+            (item_data['product_id'], item_data.get('category'), 'cart', item_data.get('quantity', 1))
+            for item_data in data['items']
+        ])
+        
         # Programmer les notifications de récupération
         schedule_recovery_notifications(cart.id)
         
@@ -117,29 +131,71 @@ def trigger_recovery(cart_id):
         data = request.json
         channels = data.get('channels', ['email'])  # Par défaut email
         message_template = data.get('message_template', 'default')
+        language = data.get('language')  # Langue par défaut des gabarits si absente
         
         notifications_sent = []
         
         for channel in channels:
             if channel == 'email' and cart.email:
-                notification = send_recovery_notification(cart, 'email', cart.email, message_template)
+                notification = send_recovery_notification(cart, 'email', cart.email, message_template, language)
                 notifications_sent.append(notification)
             elif channel == 'sms' and cart.phone:
-                notification = send_recovery_notification(cart, 'sms', cart.phone, message_template)
+                notification = send_recovery_notification(cart, 'sms', cart.phone, message_template, language)
                 notifications_sent.append(notification)
             elif channel == 'whatsapp' and cart.phone:
-                notification = send_recovery_notification(cart, 'whatsapp', cart.phone, message_template)
+                notification = send_recovery_notification(cart, 'whatsapp', cart.phone, message_template, language)
                 notifications_sent.append(notification)
         
-        # Mettre à jour le compteur de tentatives
+        # Mettre à jour le compteur de tentatives (un seul commit pour le panier et les notifications)
         cart.recovery_attempts += 1
         cart.updated_at = datetime.utcnow()
         db.session.commit()
         
+        if notifications_sent:
+            notification_outbox.wake()
+        
         return jsonify({
-            'message': f'{len(notifications_sent)} notification(s) envoyée(s)',
+            'message': f'{len(notifications_sent)} notification(s) mise(s) en file d\'envoi',
             'notifications': [notif.to_dict() for notif in notifications_sent]
-        })
+        }), 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@cart_recovery_bp.route('/recovery-notifications/outbox', methods=['GET'])
+def get_outbox_stats():
+    """
+    État de la file d'envoi des notifications (compteurs par statut)
+    """
+    try:
+        return jsonify(notification_outbox.get_stats())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cart_recovery_bp.route('/recovery-notifications/dead-letters', methods=['GET'])
+def get_dead_letters():
+    """
+    Notifications abandonnées après le nombre maximal de tentatives
+    """
+    try:
+        limit = int(request.args.get('limit', 50))
+        return jsonify({'notifications': notification_outbox.list_dead_letters(limit)})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cart_recovery_bp.route('/recovery-notifications/dead-letters/requeue', methods=['POST'])
+def requeue_dead_letters():
+    """
+    Remettre en file des notifications en lettre morte (toutes si aucun identifiant)
+    """
+    try:
+        data = request.json or {}
+        requeued = notification_outbox.requeue_dead_letters(data.get('notification_ids'))
+        
+        return jsonify({'requeued': requeued})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -254,83 +310,42 @@ def schedule_recovery_notifications(cart_id):
     # comme Celery. Pour l'instant, on simule la programmation
     pass
 
-def send_recovery_notification(cart, channel, recipient, template='default'):
+def send_recovery_notification(cart, channel, recipient, template='default', language=None):
     """
-    Envoyer une notification de récupération
+    Mettre une notification de récupération en file d'envoi
+    
+    Seule l'insertion a lieu ici (commit par l'appelant); l'envoi, les
+    nouvelles tentatives et la lettre morte sont gérés par la file d'envoi.
     """
-    try:
-        # Générer le message basé sur le template
-        message_content = generate_recovery_message(cart, template, channel)
-        
-        # Créer l'enregistrement de notification
-        notification = CartRecoveryNotification(
-            cart_id=cart.id,
-            channel=channel,
-            recipient=recipient,
-            subject=message_content.get('subject'),
-            message=message_content['message'],
-            status=NotificationStatus.PENDING
-        )
-        
-        db.session.add(notification)
-        db.session.flush()
-        
-        # Envoyer la notification via le service approprié
-        success = notification_service.send_notification(
-            channel=channel,
-            recipient=recipient,
-            subject=message_content.get('subject'),
-            message=message_content['message'],
-            cart_id=cart.id
-        )
-        
-        if success:
-            notification.status = NotificationStatus.SENT
-            notification.sent_at = datetime.utcnow()
-        else:
-            notification.status = NotificationStatus.FAILED
-            notification.error_message = "Échec de l'envoi"
-        
-        db.session.commit()
-        return notification
-        
-    except Exception as e:
-        db.session.rollback()
-        raise e
+    message_content = generate_recovery_message(cart, template, channel, language)
+    
+    return notification_outbox.enqueue(
+        cart_id=cart.id,
+        channel=channel,
+        recipient=recipient,
+        subject=message_content.get('subject'),
+        message=message_content['message'],
+        html_message=message_content.get('html')
+    )
 
-def generate_recovery_message(cart, template, channel):
+def generate_recovery_message(cart, template, channel, language=None):
     """
-    Générer le contenu du message de récupération
+    Générer le contenu du message de récupération (gabarits compilés, voir message_templates.json)
     """
-    templates = {
-        'default': {
-            'email': {
-                'subject': 'Vous avez oublié quelque chose dans votre panier !',
-                'message': f'''
-                Bonjour,
-                
-                Vous avez laissé {cart.items_count} article(s) dans votre panier d'une valeur de {cart.cart_value} {cart.currency}.
-                
-                Ne les laissez pas s'échapper ! Finalisez votre commande maintenant.
-                
-                [Finaliser ma commande]
-                
-                Cordialement,
-                L'équipe RetailBot
-                '''
-            },
-            'sms': {
-                'message': f'Votre panier de {cart.cart_value} {cart.currency} vous attend ! Finalisez votre commande: [lien]'
-            },
-            'whatsapp': {
-                'message': f'''🛒 Votre panier vous attend !
-                
-{cart.items_count} article(s) - {cart.cart_value} {cart.currency}
-
-Finalisez votre commande maintenant: [lien]'''
-            }
-        }
-    }
+    purpose = f'cart_recovery.{template}'
+    if not template_engine.has(purpose, channel):
+        purpose = 'cart_recovery.default'
     
-    return templates.get(template, templates['default']).get(channel, templates['default']['email'])
+    rendered = template_engine.render(purpose, channel, {
+        'items_count': cart.items_count,
+        'cart_value': cart.cart_value,
+        'currency': cart.currency,
+        'recovery_link': f'{RECOVERY_LINK_BASE}/{cart.id}'
+    }, language)
+    
+    return {
+        'subject': rendered['subject'],
+        'message': rendered['text'],
+        'html': rendered['html']
+    }
 
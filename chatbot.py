@@ -2,6 +2,8 @@ from flask import Blueprint, jsonify, request
 from src.models.conversation import Conversation, Message, Product, UserProfile, db
 from src.services.nlp_service import NLPService
 from src.services.recommendation_service import RecommendationService
+from src.services.recommendation_evaluation import RecommendationEvaluator
+from src.services.trending_service import get_trending_service
 import uuid
 from datetime import datetime
 
@@ -10,6 +12,7 @@ chatbot_bp = Blueprint('chatbot', __name__)
 # Initialisation des services
 nlp_service = NLPService()
 recommendation_service = RecommendationService()
+trending_service = get_trending_service()
 
 @chatbot_bp.route('/chat', methods=['POST'])
 def chat():
@@ -152,6 +155,68 @@ def get_recommendations():
     
     return jsonify(recommendations)
 
+@chatbot_bp.route('/products/trending', methods=['GET'])
+def get_trending_products():
+    """
+    Obtenir les produits et catégories tendance
+    """
+    category = request.args.get('category')
+    limit = int(request.args.get('limit', 10))
+    
+    return jsonify({
+        'products': recommendation_service.get_trending_products(category, limit),
+        'categories': [
+            {'category': name, 'score': round(score, 4)}
+            for name, score in trending_service.get_trending_categories(limit)
+        ]
+    })
+
+@chatbot_bp.route('/products/<int:product_id>/similar', methods=['GET'])
+def get_similar_products(product_id):
+    """
+    Obtenir les produits similaires à un produit
+    """
+    limit = int(request.args.get('limit', 5))
+    
+    similar_products = recommendation_service.get_similar_products(product_id, limit)
+    
+    return jsonify(similar_products)
+
+@chatbot_bp.route('/products/recommendations/rebuild', methods=['POST'])
+def rebuild_recommendation_indexes():
+    """
+    Reconstruire les tables de recommandation précalculées
+    """
+    try:
+        result = recommendation_service.rebuild_indexes()
+
+        return jsonify({
+            'message': 'Index de recommandation reconstruits',
+            'result': result
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@chatbot_bp.route('/products/recommendations/evaluate', methods=['POST'])
+def evaluate_recommendations():
+    """
+    Évaluer hors ligne les stratégies de recommandation sur l'historique
+    """
+    try:
+        data = request.json or {}
+        
+        evaluator = RecommendationEvaluator(k=int(data.get('k', 5)))
+        report = evaluator.evaluate(
+            max_cases=int(data.get('max_cases', 1000)),
+            strategies=data.get('strategies')
+        )
+        
+        return jsonify(report)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 def generate_bot_response(nlp_result, conversation, language):
     """
     Générer la réponse du bot basée sur l'intent détecté
@@ -212,6 +277,11 @@ def generate_bot_response(nlp_result, conversation, language):
             products = products_query.limit(5).all()
             response['products'] = [product.to_dict() for product in products]
             
+            # Compter les impressions produit pour les tendances
+            trending_service.record_events([
+                (product.id, product.category, 'impression', 1) for product in products
+            ])
+            
             if products:
                 if language == 'fr':
                     response['message'] = f"J'ai trouvé {len(products)} produit(s) pour vous :"
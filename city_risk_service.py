@@ -0,0 +1,267 @@
+import threading
+import time
+from typing import Dict, Any, List, Optional
+from datetime import datetime, date, timedelta
+from sqlalchemy.exc import IntegrityError
+from src.models.management import CODOrder, CityRiskDaily, OrderStatus, db
+
+
+class CityRiskService:
+    """
+    Cumuls journaliers de risque par ville, maintenus à chaque commande
+
+    Un profil sur 90 jours se lit sur au plus 90 lignes par ville; les profils
+    de toutes les villes sont gardés en cache pour l'analyse des commandes.
+    """
+
+    def __init__(self, profile_days: int = 90, cache_ttl_seconds: int = 300):
+        self.profile_days = profile_days
+        self.cache_ttl_seconds = cache_ttl_seconds
+
+        # Seuils du profil de risque
+        self.high_risk_fraud_rate = 20
+        self.high_risk_avg_score = 60
+        self.medium_risk_fraud_rate = 10
+        self.medium_risk_avg_score = 40
+        self.min_orders_for_profile = 20
+
+        self.profiles_cache: Dict[str, Dict[str, Any]] = {}
+        self.cache_loaded_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def record_order(self, order: CODOrder):
+        """
+        Ajouter une nouvelle commande au cumul de son jour (même transaction que la commande)
+        """
+        if not order.city:
+            return
+
+        day = (order.created_at or datetime.utcnow()).date()
+        self._ensure_bucket(order.city, day)
+
+        # Incréments exprimés en SQL pour ne pas écraser une écriture concurrente
+        CityRiskDaily.query.filter_by(city=order.city, day=day).update({
+            'order_count': CityRiskDaily.order_count + 1,
+            'risk_score_sum': CityRiskDaily.risk_score_sum + (order.risk_score or 0.0),
+            'fraud_count': CityRiskDaily.fraud_count + int(self._is_fraud(order.notes)),
+            'cancelled_count': CityRiskDaily.cancelled_count + int(order.status == OrderStatus.CANCELLED),
+            'verification_required_count': CityRiskDaily.verification_required_count + int(bool(order.verification_required))
+        }, synchronize_session=False)
+
+    def _ensure_bucket(self, city: str, day: date):
+        """
+        Créer la ligne du jour si besoin (un insert concurrent de la même ville est ignoré)
+        """
+        if db.session.query(CityRiskDaily.id).filter_by(city=city, day=day).first():
+            return
+
+        try:
+            # Point de sauvegarde: un doublon n'annule pas la transaction de la commande
+            with db.session.begin_nested():
+                db.session.add(CityRiskDaily(
+                    city=city,
+                    day=day,
+                    order_count=0,
+                    risk_score_sum=0.0,
+                    fraud_count=0,
+                    cancelled_count=0,
+                    verification_required_count=0
+                ))
+        except IntegrityError:
+            pass
+
+    def record_update(self, order: CODOrder, previous_status: Optional[OrderStatus], previous_notes: Optional[str]):
+        """
+        Répercuter une annulation ou une fraude confirmée sur le jour de la commande
+        """
+        cancelled_delta = int(order.status == OrderStatus.CANCELLED) - int(previous_status == OrderStatus.CANCELLED)
+        fraud_delta = int(self._is_fraud(order.notes)) - int(self._is_fraud(previous_notes))
+
+        if (not cancelled_delta and not fraud_delta) or not order.city or not order.created_at:
+            return
+
+        bucket = CityRiskDaily.query.filter_by(city=order.city, day=order.created_at.date()).first()
+        if bucket is None:
+            return
+
+        bucket.cancelled_count = CityRiskDaily.cancelled_count + cancelled_delta
+        bucket.fraud_count = CityRiskDaily.fraud_count + fraud_delta
+
+    def get_profile(self, city: str, days: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Profil de risque d'une ville sur la période (somme des cumuls journaliers)
+        """
+        start_day = datetime.utcnow().date() - timedelta(days=days or self.profile_days)
+
+        totals = db.session.query(
+            db.func.sum(CityRiskDaily.order_count),
+            db.func.sum(CityRiskDaily.risk_score_sum),
+            db.func.sum(CityRiskDaily.fraud_count)
+        ).filter(
+            CityRiskDaily.city == city,
+            CityRiskDaily.day >= start_day
+        ).one()
+
+        return self._build_profile(city, totals[0] or 0, totals[1] or 0.0, totals[2] or 0)
+
+    def get_cached_profile(self, city: str) -> Optional[Dict[str, Any]]:
+        """
+        Profil de risque depuis le cache (rechargé en une requête à expiration)
+        """
+        if not city:
+            return None
+
+        if not self.cache_loaded_at or time.time() - self.cache_loaded_at >= self.cache_ttl_seconds:
+            self._reload_cache()
+
+        return self.profiles_cache.get(city)
+
+    def is_high_risk_city(self, city: str) -> bool:
+        """
+        Ville à fort taux de fraude confirmée
+
+        Seul le taux de fraude est retenu: le score moyen dépend lui-même de ce facteur.
+        """
+        profile = self.get_cached_profile(city)
+        return bool(
+            profile
+            and profile['total_orders'] >= self.min_orders_for_profile
+            and profile['fraud_rate'] > self.high_risk_fraud_rate
+        )
+
+    def get_cities_analysis(self, days: int = 30) -> List[Dict[str, Any]]:
+        """
+        Statistiques de risque par ville sur la période
+        """
+        start_day = datetime.utcnow().date() - timedelta(days=days)
+
+        cities_stats = db.session.query(
+            CityRiskDaily.city,
+            db.func.sum(CityRiskDaily.order_count).label('total_orders'),
+            db.func.sum(CityRiskDaily.risk_score_sum).label('risk_score_sum'),
+            db.func.sum(CityRiskDaily.cancelled_count).label('cancelled_orders'),
+            db.func.sum(CityRiskDaily.verification_required_count).label('verification_required')
+        ).filter(
+            CityRiskDaily.day >= start_day
+        ).group_by(CityRiskDaily.city).all()
+
+        cities_analysis = []
+        for city_stat in cities_stats:
+            total_orders = city_stat.total_orders or 0
+            if not total_orders:
+                continue
+
+            cities_analysis.append({
+                'city': city_stat.city,
+                'total_orders': total_orders,
+                'avg_risk_score': round((city_stat.risk_score_sum or 0) / total_orders, 2),
+                'cancelled_orders': city_stat.cancelled_orders,
+                'cancellation_rate': round(city_stat.cancelled_orders / total_orders * 100, 2),
+                'verification_required': city_stat.verification_required,
+                'verification_rate': round(city_stat.verification_required / total_orders * 100, 2)
+            })
+
+        # Trier par score de risque moyen
+        cities_analysis.sort(key=lambda x: x['avg_risk_score'], reverse=True)
+        return cities_analysis
+
+    def rebuild(self) -> Dict[str, Any]:
+        """
+        Recalculer tous les cumuls journaliers depuis les commandes
+        """
+        day_expression = db.func.date(CODOrder.created_at)
+
+        rows = db.session.query(
+            CODOrder.city,
+            day_expression,
+            db.func.count(CODOrder.id),
+            db.func.sum(CODOrder.risk_score),
+            db.func.count(db.case([(CODOrder.notes.like('%FRAUDE%'), 1)])),
+            db.func.count(db.case([(CODOrder.status == OrderStatus.CANCELLED, 1)])),
+            db.func.count(db.case([(CODOrder.verification_required == True, 1)]))
+        ).group_by(CODOrder.city, day_expression).all()
+
+        db.session.query(CityRiskDaily).delete()
+        db.session.bulk_insert_mappings(CityRiskDaily, [
+            {
+                'city': city,
+                # SQLite renvoie la date sous forme de texte
+                'day': date.fromisoformat(day) if isinstance(day, str) else day,
+                'order_count': order_count,
+                'risk_score_sum': risk_score_sum or 0.0,
+                'fraud_count': fraud_count,
+                'cancelled_count': cancelled_count,
+                'verification_required_count': verification_required_count
+            }
+            for city, day, order_count, risk_score_sum, fraud_count, cancelled_count, verification_required_count in rows
+            if city and day
+        ])
+        db.session.commit()
+
+        self.cache_loaded_at = None
+        return {'buckets': len(rows)}
+
+    def _reload_cache(self):
+        start_day = datetime.utcnow().date() - timedelta(days=self.profile_days)
+
+        try:
+            rows = db.session.query(
+                CityRiskDaily.city,
+                db.func.sum(CityRiskDaily.order_count),
+                db.func.sum(CityRiskDaily.risk_score_sum),
+                db.func.sum(CityRiskDaily.fraud_count)
+            ).filter(CityRiskDaily.day >= start_day).group_by(CityRiskDaily.city).all()
+        except Exception as e:
+            print(f"Erreur chargement des profils de villes: {e}")
+            return
+
+        with self.lock:
+            self.profiles_cache = {
+                city: self._build_profile(city, total_orders or 0, risk_score_sum or 0.0, fraud_orders or 0)
+                for city, total_orders, risk_score_sum, fraud_orders in rows
+            }
+            self.cache_loaded_at = time.time()
+
+    def _build_profile(self, city: str, total_orders: int, risk_score_sum: float, fraud_orders: int) -> Dict[str, Any]:
+        if not total_orders:
+            return {
+                'city': city,
+                'total_orders': 0,
+                'risk_profile': 'unknown'
+            }
+
+        avg_risk_score = risk_score_sum / total_orders
+        fraud_rate = fraud_orders / total_orders * 100
+
+        # Déterminer le profil de risque de la ville
+        if fraud_rate > self.high_risk_fraud_rate or avg_risk_score > self.high_risk_avg_score:
+            risk_profile = 'high_risk'
+        elif fraud_rate > self.medium_risk_fraud_rate or avg_risk_score > self.medium_risk_avg_score:
+            risk_profile = 'medium_risk'
+        else:
+            risk_profile = 'low_risk'
+
+        return {
+            'city': city,
+            'total_orders': total_orders,
+            'avg_risk_score': round(avg_risk_score, 2),
+            'fraud_rate': round(fraud_rate, 2),
+            'fraud_orders': fraud_orders,
+            'risk_profile': risk_profile
+        }
+
+    def _is_fraud(self, notes: Optional[str]) -> bool:
+        return 'FRAUDE' in (notes or '')
+
+
+_city_risk_service = None
+
+
+def get_city_risk_service() -> CityRiskService:
+    """
+    Instance partagée (le cache des profils est commun au processus)
+    """
+    global _city_risk_service
+    if _city_risk_service is None:
+        _city_risk_service = CityRiskService()
+    return _city_risk_service
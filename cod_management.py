@@ -1,14 +1,20 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from src.models.management import CODOrder, CODRiskLevel, OrderStatus, db
 from src.services.fraud_detection_service import FraudDetectionService
-from src.services.verification_service import VerificationService
+from src.services.verification_dispatcher import get_verification_dispatcher
+from src.services.verification_campaign_service import get_verification_campaign_service
+from src.services.customer_history_service import CustomerHistoryService
+from src.services.city_risk_service import get_city_risk_service
 from datetime import datetime, timedelta
 
 cod_management_bp = Blueprint('cod_management', __name__)
 
 # Initialisation des services
 fraud_detection_service = FraudDetectionService()
-verification_service = VerificationService()
+verification_dispatcher = get_verification_dispatcher()
+verification_campaign_service = get_verification_campaign_service()
+customer_history_service = CustomerHistoryService()
+city_risk_service = get_city_risk_service()
 
 @cod_management_bp.route('/cod-orders', methods=['GET'])
 def get_cod_orders():
@@ -83,24 +89,43 @@ def create_cod_order():
             postal_code=data.get('postal_code'),
             order_value=data['order_value'],
             currency=data.get('currency', 'DZD'),
-            notes=data.get('notes')
+            notes=data.get('notes'),
+            client_fingerprint=data.get('client_fingerprint') or request.headers.get('X-Client-Fingerprint')
         )
         
-        # Analyser le risque de fraude
-        risk_analysis = fraud_detection_service.analyze_order(order)
+        # Analyser le risque de fraude (durées par étape renvoyées avec ?debug=1)
+        debug = request.args.get('debug') in ('1', 'true') or bool(data.get('debug'))
+        risk_analysis = fraud_detection_service.analyze_order(order, debug=debug)
         order.risk_score = risk_analysis['score']
+        order.rule_risk_score = risk_analysis['rule_score']
         order.risk_level = CODRiskLevel(risk_analysis['level'])
-        order.risk_factors = risk_analysis['factors']
+        fraud_detection_service.set_risk_factors(order, risk_analysis['factors'])
+        order.risk_rules_version = risk_analysis['rules_version']
         order.verification_required = risk_analysis['verification_required']
         
+        # Si vérification requise, la mettre en file (SMS d'abord); l'envoi se fait en arrière-plan
+        if order.verification_required:
+            order.verification_attempts = 1
+            order.verification_status = 'in_progress'
+        
         db.session.add(order)
+        customer_history_service.record_order(order)
+        city_risk_service.record_order(order)
         db.session.commit()
         
-        # Si vérification requise, déclencher le processus
-        if order.verification_required:
-            verification_service.initiate_verification(order.id)
+        job = verification_dispatcher.enqueue(order, 'sms') if order.verification_required else None
+        
+        response = order.to_dict()
+        if job:
+            response['verification_job'] = job
+        if debug:
+            response['risk_debug'] = dict(
+                risk_analysis['debug'],
+                rule_score=risk_analysis['rule_score'],
+                model_probability=risk_analysis['model_probability']
+            )
         
-        return jsonify(order.to_dict()), 201
+        return jsonify(response), 201
         
     except Exception as e:
         db.session.rollback()
@@ -113,31 +138,42 @@ def verify_order(order_id):
     """
     try:
         order = CODOrder.query.get_or_404(order_id)
-        data = request.json
+        data = request.json or {}
         
         verification_method = data.get('method', 'phone_call')  # 'phone_call', 'sms', 'whatsapp'
-        
-        # Déclencher la vérification
-        result = verification_service.verify_order(order.id, verification_method)
+        if verification_method not in verification_dispatcher.CHANNELS:
+            return jsonify({'error': 'Méthode de vérification non supportée'}), 400
         
         # Mettre à jour le statut de vérification
         order.verification_attempts += 1
+        order.verification_status = 'in_progress'
         order.updated_at = datetime.utcnow()
         
-        if result['success']:
-            order.verification_status = 'verified'
-            order.verified_at = datetime.utcnow()
-            order.status = OrderStatus.CONFIRMED
-        else:
-            order.verification_status = 'failed'
-        
-        db.session.commit()
+        # Mettre la vérification en file: les canaux sont essayés en arrière-plan (SMS, WhatsApp, appel)
+        job = verification_dispatcher.enqueue(order, verification_method, failover=data.get('failover', True))
         
         return jsonify({
-            'message': 'Vérification initiée',
-            'result': result,
+            'message': 'Vérification en file d\'attente',
+            'job': job,
+            'status_url': f"/api/cod-orders/verification-jobs/{job['id']}",
             'order': order.to_dict()
-        })
+        }), 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/verification-jobs/<int:job_id>', methods=['GET'])
+def get_verification_job(job_id):
+    """
+    Suivre un job de vérification (canaux essayés, résultat, statut de la commande)
+    """
+    try:
+        job = verification_dispatcher.get_job(job_id)
+        if not job:
+            return jsonify({'error': 'Job de vérification non trouvé'}), 404
+        
+        return jsonify(job)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -153,6 +189,7 @@ def update_order_status(order_id):
         
         new_status = data.get('status')
         notes = data.get('notes')
+        previous_status, previous_notes = order.status, order.notes
         
         if new_status:
             order.status = OrderStatus(new_status)
@@ -161,6 +198,8 @@ def update_order_status(order_id):
             order.notes = notes
         
         order.updated_at = datetime.utcnow()
+        customer_history_service.record_update(order, previous_status, previous_notes)
+        city_risk_service.record_update(order, previous_status, previous_notes)
         db.session.commit()
         
         return jsonify({
@@ -258,12 +297,15 @@ def report_fraud():
             return jsonify({'error': 'Commande non trouvée'}), 404
         
         # Mettre à jour le statut et les notes
+        previous_status, previous_notes = order.status, order.notes
         order.status = OrderStatus.CANCELLED
         order.notes = f"FRAUDE CONFIRMÉE - Type: {fraud_type} - Détails: {details}"
         order.updated_at = datetime.utcnow()
         
         # Mettre à jour le modèle de détection de fraude
         fraud_detection_service.update_fraud_model(order, fraud_type, details)
+        customer_history_service.record_update(order, previous_status, previous_notes)
+        city_risk_service.record_update(order, previous_status, previous_notes)
         
         db.session.commit()
         
@@ -282,36 +324,9 @@ def get_cities_analysis():
     """
     try:
         days = int(request.args.get('days', 30))
-        start_date = datetime.utcnow() - timedelta(days=days)
         
-        # Requête pour obtenir les statistiques par ville
-        cities_stats = db.session.query(
-            CODOrder.city,
-            db.func.count(CODOrder.id).label('total_orders'),
-            db.func.avg(CODOrder.risk_score).label('avg_risk_score'),
-            db.func.count(db.case([(CODOrder.status == OrderStatus.CANCELLED, 1)])).label('cancelled_orders'),
-            db.func.count(db.case([(CODOrder.verification_required == True, 1)])).label('verification_required')
-        ).filter(
-            CODOrder.created_at >= start_date
-        ).group_by(CODOrder.city).all()
-        
-        cities_analysis = []
-        for city_stat in cities_stats:
-            cancellation_rate = (city_stat.cancelled_orders / city_stat.total_orders * 100) if city_stat.total_orders > 0 else 0
-            verification_rate = (city_stat.verification_required / city_stat.total_orders * 100) if city_stat.total_orders > 0 else 0
-            
-            cities_analysis.append({
-                'city': city_stat.city,
-                'total_orders': city_stat.total_orders,
-                'avg_risk_score': round(city_stat.avg_risk_score or 0, 2),
-                'cancelled_orders': city_stat.cancelled_orders,
-                'cancellation_rate': round(cancellation_rate, 2),
-                'verification_required': city_stat.verification_required,
-                'verification_rate': round(verification_rate, 2)
-            })
-        
-        # Trier par score de risque moyen
-        cities_analysis.sort(key=lambda x: x['avg_risk_score'], reverse=True)
+        # Cumuls journaliers par ville
+        cities_analysis = city_risk_service.get_cities_analysis(days)
         
         return jsonify({
             'period_days': days,
@@ -321,3 +336,358 @@ def get_cities_analysis():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+@cod_management_bp.route('/cod-orders/rescore', methods=['POST'])
+def rescore_cod_orders():
+    """
+    Recalculer le score de risque des commandes existantes (traitement par lots)
+    """
+    try:
+        data = request.json or {}
+        batch_size = int(data.get('batch_size', 1000))
+        
+        start_date = None
+        if data.get('days'):
+            start_date = datetime.utcnow() - timedelta(days=int(data['days']))
+        
+        result = fraud_detection_service.rescore_orders(
+            start_date=start_date,
+            batch_size=batch_size,
+            incremental=not data.get('full', False)
+        )
+        
+        return jsonify(result)
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/customer-history/rebuild', methods=['POST'])
+def rebuild_customer_history():
+    """
+    Recalculer les agrégats d'historique client par numéro de téléphone
+    """
+    try:
+        result = customer_history_service.rebuild()
+        
+        return jsonify({
+            'message': 'Historique client recalculé',
+            'result': result
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/cities-analysis/rebuild', methods=['POST'])
+def rebuild_cities_analysis():
+    """
+    Recalculer les cumuls journaliers de risque par ville
+    """
+    try:
+        result = city_risk_service.rebuild()
+        
+        return jsonify({
+            'message': 'Cumuls par ville recalculés',
+            'result': result
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/risk-factors', methods=['GET'])
+def get_risk_factors():
+    """
+    Fréquence, co-occurrence et tendance des facteurs de risque
+    """
+    try:
+        days = int(request.args.get('days', 30))
+        start_date = datetime.utcnow() - timedelta(days=days)
+        
+        return jsonify({
+            'period_days': days,
+            'frequencies': fraud_detection_service.get_risk_factors_analysis(start_date),
+            'cooccurrence': fraud_detection_service.get_risk_factor_cooccurrence(start_date),
+            'trends': fraud_detection_service.get_risk_factor_trends(start_date)
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/risk-factors/backfill', methods=['POST'])
+def backfill_risk_factors():
+    """
+    Convertir les facteurs de risque JSON existants vers la table normalisée
+    """
+    try:
+        data = request.json or {}
+        result = fraud_detection_service.backfill_risk_factors(batch_size=int(data.get('batch_size', 1000)))
+        
+        return jsonify({
+            'message': 'Facteurs de risque convertis',
+            'result': result
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/blocklist', methods=['POST'])
+def add_blocklist_entry():
+    """
+    Ajouter manuellement un téléphone, une adresse ou une empreinte à la liste noire
+    """
+    try:
+        data = request.json
+        
+        entry_type = data.get('type')
+        value = data.get('value')
+        if not entry_type or not value:
+            return jsonify({'error': 'type et value requis'}), 400
+        if not fraud_detection_service.blocklist.normalize(entry_type, value):
+            return jsonify({'error': 'value vide après normalisation'}), 400
+        
+        added = fraud_detection_service.blocklist.add_value(entry_type, value, data.get('fraud_type', 'manual'))
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Entrée ajoutée à la liste noire' if added else 'Entrée déjà présente',
+            'added': added
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/blocklist/stats', methods=['GET'])
+def get_blocklist_stats():
+    """
+    Taille et mémoire de la liste noire chargée
+    """
+    try:
+        fraud_detection_service.blocklist.ensure_loaded()
+        return jsonify(fraud_detection_service.blocklist.get_stats())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/identity-index/rebuild', methods=['POST'])
+def rebuild_identity_index():
+    """
+    Reconstruire l'index des identités proches (fraudes et clients à fort volume)
+    """
+    try:
+        result = fraud_detection_service.identity_index.build_from_database()
+        fraud_detection_service.identity_index.save()
+        
+        return jsonify({
+            'message': "Index d'identités reconstruit",
+            'result': result,
+            'stats': fraud_detection_service.identity_index.get_stats()
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/rules', methods=['GET'])
+def get_fraud_rules():
+    """
+    Règles anti-fraude actives (version, poids, seuils)
+    """
+    try:
+        fraud_detection_service.rule_engine.maybe_reload()
+        return jsonify(fraud_detection_service.rule_engine.describe())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/rules/reload', methods=['POST'])
+def reload_fraud_rules():
+    """
+    Forcer le rechargement de la configuration des règles
+    """
+    try:
+        result = fraud_detection_service.rule_engine.load()
+        
+        return jsonify({
+            'message': 'Règles anti-fraude rechargées',
+            'result': result
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/fraud-model', methods=['GET'])
+def get_fraud_model():
+    """
+    Modèle de fraude actif (coefficients, métriques, calibration)
+    """
+    try:
+        return jsonify(fraud_detection_service.fraud_model.describe())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/fraud-model/train', methods=['POST'])
+def train_fraud_model():
+    """
+    Lancer l'entraînement du modèle de fraude en arrière-plan (suivi par /fraud-model/training)
+    """
+    try:
+        data = request.json or {}
+        
+        status = fraud_detection_service.fraud_model.start_training(
+            holdout_modulo=int(data.get('holdout_modulo', 5)),
+            l2=float(data.get('l2', 1.0))
+        )
+        
+        if not status['started']:
+            return jsonify(dict(status, error='Un entraînement est déjà en cours')), 409
+        
+        return jsonify(status), 202
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/fraud-model/training', methods=['GET'])
+def get_fraud_model_training():
+    """
+    État de l'entraînement lancé par /fraud-model/train (running, completed, failed)
+    """
+    try:
+        return jsonify(fraud_detection_service.fraud_model.get_training_status())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/fraud-model/evaluate', methods=['POST'])
+def evaluate_fraud_model():
+    """
+    Évaluer le modèle sur l'échantillon réservé
+    """
+    try:
+        data = request.json or {}
+        holdout_modulo = int(data['holdout_modulo']) if data.get('holdout_modulo') else None
+        
+        result = fraud_detection_service.fraud_model.evaluate(holdout_modulo)
+        
+        if not result['success']:
+            return jsonify(result), 400
+        
+        return jsonify(result)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/metrics', methods=['GET'])
+def get_fraud_metrics():
+    """
+    Latences de l'analyse de fraude (histogrammes par étape et par règle)
+    """
+    try:
+        return jsonify(fraud_detection_service.get_latency_metrics())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/metrics/reset', methods=['POST'])
+def reset_fraud_metrics():
+    """
+    Remettre à zéro les histogrammes de latence
+    """
+    try:
+        fraud_detection_service.metrics.reset('fraud.')
+        
+        return jsonify({'message': 'Métriques de latence réinitialisées'})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/verification-campaigns', methods=['POST'])
+def create_verification_campaign():
+    """
+    Lancer une campagne de vérification en masse (ou prévisualiser la sélection avec dry_run)
+    """
+    try:
+        data = request.json or {}
+        filters = data.get('filters', {})
+        
+        if data.get('dry_run'):
+            return jsonify(verification_campaign_service.preview(filters))
+        
+        result = verification_campaign_service.create_campaign(
+            filters=filters,
+            method=data.get('method', 'sms'),
+            failover=data.get('failover', True),
+            concurrency=int(data.get('concurrency', 20)),
+            rate_limits=data.get('rate_limits')
+        )
+        
+        if not result['success']:
+            return jsonify(result), 400
+        
+        return jsonify(result), 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/verification-campaigns', methods=['GET'])
+def list_verification_campaigns():
+    """
+    Campagnes de vérification récentes
+    """
+    try:
+        limit = request.args.get('limit', 20, type=int)
+        return jsonify({'campaigns': verification_campaign_service.list_campaigns(limit)})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/verification-campaigns/<int:campaign_id>', methods=['GET'])
+def get_verification_campaign(campaign_id):
+    """
+    Progression d'une campagne de vérification
+    """
+    try:
+        campaign = verification_campaign_service.get_campaign(campaign_id)
+        if not campaign:
+            return jsonify({'error': 'Campagne non trouvée'}), 404
+        
+        return jsonify(campaign)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/verification-campaigns/<int:campaign_id>/cancel', methods=['POST'])
+def cancel_verification_campaign(campaign_id):
+    """
+    Annuler une campagne de vérification en cours
+    """
+    try:
+        result = verification_campaign_service.cancel_campaign(campaign_id)
+        
+        if not result['success']:
+            return jsonify(result), 400
+        
+        return jsonify(result)
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@cod_management_bp.route('/cod-orders/verification-campaigns/<int:campaign_id>/stream', methods=['GET'])
+def stream_verification_campaign(campaign_id):
+    """
+    Progression en continu (Server-Sent Events) pour le tableau de bord
+    """
+    interval = request.args.get('interval', 1.0, type=float)
+    
+    return Response(
+        stream_with_context(verification_campaign_service.stream_progress(campaign_id, max(interval, 0.2))),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -0,0 +1,435 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+import zlib
+from array import array
+from datetime import datetime
+from typing import Dict, Any, List, Iterable, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from src.models.conversation import Product, db
+
+
+class HashedTfidfVectorizer:
+    """
+    Vectoriseur TF-IDF haché, local et sans modèle externe
+    """
+
+    token_pattern = re.compile(r'\w+', re.UNICODE)
+
+    def __init__(self, dimensions: int = 2 ** 18, max_df_ratio: float = 0.05):
+        self.dimensions = dimensions
+        self.max_df_ratio = max_df_ratio
+        self.idf: Dict[int, float] = {}
+        # Buckets fréquents conservés (catégorie, marque): pondérés mais hors fichier inversé
+        self.frequent_buckets = set()
+
+        # Pondération des champs du produit
+        self.field_weights = {
+            'name': 2.0,
+            'category': 1.5,
+            'brand': 1.0,
+            'description': 1.0
+        }
+
+        # Champs dont les termes trop fréquents sont écartés (mots vides des descriptions);
+        # catégorie et marque restent, atténuées par l'IDF, dans frequent_buckets
+        self.capped_fields = {'description'}
+
+    def extract_terms(self, fields: Dict[str, Optional[str]], capped_buckets: Optional[set] = None) -> Dict[int, float]:
+        """
+        Extraire les fréquences de termes hachées d'un produit
+
+        Les buckets des champs plafonnés sont ajoutés à capped_buckets si fourni.
+        """
+        term_frequencies: Dict[int, float] = {}
+
+        for field, weight in self.field_weights.items():
+            text = fields.get(field)
+            if not text:
+                continue
+
+            for token in self.token_pattern.findall(text.lower()):
+                if len(token) < 2:
+                    continue
+                bucket = zlib.crc32(f'{field}:{token}'.encode('utf-8')) % self.dimensions
+                term_frequencies[bucket] = term_frequencies.get(bucket, 0.0) + weight
+                if capped_buckets is not None and field in self.capped_fields:
+                    capped_buckets.add(bucket)
+
+        return term_frequencies
+
+    def fit(self, documents: List[Dict[int, float]], capped_buckets: Optional[set] = None):
+        """
+        Calculer l'IDF des buckets et écarter les termes plafonnés trop fréquents
+
+        Les autres termes trop fréquents sont gardés et notés dans frequent_buckets.
+        """
+        document_frequencies: Dict[int, int] = {}
+        for terms in documents:
+            for bucket in terms:
+                document_frequencies[bucket] = document_frequencies.get(bucket, 0) + 1
+
+        total = len(documents)
+        max_df = max(1, int(total * self.max_df_ratio)) if total > 10 else total
+
+        self.idf = {
+            bucket: math.log((1 + total) / (1 + df)) + 1.0
+            for bucket, df in document_frequencies.items()
+            if df <= max_df or bucket not in (capped_buckets or ())
+        }
+        self.frequent_buckets = {
+            bucket for bucket, df in document_frequencies.items()
+            if df > max_df and bucket in self.idf
+        }
+
+    def transform(self, terms: Dict[int, float]) -> Tuple[array, array]:
+        """
+        Convertir des fréquences de termes en vecteur creux normalisé (L2)
+        """
+        weighted = []
+        for bucket, frequency in terms.items():
+            idf = self.idf.get(bucket)
+            if idf is not None:
+                weighted.append((bucket, (1.0 + math.log(frequency)) * idf))
+
+        weighted.sort()
+        norm = math.sqrt(sum(value * value for _, value in weighted)) or 1.0
+
+        return (
+            array('i', [bucket for bucket, _ in weighted]),
+            array('f', [value / norm for _, value in weighted])
+        )
+
+
+class ContentSimilarityService:
+    """
+    Index vectoriel en mémoire pour les requêtes « produits similaires »
+
+    Construit au démarrage (ou par la route de reconstruction), puis tenu à
+    jour produit par produit après chaque commit: un produit modifié reçoit
+    une nouvelle ligne (IDF de la dernière construction), l'ancienne est
+    ignorée à la lecture, et l'index est compacté quand ces lignes mortes
+    dépassent compaction_ratio des lignes vivantes. Les termes de description
+    présents dans plus de max_df_ratio du catalogue sont écartés: ils
+    n'apportent presque rien au classement et leurs listes inversées dominent
+    le coût d'une requête. Les termes de catégorie et de marque aussi
+    fréquents restent dans les vecteurs mais pas dans le fichier inversé: leur
+    contribution est ajoutée aux seuls candidats trouvés par les autres termes
+    (recherche dichotomique dans la ligne CSR), et quelques lignes de leurs
+    listes complètent les résultats quand ces candidats manquent.
+    """
+
+    def __init__(self, dimensions: int = 2 ** 18, max_df_ratio: float = 0.05, compaction_ratio: float = 0.25,
+                 frequent_fill_factor: int = 4):
+        self.vectorizer = HashedTfidfVectorizer(dimensions=dimensions, max_df_ratio=max_df_ratio)
+        self.compaction_ratio = compaction_ratio
+        # Lignes lues par liste fréquente pour compléter un top-K: limit * frequent_fill_factor
+        self.frequent_fill_factor = frequent_fill_factor
+
+        # Vecteurs stockés en CSR contigu (float32)
+        self.product_ids = array('q')
+        self.indptr = array('i', [0])
+        self.indices = array('i')
+        self.data = array('f')
+        self.row_by_product: Dict[int, int] = {}
+
+        # Fichier inversé: bucket -> (lignes, poids); buckets fréquents: bucket -> lignes
+        self.postings: Dict[int, Tuple[array, array]] = {}
+        self.frequent_postings: Dict[int, array] = {}
+        # Lignes remplacées ou retirées depuis la dernière construction
+        self.removed_rows = set()
+        self.built_at: Optional[datetime] = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_built(self) -> bool:
+        return self.built_at is not None
+
+    def build(self, products: Iterable[Tuple[int, Dict[str, Optional[str]]]]) -> Dict[str, Any]:
+        """
+        Construire l'index à partir de (product_id, champs texte)
+        """
+        product_ids = array('q')
+        documents = []
+        capped_buckets = set()
+        for product_id, fields in products:
+            product_ids.append(product_id)
+            documents.append(self.vectorizer.extract_terms(fields, capped_buckets))
+
+        self.vectorizer.fit(documents, capped_buckets)
+
+        indptr = array('i', [0])
+        indices = array('i')
+        data = array('f')
+        postings: Dict[int, Tuple[array, array]] = {}
+        frequent_postings: Dict[int, array] = {}
+
+        for row, terms in enumerate(documents):
+            vector_indices, vector_values = self.vectorizer.transform(terms)
+            indices.extend(vector_indices)
+            data.extend(vector_values)
+            indptr.append(len(indices))
+            self._add_postings(postings, frequent_postings, row, vector_indices, vector_values)
+
+        with self.lock:
+            self.product_ids = product_ids
+            self.indptr = indptr
+            self.indices = indices
+            self.data = data
+            self.row_by_product = {product_id: row for row, product_id in enumerate(product_ids)}
+            self.postings = postings
+            self.frequent_postings = frequent_postings
+            self.removed_rows = set()
+            self.built_at = datetime.utcnow()
+
+        return {
+            'products': len(product_ids),
+            'terms': len(postings),
+            'frequent_terms': len(frequent_postings),
+            'non_zero': len(data),
+            'built_at': self.built_at.isoformat()
+        }
+
+    def build_from_database(self) -> Dict[str, Any]:
+        """
+        Indexer le catalogue actif
+        """
+        rows = db.session.query(
+            Product.id,
+            Product.name,
+            Product.description,
+            Product.category,
+            Product.brand
+        ).filter(Product.is_active == True).yield_per(5000)
+
+        return self.build(
+            (product_id, {'name': name, 'description': description, 'category': category, 'brand': brand})
+            for product_id, name, description, category, brand in rows
+        )
+
+    def update_product(self, product_id: int, fields: Dict[str, Optional[str]], is_active: bool = True):
+        """
+        Répercuter la création, la modification ou la désactivation d'un produit
+        """
+        if not self.is_built:
+            return
+
+        with self.lock:
+            row = self.row_by_product.pop(product_id, None)
+            if row is not None:
+                self.removed_rows.add(row)
+                if len(self.removed_rows) > max(100, self.compaction_ratio * len(self.row_by_product)):
+                    self._compact()
+            if not is_active:
+                return
+
+            vector_indices, vector_values = self.vectorizer.transform(self.vectorizer.extract_terms(fields))
+            row = len(self.product_ids)
+            self.product_ids.append(product_id)
+            self.indices.extend(vector_indices)
+            self.data.extend(vector_values)
+            self.indptr.append(len(self.indices))
+            self._add_postings(self.postings, self.frequent_postings, row, vector_indices, vector_values)
+
+            self.row_by_product[product_id] = row
+
+    def _add_postings(self, postings: Dict[int, Tuple[array, array]], frequent_postings: Dict[int, array],
+                      row: int, vector_indices: array, vector_values: array):
+        """
+        Ajouter une ligne aux listes inversées (ou fréquentes) de ses buckets
+        """
+        frequent_buckets = self.vectorizer.frequent_buckets
+        for bucket, value in zip(vector_indices, vector_values):
+            if bucket in frequent_buckets:
+                rows = frequent_postings.get(bucket)
+                if rows is None:
+                    rows = frequent_postings[bucket] = array('i')
+                rows.append(row)
+                continue
+
+            posting = postings.get(bucket)
+            if posting is None:
+                posting = postings[bucket] = (array('i'), array('f'))
+            posting[0].append(row)
+            posting[1].append(value)
+
+    def _compact(self):
+        """
+        Retirer les lignes remplacées ou désactivées (vecteurs conservés, sans recalcul de l'IDF)
+
+        Appelé sous le verrou.
+        """
+        product_ids = array('q')
+        indptr = array('i', [0])
+        indices = array('i')
+        data = array('f')
+        postings: Dict[int, Tuple[array, array]] = {}
+        frequent_postings: Dict[int, array] = {}
+        row_by_product: Dict[int, int] = {}
+
+        for product_id, old_row in sorted(self.row_by_product.items(), key=lambda item: item[1]):
+            start, end = self.indptr[old_row], self.indptr[old_row + 1]
+            row = len(product_ids)
+            product_ids.append(product_id)
+            indices.extend(self.indices[start:end])
+            data.extend(self.data[start:end])
+            indptr.append(len(indices))
+            row_by_product[product_id] = row
+            self._add_postings(postings, frequent_postings, row, self.indices[start:end], self.data[start:end])
+
+        self.product_ids = product_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.row_by_product = row_by_product
+        self.postings = postings
+        self.frequent_postings = frequent_postings
+        self.removed_rows = set()
+
+    def get_similar_products(self, product_id: int, limit: int = 5) -> List[Tuple[int, float]]:
+        """
+        Produits les plus proches d'un produit indexé
+        """
+        return self.search_many([product_id], limit)[0]
+
+    def search_many(self, product_ids: List[int], limit: int = 5) -> List[List[Tuple[int, float]]]:
+        """
+        Requêtes top-K groupées (produit similaire pour chaque référence)
+        """
+        results = []
+
+        # Verrou: une reconstruction ou une mise à jour ne change pas l'index pendant la lecture
+        with self.lock:
+            for product_id in product_ids:
+                row = self.row_by_product.get(product_id)
+                if row is None:
+                    results.append([])
+                    continue
+
+                start, end = self.indptr[row], self.indptr[row + 1]
+                scores = self._score(self.indices[start:end], self.data[start:end], limit + 1)
+                scores.pop(row, None)
+                for removed in self.removed_rows.intersection(scores):
+                    del scores[removed]
+
+                best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+                results.append([(self.product_ids[r], round(score, 4)) for r, score in best])
+
+        return results
+
+    def search_text(self, fields: Dict[str, Optional[str]], limit: int = 5) -> List[Tuple[int, float]]:
+        """
+        Rechercher les produits proches d'un texte libre
+        """
+        vector_indices, vector_values = self.vectorizer.transform(self.vectorizer.extract_terms(fields))
+
+        with self.lock:
+            scores = self._score(vector_indices, vector_values, limit)
+            for removed in self.removed_rows.intersection(scores):
+                del scores[removed]
+
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [(self.product_ids[r], round(score, 4)) for r, score in best]
+
+    def _score(self, vector_indices: array, vector_values: array, limit: int) -> Dict[int, float]:
+        """
+        Produit scalaire creux en ne parcourant que les listes inversées de la requête
+
+        Les buckets fréquents de la requête sont ajoutés aux candidats par
+        lecture de leur ligne; si les candidats ne suffisent pas pour limit
+        résultats, les premières lignes des listes fréquentes complètent.
+        """
+        scores: Dict[int, float] = {}
+        frequent: Dict[int, float] = {}
+
+        for bucket, query_value in zip(vector_indices, vector_values):
+            if bucket in self.vectorizer.frequent_buckets:
+                frequent[bucket] = query_value
+                continue
+
+            posting = self.postings.get(bucket)
+            if posting is None:
+                continue
+
+            rows, values = posting
+            for r, value in zip(rows, values):
+                scores[r] = scores.get(r, 0.0) + query_value * value
+
+        if not frequent:
+            return scores
+
+        frequent_dot = self._frequent_dot
+        for r in scores:
+            scores[r] += frequent_dot(r, frequent)
+
+        if len(scores) - len(self.removed_rows.intersection(scores)) < limit:
+            fill = limit * self.frequent_fill_factor
+            for bucket in frequent:
+                for r in self.frequent_postings.get(bucket, array('i'))[:fill]:
+                    if r not in scores:
+                        scores[r] = self._frequent_dot(r, frequent)
+
+        return scores
+
+    def _frequent_dot(self, row: int, frequent: Dict[int, float]) -> float:
+        """
+        Contribution des buckets fréquents de la requête à une ligne (buckets triés dans la ligne)
+        """
+        indices, data = self.indices, self.data
+        start, end = self.indptr[row], self.indptr[row + 1]
+        total = 0.0
+        for bucket, query_value in frequent.items():
+            position = bisect.bisect_left(indices, bucket, start, end)
+            if position < end and indices[position] == bucket:
+                total += query_value * data[position]
+        return total
+
+
+_content_index = None
+_content_index_lock = threading.Lock()
+
+
+def get_content_index() -> ContentSimilarityService:
+    """
+    Index de contenu partagé par les services du processus
+    """
+    global _content_index
+    if _content_index is None:
+        with _content_index_lock:
+            if _content_index is None:
+                _content_index = ContentSimilarityService()
+    return _content_index
+
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+def _sync_product(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('content_index_changes', []).append((
+            target.id,
+            {'name': target.name, 'description': target.description, 'category': target.category, 'brand': target.brand},
+            bool(target.is_active)
+        ))
+
+
+@event.listens_for(Product, 'after_delete')
+def _remove_product(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('content_index_changes', []).append((target.id, {}, False))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    # Index mis à jour seulement pour les modifications validées
+    for product_id, fields, is_active in session.info.pop('content_index_changes', None) or []:
+        get_content_index().update_product(product_id, fields, is_active)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('content_index_changes', None)
@@ -0,0 +1,188 @@
+import heapq
+import threading
+from array import array
+from datetime import datetime
+from typing import Dict, Any, List, Iterable, Optional, Tuple
+from src.models.management import AbandonedCartItem, db
+from src.services.trending_service import normalize_product_key
+
+
+class CooccurrenceService:
+    """
+    Moteur d'association produit x produit construit à partir des paniers
+
+    Les clés produit sont normalisées comme celles des tendances: un
+    product_id de panier numérique correspond à l'id du catalogue.
+    """
+
+    def __init__(self, top_k: int = 20, min_pair_count: int = 2):
+        self.top_k = top_k
+        self.min_pair_count = min_pair_count
+
+        # Table précalculée: product_id -> [(product_id associé, lift, confidence, count)]
+        self.associations: Dict[str, List[Tuple[str, float, float, int]]] = {}
+        self.total_baskets = 0
+        self.built_at: Optional[datetime] = None
+
+    @property
+    def is_built(self) -> bool:
+        return self.built_at is not None
+
+    def build(self, baskets: Iterable[Iterable[str]]) -> Dict[str, Any]:
+        """
+        Construire la matrice de co-occurrence (format CSR) et la table top-K
+        """
+        product_index: Dict[str, int] = {}
+        product_keys: List[str] = []
+        item_counts = array('i')
+        pair_counts: Dict[int, Dict[int, int]] = {}
+        total_baskets = 0
+
+        for basket in baskets:
+            indices = set()
+            for product_id in basket:
+                key = normalize_product_key(product_id)
+                index = product_index.get(key)
+                if index is None:
+                    index = len(product_keys)
+                    product_index[key] = index
+                    product_keys.append(key)
+                    item_counts.append(0)
+                indices.add(index)
+
+            if not indices:
+                continue
+
+            total_baskets += 1
+            ordered = sorted(indices)
+            for position, i in enumerate(ordered):
+                item_counts[i] += 1
+                row = pair_counts.setdefault(i, {})
+                for j in ordered[position + 1:]:
+                    row[j] = row.get(j, 0) + 1
+
+        indptr, indices, counts = self._to_csr(len(product_keys), pair_counts)
+
+        self.associations = self._compute_top_k(product_keys, item_counts, indptr, indices, counts, total_baskets)
+        self.total_baskets = total_baskets
+        self.built_at = datetime.utcnow()
+
+        return {
+            'products': len(product_keys),
+            'baskets': total_baskets,
+            'pairs': len(indices) // 2,
+            'products_with_associations': len(self.associations),
+            'built_at': self.built_at.isoformat()
+        }
+
+    def build_from_database(self) -> Dict[str, Any]:
+        """
+        Construire la table à partir des lignes de tous les paniers enregistrés
+
+        Un panier est enregistré quel que soit son devenir (abandonné, récupéré
+        ou converti): ce sont les seules lignes produit disponibles, les
+        commandes COD ne gardant pas le détail des articles.
+        """
+        rows = db.session.query(
+            AbandonedCartItem.cart_id,
+            AbandonedCartItem.product_id
+        ).order_by(AbandonedCartItem.cart_id).yield_per(5000)
+
+        return self.build(self._group_baskets(rows))
+
+    def get_associated_products(self, product_id, limit: int = 5) -> List[Tuple[str, float, float, int]]:
+        """
+        Lire les produits associés depuis la table précalculée
+        """
+        return self.associations.get(normalize_product_key(product_id), [])[:limit]
+
+    def _group_baskets(self, rows) -> Iterable[List[str]]:
+        """
+        Regrouper les lignes (cart_id, product_id) triées par panier
+        """
+        current_cart = None
+        basket: List[str] = []
+
+        for cart_id, product_id in rows:
+            if cart_id != current_cart:
+                if basket:
+                    yield basket
+                current_cart = cart_id
+                basket = []
+            basket.append(product_id)
+
+        if basket:
+            yield basket
+
+    def _to_csr(self, size: int, pair_counts: Dict[int, Dict[int, int]]):
+        """
+        Convertir les comptes de paires en matrice symétrique CSR (indptr, indices, data)
+        """
+        rows: List[List[Tuple[int, int]]] = [[] for _ in range(size)]
+        for i, row in pair_counts.items():
+            for j, count in row.items():
+                rows[i].append((j, count))
+                rows[j].append((i, count))
+
+        indptr = array('i', [0])
+        indices = array('i')
+        counts = array('i')
+
+        for row in rows:
+            row.sort()
+            for j, count in row:
+                indices.append(j)
+                counts.append(count)
+            indptr.append(len(indices))
+
+        return indptr, indices, counts
+
+    def _compute_top_k(self, product_keys: List[str], item_counts: array, indptr: array,
+                       indices: array, counts: array, total_baskets: int) -> Dict[str, List[Tuple[str, float, float, int]]]:
+        """
+        Calculer le lift et la confiance, puis garder les K meilleures associations par produit
+        """
+        associations = {}
+
+        for i, key in enumerate(product_keys):
+            start, end = indptr[i], indptr[i + 1]
+            if start == end:
+                continue
+
+            count_i = item_counts[i]
+            candidates = []
+
+            for position in range(start, end):
+                pair_count = counts[position]
+                if pair_count < self.min_pair_count:
+                    continue
+
+                j = indices[position]
+                confidence = pair_count / count_i
+                lift = confidence * total_baskets / item_counts[j]
+                candidates.append((lift, confidence, pair_count, j))
+
+            if candidates:
+                best = heapq.nlargest(self.top_k, candidates)
+                associations[key] = [
+                    (product_keys[j], round(lift, 4), round(confidence, 4), pair_count)
+                    for lift, confidence, pair_count, j in best
+                ]
+
+        return associations
+
+
+_cooccurrence_service = None
+_cooccurrence_service_lock = threading.Lock()
+
+
+def get_cooccurrence_service() -> CooccurrenceService:
+    """
+    Table d'associations partagée du processus (construite au démarrage)
+    """
+    global _cooccurrence_service
+    if _cooccurrence_service is None:
+        with _cooccurrence_service_lock:
+            if _cooccurrence_service is None:
+                _cooccurrence_service = CooccurrenceService()
+    return _cooccurrence_service
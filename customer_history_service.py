@@ -0,0 +1,233 @@
+from bisect import bisect_left, bisect_right
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from src.models.management import CODOrder, CustomerPhoneStats, OrderStatus, db
+
+
+class CustomerHistoryService:
+    """
+    Agrégats d'historique par numéro de téléphone pour la détection de fraude
+
+    Les compteurs sont mis à jour dans la transaction de la commande: l'appelant
+    reste responsable du commit. Les incréments sont exprimés en SQL et la
+    première ligne d'un numéro est créée par un insert toléré en doublon, pour
+    que deux workers enregistrant une commande du même client ne perdent rien.
+    """
+
+    def __init__(self, recent_window_hours: int = 24, max_recent_orders: int = 50):
+        self.recent_window = timedelta(hours=recent_window_hours)
+        self.max_recent_orders = max_recent_orders
+
+    def get_history(self, phone: str, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Historique d'un client (une lecture par clé primaire)
+        """
+        stats = CustomerPhoneStats.query.get(phone) if phone else None
+        if not stats:
+            return {
+                'has_fraud_history': False,
+                'multiple_recent_orders': False,
+                'total_previous_orders': 0,
+                'recent_orders_count': 0,
+                'cancelled_orders': 0
+            }
+
+        recent_count = len(self._recent_times(stats, now or datetime.utcnow()))
+
+        return {
+            'has_fraud_history': stats.fraud_orders > 0,
+            'multiple_recent_orders': recent_count > 1,
+            'total_previous_orders': stats.total_orders,
+            'recent_orders_count': recent_count,
+            'cancelled_orders': stats.cancelled_orders
+        }
+
+    def load_timelines(self, phones) -> Dict[str, List[tuple]]:
+        """
+        Charger l'historique (date, id, fraude, annulation) de plusieurs numéros en une requête par bloc
+        """
+        phones = [phone for phone in phones if phone]
+        timelines: Dict[str, List[tuple]] = {}
+
+        # Blocs de 500 pour rester sous la limite de variables SQLite
+        for start in range(0, len(phones), 500):
+            rows = db.session.query(
+                CODOrder.customer_phone,
+                CODOrder.created_at,
+                CODOrder.id,
+                CODOrder.notes,
+                CODOrder.status
+            ).filter(CODOrder.customer_phone.in_(phones[start:start + 500])).all()
+
+            for phone, created_at, order_id, notes, status in rows:
+                timelines.setdefault(phone, []).append(
+                    (created_at, order_id, 'FRAUDE' in (notes or ''), status == OrderStatus.CANCELLED)
+                )
+
+        for timeline in timelines.values():
+            timeline.sort()
+
+        return timelines
+
+    def history_at(self, timeline: Optional[List[tuple]], order_id: Optional[int],
+                   at: datetime) -> Dict[str, Any]:
+        """
+        Historique d'un client à la date de la commande, en excluant la commande elle-même
+        """
+        if not timeline:
+            return {
+                'has_fraud_history': False,
+                'multiple_recent_orders': False,
+                'total_previous_orders': 0,
+                'recent_orders_count': 0,
+                'cancelled_orders': 0
+            }
+
+        others = [entry for entry in timeline if entry[1] != order_id]
+        dates = [entry[0] for entry in others]
+
+        recent_count = bisect_right(dates, at) - bisect_left(dates, at - self.recent_window)
+        previous_count = bisect_left(dates, at)
+
+        # Seules les commandes antérieures comptent: l'historique est celui vu au moment de la commande
+        return {
+            'has_fraud_history': any(entry[2] for entry in others[:previous_count]),
+            'multiple_recent_orders': recent_count > 1,
+            'total_previous_orders': previous_count,
+            'recent_orders_count': recent_count,
+            'cancelled_orders': sum(1 for entry in others[:previous_count] if entry[3])
+        }
+
+    def record_order(self, order: CODOrder):
+        """
+        Comptabiliser une nouvelle commande
+        """
+        phone = order.customer_phone
+        if not phone:
+            return
+
+        self._ensure_row(phone)
+        created_at = order.created_at or datetime.utcnow()
+
+        CustomerPhoneStats.query.filter_by(phone=phone).update({
+            'total_orders': CustomerPhoneStats.total_orders + 1,
+            'cancelled_orders': CustomerPhoneStats.cancelled_orders + int(order.status == OrderStatus.CANCELLED),
+            'fraud_orders': CustomerPhoneStats.fraud_orders + int(self._is_fraud(order.notes)),
+            'last_order_at': db.case(
+                [(db.or_(CustomerPhoneStats.last_order_at.is_(None), CustomerPhoneStats.last_order_at < created_at), created_at)],
+                else_=CustomerPhoneStats.last_order_at
+            )
+        }, synchronize_session=False)
+
+        self._add_recent_time(phone, created_at)
+
+    def record_update(self, order: CODOrder, previous_status: Optional[OrderStatus], previous_notes: Optional[str]):
+        """
+        Répercuter un changement de statut ou de notes (annulation, fraude confirmée)
+        """
+        cancelled_delta = int(order.status == OrderStatus.CANCELLED) - int(previous_status == OrderStatus.CANCELLED)
+        fraud_delta = int(self._is_fraud(order.notes)) - int(self._is_fraud(previous_notes))
+
+        if not cancelled_delta and not fraud_delta:
+            return
+
+        if not order.customer_phone:
+            return
+
+        self._ensure_row(order.customer_phone)
+        CustomerPhoneStats.query.filter_by(phone=order.customer_phone).update({
+            'cancelled_orders': self._clamped_increment(CustomerPhoneStats.cancelled_orders, cancelled_delta),
+            'fraud_orders': self._clamped_increment(CustomerPhoneStats.fraud_orders, fraud_delta)
+        }, synchronize_session=False)
+
+    def rebuild(self) -> Dict[str, Any]:
+        """
+        Recalculer tous les agrégats depuis les commandes
+        """
+        recent_threshold = datetime.utcnow() - self.recent_window
+
+        totals = db.session.query(
+            CODOrder.customer_phone,
+            db.func.count(CODOrder.id),
+            db.func.count(db.case([(CODOrder.status == OrderStatus.CANCELLED, 1)])),
+            db.func.count(db.case([(CODOrder.notes.like('%FRAUDE%'), 1)])),
+            db.func.max(CODOrder.created_at)
+        ).group_by(CODOrder.customer_phone).all()
+
+        recent_rows = db.session.query(CODOrder.customer_phone, CODOrder.created_at)\
+                                .filter(CODOrder.created_at >= recent_threshold)\
+                                .order_by(CODOrder.created_at).all()
+
+        recent_by_phone: Dict[str, List[str]] = {}
+        for phone, created_at in recent_rows:
+            recent_by_phone.setdefault(phone, []).append(created_at.isoformat())
+
+        db.session.query(CustomerPhoneStats).delete()
+        db.session.bulk_insert_mappings(CustomerPhoneStats, [
+            {
+                'phone': phone,
+                'total_orders': total_orders,
+                'cancelled_orders': cancelled_orders,
+                'fraud_orders': fraud_orders,
+                'last_order_at': last_order_at,
+                'recent_order_times': recent_by_phone.get(phone, [])[-self.max_recent_orders:],
+                'updated_at': datetime.utcnow()
+            }
+            for phone, total_orders, cancelled_orders, fraud_orders, last_order_at in totals
+        ])
+        db.session.commit()
+
+        return {'phones': len(totals)}
+
+    def _ensure_row(self, phone: str):
+        """
+        Créer la ligne du numéro si besoin (un insert concurrent du même numéro est ignoré)
+        """
+        if db.session.query(CustomerPhoneStats.phone).filter_by(phone=phone).first():
+            return
+
+        try:
+            # Point de sauvegarde: un doublon n'annule pas la transaction de la commande
+            with db.session.begin_nested():
+                db.session.add(CustomerPhoneStats(
+                    phone=phone,
+                    total_orders=0,
+                    cancelled_orders=0,
+                    fraud_orders=0,
+                    recent_order_times=[]
+                ))
+        except IntegrityError:
+            pass
+
+    def _add_recent_time(self, phone: str, created_at: datetime):
+        """
+        Ajouter une date à la fenêtre récente
+
+        Appelé après l'UPDATE des compteurs: la ligne est déjà verrouillée par
+        cette transaction jusqu'au commit, la lecture puis l'écriture de la
+        liste ne peuvent pas croiser celles d'un autre worker.
+        """
+        current = db.session.query(CustomerPhoneStats.recent_order_times).filter_by(phone=phone).scalar()
+        recent_times = self._recent_times_from(current, datetime.utcnow())
+        recent_times.append(created_at)
+        recent_times.sort()
+
+        CustomerPhoneStats.query.filter_by(phone=phone).update({
+            'recent_order_times': [t.isoformat() for t in recent_times[-self.max_recent_orders:]]
+        }, synchronize_session=False)
+
+    @staticmethod
+    def _clamped_increment(column, delta: int):
+        return db.case([(column + delta < 0, 0)], else_=column + delta)
+
+    def _recent_times(self, stats: CustomerPhoneStats, now: datetime) -> List[datetime]:
+        return self._recent_times_from(stats.recent_order_times, now)
+
+    def _recent_times_from(self, values: Optional[List[str]], now: datetime) -> List[datetime]:
+        threshold = now - self.recent_window
+        times = [datetime.fromisoformat(value) for value in (values or [])]
+        return [t for t in times if t >= threshold]
+
+    def _is_fraud(self, notes: Optional[str]) -> bool:
+        return 'FRAUDE' in (notes or '')
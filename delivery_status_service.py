@@ -0,0 +1,279 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from src.models.management import CartRecoveryNotification, NotificationStatus, db
+
+
+class DeliveryStatusIngestor:
+    """
+    Application des statuts de livraison WhatsApp reçus par webhook
+
+    Le webhook ne fait que mettre les statuts en file et répond tout de suite.
+    Un thread les regroupe (batch_size statuts ou flush_interval_seconds), garde
+    le statut le plus avancé par message, retrouve les notifications par
+    provider_message_id (colonne indexée) et écrit le lot en un seul commit.
+
+    Un statut peut arriver avant que la file d'envoi ait enregistré l'identifiant
+    du message. Un statut sans notification n'est réessayé (toutes les
+    unmatched_retry_interval_seconds, pendant unmatched_retry_seconds au plus)
+    que si des notifications WhatsApp sont en cours d'envoi; sinon il ne
+    correspondra jamais (OTP, messages d'autres services) et il est abandonné.
+
+    L'ingestion est au mieux: les statuts en file ne vivent qu'en mémoire et
+    sont perdus si le processus s'arrête avant de les écrire.
+    """
+
+    # Ordre de progression: un statut n'écrase jamais un statut plus avancé
+    STATUS_RANKS = {
+        'sent': 1,
+        'failed': 2,
+        'delivered': 3,
+        'read': 4
+    }
+
+    LOOKUP_CHUNK_SIZE = 500
+
+    def __init__(self, batch_size: Optional[int] = None, flush_interval_seconds: float = 1.0,
+                 unmatched_retry_seconds: float = 30.0, unmatched_retry_interval_seconds: float = 5.0):
+        self.batch_size = batch_size or int(os.getenv('DELIVERY_STATUS_BATCH_SIZE', 500))
+        self.flush_interval_seconds = flush_interval_seconds
+        self.unmatched_retry_seconds = unmatched_retry_seconds
+        self.unmatched_retry_interval_seconds = unmatched_retry_interval_seconds
+
+        self.app = None
+        self.incoming: queue.Queue = queue.Queue()
+        # Statuts sans notification (encore): identifiant -> (reçu à, prochain essai, statut)
+        self.deferred: Dict[str, Tuple[float, float, Dict[str, Any]]] = {}
+        self.thread: Optional[threading.Thread] = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.stats = {
+            'received': 0,
+            'applied': 0,
+            'unmatched': 0,
+            'batches': 0
+        }
+
+    def init_app(self, app):
+        """
+        Le thread d'ingestion ouvre son propre contexte d'application pour écrire en base
+        """
+        self.app = app
+
+    def submit(self, statuses: List[Dict[str, Any]]):
+        """
+        Confier des statuts au thread d'ingestion (ne bloque pas la requête du webhook)
+
+        Chaque statut contient id, status, timestamp et errors (WhatsAppIntegration.parse_webhook).
+        """
+        if not statuses:
+            return
+        self._ensure_started()
+        with self.lock:
+            self.stats['received'] += len(statuses)
+        for status in statuses:
+            self.incoming.put(status)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['waiting_for_notification'] = len(self.deferred)
+        stats['queued'] = self.incoming.qsize()
+        stats['batch_size'] = self.batch_size
+        return stats
+
+    def apply(self, statuses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Appliquer un lot de statuts en une transaction; renvoie les statuts sans notification
+        """
+        latest: Dict[str, Dict[str, Any]] = {}
+        # Première livraison connue: 'delivered' et 'read' arrivent souvent dans le même lot
+        delivered_at: Dict[str, datetime] = {}
+        for status in statuses:
+            if status.get('status') not in self.STATUS_RANKS:
+                continue
+            current = latest.get(status['id'])
+            if current is None or self._rank(status) > self._rank(current):
+                latest[status['id']] = status
+            if status['status'] in ('delivered', 'read'):
+                at = self._timestamp(status)
+                delivered_at[status['id']] = min(at, delivered_at.get(status['id'], at))
+
+        if not latest:
+            return []
+
+        message_ids = list(latest.keys())
+        rows = []
+        for start in range(0, len(message_ids), self.LOOKUP_CHUNK_SIZE):
+            rows.extend(db.session.query(
+                CartRecoveryNotification.id,
+                CartRecoveryNotification.provider_message_id,
+                CartRecoveryNotification.status,
+                CartRecoveryNotification.delivered_at,
+                CartRecoveryNotification.read_at
+            ).filter(
+                CartRecoveryNotification.provider_message_id.in_(message_ids[start:start + self.LOOKUP_CHUNK_SIZE])
+            ).all())
+
+        updates = []
+        matched = set()
+        for row in rows:
+            matched.add(row.provider_message_id)
+            update = self._update_for(row, latest[row.provider_message_id], delivered_at.get(row.provider_message_id))
+            if update:
+                updates.append(update)
+
+        if updates:
+            db.session.bulk_update_mappings(CartRecoveryNotification, updates)
+        db.session.commit()
+
+        with self.lock:
+            self.stats['batches'] += 1
+            self.stats['applied'] += len(updates)
+
+        return [status for message_id, status in latest.items() if message_id not in matched]
+
+    def _rank(self, status: Dict[str, Any]):
+        return self.STATUS_RANKS[status['status']], int(status.get('timestamp') or 0)
+
+    @staticmethod
+    def _timestamp(status: Dict[str, Any]) -> datetime:
+        return datetime.utcfromtimestamp(int(status['timestamp'])) if status.get('timestamp') else datetime.utcnow()
+
+    def _update_for(self, row, status: Dict[str, Any], delivered_at: Optional[datetime]) -> Optional[Dict[str, Any]]:
+        """
+        Modifications d'une notification pour son statut le plus avancé (None si rien ne change)
+        """
+        at = self._timestamp(status)
+        kind = status['status']
+
+        if kind == 'read':
+            if row.read_at:
+                return None
+            return {
+                'id': row.id,
+                'status': NotificationStatus.DELIVERED,
+                'delivered_at': row.delivered_at or delivered_at or at,
+                'read_at': at
+            }
+
+        if kind == 'delivered':
+            if row.delivered_at:
+                return None
+            return {'id': row.id, 'status': NotificationStatus.DELIVERED, 'delivered_at': delivered_at or at}
+
+        if kind == 'failed':
+            # Un échec signalé après la livraison ne remet pas la notification en échec
+            if row.delivered_at or row.status == NotificationStatus.FAILED:
+                return None
+            errors = status.get('errors') or [{}]
+            return {
+                'id': row.id,
+                'status': NotificationStatus.FAILED,
+                'error_message': errors[0].get('title') or errors[0].get('message') or 'Échec de livraison WhatsApp'
+            }
+
+        # 'sent': déjà enregistré par la file d'envoi
+        return None
+
+    def _ensure_started(self):
+        """
+        Démarrer le thread d'ingestion dans ce processus (les threads ne survivent pas au fork)
+        """
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.incoming = queue.Queue()
+            self.deferred = {}
+            self.thread = threading.Thread(target=self._run, name='delivery-statuses', daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+
+            now = time.monotonic()
+            with self.lock:
+                retries = {
+                    message_id: entry for message_id, entry in self.deferred.items() if entry[1] <= now
+                }
+                for message_id in retries:
+                    del self.deferred[message_id]
+
+            if not batch and not retries:
+                continue
+
+            statuses = [status for _, _, status in retries.values()] + batch
+            with self.app.app_context():
+                try:
+                    unmatched = self.apply(statuses)
+                    # Aucun envoi WhatsApp en cours: un statut sans notification ne correspondra jamais
+                    if unmatched and not self._sends_in_flight():
+                        self._drop(len(unmatched))
+                        unmatched = []
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Erreur ingestion des statuts de livraison: {e}")
+                    # Le lot n'est pas perdu: il est repris au passage suivant
+                    unmatched = statuses
+
+            now = time.monotonic()
+            dropped = 0
+            with self.lock:
+                for status in unmatched:
+                    first_seen = retries[status['id']][0] if status['id'] in retries else now
+                    if now - first_seen < self.unmatched_retry_seconds:
+                        self.deferred[status['id']] = (first_seen, now + self.unmatched_retry_interval_seconds, status)
+                    else:
+                        dropped += 1
+            if dropped:
+                self._drop(dropped)
+
+    def _sends_in_flight(self) -> bool:
+        return db.session.query(CartRecoveryNotification.id).filter(
+            CartRecoveryNotification.channel == 'whatsapp',
+            CartRecoveryNotification.status == NotificationStatus.PROCESSING
+        ).first() is not None
+
+    def _drop(self, count: int):
+        with self.lock:
+            self.stats['unmatched'] += count
+
+    def _collect(self) -> List[Dict[str, Any]]:
+        """
+        Attendre un lot plein ou la fin de l'intervalle, selon ce qui arrive en premier
+        """
+        batch = []
+        deadline = time.monotonic() + self.flush_interval_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.incoming.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+
+_delivery_status_ingestor = None
+_delivery_status_ingestor_lock = threading.Lock()
+
+
+def get_delivery_status_ingestor() -> DeliveryStatusIngestor:
+    """
+    Ingestion partagée des statuts de livraison du processus
+    """
+    global _delivery_status_ingestor
+    if _delivery_status_ingestor is None:
+        with _delivery_status_ingestor_lock:
+            if _delivery_status_ingestor is None:
+                _delivery_status_ingestor = DeliveryStatusIngestor()
+    return _delivery_status_ingestor
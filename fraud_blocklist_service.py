@@ -0,0 +1,297 @@
+import hashlib
+import math
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from typing import Dict, Any, List, Optional, Set
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from src.models.management import CODOrder, FraudBlocklistEntry, db
+
+
+def normalize_value(entry_type: str, value: str) -> str:
+    """
+    Normaliser un téléphone, un nom ou une adresse avant hachage
+    """
+    if entry_type == 'phone':
+        digits = re.sub(r'[^\d]', '', value)
+        # Format international algérien ramené au format local
+        if digits.startswith('213') and len(digits) == 12:
+            digits = '0' + digits[3:]
+        return digits
+
+    # Caractères de mot Unicode: les noms et adresses en arabe restent distincts
+    text = unicodedata.normalize('NFKD', value.casefold())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'\w+', text))
+
+
+class BloomFilter:
+    """
+    Filtre de Bloom sur des empreintes 64 bits (double hachage)
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1000)
+        self.capacity = capacity
+        self.size = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, fingerprint: int):
+        for position in self._positions(fingerprint):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, fingerprint: int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(fingerprint))
+
+    def _positions(self, fingerprint: int):
+        first = fingerprint & 0xFFFFFFFF
+        second = (fingerprint >> 32) | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+
+class FingerprintSet:
+    """
+    Ensemble compact d'empreintes 64 bits
+
+    Le gros des entrées est un tableau trié (8 octets par entrée); les ajouts
+    à chaud vont dans un petit ensemble fusionné périodiquement. Le filtre de
+    Bloom écarte en O(1) la quasi-totalité des valeurs absentes.
+    """
+
+    def __init__(self, fingerprints: Optional[List[int]] = None, use_bloom: bool = True, merge_threshold: int = 4096):
+        self.merge_threshold = merge_threshold
+        self.sorted_values = array('Q', sorted(set(fingerprints or [])))
+        self.pending: Set[int] = set()
+
+        self.bloom = None
+        if use_bloom:
+            self.bloom = BloomFilter(len(self.sorted_values) * 2)
+            for fingerprint in self.sorted_values:
+                self.bloom.add(fingerprint)
+
+    def __len__(self) -> int:
+        return len(self.sorted_values) + len(self.pending)
+
+    def add(self, fingerprint: int):
+        if fingerprint in self:
+            return
+
+        self.pending.add(fingerprint)
+        if self.bloom is not None:
+            self.bloom.add(fingerprint)
+
+        if len(self.pending) >= self.merge_threshold:
+            self.sorted_values = array('Q', sorted(list(self.sorted_values) + list(self.pending)))
+            self.pending = set()
+
+            # Filtre saturé: le reconstruire pour garder le taux de faux positifs
+            if self.bloom is not None and len(self.sorted_values) > self.bloom.capacity:
+                self.bloom = BloomFilter(len(self.sorted_values) * 2)
+                for value in self.sorted_values:
+                    self.bloom.add(value)
+
+    def __contains__(self, fingerprint: int) -> bool:
+        if self.bloom is not None and fingerprint not in self.bloom:
+            return False
+        if fingerprint in self.pending:
+            return True
+
+        index = bisect_left(self.sorted_values, fingerprint)
+        return index < len(self.sorted_values) and self.sorted_values[index] == fingerprint
+
+    def memory_bytes(self) -> int:
+        bloom_bytes = len(self.bloom.bits) if self.bloom is not None else 0
+        return self.sorted_values.itemsize * len(self.sorted_values) + bloom_bytes
+
+
+class FraudBlocklistService:
+    """
+    Liste noire des téléphones, adresses et empreintes liés à des fraudes confirmées
+    """
+
+    entry_types = ('phone', 'address', 'fingerprint')
+
+    def __init__(self, use_bloom: bool = True, refresh_interval_seconds: int = 60):
+        self.use_bloom = use_bloom
+        self.refresh_interval_seconds = refresh_interval_seconds
+
+        self.sets: Dict[str, FingerprintSet] = {
+            entry_type: FingerprintSet(use_bloom=use_bloom) for entry_type in self.entry_types
+        }
+
+        self.last_entry_id = 0
+        self.loaded_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def reload(self) -> Dict[str, Any]:
+        """
+        Charger toute la liste noire depuis la base
+        """
+        values: Dict[str, List[int]] = {entry_type: [] for entry_type in self.entry_types}
+        last_entry_id = 0
+
+        rows = db.session.query(
+            FraudBlocklistEntry.id,
+            FraudBlocklistEntry.entry_type,
+            FraudBlocklistEntry.value_hash
+        ).yield_per(10000)
+
+        for entry_id, entry_type, value_hash in rows:
+            if entry_type in values:
+                values[entry_type].append(int(value_hash, 16))
+            last_entry_id = max(last_entry_id, entry_id)
+
+        with self.lock:
+            self.sets = {
+                entry_type: FingerprintSet(fingerprints, use_bloom=self.use_bloom)
+                for entry_type, fingerprints in values.items()
+            }
+            self.last_entry_id = last_entry_id
+            self.loaded_at = time.time()
+
+        return self.get_stats()
+
+    def refresh(self):
+        """
+        Intégrer les entrées ajoutées par d'autres processus (par identifiant croissant)
+        """
+        rows = db.session.query(
+            FraudBlocklistEntry.id,
+            FraudBlocklistEntry.entry_type,
+            FraudBlocklistEntry.value_hash
+        ).filter(FraudBlocklistEntry.id > self.last_entry_id).order_by(FraudBlocklistEntry.id).all()
+
+        with self.lock:
+            for entry_id, entry_type, value_hash in rows:
+                if entry_type in self.sets:
+                    self.sets[entry_type].add(int(value_hash, 16))
+                self.last_entry_id = max(self.last_entry_id, entry_id)
+            self.loaded_at = time.time()
+
+    def ensure_loaded(self):
+        if not self.loaded_at:
+            self.reload()
+        elif time.time() - self.loaded_at >= self.refresh_interval_seconds:
+            self.refresh()
+
+    def check_order(self, order: CODOrder) -> List[str]:
+        """
+        Facteurs de liste noire d'une commande (test d'appartenance en mémoire)
+        """
+        try:
+            self.ensure_loaded()
+        except Exception as e:
+            print(f"Erreur chargement de la liste noire: {e}")
+
+        factors = []
+        for entry_type, value in self._order_values(order).items():
+            if not value or not self.normalize(entry_type, value):
+                continue
+            if self.fingerprint(entry_type, value) in self.sets[entry_type]:
+                factors.append(f'blocklisted_{entry_type}')
+
+        return factors
+
+    def add_order(self, order: CODOrder, fraud_type: Optional[str] = None) -> int:
+        """
+        Ajouter les identifiants d'une commande frauduleuse (dans la transaction en cours)
+        """
+        added = 0
+        for entry_type, value in self._order_values(order).items():
+            if value and self.add_value(entry_type, value, fraud_type, order.order_id):
+                added += 1
+        return added
+
+    def add_value(self, entry_type: str, value: str, fraud_type: Optional[str] = None,
+                  source_order_id: Optional[str] = None) -> bool:
+        """
+        Ajouter une valeur brute à la liste noire
+
+        L'empreinte n'entre dans l'ensemble en mémoire qu'au commit de la
+        transaction (voir _apply_additions).
+        """
+        if entry_type not in self.sets:
+            raise ValueError(f'Type de liste noire inconnu: {entry_type}')
+
+        # Valeur vide après normalisation: toutes partageraient la même empreinte
+        if not self.normalize(entry_type, value):
+            return False
+
+        fingerprint = self.fingerprint(entry_type, value)
+        value_hash = f'{fingerprint:016x}'
+
+        if FraudBlocklistEntry.query.filter_by(entry_type=entry_type, value_hash=value_hash).first():
+            return False
+
+        db.session.add(FraudBlocklistEntry(
+            entry_type=entry_type,
+            value_hash=value_hash,
+            fraud_type=fraud_type,
+            source_order_id=source_order_id
+        ))
+        db.session.info.setdefault('fraud_blocklist_additions', []).append((self, entry_type, fingerprint))
+
+        return True
+
+    def apply_addition(self, entry_type: str, fingerprint: int):
+        with self.lock:
+            self.sets[entry_type].add(fingerprint)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            entry_type: {
+                'entries': len(fingerprint_set),
+                'memory_bytes': fingerprint_set.memory_bytes()
+            }
+            for entry_type, fingerprint_set in self.sets.items()
+        }
+
+    def fingerprint(self, entry_type: str, value: str) -> int:
+        """
+        Empreinte 64 bits de la valeur normalisée
+        """
+        normalized = self.normalize(entry_type, value)
+        digest = hashlib.blake2b(f'{entry_type}:{normalized}'.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def normalize(self, entry_type: str, value: str) -> str:
+        return normalize_value(entry_type, value)
+
+    def _order_values(self, order: CODOrder) -> Dict[str, Optional[str]]:
+        address = f'{order.delivery_address or ""} {order.city or ""}'.strip()
+        return {
+            'phone': order.customer_phone,
+            'address': address,
+            'fingerprint': getattr(order, 'client_fingerprint', None)
+        }
+
+
+_fraud_blocklist_service = None
+
+
+def get_fraud_blocklist_service() -> FraudBlocklistService:
+    """
+    Instance partagée (la liste noire en mémoire est commune au processus)
+    """
+    global _fraud_blocklist_service
+    if _fraud_blocklist_service is None:
+        _fraud_blocklist_service = FraudBlocklistService()
+    return _fraud_blocklist_service
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_additions(session):
+    # Liste noire mise à jour seulement pour les signalements validés
+    for service, entry_type, fingerprint in session.info.pop('fraud_blocklist_additions', None) or []:
+        service.apply_addition(entry_type, fingerprint)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_additions(session):
+    session.info.pop('fraud_blocklist_additions', None)
@@ -1,7 +1,17 @@
-import re
-from typing import Dict, Any, List
-from datetime import datetime, timedelta
-from src.models.management import CODOrder, CODRiskLevel, db
+import time
+from time import perf_counter_ns
+from typing import Dict, Any, List, Optional
+from datetime import datetime
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+from src.models.management import CODOrder, CODOrderRiskFactor, CODRiskLevel, db
+from src.services.customer_history_service import CustomerHistoryService
+from src.services.city_risk_service import get_city_risk_service
+from src.services.fraud_blocklist_service import get_fraud_blocklist_service
+from src.services.identity_similarity_service import get_identity_index
+from src.services.fraud_rule_engine import get_fraud_rule_engine
+from src.services.fraud_model_service import get_fraud_model_service
+from src.services.latency_metrics import get_latency_metrics
 import json
 
 class FraudDetectionService:
@@ -9,236 +19,261 @@ class FraudDetectionService:
     Service de détection de fraude pour les commandes COD
     """
     
+    # Entrées qui dépendent de l'état de la base (historique, listes, index) et non de la commande
+    CONTEXT_INPUTS = {'customer_history', 'high_risk_city', 'blocklist', 'similar_identity_labels'}
+    
     def __init__(self):
-        # Règles de base pour la détection de fraude
-        self.risk_rules = {
-            'high_value_threshold': 50000,  # DZD
-            'suspicious_cities': ['Unknown', 'Test', ''],
-            'phone_patterns': {
-                'invalid': [r'^0{10}', r'^1{10}', r'^(\d)\1{9}'],  # Numéros suspects
-                'valid': [r'^(05|06|07)\d{8}$']  # Format algérien valide
-            },
-            'name_patterns': {
-                'suspicious': [r'^test', r'^fake', r'^admin', r'^\d+$']
-            },
-            'address_patterns': {
-                'suspicious': [r'^test', r'^fake', r'^admin', r'^\d+$', r'^.{1,5}$']
-            }
-        }
+        # Règles et poids: configuration versionnée, rechargée à chaud
+        self.rule_engine = get_fraud_rule_engine()
         
-        # Poids des facteurs de risque
-        self.risk_weights = {
-            'high_order_value': 25,
-            'suspicious_phone': 30,
-            'suspicious_name': 20,
-            'suspicious_address': 15,
-            'suspicious_city': 20,
-            'repeat_customer_fraud': 40,
-            'multiple_orders_same_phone': 15,
-            'weekend_order': 5,
-            'late_night_order': 10
-        }
+        self.customer_history = CustomerHistoryService()
+        self.city_risk = get_city_risk_service()
+        self.blocklist = get_fraud_blocklist_service()
+        self.identity_index = get_identity_index()
+        
+        # Modèle entraîné sur les fraudes confirmées, combiné au score des règles
+        self.fraud_model = get_fraud_model_service()
+        
+        # Latences par étape (entrées de contexte, règles, modèle), préfixe 'fraud.'
+        self.metrics = get_latency_metrics()
+    
+    @property
+    def risk_weights(self) -> Dict[str, float]:
+        return self.rule_engine.weights
     
-    def analyze_order(self, order) -> Dict[str, Any]:
+    def analyze_order(self, order, debug: bool = False) -> Dict[str, Any]:
         """
         Analyser une commande COD pour détecter les risques de fraude
-        """
-        risk_factors = []
-        risk_score = 0
-        
-        # 1. Analyse de la valeur de la commande
-        if order.order_value > self.risk_rules['high_value_threshold']:
-            risk_factors.append('high_order_value')
-            risk_score += self.risk_weights['high_order_value']
-        
-        # 2. Analyse du numéro de téléphone
-        phone_risk = self._analyze_phone(order.customer_phone)
-        if phone_risk:
-            risk_factors.append('suspicious_phone')
-            risk_score += self.risk_weights['suspicious_phone']
-        
-        # 3. Analyse du nom du client
-        name_risk = self._analyze_name(order.customer_name)
-        if name_risk:
-            risk_factors.append('suspicious_name')
-            risk_score += self.risk_weights['suspicious_name']
-        
-        # 4. Analyse de l'adresse
-        address_risk = self._analyze_address(order.delivery_address)
-        if address_risk:
-            risk_factors.append('suspicious_address')
-            risk_score += self.risk_weights['suspicious_address']
-        
-        # 5. Analyse de la ville
-        city_risk = self._analyze_city(order.city)
-        if city_risk:
-            risk_factors.append('suspicious_city')
-            risk_score += self.risk_weights['suspicious_city']
-        
-        # 6. Analyse de l'historique du client
-        customer_history_risk = self._analyze_customer_history(order.customer_phone)
-        if customer_history_risk['has_fraud_history']:
-            risk_factors.append('repeat_customer_fraud')
-            risk_score += self.risk_weights['repeat_customer_fraud']
-        
-        if customer_history_risk['multiple_recent_orders']:
-            risk_factors.append('multiple_orders_same_phone')
-            risk_score += self.risk_weights['multiple_orders_same_phone']
-        
-        # 7. Analyse temporelle
-        time_risk = self._analyze_order_timing()
-        if time_risk['is_weekend']:
-            risk_factors.append('weekend_order')
-            risk_score += self.risk_weights['weekend_order']
-        
-        if time_risk['is_late_night']:
-            risk_factors.append('late_night_order')
-            risk_score += self.risk_weights['late_night_order']
-        
-        # Déterminer le niveau de risque
-        risk_level = self._calculate_risk_level(risk_score)
-        
-        # Déterminer si une vérification est requise
-        verification_required = risk_level in [CODRiskLevel.HIGH, CODRiskLevel.VERY_HIGH]
         
-        return {
-            'score': min(risk_score, 100),  # Limiter à 100
-            'level': risk_level.value,
-            'factors': risk_factors,
-            'verification_required': verification_required,
-            'details': {
-                'phone_analysis': phone_risk,
-                'name_analysis': name_risk,
-                'address_analysis': address_risk,
-                'city_analysis': city_risk,
-                'customer_history': customer_history_risk,
-                'timing_analysis': time_risk
+        Chaque étape est chronométrée; avec debug, les durées de la commande sont
+        ajoutées au résultat.
+        """
+        started = perf_counter_ns()
+        self.rule_engine.maybe_reload()
+        
+        timings: Dict[str, int] = {}
+        rule_timings: Dict[str, int] = {}
+        details: Dict[str, Any] = {}
+        inputs = self._order_inputs(order, self.rule_engine.required_inputs(), details=details, timings=timings)
+        
+        step_started = perf_counter_ns()
+        analysis = self.rule_engine.evaluate(inputs, timings=rule_timings)
+        timings['rules'] = perf_counter_ns() - step_started
+        
+        step_started = perf_counter_ns()
+        history = inputs.get('customer_history')
+        if history is None:
+            history = self._analyze_customer_history(order.customer_phone)
+        self._apply_model(order, analysis, history, inputs.get('order_time'))
+        timings['model'] = perf_counter_ns() - step_started
+        
+        timings['total'] = perf_counter_ns() - started
+        self.metrics.observe_many(timings, 'fraud.')
+        self.metrics.observe_many(rule_timings, 'fraud.rule.')
+        
+        analysis['details'] = details
+        if debug:
+            analysis['debug'] = {
+                'timings_us': self._to_microseconds(timings),
+                'rule_timings_us': self._to_microseconds(rule_timings)
             }
-        }
+        return analysis
+    
+    def _to_microseconds(self, timings: Dict[str, int]) -> Dict[str, float]:
+        return {name: round(nanoseconds / 1000, 2) for name, nanoseconds in timings.items()}
     
-    def _analyze_phone(self, phone: str) -> bool:
+    def get_latency_metrics(self) -> Dict[str, Any]:
         """
-        Analyser le numéro de téléphone pour détecter les anomalies
+        Histogrammes de latence de l'analyse de fraude (par étape et par règle)
         """
-        if not phone:
-            return True
-        
-        # Nettoyer le numéro
-        clean_phone = re.sub(r'[^\d]', '', phone)
-        
-        # Vérifier les patterns suspects
-        for pattern in self.risk_rules['phone_patterns']['invalid']:
-            if re.match(pattern, clean_phone):
-                return True
-        
-        # Vérifier le format valide
-        valid_format = False
-        for pattern in self.risk_rules['phone_patterns']['valid']:
-            if re.match(pattern, clean_phone):
-                valid_format = True
-                break
-        
-        return not valid_format
+        return self.metrics.snapshot('fraud.')
     
-    def _analyze_name(self, name: str) -> bool:
+    def _apply_model(self, order, analysis: Dict[str, Any], history: Dict[str, Any],
+                     at: Optional[datetime] = None):
         """
-        Analyser le nom du client pour détecter les anomalies
+        Combiner le score des règles avec la probabilité du modèle (si un modèle est entraîné)
         """
-        if not name or len(name.strip()) < 2:
-            return True
-        
-        name_lower = name.lower().strip()
-        
-        # Vérifier les patterns suspects
-        for pattern in self.risk_rules['name_patterns']['suspicious']:
-            if re.match(pattern, name_lower):
-                return True
-        
-        return False
+        analysis['rule_score'] = analysis['score']
+        probability = self.fraud_model.predict(self.fraud_model.order_features(order, history, at))
+        analysis['model_probability'] = None if probability is None else round(probability, 4)
+        
+        if probability is None:
+            return
+        
+        score = self.fraud_model.blend(analysis['score'], probability)
+        level = self.rule_engine.level_for(score)
+        analysis['score'] = score
+        analysis['level'] = level
+        analysis['verification_required'] = level in self.rule_engine.table.verification_levels
     
-    def _analyze_address(self, address: str) -> bool:
-        """
-        Analyser l'adresse de livraison pour détecter les anomalies
+    def _order_inputs(self, order, names, at: Optional[datetime] = None,
+                      history: Optional[Dict[str, Any]] = None,
+                      details: Optional[Dict[str, Any]] = None,
+                      timings: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
         """
-        if not address or len(address.strip()) < 5:
-            return True
+        Calculer uniquement les entrées demandées par la table de décision
         
-        address_lower = address.lower().strip()
-        
-        # Vérifier les patterns suspects
-        for pattern in self.risk_rules['address_patterns']['suspicious']:
-            if re.match(pattern, address_lower):
-                return True
-        
-        return False
+        Les entrées de contexte (requêtes, listes, index) sont chronométrées dans timings.
+        """
+        inputs = {}
+        
+        for name in names:
+            if timings is not None:
+                input_started = perf_counter_ns()
+            
+            if name == 'order_time':
+                inputs[name] = at or order.created_at or datetime.utcnow()
+            elif name == 'customer_history':
+                inputs[name] = history if history is not None else self._analyze_customer_history(order.customer_phone)
+            elif name == 'high_risk_city':
+                inputs[name] = self.city_risk.is_high_risk_city(order.city)
+            elif name == 'blocklist':
+                inputs[name] = self.blocklist.check_order(order)
+            elif name == 'similar_identity_labels':
+                similar_identities = self.identity_index.find_similar(order)
+                inputs[name] = {identity['label'] for identity in similar_identities}
+                if details is not None:
+                    details['similar_identities'] = similar_identities
+            else:
+                inputs[name] = getattr(order, name)
+            
+            if timings is not None and name in self.CONTEXT_INPUTS:
+                key = 'input.' + name
+                timings[key] = timings.get(key, 0) + perf_counter_ns() - input_started
+        
+        if details is not None:
+            for name in ('customer_history', 'high_risk_city', 'blocklist'):
+                if name in inputs:
+                    details[name] = inputs[name]
+        
+        return inputs
     
-    def _analyze_city(self, city: str) -> bool:
+    def _analyze_customer_history(self, phone: str) -> Dict[str, Any]:
         """
-        Analyser la ville pour détecter les anomalies
+        Analyser l'historique du client (agrégats par numéro)
         """
-        if not city:
-            return True
-        
-        return city.strip() in self.risk_rules['suspicious_cities']
+        return self.customer_history.get_history(phone)
     
-    def _analyze_customer_history(self, phone: str) -> Dict[str, Any]:
+    def _calculate_risk_level(self, risk_score: float) -> CODRiskLevel:
         """
-        Analyser l'historique du client
+        Calculer le niveau de risque basé sur le score
         """
-        # Rechercher les commandes précédentes avec le même numéro
-        previous_orders = CODOrder.query.filter_by(customer_phone=phone).all()
-        
-        # Vérifier s'il y a eu des fraudes confirmées
-        fraud_history = any(
-            'FRAUDE' in (order.notes or '') 
-            for order in previous_orders
-        )
-        
-        # Vérifier les commandes multiples récentes (dernières 24h)
-        recent_threshold = datetime.utcnow() - timedelta(hours=24)
-        recent_orders = [
-            order for order in previous_orders 
-            if order.created_at >= recent_threshold
-        ]
-        
-        return {
-            'has_fraud_history': fraud_history,
-            'multiple_recent_orders': len(recent_orders) > 1,
-            'total_previous_orders': len(previous_orders),
-            'recent_orders_count': len(recent_orders)
-        }
+        return CODRiskLevel(self.rule_engine.level_for(risk_score))
     
-    def _analyze_order_timing(self) -> Dict[str, bool]:
+    def analyze_orders(self, orders: List[CODOrder], incremental: bool = False) -> List[Dict[str, Any]]:
         """
-        Analyser le timing de la commande
+        Analyser un lot de commandes: historique chargé en une requête, scores calculés par colonne
+        
+        En mode incrémental, une commande déjà notée avec la même version des règles
+        ne réévalue que les règles dépendant du contexte (historique, listes, index).
         """
-        now = datetime.utcnow()
+        if not orders:
+            return []
         
-        # Vérifier si c'est le weekend (samedi = 5, dimanche = 6)
-        is_weekend = now.weekday() >= 5
+        started = perf_counter_ns()
+        self.rule_engine.maybe_reload()
+        version = self.rule_engine.version
         
-        # Vérifier si c'est tard le soir ou tôt le matin (22h-6h)
-        is_late_night = now.hour >= 22 or now.hour <= 6
+        timings: Dict[str, int] = {}
+        rule_timings: Dict[str, int] = {}
         
-        return {
-            'is_weekend': is_weekend,
-            'is_late_night': is_late_night,
-            'hour': now.hour,
-            'weekday': now.weekday()
-        }
+        now = datetime.utcnow()
+        timelines = self.customer_history.load_timelines({order.customer_phone for order in orders})
+        timings['input.load_timelines'] = perf_counter_ns() - started
+        
+        inputs_list = []
+        previous_factors_list = []
+        changed_inputs_list = []
+        histories = []
+        
+        for order in orders:
+            at = order.created_at or now
+            
+            if incremental and order.risk_rules_version == version and order.risk_factors is not None:
+                changed_inputs = self.CONTEXT_INPUTS
+                previous_factors = order.risk_factors
+            else:
+                changed_inputs = None
+                previous_factors = None
+            
+            names = self.rule_engine.required_inputs(changed_inputs)
+            history = self.customer_history.history_at(timelines.get(order.customer_phone), order.id, at)
+            
+            inputs_list.append(self._order_inputs(order, names, at=at, history=history, timings=timings))
+            previous_factors_list.append(previous_factors)
+            changed_inputs_list.append(changed_inputs)
+            histories.append((history, at))
+        
+        step_started = perf_counter_ns()
+        results = self.rule_engine.evaluate_batch(inputs_list, previous_factors_list, changed_inputs_list, rule_timings)
+        timings['rules'] = perf_counter_ns() - step_started
+        
+        step_started = perf_counter_ns()
+        for order, analysis, (history, at) in zip(orders, results, histories):
+            self._apply_model(order, analysis, history, at)
+        timings['model'] = perf_counter_ns() - step_started
+        
+        # Durées moyennes par commande, séparées de l'analyse unitaire
+        timings['total'] = perf_counter_ns() - started
+        self.metrics.observe_many(timings, 'fraud.batch.', count=len(orders))
+        self.metrics.observe_many(rule_timings, 'fraud.batch.rule.', count=len(orders))
+        
+        return results
     
-    def _calculate_risk_level(self, risk_score: float) -> CODRiskLevel:
+    def rescore_orders(self, start_date: Optional[datetime] = None, batch_size: int = 1000,
+                       incremental: bool = True) -> Dict[str, Any]:
         """
-        Calculer le niveau de risque basé sur le score
+        Recalculer le score de toutes les commandes (par lots, pagination par identifiant)
         """
-        if risk_score >= 70:
-            return CODRiskLevel.VERY_HIGH
-        elif risk_score >= 50:
-            return CODRiskLevel.HIGH
-        elif risk_score >= 25:
-            return CODRiskLevel.MEDIUM
-        else:
-            return CODRiskLevel.LOW
+        started = time.perf_counter()
+        rescored = 0
+        level_changes = 0
+        last_id = 0
+        
+        while True:
+            query = CODOrder.query.filter(CODOrder.id > last_id)
+            if start_date:
+                query = query.filter(CODOrder.created_at >= start_date)
+            
+            orders = query.order_by(CODOrder.id).limit(batch_size).all()
+            if not orders:
+                break
+            
+            updates = []
+            factor_rows = []
+            for order, analysis in zip(orders, self.analyze_orders(orders, incremental=incremental)):
+                if order.risk_level.value != analysis['level']:
+                    level_changes += 1
+                
+                updates.append({
+                    'id': order.id,
+                    'risk_score': analysis['score'],
+                    'rule_risk_score': analysis['rule_score'],
+                    'risk_level': CODRiskLevel(analysis['level']),
+                    'risk_factors': analysis['factors'],
+                    'verification_required': analysis['verification_required'],
+                    'risk_rules_version': analysis['rules_version']
+                })
+                factor_rows.extend(
+                    {'order_id': order.id, 'factor': factor, 'created_at': order.created_at}
+                    for factor in analysis['factors']
+                )
+            
+            last_id = orders[-1].id
+            db.session.bulk_update_mappings(CODOrder, updates)
+            self._replace_factor_rows([order.id for order in orders], factor_rows)
+            db.session.commit()
+            db.session.expunge_all()
+            rescored += len(updates)
+        
+        # Les cumuls par ville contiennent les anciens scores
+        self.city_risk.rebuild()
+        
+        return {
+            'rescored_orders': rescored,
+            'level_changes': level_changes,
+            'duration_seconds': round(time.perf_counter() - started, 2)
+        }
     
     def update_fraud_model(self, order, fraud_type: str, details: str):
         """
@@ -261,29 +296,82 @@ class FraudDetectionService:
         # Dans une implémentation réelle, ceci serait sauvegardé dans une base de données
         # pour l'analyse et l'amélioration du modèle
         print(f"Fraude confirmée enregistrée: {json.dumps(fraud_data, indent=2)}")
+        
+        # Bloquer le téléphone, l'adresse et l'empreinte pour les commandes suivantes
+        self.blocklist.add_order(order, fraud_type)
+        
+        # Indexer l'identité pour repérer les variantes (un chiffre ou une lettre changés);
+        # les autres processus la reprennent via les entrées de liste noire
+        self.identity_index.add_identity(order, 'fraud')
+    
+    def set_risk_factors(self, order: CODOrder, factors: List[str]):
+        """
+        Enregistrer les facteurs de risque d'une commande (JSON et table normalisée)
+        """
+        order.risk_factors = factors
+        created_at = order.created_at or datetime.utcnow()
+        order.factor_rows = [CODOrderRiskFactor(factor=factor, created_at=created_at) for factor in factors]
+    
+    def backfill_risk_factors(self, batch_size: int = 1000) -> Dict[str, Any]:
+        """
+        Convertir les facteurs JSON existants vers la table normalisée (rejouable)
+        """
+        processed = 0
+        inserted = 0
+        last_id = 0
+        
+        while True:
+            rows = db.session.query(
+                CODOrder.id,
+                CODOrder.created_at,
+                CODOrder.risk_factors
+            ).filter(CODOrder.id > last_id).order_by(CODOrder.id).limit(batch_size).all()
+            
+            if not rows:
+                break
+            
+            factor_rows = [
+                {'order_id': order_id, 'factor': factor, 'created_at': created_at}
+                for order_id, created_at, risk_factors in rows
+                for factor in set(risk_factors or [])
+            ]
+            
+            self._replace_factor_rows([row[0] for row in rows], factor_rows)
+            db.session.commit()
+            
+            last_id = rows[-1][0]
+            processed += len(rows)
+            inserted += len(factor_rows)
+        
+        return {'processed_orders': processed, 'factor_rows': inserted}
+    
+    def _replace_factor_rows(self, order_ids: List[int], factor_rows: List[Dict[str, Any]]):
+        db.session.query(CODOrderRiskFactor)\
+                  .filter(CODOrderRiskFactor.order_id.in_(order_ids))\
+                  .delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(CODOrderRiskFactor, factor_rows)
     
     def get_risk_factors_analysis(self, start_date: datetime) -> List[Dict[str, Any]]:
         """
         Analyser les facteurs de risque les plus fréquents
         """
-        # Récupérer toutes les commandes avec facteurs de risque depuis start_date
-        orders = CODOrder.query.filter(
+        total_orders = CODOrder.query.filter(
             CODOrder.created_at >= start_date,
             CODOrder.risk_factors.isnot(None)
-        ).all()
+        ).count()
         
         # Compter les occurrences de chaque facteur de risque
-        factor_counts = {}
-        total_orders = len(orders)
-        
-        for order in orders:
-            if order.risk_factors:
-                for factor in order.risk_factors:
-                    factor_counts[factor] = factor_counts.get(factor, 0) + 1
+        factor_counts = db.session.query(
+            CODOrderRiskFactor.factor,
+            db.func.count(CODOrderRiskFactor.id).label('count')
+        ).filter(
+            CODOrderRiskFactor.created_at >= start_date
+        ).group_by(CODOrderRiskFactor.factor)\
+         .order_by(db.func.count(CODOrderRiskFactor.id).desc(), CODOrderRiskFactor.factor).all()
         
         # Créer la liste des facteurs triés par fréquence
         risk_factors_analysis = []
-        for factor, count in sorted(factor_counts.items(), key=lambda x: x[1], reverse=True):
+        for factor, count in factor_counts:
             percentage = (count / total_orders * 100) if total_orders > 0 else 0
             risk_factors_analysis.append({
                 'factor': factor,
@@ -294,49 +382,52 @@ class FraudDetectionService:
         
         return risk_factors_analysis
     
-    def get_city_risk_profile(self, city: str) -> Dict[str, Any]:
+    def get_risk_factor_cooccurrence(self, start_date: datetime, limit: int = 20) -> List[Dict[str, Any]]:
         """
-        Obtenir le profil de risque d'une ville
+        Paires de facteurs de risque les plus souvent présentes sur une même commande
         """
-        # Analyser les commandes des 90 derniers jours pour cette ville
-        ninety_days_ago = datetime.utcnow() - timedelta(days=90)
-        
-        city_orders = CODOrder.query.filter(
-            CODOrder.city == city,
-            CODOrder.created_at >= ninety_days_ago
-        ).all()
-        
-        if not city_orders:
-            return {
-                'city': city,
-                'total_orders': 0,
-                'risk_profile': 'unknown'
-            }
-        
-        # Calculer les statistiques
-        total_orders = len(city_orders)
-        avg_risk_score = sum(order.risk_score for order in city_orders) / total_orders
-        
-        fraud_orders = [
-            order for order in city_orders 
-            if order.notes and 'FRAUDE' in order.notes
+        first = aliased(CODOrderRiskFactor)
+        second = aliased(CODOrderRiskFactor)
+        
+        pairs = db.session.query(
+            first.factor,
+            second.factor,
+            db.func.count(first.order_id).label('count')
+        ).join(
+            second, and_(second.order_id == first.order_id, second.factor > first.factor)
+        ).filter(
+            first.created_at >= start_date
+        ).group_by(first.factor, second.factor)\
+         .order_by(db.func.count(first.order_id).desc()).limit(limit).all()
+        
+        return [
+            {'factors': [first_factor, second_factor], 'count': count}
+            for first_factor, second_factor, count in pairs
         ]
-        fraud_rate = len(fraud_orders) / total_orders * 100
-        
-        # Déterminer le profil de risque de la ville
-        if fraud_rate > 20 or avg_risk_score > 60:
-            risk_profile = 'high_risk'
-        elif fraud_rate > 10 or avg_risk_score > 40:
-            risk_profile = 'medium_risk'
-        else:
-            risk_profile = 'low_risk'
-        
-        return {
-            'city': city,
-            'total_orders': total_orders,
-            'avg_risk_score': round(avg_risk_score, 2),
-            'fraud_rate': round(fraud_rate, 2),
-            'fraud_orders': len(fraud_orders),
-            'risk_profile': risk_profile
-        }
-
+    
+    def get_risk_factor_trends(self, start_date: datetime) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Évolution journalière de chaque facteur de risque
+        """
+        day_expression = db.func.date(CODOrderRiskFactor.created_at)
+        
+        rows = db.session.query(
+            CODOrderRiskFactor.factor,
+            day_expression,
+            db.func.count(CODOrderRiskFactor.id)
+        ).filter(
+            CODOrderRiskFactor.created_at >= start_date
+        ).group_by(CODOrderRiskFactor.factor, day_expression)\
+         .order_by(CODOrderRiskFactor.factor, day_expression).all()
+        
+        trends: Dict[str, List[Dict[str, Any]]] = {}
+        for factor, day, count in rows:
+            trends.setdefault(factor, []).append({'date': str(day), 'count': count})
+        
+        return trends
+    
+    def get_city_risk_profile(self, city: str) -> Dict[str, Any]:
+        """
+        Obtenir le profil de risque d'une ville (cumuls journaliers des 90 derniers jours)
+        """
+        return self.city_risk.get_profile(city)
@@ -0,0 +1,492 @@
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import or_
+from src.models.management import CODOrder, OrderStatus
+from src.services.customer_history_service import CustomerHistoryService
+
+
+class FraudModelService:
+    """
+    Modèle de fraude entraînable (régression logistique) combiné au score des règles
+
+    Étiquettes: fraude confirmée ou commande retournée = 1, commande livrée = 0.
+    Le modèle est sauvegardé dans un petit fichier JSON; l'inférence est un
+    seul produit scalaire sur des coefficients pré-normalisés.
+    """
+
+    FEATURES = [
+        'log_order_value',
+        'has_email',
+        'short_name',
+        'log_address_length',
+        'weekend',
+        'late_night',
+        'log_previous_orders',
+        'recent_orders',
+        'previous_cancel_rate',
+        'previous_fraud'
+    ]
+
+    def __init__(self, model_path: Optional[str] = None, blend_weight: float = 0.4,
+                 reload_interval_seconds: float = 30.0, training_timeout_seconds: int = 3600):
+        self.model_path = model_path or os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), 'database', 'fraud_model.json'
+        )
+        # État de l'entraînement en cours, lisible par tous les processus
+        self.training_status_path = f'{os.path.splitext(self.model_path)[0]}_training.json'
+        self.training_timeout_seconds = training_timeout_seconds
+        self.blend_weight = blend_weight
+        self.reload_interval_seconds = reload_interval_seconds
+        self.customer_history = CustomerHistoryService()
+
+        self.model: Optional[Dict[str, Any]] = None
+        self.weights: Optional[List[float]] = None
+        self.bias = 0.0
+        self.loaded_mtime: Optional[float] = None
+        self.checked_at = 0.0
+
+        self.app = None
+        self.training_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    def order_features(self, order, history: Optional[Dict[str, Any]], at: Optional[datetime] = None) -> List[float]:
+        """
+        Variables d'une commande (historique connu à la date de la commande)
+        """
+        at = at or order.created_at or datetime.utcnow()
+        history = history or {}
+        previous_orders = history.get('total_previous_orders', 0)
+
+        return [
+            math.log1p(max(order.order_value or 0.0, 0.0)),
+            1.0 if order.customer_email else 0.0,
+            1.0 if len((order.customer_name or '').strip()) < 5 else 0.0,
+            math.log1p(len((order.delivery_address or '').strip())),
+            1.0 if at.weekday() >= 5 else 0.0,
+            1.0 if at.hour >= 22 or at.hour <= 6 else 0.0,
+            math.log1p(previous_orders),
+            float(history.get('recent_orders_count', 0)),
+            history.get('cancelled_orders', 0) / previous_orders if previous_orders else 0.0,
+            1.0 if history.get('has_fraud_history') else 0.0
+        ]
+
+    def predict(self, features: List[float]) -> Optional[float]:
+        """
+        Probabilité de fraude (None si aucun modèle n'est entraîné)
+        """
+        self.ensure_loaded()
+        if self.weights is None:
+            return None
+
+        z = self.bias + sum(w * x for w, x in zip(self.weights, features))
+        return self._sigmoid(z)
+
+    def blend(self, rule_score: float, probability: float) -> float:
+        """
+        Score combiné règles + modèle (sur 100)
+
+        Le modèle peut relever le score des règles, jamais l'abaisser: les seuils
+        de niveau sont calibrés sur les règles, et une probabilité faible ne doit
+        pas faire passer une commande HIGH sous le seuil de vérification.
+        """
+        blended = (1 - self.blend_weight) * rule_score + self.blend_weight * 100 * probability
+        return round(max(rule_score, blended), 2)
+
+    def ensure_loaded(self):
+        """
+        Charger le fichier de poids, puis le recharger s'il a été remplacé
+        """
+        now = time.time()
+        if now - self.checked_at < self.reload_interval_seconds:
+            return
+        self.checked_at = now
+
+        try:
+            if not os.path.exists(self.model_path):
+                return
+            mtime = os.path.getmtime(self.model_path)
+            if mtime != self.loaded_mtime:
+                with open(self.model_path, 'r', encoding='utf-8') as f:
+                    self._set_model(json.load(f))
+                self.loaded_mtime = mtime
+        except Exception as e:
+            print(f"Erreur chargement du modèle de fraude: {e}")
+
+    def train(self, holdout_modulo: int = 5, l2: float = 1.0, max_iterations: int = 25) -> Dict[str, Any]:
+        """
+        Entraîner le modèle sur les commandes étiquetées et l'évaluer sur l'échantillon réservé
+        """
+        started = time.perf_counter()
+        train_set, holdout_set = self._split(self.build_dataset(), holdout_modulo)
+
+        labels = [label for _, label, _ in train_set]
+        if len(train_set) < 50 or len(set(labels)) < 2:
+            return {'success': False, 'error': 'Pas assez de commandes étiquetées pour entraîner le modèle'}
+
+        rows = [features for features, _, _ in train_set]
+        means, stds = self._standardization(rows)
+        standardized = [[(x - m) / s for x, m, s in zip(row, means, stds)] for row in rows]
+
+        coefficients, intercept, iterations = self._fit_logistic(standardized, labels, l2, max_iterations)
+
+        # Coefficients repliés sur les variables brutes: inférence en un produit scalaire
+        weights = [c / s for c, s in zip(coefficients, stds)]
+        bias = intercept - sum(c * m / s for c, m, s in zip(coefficients, means, stds))
+
+        model = {
+            'format': 1,
+            'trained_at': datetime.utcnow().isoformat(),
+            'features': self.FEATURES,
+            'weights': weights,
+            'bias': bias,
+            'standardized_coefficients': dict(zip(self.FEATURES, coefficients)),
+            'training': {
+                'orders': len(train_set),
+                'positives': sum(labels),
+                'l2': l2,
+                'iterations': iterations,
+                'holdout_modulo': holdout_modulo
+            }
+        }
+        self._set_model(model)
+        model['holdout'] = self._evaluate_set(holdout_set)
+
+        self._save(model)
+        model['duration_seconds'] = round(time.perf_counter() - started, 2)
+        model['success'] = True
+        return model
+
+    def start_training(self, holdout_modulo: int = 5, l2: float = 1.0) -> Dict[str, Any]:
+        """
+        Lancer l'entraînement dans un thread d'arrière-plan (suivi par get_training_status)
+
+        Un entraînement déjà en cours (dans ce processus ou un autre) n'est pas
+        relancé: son état est renvoyé avec started=False.
+        """
+        with self.training_lock:
+            status = self.get_training_status()
+            if status.get('status') == 'running' and not self._training_stale(status):
+                return dict(status, started=False)
+
+            status = {
+                'status': 'running',
+                'started_at': datetime.utcnow().isoformat(),
+                'pid': os.getpid(),
+                'holdout_modulo': holdout_modulo,
+                'l2': l2
+            }
+            self._write_training_status(status)
+
+        thread = threading.Thread(
+            target=self._train_in_context, args=(holdout_modulo, l2),
+            name='fraud-model-training', daemon=True
+        )
+        thread.start()
+        return dict(status, started=True)
+
+    def get_training_status(self) -> Dict[str, Any]:
+        """
+        État du dernier entraînement lancé en arrière-plan
+        """
+        try:
+            with open(self.training_status_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'status': 'idle'}
+
+    def evaluate(self, holdout_modulo: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Évaluer le modèle sauvegardé sur l'échantillon réservé (métriques et calibration)
+        """
+        self.checked_at = 0.0
+        self.ensure_loaded()
+        if self.weights is None:
+            return {'success': False, 'error': 'Aucun modèle entraîné'}
+
+        holdout_modulo = holdout_modulo or self.model['training']['holdout_modulo']
+        _, holdout_set = self._split(self.build_dataset(), holdout_modulo)
+
+        report = self._evaluate_set(holdout_set)
+        report['success'] = True
+        report['trained_at'] = self.model['trained_at']
+        return report
+
+    def describe(self) -> Dict[str, Any]:
+        self.ensure_loaded()
+        if self.model is None:
+            return {'trained': False, 'model_path': self.model_path}
+        return dict(self.model, trained=True, model_path=self.model_path, blend_weight=self.blend_weight)
+
+    def build_dataset(self, batch_size: int = 2000) -> List[Tuple[List[float], int, Tuple[int, Optional[float]]]]:
+        """
+        Commandes étiquetées: (variables, étiquette, (identifiant, score des règles))
+
+        Le score des règles est celui enregistré avant la combinaison avec le
+        modèle (None pour une commande notée avant son enregistrement).
+        """
+        dataset = []
+        last_id = 0
+
+        while True:
+            orders = CODOrder.query.filter(
+                CODOrder.id > last_id,
+                or_(
+                    CODOrder.status.in_([OrderStatus.DELIVERED, OrderStatus.RETURNED]),
+                    CODOrder.notes.like('%FRAUDE%')
+                )
+            ).order_by(CODOrder.id).limit(batch_size).all()
+
+            if not orders:
+                break
+
+            timelines = self.customer_history.load_timelines({order.customer_phone for order in orders})
+            for order in orders:
+                at = order.created_at or datetime.utcnow()
+                # history_at ne voit que les commandes antérieures: la fraude de la commande ne fuit pas
+                history = self.customer_history.history_at(timelines.get(order.customer_phone), order.id, at)
+
+                label = 1 if ('FRAUDE' in (order.notes or '') or order.status == OrderStatus.RETURNED) else 0
+                dataset.append((self.order_features(order, history, at), label, (order.id, order.rule_risk_score)))
+
+            last_id = orders[-1].id
+
+        return dataset
+
+    def _split(self, dataset, holdout_modulo: int):
+        train_set = [row for row in dataset if row[2][0] % holdout_modulo != 0]
+        holdout_set = [row for row in dataset if row[2][0] % holdout_modulo == 0]
+        return train_set, holdout_set
+
+    def _evaluate_set(self, dataset) -> Dict[str, Any]:
+        """
+        AUC, log-loss, Brier, précision/rappel et courbe de calibration
+        """
+        if not dataset:
+            return {'orders': 0}
+
+        labels = [label for _, label, _ in dataset]
+        probabilities = [self.predict(features) for features, _, _ in dataset]
+        # Référence: règles seules, sur les commandes dont le score des règles est connu
+        rule_scores = [meta[1] / 100 for _, _, meta in dataset if meta[1] is not None]
+        rule_labels = [label for _, label, meta in dataset if meta[1] is not None]
+
+        started = time.perf_counter()
+        for features, _, _ in dataset:
+            self.predict(features)
+        inference_us = (time.perf_counter() - started) / len(dataset) * 1e6
+
+        epsilon = 1e-12
+        log_loss = -sum(
+            y * math.log(max(p, epsilon)) + (1 - y) * math.log(max(1 - p, epsilon))
+            for p, y in zip(probabilities, labels)
+        ) / len(labels)
+        brier = sum((p - y) ** 2 for p, y in zip(probabilities, labels)) / len(labels)
+
+        predicted_positive = [p >= 0.5 for p in probabilities]
+        true_positive = sum(1 for predicted, y in zip(predicted_positive, labels) if predicted and y)
+        precision = true_positive / sum(predicted_positive) if any(predicted_positive) else 0.0
+        recall = true_positive / sum(labels) if sum(labels) else 0.0
+
+        return {
+            'orders': len(labels),
+            'positives': sum(labels),
+            'auc': round(self._auc(probabilities, labels), 4),
+            'rule_score_auc': round(self._auc(rule_scores, rule_labels), 4) if rule_scores else None,
+            'rule_score_orders': len(rule_scores),
+            'log_loss': round(log_loss, 4),
+            'brier_score': round(brier, 4),
+            'precision_at_0_5': round(precision, 4),
+            'recall_at_0_5': round(recall, 4),
+            'inference_microseconds': round(inference_us, 2),
+            'calibration': self._calibration(probabilities, labels)
+        }
+
+    def _calibration(self, probabilities: List[float], labels: List[int], bins: int = 10) -> List[Dict[str, Any]]:
+        buckets = [[0, 0.0, 0] for _ in range(bins)]
+        for p, y in zip(probabilities, labels):
+            bucket = buckets[min(int(p * bins), bins - 1)]
+            bucket[0] += 1
+            bucket[1] += p
+            bucket[2] += y
+
+        return [
+            {
+                'range': [round(i / bins, 2), round((i + 1) / bins, 2)],
+                'orders': count,
+                'mean_predicted': round(total_p / count, 4),
+                'observed_rate': round(positives / count, 4)
+            }
+            for i, (count, total_p, positives) in enumerate(buckets) if count
+        ]
+
+    def _auc(self, scores: List[float], labels: List[int]) -> float:
+        """
+        Aire sous la courbe ROC par les rangs (Mann-Whitney, ex æquo moyennés)
+        """
+        positives = sum(labels)
+        negatives = len(labels) - positives
+        if not positives or not negatives:
+            return 0.0
+
+        ranked = sorted(zip(scores, labels))
+        rank_sum = 0.0
+        i = 0
+        while i < len(ranked):
+            j = i
+            while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+                j += 1
+            average_rank = (i + j) / 2 + 1
+            rank_sum += average_rank * sum(1 for k in range(i, j + 1) if ranked[k][1])
+            i = j + 1
+
+        return (rank_sum - positives * (positives + 1) / 2) / (positives * negatives)
+
+    def _standardization(self, rows: List[List[float]]) -> Tuple[List[float], List[float]]:
+        count = len(rows)
+        means = [sum(column) / count for column in zip(*rows)]
+        stds = [
+            math.sqrt(sum((x - m) ** 2 for x in column) / count) or 1.0
+            for column, m in zip(zip(*rows), means)
+        ]
+        return means, stds
+
+    def _fit_logistic(self, rows: List[List[float]], labels: List[int], l2: float,
+                      max_iterations: int) -> Tuple[List[float], float, int]:
+        """
+        Régression logistique L2 par Newton-Raphson (IRLS)
+        """
+        dimension = len(rows[0]) + 1
+        weights = [0.0] * dimension
+        augmented = [row + [1.0] for row in rows]
+
+        for iteration in range(1, max_iterations + 1):
+            gradient = [0.0] * dimension
+            hessian = [[0.0] * dimension for _ in range(dimension)]
+
+            for x, y in zip(augmented, labels):
+                p = self._sigmoid(sum(w * v for w, v in zip(weights, x)))
+                error = p - y
+                curvature = p * (1 - p)
+                for a in range(dimension):
+                    gradient[a] += error * x[a]
+                    row = hessian[a]
+                    scaled = curvature * x[a]
+                    for b in range(a, dimension):
+                        row[b] += scaled * x[b]
+
+            # Pénalité L2 (hors constante) et symétrisation de la hessienne
+            for a in range(dimension):
+                for b in range(a):
+                    hessian[a][b] = hessian[b][a]
+                if a < dimension - 1:
+                    gradient[a] += l2 * weights[a]
+                    hessian[a][a] += l2
+
+            step = self._solve(hessian, gradient)
+            weights = [w - s for w, s in zip(weights, step)]
+
+            if max(abs(s) for s in step) < 1e-6:
+                break
+
+        return weights[:-1], weights[-1], iteration
+
+    def _solve(self, matrix: List[List[float]], vector: List[float]) -> List[float]:
+        """
+        Élimination de Gauss avec pivot partiel
+        """
+        size = len(vector)
+        augmented = [row[:] + [value] for row, value in zip(matrix, vector)]
+
+        for column in range(size):
+            pivot = max(range(column, size), key=lambda r: abs(augmented[r][column]))
+            augmented[column], augmented[pivot] = augmented[pivot], augmented[column]
+            pivot_value = augmented[column][column] or 1e-12
+
+            for r in range(column + 1, size):
+                factor = augmented[r][column] / pivot_value
+                if factor:
+                    for c in range(column, size + 1):
+                        augmented[r][c] -= factor * augmented[column][c]
+
+        solution = [0.0] * size
+        for r in range(size - 1, -1, -1):
+            total = augmented[r][size] - sum(augmented[r][c] * solution[c] for c in range(r + 1, size))
+            solution[r] = total / (augmented[r][r] or 1e-12)
+        return solution
+
+    def _sigmoid(self, z: float) -> float:
+        if z >= 0:
+            return 1.0 / (1.0 + math.exp(-z))
+        exp_z = math.exp(z)
+        return exp_z / (1.0 + exp_z)
+
+    def _set_model(self, model: Dict[str, Any]):
+        if model.get('features') != self.FEATURES:
+            print("Modèle de fraude ignoré: variables différentes de la version courante")
+            return
+        self.model = model
+        self.weights = model['weights']
+        self.bias = model['bias']
+
+    def _train_in_context(self, holdout_modulo: int, l2: float):
+        status = self.get_training_status()
+        with self.app.app_context():
+            try:
+                result = self.train(holdout_modulo=holdout_modulo, l2=l2)
+                if result['success']:
+                    status.update({
+                        'status': 'completed',
+                        'training': result['training'],
+                        'holdout': result['holdout'],
+                        'duration_seconds': result['duration_seconds']
+                    })
+                else:
+                    status.update({'status': 'failed', 'error': result['error']})
+            except Exception as e:
+                print(f"Erreur entraînement du modèle de fraude: {e}")
+                status.update({'status': 'failed', 'error': str(e)})
+
+        status['finished_at'] = datetime.utcnow().isoformat()
+        self._write_training_status(status)
+
+    def _training_stale(self, status: Dict[str, Any]) -> bool:
+        """
+        Entraînement 'running' sans fin depuis trop longtemps (processus arrêté)
+        """
+        started_at = datetime.fromisoformat(status['started_at'])
+        return (datetime.utcnow() - started_at).total_seconds() > self.training_timeout_seconds
+
+    def _write_training_status(self, status: Dict[str, Any]):
+        os.makedirs(os.path.dirname(self.training_status_path), exist_ok=True)
+        temporary_path = f'{self.training_status_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(status, f, indent=2)
+        os.replace(temporary_path, self.training_status_path)
+
+    def _save(self, model: Dict[str, Any]):
+        os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
+        temporary_path = f'{self.model_path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(model, f, indent=2)
+        os.replace(temporary_path, self.model_path)
+        self.loaded_mtime = os.path.getmtime(self.model_path)
+
+
+_fraud_model_service = None
+
+
+def get_fraud_model_service() -> FraudModelService:
+    """
+    Instance partagée du modèle de fraude
+    """
+    global _fraud_model_service
+    if _fraud_model_service is None:
+        _fraud_model_service = FraudModelService()
+    return _fraud_model_service
@@ -0,0 +1,158 @@
+import random
+import re
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Dict, Any, List
+from src.services.fraud_rule_engine import FraudRuleEngine
+
+
+# Règles de l'implémentation impérative d'origine (référence du banc d'essai)
+LEGACY_RULES = {
+    'high_value_threshold': 50000,
+    'suspicious_cities': ['Unknown', 'Test', ''],
+    'phone_patterns': {
+        'invalid': [r'^0{10}', r'^1{10}', r'^(\d)\1{9}'],
+        'valid': [r'^(05|06|07)\d{8}$']
+    },
+    'name_patterns': {
+        'suspicious': [r'^test', r'^fake', r'^admin', r'^\d+$']
+    },
+    'address_patterns': {
+        'suspicious': [r'^test', r'^fake', r'^admin', r'^\d+$', r'^.{1,5}$']
+    }
+}
+
+LEGACY_WEIGHTS = {
+    'high_order_value': 25,
+    'suspicious_phone': 30,
+    'suspicious_name': 20,
+    'suspicious_address': 15,
+    'suspicious_city': 20,
+    'weekend_order': 5,
+    'late_night_order': 10
+}
+
+
+def legacy_score(order) -> int:
+    """
+    Évaluation impérative des règles statiques, telle qu'avant le moteur de règles
+    """
+    score = 0
+
+    if order.order_value > LEGACY_RULES['high_value_threshold']:
+        score += LEGACY_WEIGHTS['high_order_value']
+
+    phone = order.customer_phone
+    if not phone:
+        score += LEGACY_WEIGHTS['suspicious_phone']
+    else:
+        clean_phone = re.sub(r'[^\d]', '', phone)
+        invalid = any(re.match(pattern, clean_phone) for pattern in LEGACY_RULES['phone_patterns']['invalid'])
+        valid = any(re.match(pattern, clean_phone) for pattern in LEGACY_RULES['phone_patterns']['valid'])
+        if invalid or not valid:
+            score += LEGACY_WEIGHTS['suspicious_phone']
+
+    name = order.customer_name
+    if not name or len(name.strip()) < 2 or any(
+            re.match(pattern, name.lower().strip()) for pattern in LEGACY_RULES['name_patterns']['suspicious']):
+        score += LEGACY_WEIGHTS['suspicious_name']
+
+    address = order.delivery_address
+    if not address or len(address.strip()) < 5 or any(
+            re.match(pattern, address.lower().strip()) for pattern in LEGACY_RULES['address_patterns']['suspicious']):
+        score += LEGACY_WEIGHTS['suspicious_address']
+
+    if not order.city or order.city.strip() in LEGACY_RULES['suspicious_cities']:
+        score += LEGACY_WEIGHTS['suspicious_city']
+
+    if order.created_at.weekday() >= 5:
+        score += LEGACY_WEIGHTS['weekend_order']
+    if order.created_at.hour >= 22 or order.created_at.hour <= 6:
+        score += LEGACY_WEIGHTS['late_night_order']
+
+    return score
+
+
+def generate_orders(count: int, seed: int = 7) -> List[SimpleNamespace]:
+    """
+    Commandes synthétiques (une partie volontairement suspecte)
+    """
+    generator = random.Random(seed)
+    cities = ['Alger', 'Oran', 'Constantine', 'Sétif', 'Test', '']
+    start = datetime(2024, 1, 1)
+
+    orders = []
+    for i in range(count):
+        suspicious = generator.random() < 0.2
+        orders.append(SimpleNamespace(
+            customer_phone='0000000000' if suspicious else f'0{generator.choice("567")}{generator.randint(0, 99999999):08d}',
+            customer_name='test user' if suspicious else f'Client {i}',
+            delivery_address='fake' if suspicious else f'{generator.randint(1, 200)} rue des Martyrs',
+            city=generator.choice(cities),
+            order_value=generator.uniform(1000, 80000),
+            created_at=start + timedelta(minutes=generator.randint(0, 525600))
+        ))
+    return orders
+
+
+def run_benchmark(count: int = 20000, engine: FraudRuleEngine = None) -> Dict[str, Any]:
+    """
+    Comparer le débit (règles/s) de l'implémentation impérative et de la table de décision
+    """
+    engine = engine or FraudRuleEngine()
+    orders = generate_orders(count)
+
+    # Les entrées de contexte sont figées: seul le coût des règles est mesuré
+    context = {
+        'customer_history': {'has_fraud_history': False, 'multiple_recent_orders': False},
+        'high_risk_city': False,
+        'blocklist': [],
+        'similar_identity_labels': set()
+    }
+    inputs_list = [
+        dict(context,
+             order_value=order.order_value,
+             customer_phone=order.customer_phone,
+             customer_name=order.customer_name,
+             delivery_address=order.delivery_address,
+             city=order.city,
+             order_time=order.created_at)
+        for order in orders
+    ]
+
+    started = time.perf_counter()
+    legacy_scores = [legacy_score(order) for order in orders]
+    legacy_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = engine.evaluate_batch(inputs_list)
+    engine_seconds = time.perf_counter() - started
+
+    # Réévaluation incrémentale: seules les règles de contexte sont recalculées
+    started = time.perf_counter()
+    engine.evaluate_batch(
+        inputs_list,
+        [result['factors'] for result in results],
+        [{'customer_history', 'high_risk_city', 'blocklist', 'similar_identity_labels'}] * count
+    )
+    incremental_seconds = time.perf_counter() - started
+
+    mismatches = sum(1 for legacy, result in zip(legacy_scores, results) if min(legacy, 100) != result['score'])
+    legacy_rules = len(LEGACY_WEIGHTS) * count
+    engine_rules = len(engine.table.rules) * count
+
+    return {
+        'orders': count,
+        'legacy_rules_per_second': round(legacy_rules / legacy_seconds),
+        'engine_rules_per_second': round(engine_rules / engine_seconds),
+        'engine_incremental_orders_per_second': round(count / incremental_seconds),
+        'legacy_orders_per_second': round(count / legacy_seconds),
+        'engine_orders_per_second': round(count / engine_seconds),
+        'score_mismatches': mismatches
+    }
+
+
+if __name__ == '__main__':
+    for key, value in run_benchmark().items():
+        print(f'{key}: {value}')
@@ -0,0 +1,330 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from time import perf_counter_ns
+from operator import itemgetter
+from typing import Dict, Any, List, Optional, Set, Callable, NamedTuple, Tuple
+
+
+def _greater_than(threshold: float) -> Callable[[Any], bool]:
+    return lambda value: value is not None and value > threshold
+
+
+def _phone_pattern(invalid: List[str], valid: List[str]) -> Callable[[Any], bool]:
+    non_digit = re.compile(r'[^\d]')
+    invalid_patterns = [re.compile(pattern) for pattern in invalid]
+    valid_patterns = [re.compile(pattern) for pattern in valid]
+
+    def predicate(value):
+        if not value:
+            return True
+        clean_phone = non_digit.sub('', value)
+        if any(pattern.match(clean_phone) for pattern in invalid_patterns):
+            return True
+        return not any(pattern.match(clean_phone) for pattern in valid_patterns)
+
+    return predicate
+
+
+def _text_pattern(patterns: List[str], min_length: int = 0) -> Callable[[Any], bool]:
+    compiled = [re.compile(pattern) for pattern in patterns]
+
+    def predicate(value):
+        if not value or len(value.strip()) < min_length:
+            return True
+        text = value.lower().strip()
+        return any(pattern.match(text) for pattern in compiled)
+
+    return predicate
+
+
+def _in_set(values: List[str], match_empty: bool = False) -> Callable[[Any], bool]:
+    members = frozenset(values)
+    return lambda value: match_empty if not value else value.strip() in members
+
+
+def _weekend() -> Callable[[Any], bool]:
+    # Samedi = 5, dimanche = 6
+    return lambda value: value.weekday() >= 5
+
+
+def _hour_outside(start_hour: int, end_hour: int) -> Callable[[Any], bool]:
+    return lambda value: value.hour >= start_hour or value.hour <= end_hour
+
+
+def _flag(key: str) -> Callable[[Any], bool]:
+    return lambda value: bool(value and value.get(key))
+
+
+def _is_true() -> Callable[[Any], bool]:
+    return bool
+
+
+def _contains(value: str) -> Callable[[Any], bool]:
+    return lambda collection: bool(collection) and value in collection
+
+
+PREDICATES: Dict[str, Callable[..., Callable[[Any], bool]]] = {
+    'greater_than': _greater_than,
+    'phone_pattern': _phone_pattern,
+    'text_pattern': _text_pattern,
+    'in_set': _in_set,
+    'weekend': _weekend,
+    'hour_outside': _hour_outside,
+    'flag': _flag,
+    'is_true': _is_true,
+    'contains': _contains
+}
+
+
+class CompiledRule(NamedTuple):
+    rule_id: str
+    weight: float
+    input_name: str
+    predicate: Callable[[Any], bool]
+
+
+class DecisionTable(NamedTuple):
+    version: str
+    label: Any
+    rules: Tuple[CompiledRule, ...]
+    weights: Dict[str, float]
+    levels: Tuple[Tuple[float, str], ...]
+    verification_levels: frozenset
+    max_score: float
+    rules_by_input: Dict[str, Tuple[int, ...]]
+
+
+class FraudRuleEngine:
+    """
+    Moteur de règles anti-fraude déclaratif
+
+    Les règles sont lues depuis un fichier JSON versionné et compilées en une
+    table de décision (prédicats précompilés). Le fichier est surveillé: une
+    modification est prise en compte sans redémarrer les workers.
+
+    La version de la table est une empreinte de son contenu (règles actives,
+    poids, arguments, niveaux): toute modification qui change les scores
+    change la version, même si le champ "version" du fichier n'a pas été
+    incrémenté. Ce champ reste un libellé (label).
+    """
+
+    def __init__(self, config_path: Optional[str] = None, reload_interval_seconds: float = 5.0):
+        self.config_path = config_path or os.environ.get(
+            'FRAUD_RULES_PATH', os.path.join(os.path.dirname(__file__), 'fraud_rules.json')
+        )
+        self.reload_interval_seconds = reload_interval_seconds
+
+        self.table: Optional[DecisionTable] = None
+        self.loaded_mtime: Optional[float] = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+        self.load()
+
+    @property
+    def version(self) -> str:
+        return self.table.version
+
+    @property
+    def weights(self) -> Dict[str, float]:
+        return self.table.weights
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Lire et compiler la configuration (la table courante reste active en cas d'erreur)
+        """
+        mtime = os.path.getmtime(self.config_path)
+        with open(self.config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        table = self.compile(config)
+
+        with self.lock:
+            self.table = table
+            self.loaded_mtime = mtime
+            self.checked_at = time.time()
+
+        return {'version': table.version, 'label': table.label, 'rules': len(table.rules)}
+
+    def maybe_reload(self):
+        """
+        Recharger si le fichier a changé (vérification au plus toutes les quelques secondes)
+        """
+        now = time.time()
+        if now - self.checked_at < self.reload_interval_seconds:
+            return
+        self.checked_at = now
+
+        try:
+            if os.path.getmtime(self.config_path) != self.loaded_mtime:
+                result = self.load()
+                print(f"Règles anti-fraude rechargées: version {result['version']} ({result['label']})")
+        except Exception as e:
+            print(f"Erreur rechargement des règles anti-fraude: {e}")
+
+    def compile(self, config: Dict[str, Any]) -> DecisionTable:
+        """
+        Compiler la configuration en table de décision
+        """
+        rules = []
+        rules_by_input: Dict[str, List[int]] = {}
+        enabled_rules = []
+
+        for rule in config['rules']:
+            if rule.get('enabled', True) is False:
+                continue
+            enabled_rules.append({key: rule.get(key) for key in ('id', 'weight', 'input', 'predicate', 'args')})
+
+            factory = PREDICATES.get(rule['predicate'])
+            if factory is None:
+                raise ValueError(f"Prédicat inconnu pour la règle {rule['id']}: {rule['predicate']}")
+
+            rules_by_input.setdefault(rule['input'], []).append(len(rules))
+            rules.append(CompiledRule(
+                rule_id=rule['id'],
+                weight=rule['weight'],
+                input_name=rule['input'],
+                predicate=factory(**rule.get('args', {}))
+            ))
+
+        levels = tuple(sorted(
+            ((level['min_score'], level['level']) for level in config['levels']),
+            reverse=True
+        ))
+
+        verification_levels = frozenset(config.get('verification_levels', []))
+        max_score = config.get('max_score', 100)
+
+        # Empreinte du contenu compilé: clés triées, indépendante de la mise en forme du fichier
+        content = json.dumps({
+            'rules': enabled_rules,
+            'levels': levels,
+            'verification_levels': sorted(verification_levels),
+            'max_score': max_score
+        }, sort_keys=True, separators=(',', ':'))
+
+        return DecisionTable(
+            version=hashlib.sha256(content.encode('utf-8')).hexdigest()[:12],
+            label=config.get('version'),
+            rules=tuple(rules),
+            weights={rule.rule_id: rule.weight for rule in rules},
+            levels=levels,
+            verification_levels=verification_levels,
+            max_score=max_score,
+            rules_by_input={name: tuple(indexes) for name, indexes in rules_by_input.items()}
+        )
+
+    def required_inputs(self, changed_inputs: Optional[Set[str]] = None) -> Set[str]:
+        """
+        Entrées à calculer: toutes, ou seulement celles qui ont changé et sont utilisées
+        """
+        names = set(self.table.rules_by_input)
+        return names if changed_inputs is None else names & changed_inputs
+
+    def evaluate(self, inputs: Dict[str, Any], previous_factors: Optional[List[str]] = None,
+                 changed_inputs: Optional[Set[str]] = None,
+                 timings: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """
+        Évaluer une commande
+
+        Avec previous_factors et changed_inputs, seules les règles dont l'entrée a
+        changé sont réévaluées; les autres reprennent le résultat précédent.
+        """
+        return self.evaluate_batch([inputs], [previous_factors], [changed_inputs], timings)[0]
+
+    def evaluate_batch(self, inputs_list: List[Dict[str, Any]],
+                       previous_factors_list: Optional[List[Optional[List[str]]]] = None,
+                       changed_inputs_list: Optional[List[Optional[Set[str]]]] = None,
+                       timings: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+        """
+        Évaluer un lot règle par règle (une colonne 0/1 par règle)
+
+        Si timings est fourni, la durée de chaque règle sur le lot y est ajoutée
+        (nanosecondes, clé = identifiant de la règle).
+        """
+        table = self.table
+        size = len(inputs_list)
+        previous_factors_list = previous_factors_list or [None] * size
+        changed_inputs_list = changed_inputs_list or [None] * size
+
+        previous_sets = [
+            set(previous) if previous is not None and changed is not None else None
+            for previous, changed in zip(previous_factors_list, changed_inputs_list)
+        ]
+
+        scores = [0] * size
+        factors: List[List[str]] = [[] for _ in range(size)]
+
+        incremental = any(previous is not None for previous in previous_sets)
+
+        for rule_id, weight, input_name, predicate in table.rules:
+            if timings is not None:
+                rule_started = perf_counter_ns()
+
+            if incremental:
+                column = [
+                    rule_id in previous_sets[i]
+                    if previous_sets[i] is not None and input_name not in changed_inputs_list[i]
+                    else predicate(inputs_list[i][input_name])
+                    for i in range(size)
+                ]
+            else:
+                column = map(predicate, map(itemgetter(input_name), inputs_list))
+
+            for i, matched in enumerate(column):
+                if matched:
+                    scores[i] += weight
+                    factors[i].append(rule_id)
+
+            if timings is not None:
+                timings[rule_id] = timings.get(rule_id, 0) + perf_counter_ns() - rule_started
+
+        results = []
+        for score, order_factors in zip(scores, factors):
+            level = self.level_for(score, table)
+            results.append({
+                'score': min(score, table.max_score),
+                'level': level,
+                'factors': order_factors,
+                'verification_required': level in table.verification_levels,
+                'rules_version': table.version
+            })
+
+        return results
+
+    def level_for(self, score: float, table: Optional[DecisionTable] = None) -> str:
+        for min_score, level in (table or self.table).levels:
+            if score >= min_score:
+                return level
+        return 'low'
+
+    def describe(self) -> Dict[str, Any]:
+        table = self.table
+        return {
+            'version': table.version,
+            'label': table.label,
+            'config_path': self.config_path,
+            'rules': [
+                {'id': rule.rule_id, 'weight': rule.weight, 'input': rule.input_name}
+                for rule in table.rules
+            ],
+            'levels': [{'level': level, 'min_score': min_score} for min_score, level in table.levels],
+            'verification_levels': sorted(table.verification_levels)
+        }
+
+
+_fraud_rule_engine = None
+
+
+def get_fraud_rule_engine() -> FraudRuleEngine:
+    """
+    Instance partagée du moteur de règles
+    """
+    global _fraud_rule_engine
+    if _fraud_rule_engine is None:
+        _fraud_rule_engine = FraudRuleEngine()
+    return _fraud_rule_engine
@@ -0,0 +1,164 @@
+import os
+import threading
+from typing import Dict, Any, Optional, Tuple, Union
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class HTTPClient:
+    """
+    Client HTTP partagé par les intégrations sortantes (SMS, WhatsApp, Shopify)
+
+    Une session requests par hôte: les connexions restent ouvertes (keep-alive)
+    et sont réutilisées d'un appel à l'autre, sans DNS, TCP ni TLS à refaire.
+    Les erreurs de connexion sont rejouées pour toutes les méthodes; les erreurs
+    de lecture et les réponses 429/5xx seulement pour les méthodes idempotentes,
+    pour ne jamais envoyer deux fois un même message.
+    """
+
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_maxsize: Optional[int] = None, connect_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None, max_retries: Optional[int] = None,
+                 backoff_factor: float = 0.2):
+        self.pool_maxsize = pool_maxsize or int(os.getenv('HTTP_POOL_MAXSIZE', 20))
+        self.connect_timeout = connect_timeout or float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+        self.read_timeout = read_timeout or float(os.getenv('HTTP_READ_TIMEOUT', 10))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('HTTP_MAX_RETRIES', 2))
+        self.backoff_factor = backoff_factor
+
+        self.host_settings: Dict[str, Dict[str, Any]] = {}
+        self.sessions: Dict[str, requests.Session] = {}
+        self.request_counts: Dict[str, int] = {}
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    def configure_host(self, host: str, pool_maxsize: Optional[int] = None, connect_timeout: Optional[float] = None,
+                       read_timeout: Optional[float] = None, max_retries: Optional[int] = None):
+        """
+        Réglages propres à un hôte (prise en compte à la prochaine création de session)
+        """
+        settings = {
+            'pool_maxsize': pool_maxsize,
+            'connect_timeout': connect_timeout,
+            'read_timeout': read_timeout,
+            'max_retries': max_retries
+        }
+        with self.lock:
+            self.host_settings[host] = {key: value for key, value in settings.items() if value is not None}
+            session = self.sessions.pop(host, None)
+        if session:
+            session.close()
+
+    def _setting(self, host: str, name: str):
+        return self.host_settings.get(host, {}).get(name, getattr(self, name))
+
+    def _session(self, url: str) -> Tuple[str, requests.Session]:
+        parts = urlsplit(url)
+        host = parts.netloc
+
+        with self.lock:
+            # Les sockets ne doivent pas être partagés entre processus après un fork
+            if self.pid != os.getpid():
+                self.sessions = {}
+                self.pid = os.getpid()
+
+            session = self.sessions.get(host)
+            if session is None:
+                session = self._create_session(host)
+                self.sessions[host] = session
+            self.request_counts[host] = self.request_counts.get(host, 0) + 1
+
+        return host, session
+
+    def _create_session(self, host: str) -> requests.Session:
+        retries = self._setting(host, 'max_retries')
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=self.IDEMPOTENT_METHODS,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self._setting(host, 'pool_maxsize'),
+            max_retries=retry
+        )
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _timeout(self, host: str, timeout: Optional[Timeout]) -> Tuple[float, float]:
+        connect_timeout = self._setting(host, 'connect_timeout')
+        if timeout is None:
+            return connect_timeout, self._setting(host, 'read_timeout')
+        if isinstance(timeout, tuple):
+            return timeout
+        # Délai unique de l'appelant: borne aussi la connexion
+        return min(connect_timeout, timeout), timeout
+
+    def request(self, method: str, url: str, timeout: Optional[Timeout] = None, **kwargs) -> requests.Response:
+        host, session = self._session(url)
+        return session.request(method, url, timeout=self._timeout(host, timeout), **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        with self.lock:
+            sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'pool_maxsize': self.pool_maxsize,
+                'connect_timeout': self.connect_timeout,
+                'read_timeout': self.read_timeout,
+                'max_retries': self.max_retries,
+                'hosts': {
+                    host: {
+                        'requests': self.request_counts.get(host, 0),
+                        'settings': self.host_settings.get(host, {})
+                    }
+                    for host in self.sessions
+                }
+            }
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> HTTPClient:
+    """
+    Client HTTP partagé du processus (sessions par hôte)
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = HTTPClient()
+    return _http_client
@@ -0,0 +1,346 @@
+import operator
+import os
+import pickle
+import random
+import threading
+import time
+import zlib
+from array import array
+from typing import Dict, Any, List, Optional, Set, Tuple
+from src.models.management import CODOrder, CustomerPhoneStats, FraudBlocklistEntry, db
+from src.services.fraud_blocklist_service import normalize_value
+
+
+class MinHasher:
+    """
+    Signatures MinHash sur des shingles hachés (crc32 masqué par permutation)
+    """
+
+    def __init__(self, num_perm: int = 36, seed: int = 42):
+        generator = random.Random(seed)
+        self.num_perm = num_perm
+        self.masks = [generator.getrandbits(32) for _ in range(num_perm)]
+
+    def signature(self, shingles: Set[str]) -> array:
+        hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+        if not hashes:
+            return array('I', [0xFFFFFFFF] * self.num_perm)
+
+        # Un XOR par permutation: le minimum se calcule en C via map()
+        return array('I', [min(map(mask.__xor__, hashes)) for mask in self.masks])
+
+
+class IdentitySimilarityIndex:
+    """
+    Index LSH des identités connues (fraudes confirmées, clients à fort volume)
+
+    Une identité est l'ensemble des shingles du nom, de l'adresse et du
+    téléphone normalisés; deux commandes qui ne diffèrent que d'un chiffre ou
+    d'une faute de frappe partagent la plupart de leurs bandes LSH.
+
+    L'index est construit au démarrage (warm_up) ou par la route / commande de
+    reconstruction, jamais dans une requête. Chaque processus intègre ensuite
+    les fraudes confirmées ailleurs comme la liste noire: par identifiant
+    croissant des entrées de liste noire (commande source), et recharge le
+    fichier quand un autre processus l'a reconstruit. Une fraude dont aucun
+    identifiant n'est nouveau dans la liste noire n'est vue par les autres
+    processus qu'à la reconstruction suivante.
+    """
+
+    # Version de la normalisation des shingles: un fichier plus ancien est reconstruit
+    shingle_version = 2
+
+    def __init__(self, index_path: Optional[str] = None, num_perm: int = 36, bands: int = 9,
+                 similarity_threshold: float = 0.6, strict_similarity_threshold: float = 0.8,
+                 high_volume_min_orders: int = 5, refresh_interval_seconds: int = 60):
+        self.index_path = index_path or os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), 'database', 'identity_lsh.pkl'
+        )
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.similarity_threshold = similarity_threshold
+        self.strict_similarity_threshold = strict_similarity_threshold
+        self.high_volume_min_orders = high_volume_min_orders
+        self.refresh_interval_seconds = refresh_interval_seconds
+
+        # Identités: (signature, label, téléphone normalisé, commande source)
+        self.identities: List[Tuple[array, str, str, Optional[str]]] = []
+        self.buckets: Dict[Tuple[int, int], List[int]] = {}
+        self.identity_keys: Set[Tuple[str, str]] = set()
+
+        # Dernière entrée de liste noire intégrée et version du fichier chargé
+        self.last_entry_id = 0
+        self.file_mtime: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def shingles(self, name: Optional[str], address: Optional[str], phone: Optional[str]) -> Set[str]:
+        """
+        Shingles de caractères (trigrammes) par champ normalisé
+        """
+        shingles = set()
+
+        for field, text in (('n', normalize_value('name', name or '')),
+                            ('a', normalize_value('address', address or '')),
+                            ('p', normalize_value('phone', phone or ''))):
+            padded = f' {text} '
+            shingles.update(f'{field}:{padded[i:i + 3]}' for i in range(len(padded) - 2))
+            if field != 'p':
+                shingles.update(f'{field}w:{token}' for token in text.split())
+
+        return shingles
+
+    def order_signature(self, order: CODOrder) -> array:
+        address = f'{order.delivery_address or ""} {order.city or ""}'
+        return self.hasher.signature(self.shingles(order.customer_name, address, order.customer_phone))
+
+    def has_identity_text(self, order: CODOrder) -> bool:
+        """
+        Nom ou adresse exploitables: sans eux la signature ne porte que sur le téléphone
+        """
+        address = f'{order.delivery_address or ""} {order.city or ""}'
+        return bool(normalize_value('name', order.customer_name or '') or normalize_value('address', address))
+
+    def add_identity(self, order: CODOrder, label: str) -> bool:
+        """
+        Indexer l'identité d'une commande (label 'fraud' ou 'high_volume')
+        """
+        with self.lock:
+            return self._add(self.identities, self.buckets, self.identity_keys, order, label)
+
+    def find_similar(self, order: CODOrder, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Identités proches d'une commande (hors même numéro: déjà couvert par l'historique)
+        """
+        try:
+            self.ensure_loaded()
+        except Exception as e:
+            print(f"Erreur rafraîchissement de l'index d'identités: {e}")
+
+        if not self.has_identity_text(order):
+            return []
+
+        # Une reconstruction remplace les structures: garder celles du début de la recherche
+        identities, buckets = self.identities, self.buckets
+
+        signature = self.order_signature(order)
+        phone = normalize_value('phone', order.customer_phone or '')
+
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(buckets.get(band_key, ()))
+
+        matches = []
+        for identity_id in candidates:
+            identity_signature, label, identity_phone, source_order_id = identities[identity_id]
+            if identity_phone == phone:
+                continue
+
+            similarity = sum(map(operator.eq, signature, identity_signature)) / self.hasher.num_perm
+            if similarity < self.similarity_threshold:
+                continue
+
+            # Numéro très différent: n'accepter que des nom et adresse quasi identiques
+            if similarity >= self.strict_similarity_threshold or self._phones_close(phone, identity_phone):
+                matches.append({
+                    'label': label,
+                    'similarity': round(similarity, 3),
+                    'source_order_id': source_order_id
+                })
+
+        matches.sort(key=lambda match: match['similarity'], reverse=True)
+        return matches[:limit]
+
+    def warm_up(self) -> Dict[str, Any]:
+        """
+        Charger l'index depuis le disque, ou le construire et le sauvegarder (démarrage)
+        """
+        if self.load():
+            self.refresh()
+        else:
+            self.build_from_database()
+            self.save()
+        return self.get_stats()
+
+    def ensure_loaded(self):
+        """
+        Intégrer périodiquement les changements des autres processus (jamais de construction ici)
+        """
+        if self.loaded_at is None:
+            # Index pas encore chargé (échec au démarrage): fichier seulement, sans reconstruction
+            self.loaded_at = time.time()
+            if self.load():
+                self.refresh()
+        elif time.time() - self.loaded_at >= self.refresh_interval_seconds:
+            self.refresh()
+
+    def refresh(self):
+        """
+        Recharger un fichier reconstruit ailleurs, puis ajouter les nouvelles fraudes de la liste noire
+        """
+        self.loaded_at = time.time()
+
+        mtime = self._file_mtime()
+        if mtime is not None and mtime != self.file_mtime:
+            self.load()
+
+        rows = db.session.query(FraudBlocklistEntry.id, FraudBlocklistEntry.source_order_id)\
+                         .filter(FraudBlocklistEntry.id > self.last_entry_id)\
+                         .order_by(FraudBlocklistEntry.id).all()
+        if not rows:
+            return
+
+        order_ids = list({source_order_id for _, source_order_id in rows if source_order_id})
+        for start in range(0, len(order_ids), 500):
+            for order in CODOrder.query.filter(CODOrder.order_id.in_(order_ids[start:start + 500])).all():
+                if 'FRAUDE' in (order.notes or ''):
+                    self.add_identity(order, 'fraud')
+
+        with self.lock:
+            self.last_entry_id = max(self.last_entry_id, rows[-1][0])
+
+    def build_from_database(self) -> Dict[str, Any]:
+        """
+        Reconstruire l'index: commandes frauduleuses et numéros à fort volume
+        """
+        identities: List[Tuple[array, str, str, Optional[str]]] = []
+        buckets: Dict[Tuple[int, int], List[int]] = {}
+        identity_keys: Set[Tuple[str, str]] = set()
+
+        # Relevé avant la lecture des commandes: une fraude confirmée pendant la construction est reprise par refresh()
+        last_entry_id = db.session.query(db.func.max(FraudBlocklistEntry.id)).scalar() or 0
+
+        fraud_orders = CODOrder.query.filter(CODOrder.notes.like('%FRAUDE%')).yield_per(1000)
+        fraud_count = sum(1 for order in fraud_orders if self._add(identities, buckets, identity_keys, order, 'fraud'))
+
+        high_volume_phones = [
+            phone for (phone,) in db.session.query(CustomerPhoneStats.phone)
+                                            .filter(CustomerPhoneStats.total_orders >= self.high_volume_min_orders).all()
+        ]
+
+        high_volume_count = 0
+        for start in range(0, len(high_volume_phones), 500):
+            # Dernière commande de chaque numéro comme identité de référence
+            latest_ids = db.session.query(db.func.max(CODOrder.id))\
+                                   .filter(CODOrder.customer_phone.in_(high_volume_phones[start:start + 500]))\
+                                   .group_by(CODOrder.customer_phone)
+            for order in CODOrder.query.filter(CODOrder.id.in_(latest_ids)).all():
+                if self._add(identities, buckets, identity_keys, order, 'high_volume'):
+                    high_volume_count += 1
+
+        with self.lock:
+            self.identities = identities
+            self.buckets = buckets
+            self.identity_keys = identity_keys
+            self.last_entry_id = last_entry_id
+            self.loaded_at = time.time()
+
+        return {'fraud_identities': fraud_count, 'high_volume_identities': high_volume_count, 'buckets': len(buckets)}
+
+    def save(self):
+        """
+        Persister l'index sur disque (écriture atomique)
+        """
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        temporary_path = f'{self.index_path}.{os.getpid()}.tmp'
+
+        with self.lock:
+            state = {
+                'num_perm': self.hasher.num_perm,
+                'bands': self.bands,
+                'shingle_version': self.shingle_version,
+                'identities': [(signature.tobytes(), label, phone, source) for signature, label, phone, source in self.identities],
+                'identity_keys': set(self.identity_keys),
+                'last_entry_id': self.last_entry_id
+            }
+
+        with open(temporary_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, self.index_path)
+        self.file_mtime = self._file_mtime()
+
+    def load(self) -> bool:
+        mtime = self._file_mtime()
+        if mtime is None:
+            return False
+
+        with open(self.index_path, 'rb') as f:
+            state = pickle.load(f)
+
+        # Paramètres différents: l'index doit être reconstruit
+        if state.get('num_perm') != self.hasher.num_perm or state.get('bands') != self.bands:
+            return False
+        if state.get('shingle_version') != self.shingle_version:
+            return False
+
+        identities = []
+        buckets: Dict[Tuple[int, int], List[int]] = {}
+        for identity_id, (raw_signature, label, phone, source) in enumerate(state['identities']):
+            signature = array('I')
+            signature.frombytes(raw_signature)
+            identities.append((signature, label, phone, source))
+            for band_key in self._band_keys(signature):
+                buckets.setdefault(band_key, []).append(identity_id)
+
+        with self.lock:
+            self.identities = identities
+            self.buckets = buckets
+            self.identity_keys = set(state['identity_keys'])
+            self.last_entry_id = state.get('last_entry_id', 0)
+            self.file_mtime = mtime
+            self.loaded_at = time.time()
+
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        labels: Dict[str, int] = {}
+        for _, label, _, _ in self.identities:
+            labels[label] = labels.get(label, 0) + 1
+        return {'identities': labels, 'buckets': len(self.buckets), 'index_path': self.index_path}
+
+    def _add(self, identities: List[Tuple[array, str, str, Optional[str]]], buckets: Dict[Tuple[int, int], List[int]],
+             identity_keys: Set[Tuple[str, str]], order: CODOrder, label: str) -> bool:
+        phone = normalize_value('phone', order.customer_phone or '')
+        key = (label, f'{phone}|{normalize_value("name", order.customer_name or "")}')
+        if key in identity_keys or not self.has_identity_text(order):
+            return False
+
+        signature = self.order_signature(order)
+        identity_id = len(identities)
+        identities.append((signature, label, phone, order.order_id))
+        identity_keys.add(key)
+
+        for band_key in self._band_keys(signature):
+            buckets.setdefault(band_key, []).append(identity_id)
+
+        return True
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.index_path)
+        except OSError:
+            return None
+
+    def _phones_close(self, first: str, second: str, max_differences: int = 2) -> bool:
+        if len(first) != len(second):
+            return False
+        return sum(map(operator.ne, first, second)) <= max_differences
+
+    def _band_keys(self, signature: array):
+        rows = self.rows_per_band
+        for band in range(self.bands):
+            yield band, hash(tuple(signature[band * rows:(band + 1) * rows]))
+
+
+_identity_index = None
+
+
+def get_identity_index() -> IdentitySimilarityIndex:
+    """
+    Instance partagée de l'index d'identités
+    """
+    global _identity_index
+    if _identity_index is None:
+        _identity_index = IdentitySimilarityIndex()
+    return _identity_index
@@ -1,6 +1,9 @@
 from flask import Blueprint, jsonify, request
 from src.integrations.shopify_integration import ShopifyIntegration
 from src.integrations.whatsapp_integration import WhatsAppIntegration
+from src.services.delivery_status_service import get_delivery_status_ingestor
+from src.services.message_scheduler import get_message_scheduler
+from src.services.message_templates import TemplateNotFound, get_message_template_engine
 from datetime import datetime
 import json
 
@@ -219,26 +222,108 @@ def whatsapp_webhook():
             return 'Token invalide', 403
     
     elif request.method == 'POST':
-        # Traitement des messages entrants
+        # Traitement des messages entrants et des statuts de livraison
         try:
-            webhook_data = request.get_json()
+            webhook_data = request.get_json() or {}
             
-            # Traiter le webhook (simulation)
-            result = {
-                'success': True,
-                'timestamp': datetime.utcnow().isoformat(),
-                'processed': True
-            }
+            parsed = WhatsAppIntegration.parse_webhook(webhook_data)
+            if not parsed['success']:
+                return jsonify(parsed), 400
             
-            # En production, traiter les messages avec WhatsAppIntegration
-            # whatsapp = WhatsAppIntegration(phone_number_id, access_token)
-            # result = whatsapp.process_webhook(webhook_data)
+            # Les statuts sont appliqués par lots hors de la requête: Meta attend une réponse rapide
+            get_delivery_status_ingestor().submit(parsed['statuses'])
             
-            return jsonify(result)
+            return jsonify({
+                'success': True,
+                'timestamp': datetime.utcnow().isoformat(),
+                'type': parsed['type'],
+                'messages': len(parsed['messages']),
+                'statuses_queued': len(parsed['statuses'])
+            })
             
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+@integrations_bp.route('/integrations/whatsapp/delivery-statuses', methods=['GET'])
+def get_delivery_status_stats():
+    """
+    Ingestion des statuts de livraison: reçus, appliqués, en attente de leur notification
+    """
+    try:
+        return jsonify(get_delivery_status_ingestor().get_stats())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@integrations_bp.route('/integrations/messaging/rate-limits', methods=['GET'])
+def get_messaging_rate_limits():
+    """
+    Débits SMS / WhatsApp, files d'attente par priorité et refus 429
+    """
+    try:
+        return jsonify(get_message_scheduler().get_stats())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@integrations_bp.route('/integrations/messaging/rate-limits', methods=['PUT'])
+def update_messaging_rate_limits():
+    """
+    Modifier le débit d'un fournisseur (messages par seconde)
+    """
+    try:
+        data = request.get_json() or {}
+        provider = data.get('provider')
+        rate = data.get('rate')
+        
+        if provider not in ('sms', 'whatsapp') or not rate or float(rate) <= 0:
+            return jsonify({'error': 'Fournisseur (sms, whatsapp) et débit positif requis'}), 400
+        
+        sender_rate = data.get('sender_rate')
+        get_message_scheduler().configure_provider(
+            provider, float(rate), float(sender_rate) if sender_rate else None
+        )
+        
+        return jsonify(get_message_scheduler().get_stats())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@integrations_bp.route('/integrations/messaging/templates', methods=['GET'])
+def get_message_templates():
+    """
+    Lister les gabarits de messages chargés (objet, canal, langue, client)
+    """
+    try:
+        return jsonify(get_message_template_engine().describe())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@integrations_bp.route('/integrations/messaging/templates/preview', methods=['POST'])
+def preview_message_template():
+    """
+    Rendre un gabarit avec des valeurs d'exemple
+    """
+    try:
+        data = request.get_json() or {}
+        purpose = data.get('purpose')
+        channel = data.get('channel')
+        
+        if not purpose or not channel:
+            return jsonify({'error': 'Objet (purpose) et canal requis'}), 400
+        
+        rendered = get_message_template_engine().render(
+            purpose, channel, data.get('values', {}), data.get('language'), data.get('tenant')
+        )
+        
+        return jsonify(rendered)
+        
+    except TemplateNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @integrations_bp.route('/integrations/available', methods=['GET'])
 def get_available_integrations():
     """
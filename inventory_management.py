@@ -1,6 +1,8 @@
 from flask import Blueprint, jsonify, request
 from src.models.management import InventoryItem, InventoryAlert, InventoryMovement, db
 from src.services.inventory_service import InventoryService
+from src.services.alert_dispatcher import get_alert_dispatcher
+from src.services.trending_service import get_trending_service
 from datetime import datetime, timedelta
 import csv
 import io
@@ -9,6 +11,7 @@ inventory_management_bp = Blueprint('inventory_management', __name__)
 
 # Initialisation du service d'inventaire
 inventory_service = InventoryService()
+trending_service = get_trending_service()
 
 @inventory_management_bp.route('/inventory/items', methods=['GET'])
 def get_inventory_items():
@@ -198,6 +201,10 @@ def create_inventory_movement():
         db.session.add(movement)
         db.session.commit()
         
+        # Les sorties de stock alimentent les tendances de vente
+        if movement_type == 'out':
+            trending_service.record_event(item.product_id, item.category, 'sale', quantity)
+        
         # Vérifier si des alertes doivent être créées
         inventory_service.check_and_create_alerts(item.id)
         
@@ -283,6 +290,17 @@ def resolve_alert(alert_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@inventory_management_bp.route('/inventory/alerts/dispatch-stats', methods=['GET'])
+def get_alert_dispatch_stats():
+    """
+    Envoi des alertes: messages immédiats, récapitulatifs et destinataires en attente
+    """
+    try:
+        return jsonify(get_alert_dispatcher().get_stats())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @inventory_management_bp.route('/inventory/analytics', methods=['GET'])
 def get_inventory_analytics():
     """
@@ -387,6 +405,7 @@ def import_inventory():
         imported_count = 0
         updated_count = 0
         errors = []
+        touched_items = []
         
         for row_num, row in enumerate(csv_input, start=2):  # Start=2 car ligne 1 = headers
             try:
@@ -404,6 +423,7 @@ def import_inventory():
                     existing_item.min_stock_threshold = int(row.get('min_stock_threshold', existing_item.min_stock_threshold))
                     existing_item.max_stock_threshold = int(row.get('max_stock_threshold', existing_item.max_stock_threshold))
                     existing_item.updated_at = datetime.utcnow()
+                    touched_items.append(existing_item)
                     updated_count += 1
                 else:
                     # Créer un nouvel article
@@ -421,6 +441,7 @@ def import_inventory():
                     )
                     new_item.available_stock = new_item.current_stock
                     db.session.add(new_item)
+                    touched_items.append(new_item)
                     imported_count += 1
                     
             except Exception as e:
@@ -428,10 +449,14 @@ def import_inventory():
         
         db.session.commit()
         
+        # Alertes de stock des articles importés: une passe, un commit (envoyées en récapitulatif en cas de rafale)
+        alerts_created = len(inventory_service.check_and_create_alerts_bulk(touched_items))
+        
         return jsonify({
             'message': 'Import terminé',
             'imported_count': imported_count,
             'updated_count': updated_count,
+            'alerts_created': alerts_created,
             'errors': errors
         })
         
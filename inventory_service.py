@@ -1,7 +1,9 @@
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
+from sqlalchemy import inspect
 from src.models.management import InventoryItem, InventoryAlert, InventoryMovement, db
 from src.services.notification_service import NotificationService
+from src.services.alert_dispatcher import get_alert_dispatcher
 
 class InventoryService:
     """
@@ -10,6 +12,8 @@ class InventoryService:
     
     def __init__(self):
         self.notification_service = NotificationService()
+        self.alert_dispatcher = get_alert_dispatcher()
+        self.alert_dispatcher.set_recovery(self.recover_orphaned_alerts)
         
         # Configuration des destinataires d'alertes (à configurer par l'utilisateur)
         self.alert_recipients = {
@@ -29,77 +33,119 @@ class InventoryService:
         Vérifier et créer des alertes pour un article d'inventaire
         """
         item = InventoryItem.query.get(item_id)
-        if not item or not item.is_active:
+        if not item:
             return []
         
-        alerts_created = []
+        return self.check_and_create_alerts_bulk([item])
+    
+    def check_and_create_alerts_bulk(self, items: List[InventoryItem]) -> List[Dict[str, Any]]:
+        """
+        Vérifier un lot d'articles en une passe: une requête pour les alertes existantes, un commit
+        """
+        # Articles rechargés par paquets (expirés par le commit de l'appelant)
+        item_ids = [inspect(item).identity[0] for item in items if inspect(item).identity]
+        items = []
+        for start in range(0, len(item_ids), 500):
+            items.extend(InventoryItem.query.filter(InventoryItem.id.in_(item_ids[start:start + 500])).all())
+        
+        candidates = []
+        for item in items:
+            if not item.is_active:
+                continue
+            
+            # 1. Stock faible, 2. surstock, 3. point de réapprovisionnement
+            if item.current_stock <= item.min_stock_threshold:
+                candidates.append((
+                    item,
+                    'low_stock' if item.current_stock > 0 else 'out_of_stock',
+                    'critical' if item.current_stock == 0 else 'high',
+                    'low_stock'
+                ))
+            elif item.current_stock >= item.max_stock_threshold:
+                candidates.append((item, 'overstock', 'medium', 'overstock'))
+            elif item.current_stock <= item.reorder_point:
+                candidates.append((item, 'reorder_needed', 'medium', 'reorder'))
+        
+        if not candidates:
+            return []
         
-        # 1. Vérifier le stock faible
-        if item.current_stock <= item.min_stock_threshold:
-            alert = self._create_alert(
-                item=item,
-                alert_type='low_stock' if item.current_stock > 0 else 'out_of_stock',
-                severity='critical' if item.current_stock == 0 else 'high',
-                message=self._generate_alert_message(item, 'low_stock')
-            )
-            if alert:
-                alerts_created.append(alert)
-        
-        # 2. Vérifier le surstock
-        elif item.current_stock >= item.max_stock_threshold:
-            alert = self._create_alert(
-                item=item,
-                alert_type='overstock',
-                severity='medium',
-                message=self._generate_alert_message(item, 'overstock')
-            )
-            if alert:
-                alerts_created.append(alert)
-        
-        # 3. Vérifier le point de réapprovisionnement
-        elif item.current_stock <= item.reorder_point:
-            alert = self._create_alert(
-                item=item,
-                alert_type='reorder_needed',
-                severity='medium',
-                message=self._generate_alert_message(item, 'reorder')
+        # Alertes similaires déjà ouvertes (non résolues)
+        item_ids = list({item.id for item, _, _, _ in candidates})
+        existing = set()
+        for start in range(0, len(item_ids), 500):
+            existing.update(db.session.query(InventoryAlert.item_id, InventoryAlert.alert_type).filter(
+                InventoryAlert.item_id.in_(item_ids[start:start + 500]),
+                InventoryAlert.is_resolved == False
+            ).all())
+        
+        created = []
+        for item, alert_type, severity, message_type in candidates:
+            if (item.id, alert_type) in existing:
+                continue
+            existing.add((item.id, alert_type))
+            
+            alert = InventoryAlert(
+                item_id=item.id,
+                alert_type=alert_type,
+                message=self._generate_alert_message(item, message_type),
+                severity=severity
             )
-            if alert:
-                alerts_created.append(alert)
+            db.session.add(alert)
+            created.append((alert, item))
+        
+        if not created:
+            return []
+        
+        # Données lues avant le commit (qui expire les objets de la session)
+        db.session.flush()
+        alerts_created = [alert.to_dict() for alert, _ in created]
+        notifications = [
+            self._alert_notification(alert_data, item)
+            for alert_data, (_, item) in zip(alerts_created, created)
+            if alert_data['severity'] in ['critical', 'high']
+        ]
+        db.session.commit()
         
         # Envoyer les notifications pour les alertes critiques
-        for alert in alerts_created:
-            if alert['severity'] in ['critical', 'high']:
-                self._send_alert_notification(alert, item)
+        for alert_data, recipients in notifications:
+            self._submit_alert(alert_data, recipients)
         
         return alerts_created
     
-    def _create_alert(self, item: InventoryItem, alert_type: str, severity: str, message: str) -> Optional[Dict[str, Any]]:
+    def recover_orphaned_alerts(self, orphan_after_seconds: float, max_age_hours: int = 24) -> int:
         """
-        Créer une alerte d'inventaire si elle n'existe pas déjà
+        Renvoyer les alertes critiques jamais notifiées (récapitulatif perdu par un redémarrage)
+        
+        Une alerte reste au plus une fenêtre de récapitulatif en mémoire: passé
+        orphan_after_seconds sans notified_at, son processus a disparu ou l'envoi
+        a échoué. Chaque alerte est réclamée par une mise à jour conditionnelle
+        (un seul worker la renvoie) et n'est renvoyée qu'une fois.
         """
-        # Vérifier si une alerte similaire existe déjà (non résolue)
-        existing_alert = InventoryAlert.query.filter_by(
-            item_id=item.id,
-            alert_type=alert_type,
-            is_resolved=False
-        ).first()
-        
-        if existing_alert:
-            return None  # Alerte déjà existante
-        
-        # Créer la nouvelle alerte
-        alert = InventoryAlert(
-            item_id=item.id,
-            alert_type=alert_type,
-            message=message,
-            severity=severity
-        )
-        
-        db.session.add(alert)
+        now = datetime.utcnow()
+        orphans = db.session.query(InventoryAlert.id).filter(
+            InventoryAlert.notified_at.is_(None),
+            InventoryAlert.is_resolved == False,
+            InventoryAlert.severity.in_(['critical', 'high']),
+            InventoryAlert.created_at < now - timedelta(seconds=orphan_after_seconds),
+            InventoryAlert.created_at >= now - timedelta(hours=max_age_hours)
+        ).limit(1000).all()
+        
+        claimed = []
+        for (alert_id,) in orphans:
+            if InventoryAlert.query.filter(
+                InventoryAlert.id == alert_id,
+                InventoryAlert.notified_at.is_(None)
+            ).update({'notified_at': now}, synchronize_session=False):
+                claimed.append(alert_id)
         db.session.commit()
         
-        return alert.to_dict()
+        if claimed:
+            for alert in InventoryAlert.query.filter(InventoryAlert.id.in_(claimed)).all():
+                item = InventoryItem.query.get(alert.item_id)
+                if item:
+                    self._send_alert_notification(alert.to_dict(), item)
+        
+        return len(claimed)
     
     def _generate_alert_message(self, item: InventoryItem, alert_type: str) -> str:
         """
@@ -125,33 +171,31 @@ class InventoryService:
         """
         Envoyer une notification d'alerte
         """
+        self._submit_alert(*self._alert_notification(alert, item))
+    
+    def _alert_notification(self, alert: Dict[str, Any], item: InventoryItem):
+        """
+        Contenu et destinataires d'une notification d'alerte
+        """
+        # Emails pour toutes les alertes envoyées, SMS en plus pour les alertes critiques
+        recipients = list(self.alert_recipients['email'])
+        if alert['severity'] == 'critical':
+            recipients.extend(self.alert_recipients['sms'])
+        
+        return {
+            'id': alert['id'],
+            'alert_type': alert['alert_type'],
+            'severity': alert['severity'],
+            'item_name': item.product_name,
+            'sku': item.sku,
+            'current_stock': item.current_stock,
+            'threshold': item.min_stock_threshold if alert['alert_type'] in ['low_stock', 'out_of_stock'] else item.max_stock_threshold
+        }, recipients
+    
+    def _submit_alert(self, alert: Dict[str, Any], recipients: List[str]):
         try:
-            # Envoyer par email
-            for email in self.alert_recipients['email']:
-                self.notification_service.send_inventory_alert(
-                    recipients=[email],
-                    alert_type=alert['alert_type'],
-                    item_name=item.product_name,
-                    current_stock=item.current_stock,
-                    threshold=item.min_stock_threshold if alert['alert_type'] in ['low_stock', 'out_of_stock'] else item.max_stock_threshold
-                )
-            
-            # Envoyer par SMS pour les alertes critiques
-            if alert['severity'] == 'critical':
-                for phone in self.alert_recipients['sms']:
-                    self.notification_service.send_inventory_alert(
-                        recipients=[phone],
-                        alert_type=alert['alert_type'],
-                        item_name=item.product_name,
-                        current_stock=item.current_stock,
-                        threshold=item.min_stock_threshold
-                    )
-            
-            # Marquer l'alerte comme notifiée
-            alert_obj = InventoryAlert.query.get(alert['id'])
-            if alert_obj:
-                alert_obj.notified_at = datetime.utcnow()
-                db.session.commit()
+            # Envoi en arrière-plan (regroupé en cas de rafale); notified_at est posé après l'envoi
+            self.alert_dispatcher.submit(alert, recipients)
                 
         except Exception as e:
             print(f"Erreur envoi notification alerte: {e}")
@@ -165,6 +209,7 @@ class InventoryService:
             'errors': [],
             'alerts_created': []
         }
+        touched_items = []
         
         for update in updates:
             try:
@@ -200,15 +245,15 @@ class InventoryService:
                 
                 db.session.add(movement)
                 results['updated'] += 1
-                
-                # Vérifier les alertes
-                alerts = self.check_and_create_alerts(item.id)
-                results['alerts_created'].extend(alerts)
+                touched_items.append(item)
                 
             except Exception as e:
                 results['errors'].append(f"Erreur pour {product_id}: {str(e)}")
         
         db.session.commit()
+        
+        # Vérifier les alertes de tous les articles modifiés en une passe
+        results['alerts_created'] = self.check_and_create_alerts_bulk(touched_items)
         return results
     
     def calculate_stock_velocity(self, item_id: int, days: int = 30) -> Dict[str, Any]:
@@ -0,0 +1,129 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Any, Optional
+
+
+# Bornes des intervalles en microsecondes (le dernier intervalle est ouvert)
+BUCKET_BOUNDS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 500000)
+_BUCKET_BOUNDS_NS = tuple(bound * 1000 for bound in BUCKET_BOUNDS_US)
+
+
+class LatencyHistogram:
+    """
+    Histogramme de latences à intervalles fixes (compteurs entiers, pas d'échantillons conservés)
+    """
+
+    __slots__ = ('counts', 'count', 'total_ns', 'max_ns')
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKET_BOUNDS_NS) + 1)
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def observe(self, nanoseconds: int, count: int = 1):
+        """
+        Enregistrer une durée (pour un lot: durée moyenne par élément, comptée count fois)
+        """
+        self.counts[bisect_left(_BUCKET_BOUNDS_NS, nanoseconds)] += count
+        self.count += count
+        self.total_ns += nanoseconds * count
+        if nanoseconds > self.max_ns:
+            self.max_ns = nanoseconds
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """
+        Percentile estimé (borne haute de l'intervalle), en microsecondes
+        """
+        if not self.count:
+            return None
+
+        target = fraction * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                if index < len(BUCKET_BOUNDS_US):
+                    return float(BUCKET_BOUNDS_US[index])
+                break
+        return round(self.max_ns / 1000, 2)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'mean_us': round(self.total_ns / self.count / 1000, 2) if self.count else None,
+            'max_us': round(self.max_ns / 1000, 2),
+            'p50_us': self.percentile(0.5),
+            'p95_us': self.percentile(0.95),
+            'p99_us': self.percentile(0.99),
+            'buckets_us': {
+                (f'<={bound}' if index < len(BUCKET_BOUNDS_US) else f'>{BUCKET_BOUNDS_US[-1]}'): bucket_count
+                for index, (bound, bucket_count) in enumerate(zip(BUCKET_BOUNDS_US + (None,), self.counts))
+                if bucket_count
+            }
+        }
+
+
+class LatencyMetrics:
+    """
+    Registre de latences nommées (un histogramme par étape mesurée)
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+
+    def observe(self, name: str, nanoseconds: int, count: int = 1):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(nanoseconds, count)
+
+    def observe_many(self, timings: Dict[str, int], prefix: str = '', count: int = 1):
+        """
+        Enregistrer plusieurs étapes en une prise de verrou (durées totales divisées par count)
+        """
+        with self.lock:
+            for name, nanoseconds in timings.items():
+                key = prefix + name
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = LatencyHistogram()
+                histogram.observe(nanoseconds // count, count)
+
+    def snapshot(self, prefix: str = '') -> Dict[str, Any]:
+        with self.lock:
+            metrics = {
+                name: histogram.snapshot()
+                for name, histogram in sorted(self.histograms.items())
+                if name.startswith(prefix)
+            }
+
+        return {
+            'since': self.started_at,
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'metrics': metrics
+        }
+
+    def reset(self, prefix: str = ''):
+        with self.lock:
+            for name in [name for name in self.histograms if name.startswith(prefix)]:
+                del self.histograms[name]
+            if not prefix:
+                self.started_at = time.time()
+
+
+_latency_metrics = None
+
+
+def get_latency_metrics() -> LatencyMetrics:
+    """
+    Registre partagé des latences
+    """
+    global _latency_metrics
+    if _latency_metrics is None:
+        _latency_metrics = LatencyMetrics()
+    return _latency_metrics
@@ -0,0 +1,338 @@
+import argparse
+import http.client
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+from src.services.provider_simulator import ProviderSimulator
+
+
+CHANNELS = ('email', 'sms', 'whatsapp')
+SCENARIOS = ('notifications', 'cart_recovery', 'verification')
+
+
+class _Recorder:
+    """
+    Durées par opération (échantillons exacts: quelques milliers de mesures suffisent pour p99)
+    """
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.failures: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, success: bool = True):
+        with self.lock:
+            self.samples.setdefault(name, []).append(seconds)
+            if not success:
+                self.failures[name] = self.failures.get(name, 0) + 1
+
+    def summary(self, elapsed_seconds: float) -> Dict[str, Any]:
+        with self.lock:
+            samples = {name: sorted(values) for name, values in self.samples.items()}
+            failures = dict(self.failures)
+
+        return {
+            name: {
+                'count': len(values),
+                'failed': failures.get(name, 0),
+                'per_second': round((len(values) - failures.get(name, 0)) / elapsed_seconds, 1) if elapsed_seconds else None,
+                'p50_ms': _percentile(values, 0.50),
+                'p95_ms': _percentile(values, 0.95),
+                'p99_ms': _percentile(values, 0.99),
+                'max_ms': round(values[-1] * 1000, 1)
+            }
+            for name, values in samples.items()
+        }
+
+
+def _percentile(values: Sequence[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(math.ceil(fraction * len(values))) - 1))
+    return round(values[index] * 1000, 1)
+
+
+class _JsonClient:
+    """
+    Client HTTP JSON minimal vers l'application (une connexion keep-alive par thread)
+    """
+
+    def __init__(self, base_url: str):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port
+        self.local = threading.local()
+
+    def request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Tuple[int, Dict[str, Any]]:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.local.connection = connection
+        try:
+            body = json.dumps(payload).encode('utf-8') if payload is not None else None
+            connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            data = response.read()
+            return response.status, json.loads(data) if data else {}
+        except Exception:
+            self.local.connection = None
+            raise
+
+
+def _retry_counters() -> Dict[str, int]:
+    """
+    Compteurs de nouvelles tentatives: 429 remis en file par l'ordonnanceur, reconnexions SMTP
+    """
+    from src.services.message_scheduler import get_message_scheduler
+    from src.services.smtp_pool import get_smtp_pool
+
+    scheduler = get_message_scheduler().get_stats()
+    smtp = get_smtp_pool().get_stats()
+    return {
+        'sms_throttled': scheduler.get('sms', {}).get('throttled', 0),
+        'whatsapp_throttled': scheduler.get('whatsapp', {}).get('throttled', 0),
+        'smtp_reconnects': smtp['reconnects'],
+        'smtp_send_failures': smtp['send_failures']
+    }
+
+
+def _retry_delta(before: Dict[str, int]) -> Dict[str, int]:
+    after = _retry_counters()
+    return {key: after[key] - before[key] for key in after}
+
+
+def run_notifications(messages: int, threads: int) -> Dict[str, Any]:
+    """
+    Envois directs par NotificationService, répartis sur les trois canaux et quatre clients
+    """
+    from src.services.notification_service import NotificationService
+
+    service = NotificationService()
+    recorder = _Recorder()
+    before = _retry_counters()
+
+    def send(index: int):
+        channel = CHANNELS[index % len(CHANNELS)]
+        recipient = f'client{index}@example.com' if channel == 'email' else f'+2135{index:08d}'
+        started = time.perf_counter()
+        success = service.send_notification(
+            channel, recipient, 'Test de charge', f'Message de test #{index}',
+            priority='recovery', tenant=f'tenant-{index % 4}'
+        )
+        recorder.observe(channel, time.perf_counter() - started, success)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(send, range(messages)))
+    seconds = time.perf_counter() - started
+
+    by_channel = recorder.summary(seconds)
+    succeeded = sum(stats['count'] - stats['failed'] for stats in by_channel.values())
+    return {
+        'messages': messages,
+        'succeeded': succeeded,
+        'seconds': round(seconds, 2),
+        'messages_per_second': round(succeeded / seconds, 1),
+        'by_channel': by_channel,
+        'retries': _retry_delta(before)
+    }
+
+
+def run_cart_recovery(base_url: str, carts: int, threads: int, run_id: str,
+                      drain_timeout_seconds: float = 300.0) -> Dict[str, Any]:
+    """
+    Paniers créés puis relancés par l'API HTTP, jusqu'à ce que la file d'envoi soit vide
+    """
+    client = _JsonClient(base_url)
+    recorder = _Recorder()
+    cart_ids: List[int] = []
+    lock = threading.Lock()
+
+    def create(index: int):
+        started = time.perf_counter()
+        status, body = client.request('POST', '/api/abandoned-carts', {
+            'session_id': f'load-{run_id}-{index}',
+            'email': f'client{index}@example.com',
+            'phone': f'+2135{index:08d}',
+            'cart_value': 4500,
+            'items': [{'product_id': 'load-1', 'product_name': 'Article de test', 'product_price': 4500}]
+        })
+        recorder.observe('create_cart', time.perf_counter() - started, status == 201)
+        if status == 201:
+            with lock:
+                cart_ids.append(body['id'])
+
+    def recover(cart_id: int):
+        started = time.perf_counter()
+        status, _ = client.request('POST', f'/api/abandoned-carts/{cart_id}/recover', {'channels': list(CHANNELS)})
+        recorder.observe('recover', time.perf_counter() - started, status == 202)
+
+    _, before = client.request('GET', '/api/recovery-notifications/outbox')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(create, range(carts)))
+    recover_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(recover, cart_ids))
+    requests_seconds = time.perf_counter() - started
+
+    # Attendre que la file d'envoi ait tout traité (nouvelles tentatives comprises)
+    deadline = time.monotonic() + drain_timeout_seconds
+    while True:
+        _, outbox = client.request('GET', '/api/recovery-notifications/outbox')
+        by_status = outbox['by_status']
+        if by_status['pending'] + by_status['processing'] == 0 or time.monotonic() > deadline:
+            break
+        time.sleep(0.25)
+    drain_seconds = time.perf_counter() - recover_started
+
+    processed = {key: outbox['processed'][key] - before['processed'][key] for key in outbox['processed']}
+    return {
+        'carts': len(cart_ids),
+        'notifications': len(cart_ids) * len(CHANNELS),
+        'endpoints': recorder.summary(requests_seconds),
+        'drain_seconds': round(drain_seconds, 2),
+        'notifications_per_second': round(processed['sent'] / drain_seconds, 1) if drain_seconds else None,
+        'retries': processed['retried'],
+        'dead_lettered': processed['dead_lettered'],
+        'by_status': by_status,
+        'drained': by_status['pending'] + by_status['processing'] == 0
+    }
+
+
+def run_verification(app, orders: int, threads: int, run_id: str) -> Dict[str, Any]:
+    """
+    Codes de vérification COD envoyés par VerificationService (SMS et WhatsApp en alternance)
+    """
+    from src.models.management import CODOrder, db
+    from src.services.verification_service import VerificationService
+
+    with app.app_context():
+        rows = [
+            CODOrder(
+                order_id=f'LOAD-{run_id}-{index}',
+                customer_name='Client Test',
+                customer_phone=f'+2136{index:08d}',
+                delivery_address='1 rue de Test',
+                city='Alger',
+                order_value=5000
+            )
+            for index in range(orders)
+        ]
+        db.session.add_all(rows)
+        db.session.commit()
+        order_ids = [row.id for row in rows]
+
+    service = VerificationService()
+    recorder = _Recorder()
+    before = _retry_counters()
+
+    def verify(index: int):
+        method = ('sms', 'whatsapp')[index % 2]
+        with app.app_context():
+            started = time.perf_counter()
+            result = service.verify_order(order_ids[index], method)
+            recorder.observe(method, time.perf_counter() - started, result.get('success', False))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(verify, range(len(order_ids))))
+    seconds = time.perf_counter() - started
+
+    by_method = recorder.summary(seconds)
+    succeeded = sum(stats['count'] - stats['failed'] for stats in by_method.values())
+    return {
+        'orders': len(order_ids),
+        'succeeded': succeeded,
+        'seconds': round(seconds, 2),
+        'messages_per_second': round(succeeded / seconds, 1),
+        'by_method': by_method,
+        'retries': _retry_delta(before)
+    }
+
+
+def run_load_test(scenarios: Sequence[str] = SCENARIOS, messages: int = 300, carts: int = 100, orders: int = 100,
+                  threads: int = 16, latency_ms: float = 50.0, failure_rate: float = 0.02, rate_limit: float = 0.0,
+                  smtp_failure_rate: float = 0.0, delivery_failure_rate: float = 0.02,
+                  retry_delay_seconds: float = 1.0, database_url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Démarrer les fournisseurs simulés et l'application, puis mesurer chaque scénario
+
+    La configuration des fournisseurs est lue une fois par processus: le
+    simulateur doit être démarré et ses variables exportées avant d'importer
+    l'application. La base est un fichier SQLite temporaire sauf database_url.
+    """
+    simulator = ProviderSimulator(
+        latency_ms=latency_ms, failure_rate=failure_rate, rate_limit=rate_limit,
+        smtp_failure_rate=smtp_failure_rate, delivery_failure_rate=delivery_failure_rate
+    ).start()
+    simulator.apply_env()
+
+    workdir = tempfile.mkdtemp(prefix='retailbot-load-')
+    os.environ['DATABASE_URL'] = database_url or f"sqlite:///{os.path.join(workdir, 'load_test.db')}"
+
+    from werkzeug.serving import make_server
+    from src.main import app
+    from src.services.notification_outbox import get_notification_outbox
+
+    # Nouvelles tentatives rapprochées: le test attend la fin de la file d'envoi
+    outbox = get_notification_outbox()
+    outbox.base_delay_seconds = retry_delay_seconds
+    outbox.max_delay_seconds = retry_delay_seconds * 8
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='load-test-app', daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    simulator.set_webhook_url(f'{base_url}/api/integrations/whatsapp/webhook')
+
+    run_id = str(int(time.time()))
+    results: Dict[str, Any] = {'database': os.environ['DATABASE_URL']}
+    try:
+        if 'notifications' in scenarios:
+            results['notifications'] = run_notifications(messages, threads)
+        if 'cart_recovery' in scenarios:
+            results['cart_recovery'] = run_cart_recovery(base_url, carts, threads, run_id)
+        if 'verification' in scenarios:
+            results['verification'] = run_verification(app, orders, threads, run_id)
+
+        # Laisser arriver les derniers statuts WhatsApp (webhooks différés du simulateur)
+        time.sleep(simulator.http.webhook_delay_ms * 3 / 1000 + 1.5)
+        _, results['delivery_statuses'] = _JsonClient(base_url).request('GET', '/api/integrations/whatsapp/delivery-statuses')
+        results['simulator'] = simulator.stats()
+    finally:
+        server.shutdown()
+        simulator.stop()
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Test de charge des notifications sur des fournisseurs simulés')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Parmi {', '.join(SCENARIOS)}")
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--carts', type=int, default=100)
+    parser.add_argument('--orders', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--failure-rate', type=float, default=0.02)
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Limite du simulateur par API (0: illimité)')
+    parser.add_argument('--smtp-failure-rate', type=float, default=0.0)
+    parser.add_argument('--delivery-failure-rate', type=float, default=0.02)
+    parser.add_argument('--retry-delay', type=float, default=1.0)
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    report = run_load_test(
+        scenarios=[scenario.strip() for scenario in args.scenarios.split(',') if scenario.strip()],
+        messages=args.messages, carts=args.carts, orders=args.orders, threads=args.threads,
+        latency_ms=args.latency_ms, failure_rate=args.failure_rate, rate_limit=args.rate_limit,
+        smtp_failure_rate=args.smtp_failure_rate, delivery_failure_rate=args.delivery_failure_rate,
+        retry_delay_seconds=args.retry_delay, database_url=args.database_url
+    )
+    print(json.dumps(report, indent=2, ensure_ascii=False))
@@ -3,6 +3,9 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+import click
+import threading
+from datetime import datetime, timedelta
 from flask import Flask, send_from_directory, jsonify
 from flask_cors import CORS
 from src.models.base import db
@@ -14,6 +17,19 @@ from src.routes.inventory_management import inventory_management_bp
 from src.routes.analytics import analytics_bp
 from src.routes.deployment import deployment_bp
 from src.routes.integrations import integrations_bp
+from src.services.fraud_detection_service import FraudDetectionService
+from src.services.schema_upgrade import upgrade_schema
+from src.services.fraud_blocklist_service import get_fraud_blocklist_service
+from src.services.fraud_model_service import get_fraud_model_service
+from src.services.identity_similarity_service import get_identity_index
+from src.services.verification_dispatcher import get_verification_dispatcher
+from src.services.verification_campaign_service import get_verification_campaign_service
+from src.services.notification_outbox import get_notification_outbox
+from src.services.alert_dispatcher import get_alert_dispatcher
+from src.services.delivery_status_service import get_delivery_status_ingestor
+from src.services.trending_service import get_trending_service
+from src.services.content_similarity_service import get_content_index
+from src.services.cooccurrence_service import get_cooccurrence_service
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -32,7 +48,8 @@ app.register_blueprint(deployment_bp, url_prefix='/api')
 app.register_blueprint(integrations_bp, url_prefix='/api')
 
 # Configuration des bases de données
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+# DATABASE_URL permet de viser une autre base (tests de charge) sans toucher à app.db
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL') or f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Initialiser la base de données
@@ -40,6 +57,74 @@ db.init_app(app)
 
 with app.app_context():
     db.create_all()
+    
+    # Charger la liste noire anti-fraude en mémoire
+    get_fraud_blocklist_service().reload()
+    
+    # Charger (ou construire) l'index des identités proches avant la première requête
+    try:
+        get_identity_index().warm_up()
+    except Exception as e:
+        print(f"Erreur chargement de l'index d'identités: {e}")
+    
+    # Services à threads d'arrière-plan (démarrés par start_background_workers)
+    get_verification_dispatcher().init_app(app)
+    get_verification_campaign_service().init_app(app)
+    get_notification_outbox().init_app(app)
+    get_alert_dispatcher().init_app(app)
+    get_delivery_status_ingestor().init_app(app)
+    
+    # Entraînement du modèle de fraude lancé par la route dans un thread d'arrière-plan
+    get_fraud_model_service().init_app(app)
+    
+    # Tendances: chargées au démarrage, fusionnées en base par un thread d'arrière-plan
+    get_trending_service().init_app(app)
+    try:
+        get_trending_service().reload()
+    except Exception as e:
+        print(f"Erreur chargement des tendances: {e}")
+    
+    # Index de contenu du catalogue (« produits similaires »), tenu à jour après chaque commit
+    try:
+        get_content_index().build_from_database()
+    except Exception as e:
+        print(f"Erreur construction de l'index de contenu: {e}")
+    
+    # Associations des paniers (« souvent achetés ensemble »), reconstruites par /products/recommendations/rebuild
+    try:
+        get_cooccurrence_service().build_from_database()
+    except Exception as e:
+        print(f"Erreur construction des associations de paniers: {e}")
+
+_background_workers_pid = None
+_background_workers_lock = threading.Lock()
+
+@app.before_request
+def start_background_workers():
+    """
+    Reprendre les travaux interrompus et démarrer les threads d'arrière-plan
+
+    Seulement dans les processus qui servent des requêtes (jamais dans une
+    commande flask), une fois par processus: un worker issu d'un fork
+    (gunicorn --preload) démarre ses propres threads.
+    """
+    global _background_workers_pid
+    if _background_workers_pid == os.getpid():
+        return
+    
+    with _background_workers_lock:
+        if _background_workers_pid == os.getpid():
+            return
+        _background_workers_pid = os.getpid()
+        
+        # Vérifications interrompues par un redémarrage
+        get_verification_dispatcher().recover()
+        get_verification_campaign_service().recover()
+        get_verification_campaign_service().start()
+        
+        # Notifications en file (y compris celles d'avant le redémarrage)
+        get_notification_outbox().start()
+        get_alert_dispatcher().start()
 
 @app.route('/health')
 def health_check():
@@ -55,6 +140,79 @@ def health_check():
         ]
     })
 
+@app.cli.command('upgrade-schema')
+def upgrade_schema_command():
+    """
+    Mettre à niveau une base existante (ajouts au schéma depuis sa création)
+    """
+    changes = upgrade_schema()
+    for change in changes:
+        click.echo(change)
+    click.echo(f"{len(changes)} modification(s) appliquée(s)")
+
+@app.cli.command('rescore-cod-orders')
+@click.option('--days', type=int, default=None, help='Limiter aux commandes des N derniers jours')
+@click.option('--batch-size', type=int, default=1000, help='Nombre de commandes par lot')
+@click.option('--full', is_flag=True, help='Réévaluer toutes les règles, pas seulement celles du contexte')
+def rescore_cod_orders(days, batch_size, full):
+    """
+    Recalculer le score de risque des commandes COD
+    """
+    start_date = datetime.utcnow() - timedelta(days=days) if days else None
+    result = FraudDetectionService().rescore_orders(start_date=start_date, batch_size=batch_size, incremental=not full)
+    click.echo(f"{result['rescored_orders']} commandes recalculées "
+               f"({result['level_changes']} changements de niveau) en {result['duration_seconds']}s")
+
+@app.cli.command('rebuild-identity-index')
+def rebuild_identity_index():
+    """
+    Reconstruire l'index des identités proches hors ligne (repris par les processus en cours)
+    """
+    index = get_identity_index()
+    result = index.build_from_database()
+    index.save()
+    click.echo(f"{result['fraud_identities']} identités frauduleuses, "
+               f"{result['high_volume_identities']} identités à fort volume, {result['buckets']} buckets")
+
+def _echo_fraud_model_report(report):
+    click.echo(f"Échantillon réservé: {report['orders']} commandes, {report.get('positives', 0)} fraudes")
+    if not report['orders']:
+        return
+    click.echo(f"AUC modèle {report['auc']} (règles {report['rule_score_auc']} "
+               f"sur {report['rule_score_orders']} commandes), log-loss {report['log_loss']}, Brier {report['brier_score']}")
+    click.echo(f"Précision {report['precision_at_0_5']}, rappel {report['recall_at_0_5']} (seuil 0.5), "
+               f"inférence {report['inference_microseconds']} µs")
+    for bucket in report['calibration']:
+        click.echo(f"  {bucket['range'][0]:.1f}-{bucket['range'][1]:.1f}: {bucket['orders']} commandes, "
+                   f"prédit {bucket['mean_predicted']}, observé {bucket['observed_rate']}")
+
+@app.cli.command('train-fraud-model')
+@click.option('--holdout-modulo', type=int, default=5, help='Commandes dont l\'identifiant est divisible par N réservées à l\'évaluation')
+@click.option('--l2', type=float, default=1.0, help='Régularisation L2')
+def train_fraud_model(holdout_modulo, l2):
+    """
+    Entraîner le modèle de fraude et afficher l'évaluation
+    """
+    result = get_fraud_model_service().train(holdout_modulo=holdout_modulo, l2=l2)
+    if not result['success']:
+        raise click.ClickException(result['error'])
+    
+    click.echo(f"Modèle entraîné sur {result['training']['orders']} commandes "
+               f"en {result['duration_seconds']}s ({result['training']['iterations']} itérations)")
+    _echo_fraud_model_report(result['holdout'])
+
+@app.cli.command('evaluate-fraud-model')
+@click.option('--holdout-modulo', type=int, default=None, help='Remplacer l\'échantillon réservé utilisé à l\'entraînement')
+def evaluate_fraud_model(holdout_modulo):
+    """
+    Évaluer le modèle de fraude sur l'échantillon réservé
+    """
+    result = get_fraud_model_service().evaluate(holdout_modulo)
+    if not result['success']:
+        raise click.ClickException(result['error'])
+    
+    _echo_fraud_model_report(result)
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
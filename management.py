@@ -26,9 +26,11 @@ class CODRiskLevel(Enum):
 
 class NotificationStatus(Enum):
     PENDING = "pending"
+    PROCESSING = "processing"
     SENT = "sent"
     DELIVERED = "delivered"
     FAILED = "failed"
+    DEAD_LETTER = "dead_letter"
 
 class AbandonedCart(db.Model):
     __tablename__ = 'abandoned_carts'
@@ -110,13 +112,22 @@ class CartRecoveryNotification(db.Model):
     recipient = db.Column(db.String(255), nullable=False)
     subject = db.Column(db.String(255), nullable=True)
     message = db.Column(db.Text, nullable=False)
+    html_message = db.Column(db.Text, nullable=True)  # Variante HTML des emails
     status = db.Column(db.Enum(NotificationStatus), nullable=False, default=NotificationStatus.PENDING)
     sent_at = db.Column(db.DateTime, nullable=True)
     delivered_at = db.Column(db.DateTime, nullable=True)
     clicked_at = db.Column(db.DateTime, nullable=True)
+    read_at = db.Column(db.DateTime, nullable=True)
+    provider_message_id = db.Column(db.String(128), nullable=True, index=True)  # Identifiant chez le fournisseur (webhooks de statut)
     error_message = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(36), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)  # Prise par un worker (reprise si dépassée)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
+    __table_args__ = (db.Index('ix_cart_recovery_notifications_status_next_attempt_at', 'status', 'next_attempt_at'),)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -129,7 +140,11 @@ class CartRecoveryNotification(db.Model):
             'sent_at': self.sent_at.isoformat() if self.sent_at else None,
             'delivered_at': self.delivered_at.isoformat() if self.delivered_at else None,
             'clicked_at': self.clicked_at.isoformat() if self.clicked_at else None,
+            'read_at': self.read_at.isoformat() if self.read_at else None,
+            'provider_message_id': self.provider_message_id,
             'error_message': self.error_message,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
             'created_at': self.created_at.isoformat()
         }
 
@@ -139,7 +154,7 @@ class CODOrder(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.String(255), nullable=False, unique=True)
     customer_name = db.Column(db.String(255), nullable=False)
-    customer_phone = db.Column(db.String(20), nullable=False)
+    customer_phone = db.Column(db.String(20), nullable=False, index=True)
     customer_email = db.Column(db.String(255), nullable=True)
     delivery_address = db.Column(db.Text, nullable=False)
     city = db.Column(db.String(100), nullable=False)
@@ -147,17 +162,23 @@ class CODOrder(db.Model):
     order_value = db.Column(db.Float, nullable=False)
     currency = db.Column(db.String(3), nullable=False, default='DZD')
     risk_score = db.Column(db.Float, nullable=False, default=0.0)
+    rule_risk_score = db.Column(db.Float, nullable=True)  # Score des règles seules, avant le modèle
     risk_level = db.Column(db.Enum(CODRiskLevel), nullable=False, default=CODRiskLevel.LOW)
     risk_factors = db.Column(db.JSON, nullable=True)
+    risk_rules_version = db.Column(db.String(16), nullable=True)  # Empreinte des règles ayant produit le score
     verification_required = db.Column(db.Boolean, nullable=False, default=False)
     verification_status = db.Column(db.String(50), nullable=False, default='pending')
     verification_attempts = db.Column(db.Integer, nullable=False, default=0)
     verified_at = db.Column(db.DateTime, nullable=True)
     status = db.Column(db.Enum(OrderStatus), nullable=False, default=OrderStatus.PENDING)
     notes = db.Column(db.Text, nullable=True)
+    client_fingerprint = db.Column(db.String(128), nullable=True)  # Empreinte appareil ou adresse IP
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Relations
+    factor_rows = db.relationship('CODOrderRiskFactor', backref='order', lazy=True, cascade='all, delete-orphan')
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -171,6 +192,7 @@ class CODOrder(db.Model):
             'order_value': self.order_value,
             'currency': self.currency,
             'risk_score': self.risk_score,
+            'rule_risk_score': self.rule_risk_score,
             'risk_level': self.risk_level.value,
             'risk_factors': self.risk_factors,
             'verification_required': self.verification_required,
@@ -293,3 +315,195 @@ class InventoryMovement(db.Model):
             'created_at': self.created_at.isoformat()
         }
 
+
+class TrendingCounter(db.Model):
+    __tablename__ = 'trending_counters'
+    __table_args__ = (db.UniqueConstraint('scope', 'key', 'category', name='uq_trending_counter_key'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(20), nullable=False)  # 'product', 'category', 'category_product'
+    key = db.Column(db.String(255), nullable=False)
+    category = db.Column(db.String(100), nullable=True, default='')  # '' hors 'category_product'
+    score = db.Column(db.Float, nullable=False, default=0.0)
+    checkpointed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'scope': self.scope,
+            'key': self.key,
+            'category': self.category,
+            'score': self.score,
+            'checkpointed_at': self.checkpointed_at.isoformat()
+        }
+
+
+class CustomerPhoneStats(db.Model):
+    __tablename__ = 'customer_phone_stats'
+    
+    phone = db.Column(db.String(20), primary_key=True)
+    total_orders = db.Column(db.Integer, nullable=False, default=0)
+    cancelled_orders = db.Column(db.Integer, nullable=False, default=0)
+    fraud_orders = db.Column(db.Integer, nullable=False, default=0)
+    last_order_at = db.Column(db.DateTime, nullable=True)
+    recent_order_times = db.Column(db.JSON, nullable=True)  # Dates ISO des commandes de la fenêtre récente
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'phone': self.phone,
+            'total_orders': self.total_orders,
+            'cancelled_orders': self.cancelled_orders,
+            'fraud_orders': self.fraud_orders,
+            'last_order_at': self.last_order_at.isoformat() if self.last_order_at else None,
+            'recent_order_times': self.recent_order_times or [],
+            'updated_at': self.updated_at.isoformat()
+        }
+
+
+class CityRiskDaily(db.Model):
+    __tablename__ = 'city_risk_daily'
+    __table_args__ = (db.UniqueConstraint('city', 'day', name='uq_city_risk_daily_city_day'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    city = db.Column(db.String(100), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    risk_score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    fraud_count = db.Column(db.Integer, nullable=False, default=0)
+    cancelled_count = db.Column(db.Integer, nullable=False, default=0)
+    verification_required_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'city': self.city,
+            'day': self.day.isoformat(),
+            'order_count': self.order_count,
+            'risk_score_sum': self.risk_score_sum,
+            'fraud_count': self.fraud_count,
+            'cancelled_count': self.cancelled_count,
+            'verification_required_count': self.verification_required_count
+        }
+
+
+class CODOrderRiskFactor(db.Model):
+    __tablename__ = 'cod_order_risk_factors'
+    __table_args__ = (db.Index('ix_cod_order_risk_factors_factor_created_at', 'factor', 'created_at'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('cod_orders.id'), nullable=False, index=True)
+    factor = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Date de la commande
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'factor': self.factor,
+            'created_at': self.created_at.isoformat()
+        }
+
+
+class FraudBlocklistEntry(db.Model):
+    __tablename__ = 'fraud_blocklist_entries'
+    __table_args__ = (db.UniqueConstraint('entry_type', 'value_hash', name='uq_fraud_blocklist_type_hash'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entry_type = db.Column(db.String(20), nullable=False)  # 'phone', 'address', 'fingerprint'
+    value_hash = db.Column(db.String(16), nullable=False)  # Empreinte 64 bits de la valeur normalisée
+    fraud_type = db.Column(db.String(50), nullable=True)
+    source_order_id = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'entry_type': self.entry_type,
+            'value_hash': self.value_hash,
+            'fraud_type': self.fraud_type,
+            'source_order_id': self.source_order_id,
+            'created_at': self.created_at.isoformat()
+        }
+
+
+class VerificationCampaign(db.Model):
+    __tablename__ = 'verification_campaigns'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'completed', 'cancelled', 'failed'
+    filters = db.Column(db.JSON, nullable=False)
+    method = db.Column(db.String(20), nullable=False, default='sms')
+    failover = db.Column(db.Boolean, nullable=False, default=True)
+    concurrency = db.Column(db.Integer, nullable=False, default=20)
+    rate_limits = db.Column(db.JSON, nullable=True)  # Plafonds propres à la campagne (envois/s par fournisseur)
+    total_orders = db.Column(db.Integer, nullable=False, default=0)
+    processed_orders = db.Column(db.Integer, nullable=False, default=0)
+    succeeded_orders = db.Column(db.Integer, nullable=False, default=0)
+    failed_orders = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Dernier signe de vie du worker qui l'exécute
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        elapsed = None
+        if self.started_at:
+            elapsed = ((self.finished_at or datetime.utcnow()) - self.started_at).total_seconds()
+        
+        return {
+            'id': self.id,
+            'status': self.status,
+            'filters': self.filters,
+            'method': self.method,
+            'failover': self.failover,
+            'concurrency': self.concurrency,
+            'rate_limits': self.rate_limits,
+            'total_orders': self.total_orders,
+            'processed_orders': self.processed_orders,
+            'succeeded_orders': self.succeeded_orders,
+            'failed_orders': self.failed_orders,
+            'progress': round(self.processed_orders / self.total_orders * 100, 2) if self.total_orders else 0,
+            'orders_per_minute': round(self.processed_orders / elapsed * 60, 1) if elapsed else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class VerificationJob(db.Model):
+    __tablename__ = 'verification_jobs'
+    __table_args__ = (db.Index('ix_verification_jobs_status_created_at', 'status', 'created_at'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('cod_orders.id'), nullable=False, index=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('verification_campaigns.id'), nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+    channels = db.Column(db.JSON, nullable=False)  # Canaux à essayer dans l'ordre
+    channel = db.Column(db.String(20), nullable=True)  # Canal ayant abouti
+    attempts = db.Column(db.JSON, nullable=True)  # [{'channel', 'success', 'error', 'duration_ms'}]
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    applied_at = db.Column(db.DateTime, nullable=True)  # Statut reporté sur la commande
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'campaign_id': self.campaign_id,
+            'status': self.status,
+            'channels': self.channels,
+            'channel': self.channel,
+            'attempts': self.attempts or [],
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'applied_at': self.applied_at.isoformat() if self.applied_at else None
+        }
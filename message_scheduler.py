@@ -0,0 +1,365 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Callable, Deque, Optional
+from src.services.rate_limiter import TokenBucket, make_bucket, shared_rate_dir
+
+
+class ProviderThrottled(Exception):
+    """
+    Le fournisseur a refusé l'envoi pour dépassement de débit (HTTP 429)
+    """
+
+    def __init__(self, retry_after: float = 1.0, message: str = 'Limite de débit du fournisseur atteinte'):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Message:
+    __slots__ = ('send', 'priority', 'tenant', 'sender', 'future', 'enqueued_at', 'throttled')
+
+    def __init__(self, send: Callable[[], Any], priority: str, tenant: str, sender: str):
+        self.send = send
+        self.priority = priority
+        self.tenant = tenant
+        self.sender = sender
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        self.throttled = 0
+
+
+class _ProviderState:
+    """
+    Files d'un fournisseur: une file par classe de priorité, une sous-file par client
+    """
+
+    def __init__(self, provider: str, rate: float, sender_rate: Optional[float], max_inflight: int, priorities,
+                 shared_dir: Optional[str] = None):
+        self.provider = provider
+        self.shared_dir = shared_dir
+        # Rafale d'un seul jeton: jamais plus de rate envois sur une fenêtre d'une seconde
+        self.bucket = make_bucket(f'provider_{provider}', rate, capacity=1.0, shared_dir=shared_dir)
+        self.sender_rate = sender_rate
+        self.sender_buckets: Dict[str, TokenBucket] = {}
+        self.inflight = threading.BoundedSemaphore(max_inflight)
+        self.queues: Dict[str, 'OrderedDict[str, Deque[_Message]]'] = {priority: OrderedDict() for priority in priorities}
+        self.size = 0
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.stats = {
+            'sent': 0,
+            'failed': 0,
+            'throttled': 0,
+            'cancelled': 0,
+            'wait_ms_total': {priority: 0.0 for priority in priorities},
+            'dispatched': {priority: 0 for priority in priorities}
+        }
+
+    def sender_bucket(self, sender: str) -> Optional[TokenBucket]:
+        if not self.sender_rate:
+            return None
+        bucket = self.sender_buckets.get(sender)
+        if bucket is None:
+            name = f'sender_{self.provider}_{hashlib.blake2b(sender.encode("utf-8"), digest_size=8).hexdigest()}'
+            bucket = make_bucket(name, self.sender_rate, capacity=1.0, shared_dir=self.shared_dir)
+            self.sender_buckets[sender] = bucket
+        return bucket
+
+
+class MessageRateScheduler:
+    """
+    Ordonnanceur des envois SMS / WhatsApp sous les limites de débit des fournisseurs
+
+    Chaque fournisseur a un seau de jetons (et un par expéditeur si configuré).
+    Un thread par fournisseur prend un jeton puis choisit le message suivant:
+    la classe de priorité la plus haute d'abord (OTP > alertes > récupération),
+    puis les clients à tour de rôle dans cette classe. L'envoi lui-même se fait
+    dans un pool de threads, pour atteindre le débit permis malgré la latence
+    des API. Une réponse 429 suspend le fournisseur et remet le message en tête.
+
+    Avec shared_dir, les seaux sont des segments partagés (SharedTokenBucket):
+    le débit d'un fournisseur est commun à tous les workers de la machine au
+    lieu d'être multiplié par leur nombre, et une pause 429 les suspend tous.
+    Les files et la concurrence (max_inflight) restent propres au processus.
+    Plusieurs machines doivent se partager le débit (PROVIDER_RATE_* divisé
+    par le nombre de machines).
+    """
+
+    PRIORITIES = ('otp', 'alert', 'recovery')
+
+    def __init__(self, provider_rates: Dict[str, float], sender_rates: Optional[Dict[str, float]] = None,
+                 max_inflight: int = 32, max_throttle_retries: int = 3, shared_dir: Optional[str] = None):
+        self.provider_rates = dict(provider_rates)
+        self.sender_rates = dict(sender_rates or {})
+        self.max_inflight = max_inflight
+        self.max_throttle_retries = max_throttle_retries
+        self.shared_dir = shared_dir
+
+        self.providers: Dict[str, _ProviderState] = {}
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def configure_provider(self, provider: str, rate: float, sender_rate: Optional[float] = None):
+        """
+        Modifier le débit d'un fournisseur (pris en compte immédiatement, par tous les workers si partagé)
+        """
+        with self.lock:
+            self.provider_rates[provider] = float(rate)
+            if sender_rate is not None:
+                self.sender_rates[provider] = float(sender_rate)
+
+        # Le seau partagé porte le débit: le créer au besoin pour que les autres workers le voient
+        state = self._state(provider)
+
+        if state:
+            state.bucket.set_rate(rate, capacity=1.0)
+            if sender_rate is not None:
+                with state.condition:
+                    state.sender_rate = float(sender_rate)
+                    for bucket in state.sender_buckets.values():
+                        bucket.set_rate(sender_rate, capacity=1.0)
+
+    def submit(self, provider: str, send: Callable[[], Any], priority: str = 'recovery',
+               tenant: str = 'default', sender: Optional[str] = None) -> Future:
+        """
+        Mettre un envoi en file; send() est appelé quand le débit le permet
+
+        send() lève ProviderThrottled si le fournisseur répond 429. Un fournisseur
+        sans limite configurée est appelé directement.
+        """
+        if priority not in self.PRIORITIES:
+            raise ValueError(f'Priorité inconnue: {priority}')
+
+        state = self._state(provider)
+        if state is None:
+            future: Future = Future()
+            try:
+                future.set_result(send())
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        message = _Message(send, priority, tenant, sender or provider)
+        with state.condition:
+            state.queues[priority].setdefault(tenant, deque()).append(message)
+            state.size += 1
+            state.condition.notify()
+        return message.future
+
+    def run(self, provider: str, send: Callable[[], Any], priority: str = 'recovery', tenant: str = 'default',
+            sender: Optional[str] = None, timeout: Optional[float] = None) -> Any:
+        """
+        Envoyer et attendre le résultat
+
+        Si le délai expire, un message encore en file est annulé (délai signalé);
+        un envoi déjà en cours est attendu jusqu'au bout, pour ne pas signaler un
+        échec qui serait renvoyé alors que le message est parti.
+        """
+        future = self.submit(provider, send, priority, tenant, sender)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise
+            return future.result()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            providers = dict(self.providers)
+
+        stats = {}
+        for provider, state in providers.items():
+            with state.condition:
+                queued = {
+                    priority: sum(len(messages) for messages in tenants.values())
+                    for priority, tenants in state.queues.items()
+                }
+                counters = {
+                    key: dict(value) if isinstance(value, dict) else value
+                    for key, value in state.stats.items()
+                }
+
+            wait_totals = counters.pop('wait_ms_total')
+            counters['avg_wait_ms'] = {
+                priority: round(wait_totals[priority] / counters['dispatched'][priority], 1)
+                if counters['dispatched'][priority] else 0.0
+                for priority in self.PRIORITIES
+            }
+            stats[provider] = {
+                'rate': state.bucket.rate,
+                'sender_rate': state.sender_rate,
+                'queued': queued,
+                **counters
+            }
+        return stats
+
+    def _state(self, provider: str) -> Optional[_ProviderState]:
+        """
+        État du fournisseur dans ce processus (threads recréés après un fork)
+        """
+        if self.pid == os.getpid() and provider in self.providers:
+            return self.providers[provider]
+
+        with self.lock:
+            if self.pid != os.getpid():
+                self.providers = {}
+                self.executor = ThreadPoolExecutor(max_workers=self.max_inflight, thread_name_prefix='message-send')
+                self.pid = os.getpid()
+
+            rate = self.provider_rates.get(provider)
+            if not rate:
+                return None
+
+            state = self.providers.get(provider)
+            if state is None:
+                state = _ProviderState(
+                    provider, rate, self.sender_rates.get(provider), self.max_inflight, self.PRIORITIES,
+                    self.shared_dir
+                )
+                state.thread = threading.Thread(
+                    target=self._dispatch_loop, args=(state,), name=f'message-scheduler-{provider}', daemon=True
+                )
+                state.thread.start()
+                self.providers[provider] = state
+            return state
+
+    def _dispatch_loop(self, state: _ProviderState):
+        while True:
+            with state.condition:
+                while state.size == 0:
+                    state.condition.wait()
+
+            # Place dans le pool d'envoi, puis jeton du fournisseur (attente hors verrou)
+            state.inflight.acquire()
+            state.bucket.acquire()
+
+            with state.condition:
+                message, wait = self._pick(state)
+
+            if message is None:
+                state.bucket.refund()
+                state.inflight.release()
+                if wait:
+                    time.sleep(wait)
+                continue
+
+            self.executor.submit(self._execute, state, message)
+
+    def _pick(self, state: _ProviderState):
+        """
+        Message suivant: priorité la plus haute, clients à tour de rôle, expéditeur non saturé
+
+        Renvoie (message, None) ou (None, secondes à attendre avant un nouvel essai).
+        """
+        shortest_wait = None
+
+        for priority in self.PRIORITIES:
+            tenants = state.queues[priority]
+            for tenant in list(tenants.keys()):
+                messages = tenants[tenant]
+
+                # Messages annulés par l'appelant (délai dépassé)
+                while messages and messages[0].future.cancelled():
+                    messages.popleft()
+                    state.size -= 1
+                    state.stats['cancelled'] += 1
+                if not messages:
+                    del tenants[tenant]
+                    continue
+
+                message = messages[0]
+                bucket = state.sender_bucket(message.sender)
+                if bucket is not None and not bucket.try_acquire():
+                    wait = bucket.wait_time()
+                    shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+                    continue
+
+                messages.popleft()
+                state.size -= 1
+                if messages:
+                    # Ce client repasse en fin de tour
+                    tenants.move_to_end(tenant)
+                else:
+                    del tenants[tenant]
+
+                state.stats['dispatched'][priority] += 1
+                state.stats['wait_ms_total'][priority] += (time.monotonic() - message.enqueued_at) * 1000
+                return message, None
+
+        return None, shortest_wait
+
+    def _execute(self, state: _ProviderState, message: _Message):
+        try:
+            # Un message remis en file après un 429 a déjà démarré
+            if not message.throttled and not message.future.set_running_or_notify_cancel():
+                with state.condition:
+                    state.stats['cancelled'] += 1
+                return
+
+            try:
+                result = message.send()
+            except ProviderThrottled as e:
+                # Le fournisseur impose une pause: tout le débit est suspendu, pas seulement ce message
+                state.bucket.pause(e.retry_after)
+                with state.condition:
+                    state.stats['throttled'] += 1
+                    message.throttled += 1
+                    if message.throttled <= self.max_throttle_retries:
+                        state.queues[message.priority].setdefault(message.tenant, deque()).appendleft(message)
+                        state.queues[message.priority].move_to_end(message.tenant, last=False)
+                        state.size += 1
+                        state.condition.notify()
+                        return
+                    state.stats['failed'] += 1
+                message.future.set_exception(e)
+                return
+            except Exception as e:
+                with state.condition:
+                    state.stats['failed'] += 1
+                message.future.set_exception(e)
+                return
+
+            succeeded = result.get('success') if isinstance(result, dict) else result is not False
+            with state.condition:
+                state.stats['sent' if succeeded else 'failed'] += 1
+            message.future.set_result(result)
+        finally:
+            state.inflight.release()
+
+
+_message_scheduler = None
+_message_scheduler_lock = threading.Lock()
+
+
+def _env_rate(name: str, default: Optional[float] = None) -> Optional[float]:
+    value = os.getenv(name)
+    if value in (None, ''):
+        return default
+    return float(value)
+
+
+def get_message_scheduler() -> MessageRateScheduler:
+    """
+    Ordonnanceur partagé (débits PROVIDER_RATE_* et SENDER_RATE_*, en messages/s, pour tous les workers)
+    """
+    global _message_scheduler
+    if _message_scheduler is None:
+        with _message_scheduler_lock:
+            if _message_scheduler is None:
+                _message_scheduler = MessageRateScheduler(
+                    provider_rates={
+                        'sms': _env_rate('PROVIDER_RATE_SMS', 30.0),
+                        'whatsapp': _env_rate('PROVIDER_RATE_WHATSAPP', 80.0)
+                    },
+                    sender_rates={
+                        'sms': _env_rate('SENDER_RATE_SMS'),
+                        'whatsapp': _env_rate('SENDER_RATE_WHATSAPP')
+                    },
+                    max_inflight=int(os.getenv('MESSAGE_MAX_INFLIGHT', 32)),
+                    shared_dir=shared_rate_dir()
+                )
+    return _message_scheduler
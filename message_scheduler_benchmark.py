@@ -0,0 +1,110 @@
+import argparse
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Any
+from urllib.parse import urlsplit
+from src.services.message_scheduler import MessageRateScheduler, ProviderThrottled
+from src.services.stub_provider import StubProviderServer
+
+
+class _Sender:
+    """
+    Envoi HTTP minimal vers le fournisseur simulé (une connexion keep-alive par thread)
+    """
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.host, self.port, self.path = parts.hostname, parts.port, parts.path
+        self.local = threading.local()
+
+    def post(self) -> int:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            self.local.connection = connection
+        try:
+            connection.request('POST', self.path, body=b'{}', headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        except Exception:
+            self.local.connection = None
+            raise
+
+    def send(self) -> bool:
+        status = self.post()
+        if status == 429:
+            raise ProviderThrottled(1.0)
+        return status == 200
+
+
+def run_benchmark(messages: int = 600, provider_rate: float = 100.0, latency_ms: float = 50.0,
+                  threads: int = 32) -> Dict[str, Any]:
+    """
+    Comparer des envois non régulés et l'ordonnanceur face à une limite stricte du fournisseur
+    """
+    stub = StubProviderServer(port=0, latency_ms=latency_ms, rate_limit=provider_rate).start()
+    sender = _Sender(f'{stub.url}/sms')
+
+    # Sans régulation: autant d'envois concurrents que de threads, les refus 429 sont perdus
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        statuses = list(executor.map(lambda _: sender.post(), range(messages)))
+    unpaced_seconds = time.perf_counter() - started
+    unpaced_accepted = statuses.count(200)
+
+    time.sleep(1.5)
+
+    # Avec l'ordonnanceur: trois clients, trois classes de priorité, un seul fournisseur
+    scheduler = MessageRateScheduler({'sms': provider_rate}, max_inflight=threads)
+    priorities = {'otp': messages // 6, 'alert': messages // 6}
+    priorities['recovery'] = messages - priorities['otp'] - priorities['alert']
+
+    futures = []
+    started = time.perf_counter()
+    # La récupération arrive en premier: les OTP arrivés ensuite doivent quand même passer devant
+    for priority in ('recovery', 'alert', 'otp'):
+        for index in range(priorities[priority]):
+            tenant = f'tenant-{index % 3}'
+            future = scheduler.submit('sms', sender.send, priority=priority, tenant=tenant)
+            futures.append((priority, tenant, future))
+
+    completion: Dict[str, float] = {}
+    for priority, tenant, future in futures:
+        future.add_done_callback(
+            lambda _, priority=priority: completion.__setitem__(priority, time.perf_counter() - started)
+        )
+    wait([future for _, _, future in futures])
+    paced_seconds = time.perf_counter() - started
+
+    paced_accepted = sum(1 for _, _, future in futures if future.exception() is None and future.result())
+    stats = scheduler.get_stats()['sms']
+    stub.stop()
+
+    return {
+        'messages': messages,
+        'provider_rate': provider_rate,
+        'unpaced_accepted': unpaced_accepted,
+        'unpaced_rejected': messages - unpaced_accepted,
+        'unpaced_seconds': round(unpaced_seconds, 2),
+        'paced_accepted': paced_accepted,
+        'paced_throttled': stats['throttled'],
+        'paced_seconds': round(paced_seconds, 2),
+        'paced_messages_per_second': round(paced_accepted / paced_seconds, 1),
+        'finished_at_seconds': {priority: round(value, 2) for priority, value in completion.items()},
+        'avg_wait_ms': stats['avg_wait_ms']
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Banc d\'essai de l\'ordonnanceur de débit sur un fournisseur limité')
+    parser.add_argument('--messages', type=int, default=600)
+    parser.add_argument('--provider-rate', type=float, default=100.0)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--threads', type=int, default=32)
+    args = parser.parse_args()
+
+    for key, value in run_benchmark(args.messages, args.provider_rate, args.latency_ms, args.threads).items():
+        print(f'{key}: {value}')
@@ -0,0 +1,257 @@
+import html
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Any, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+
+_PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+
+class TemplateNotFound(LookupError):
+    pass
+
+
+class _Values(dict):
+    """
+    Valeurs de rendu: une variable absente est rendue vide plutôt que de faire échouer l'envoi
+    """
+
+    def __missing__(self, key):
+        return ''
+
+
+class CompiledText(NamedTuple):
+    pattern: str
+    fields: Tuple[str, ...]
+
+    def render(self, values: Dict[str, Any]) -> str:
+        return self.pattern.format_map(values)
+
+
+class CompiledTemplate(NamedTuple):
+    purpose: str
+    channel: str
+    language: str
+    tenant: str
+    subject: Optional[CompiledText]
+    text: CompiledText
+    html: Optional[CompiledText]
+
+    def render(self, values: Dict[str, Any]) -> Dict[str, Optional[str]]:
+        mapping = values if isinstance(values, _Values) else _Values(values)
+        rendered = {
+            'subject': self.subject.render(mapping) if self.subject else None,
+            'text': self.text.render(mapping),
+            'html': None
+        }
+        if self.html:
+            # Seules les variables du gabarit HTML sont échappées
+            escaped = _Values({field: html.escape(str(mapping[field])) for field in self.html.fields})
+            rendered['html'] = self.html.render(escaped)
+        return rendered
+
+
+class TemplateTable(NamedTuple):
+    version: int
+    default_language: str
+    templates: Dict[Tuple[str, str, str, str], CompiledTemplate]
+
+
+def compile_text(source: str) -> CompiledText:
+    """
+    Compiler un gabarit {{variable}} en chaîne de format Python (rendu par str.format_map)
+    """
+    parts = []
+    fields = []
+    position = 0
+    for match in _PLACEHOLDER.finditer(source):
+        # Les accolades du texte littéral sont doublées pour str.format
+        parts.append(source[position:match.start()].replace('{', '{{').replace('}', '}}'))
+        parts.append('{' + match.group(1) + '}')
+        if match.group(1) not in fields:
+            fields.append(match.group(1))
+        position = match.end()
+    parts.append(source[position:].replace('{', '{{').replace('}', '}}'))
+    return CompiledText(''.join(parts), tuple(fields))
+
+
+class MessageTemplateEngine:
+    """
+    Gabarits des messages sortants (email, SMS, WhatsApp)
+
+    Un gabarit est identifié par (objet, canal, langue, client) et compilé une
+    fois au chargement du fichier JSON; le rendu n'est qu'un str.format_map.
+    La recherche retombe sur le client 'default' puis sur la langue par défaut.
+    Le fichier est surveillé comme celui des règles anti-fraude.
+    """
+
+    DEFAULT_TENANT = 'default'
+
+    def __init__(self, config_path: Optional[str] = None, reload_interval_seconds: float = 5.0):
+        self.config_path = config_path or os.environ.get(
+            'MESSAGE_TEMPLATES_PATH', os.path.join(os.path.dirname(__file__), 'message_templates.json')
+        )
+        self.reload_interval_seconds = reload_interval_seconds
+
+        self.table: Optional[TemplateTable] = None
+        self.resolved: Dict[Tuple[str, str, str, str], CompiledTemplate] = {}
+        self.loaded_mtime: Optional[float] = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+        self.load()
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Lire et compiler les gabarits (les gabarits courants restent actifs en cas d'erreur)
+        """
+        mtime = os.path.getmtime(self.config_path)
+        with open(self.config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        table = self.compile(config)
+
+        with self.lock:
+            self.table = table
+            self.resolved = {}
+            self.loaded_mtime = mtime
+            self.checked_at = time.time()
+
+        return {'version': table.version, 'templates': len(table.templates)}
+
+    def maybe_reload(self):
+        """
+        Recharger si le fichier a changé (vérification au plus toutes les quelques secondes)
+        """
+        now = time.time()
+        if now - self.checked_at < self.reload_interval_seconds:
+            return
+        self.checked_at = now
+
+        try:
+            if os.path.getmtime(self.config_path) != self.loaded_mtime:
+                result = self.load()
+                print(f"Gabarits de messages rechargés: version {result['version']}")
+        except Exception as e:
+            print(f"Erreur rechargement des gabarits de messages: {e}")
+
+    def compile(self, config: Dict[str, Any]) -> TemplateTable:
+        templates = {}
+        for entry in config['templates']:
+            key = (
+                entry['purpose'],
+                entry['channel'],
+                entry['language'],
+                entry.get('tenant', self.DEFAULT_TENANT)
+            )
+            if key in templates:
+                raise ValueError(f'Gabarit en double: {key}')
+
+            templates[key] = CompiledTemplate(
+                purpose=key[0],
+                channel=key[1],
+                language=key[2],
+                tenant=key[3],
+                subject=compile_text(entry['subject']) if entry.get('subject') else None,
+                text=compile_text(entry['text']),
+                html=compile_text(entry['html']) if entry.get('html') else None
+            )
+
+        return TemplateTable(
+            version=config['version'],
+            default_language=config.get('default_language', 'fr'),
+            templates=templates
+        )
+
+    def get(self, purpose: str, channel: str, language: Optional[str] = None,
+            tenant: Optional[str] = None) -> CompiledTemplate:
+        """
+        Gabarit compilé, avec repli sur le client par défaut puis la langue par défaut
+        """
+        self.maybe_reload()
+        table = self.table
+        language = language or table.default_language
+        tenant = tenant or self.DEFAULT_TENANT
+        key = (purpose, channel, language, tenant)
+
+        template = self.resolved.get(key)
+        if template is not None:
+            return template
+
+        for candidate in (
+            key,
+            (purpose, channel, language, self.DEFAULT_TENANT),
+            (purpose, channel, table.default_language, tenant),
+            (purpose, channel, table.default_language, self.DEFAULT_TENANT)
+        ):
+            template = table.templates.get(candidate)
+            if template is not None:
+                if self.table is table:
+                    self.resolved[key] = template
+                return template
+
+        raise TemplateNotFound(f'Aucun gabarit pour {purpose} / {channel}')
+
+    def has(self, purpose: str, channel: str) -> bool:
+        try:
+            self.get(purpose, channel)
+            return True
+        except TemplateNotFound:
+            return False
+
+    def render(self, purpose: str, channel: str, values: Dict[str, Any], language: Optional[str] = None,
+               tenant: Optional[str] = None) -> Dict[str, Optional[str]]:
+        """
+        Rendre un message: {'subject', 'text', 'html'} (html None sans variante HTML)
+        """
+        return self.get(purpose, channel, language, tenant).render(values)
+
+    def render_batch(self, purpose: str, channel: str, rows: Iterable[Dict[str, Any]],
+                     language: Optional[str] = None, tenant: Optional[str] = None) -> Iterator[Dict[str, Optional[str]]]:
+        """
+        Rendre une série de messages avec le même gabarit (résolu une seule fois)
+
+        Générateur: une campagne de 100 000 messages n'est pas matérialisée en mémoire.
+        """
+        template = self.get(purpose, channel, language, tenant)
+        render = template.render
+        for values in rows:
+            yield render(values)
+
+    def describe(self) -> Dict[str, Any]:
+        table = self.table
+        return {
+            'version': table.version,
+            'config_path': self.config_path,
+            'default_language': table.default_language,
+            'templates': [
+                {
+                    'purpose': template.purpose,
+                    'channel': template.channel,
+                    'language': template.language,
+                    'tenant': template.tenant,
+                    'fields': sorted(set(template.text.fields) | set(template.subject.fields if template.subject else ())),
+                    'html': template.html is not None
+                }
+                for template in table.templates.values()
+            ]
+        }
+
+
+_message_template_engine = None
+_message_template_engine_lock = threading.Lock()
+
+
+def get_message_template_engine() -> MessageTemplateEngine:
+    """
+    Gabarits partagés du processus (compilés une fois, rechargés si le fichier change)
+    """
+    global _message_template_engine
+    if _message_template_engine is None:
+        with _message_template_engine_lock:
+            if _message_template_engine is None:
+                _message_template_engine = MessageTemplateEngine()
+    return _message_template_engine
@@ -0,0 +1,371 @@
+import os
+import random
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam
+from typing import Dict, Any, List, Optional
+from src.models.management import CartRecoveryNotification, NotificationStatus, db
+from src.services.notification_service import NotificationService
+
+
+class NotificationOutbox:
+    """
+    File d'envoi durable des notifications de récupération de panier
+
+    La requête HTTP insère la notification en PENDING et rend la main. Des
+    workers prennent les notifications dues par lots (prise atomique avec un
+    bail), les envoient, puis enregistrent les statuts du lot en un seul commit.
+    Un échec est rejoué avec un délai exponentiel; après max_attempts la
+    notification passe en DEAD_LETTER et n'est plus reprise automatiquement.
+
+    Le bail couvre l'envoi d'une seule notification (délai du fournisseur et
+    attente dans l'ordonnanceur de débit): il est renouvelé pour tout le lot
+    avant chaque envoi. Le résultat n'est écrit que si la ligne porte encore
+    le jeton du worker: un worker en retard n'écrase jamais l'état d'une
+    notification reprise par un autre.
+    """
+
+    # Délai maximal de l'appel au fournisseur, en secondes
+    CHANNEL_TIMEOUTS = {
+        'email': 30,
+        'sms': 10,
+        'whatsapp': 15
+    }
+
+    def __init__(self, max_workers: Optional[int] = None, batch_size: int = 50, poll_interval_seconds: float = 2.0,
+                 max_attempts: Optional[int] = None, base_delay_seconds: float = 30.0,
+                 max_delay_seconds: float = 3600.0, lease_seconds: float = 300.0):
+        self.max_workers = max_workers or int(os.getenv('NOTIFICATION_OUTBOX_WORKERS', 2))
+        self.batch_size = batch_size
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_attempts = max_attempts or int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', 5))
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.lease_seconds = lease_seconds
+
+        self.notification_service = NotificationService()
+
+        self.app = None
+        self.workers: List[threading.Thread] = []
+        self.wakeup = threading.Event()
+        self.pid = None
+        self.lock = threading.Lock()
+        self.stats = {
+            'batches': 0,
+            'sent': 0,
+            'retried': 0,
+            'dead_lettered': 0
+        }
+
+    def init_app(self, app):
+        """
+        Les workers ouvrent leur propre contexte d'application pour accéder à la base
+        """
+        self.app = app
+
+    def start(self):
+        self._ensure_started()
+
+    def wake(self):
+        """
+        Signaler de nouvelles notifications (évite d'attendre le prochain passage)
+        """
+        self._ensure_started()
+        self.wakeup.set()
+
+    def enqueue(self, cart_id: int, channel: str, recipient: str, subject: Optional[str],
+                message: str, html_message: Optional[str] = None) -> CartRecoveryNotification:
+        """
+        Ajouter une notification à la session (le commit revient à l'appelant)
+        """
+        notification = CartRecoveryNotification(
+            cart_id=cart_id,
+            channel=channel,
+            recipient=recipient,
+            subject=subject,
+            message=message,
+            html_message=html_message,
+            status=NotificationStatus.PENDING,
+            attempts=0,
+            next_attempt_at=datetime.utcnow()
+        )
+        db.session.add(notification)
+        return notification
+
+    def claim_batch(self, limit: Optional[int] = None) -> List[CartRecoveryNotification]:
+        """
+        Prendre un lot de notifications dues: en attente, ou en cours avec un bail expiré
+
+        La prise est un UPDATE conditionnel marqué d'un jeton: deux workers (ou
+        deux processus) ne peuvent pas prendre la même notification. La tentative
+        est comptée à la prise, pour qu'un message qui fait tomber le worker
+        finisse lui aussi en DEAD_LETTER.
+        """
+        now = datetime.utcnow()
+        due = db.or_(
+            db.and_(
+                CartRecoveryNotification.status == NotificationStatus.PENDING,
+                CartRecoveryNotification.next_attempt_at <= now
+            ),
+            db.and_(
+                CartRecoveryNotification.status == NotificationStatus.PROCESSING,
+                CartRecoveryNotification.locked_until < now
+            )
+        )
+
+        ids = [row[0] for row in db.session.query(CartRecoveryNotification.id).filter(
+            due, CartRecoveryNotification.attempts < self.max_attempts
+        ).order_by(CartRecoveryNotification.next_attempt_at).limit(limit or self.batch_size).all()]
+        if not ids:
+            return []
+
+        token = str(uuid.uuid4())
+        CartRecoveryNotification.query.filter(CartRecoveryNotification.id.in_(ids), due).update(
+            {
+                'status': NotificationStatus.PROCESSING,
+                'claimed_by': token,
+                'locked_until': now + timedelta(seconds=self.lease_seconds),
+                'attempts': CartRecoveryNotification.attempts + 1
+            },
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        return CartRecoveryNotification.query.filter_by(claimed_by=token).all()
+
+    def process_batch(self, limit: Optional[int] = None) -> int:
+        """
+        Prendre, envoyer et enregistrer un lot; renvoie le nombre de notifications traitées
+        """
+        notifications = self.claim_batch(limit)
+        if not notifications:
+            return 0
+
+        token = notifications[0].claimed_by
+        updates = []
+        for notification in notifications:
+            # Le lot peut durer bien plus que le bail: le renouveler avant chaque envoi
+            self._renew_lease(token)
+            if notification.claimed_by != token:
+                # Bail expiré entre deux envois et notification reprise par un autre worker
+                continue
+            try:
+                result = self.notification_service.deliver(
+                    channel=notification.channel,
+                    recipient=notification.recipient,
+                    subject=notification.subject,
+                    message=notification.message,
+                    cart_id=notification.cart_id,
+                    timeout=self.CHANNEL_TIMEOUTS.get(notification.channel, 30),
+                    html=notification.html_message
+                )
+            except Exception as e:
+                result = {'success': False, 'provider_message_id': None, 'error': str(e)}
+
+            updates.append(self._outcome(notification, result['success'], result['error'], result['provider_message_id']))
+
+        self._write_outcomes(token, updates)
+
+        with self.lock:
+            self.stats['batches'] += 1
+            for update in updates:
+                if update['status'] == NotificationStatus.SENT:
+                    self.stats['sent'] += 1
+                elif update['status'] == NotificationStatus.DEAD_LETTER:
+                    self.stats['dead_lettered'] += 1
+                else:
+                    self.stats['retried'] += 1
+
+        return len(updates)
+
+    def _renew_lease(self, token: str):
+        CartRecoveryNotification.query.filter(
+            CartRecoveryNotification.claimed_by == token,
+            CartRecoveryNotification.status == NotificationStatus.PROCESSING
+        ).update(
+            {'locked_until': datetime.utcnow() + timedelta(seconds=self.lease_seconds)},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+    def _write_outcomes(self, token: str, updates: List[Dict[str, Any]]):
+        """
+        Statuts du lot en une seule requête groupée, limitée aux lignes encore prises par ce worker
+        """
+        table = CartRecoveryNotification.__table__
+        statement = table.update().where(db.and_(
+            table.c.id == bindparam('b_id'),
+            table.c.claimed_by == bindparam('b_token')
+        )).values({
+            column: bindparam(f'b_{column}')
+            for column in ('status', 'sent_at', 'error_message', 'next_attempt_at', 'provider_message_id',
+                           'claimed_by', 'locked_until')
+        })
+        db.session.execute(statement, [
+            dict({f'b_{key}': value for key, value in update.items()}, b_token=token)
+            for update in updates
+        ])
+        db.session.commit()
+
+    def _outcome(self, notification: CartRecoveryNotification, success: bool, error: Optional[str],
+                 provider_message_id: Optional[str] = None) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        # Mêmes colonnes pour chaque ligne: le lot est écrit par une seule requête paramétrée
+        update = {
+            'id': notification.id,
+            'sent_at': notification.sent_at,
+            'next_attempt_at': notification.next_attempt_at,
+            'provider_message_id': notification.provider_message_id,
+            'claimed_by': None,
+            'locked_until': None
+        }
+
+        if success:
+            # L'identifiant du fournisseur rattache les statuts de livraison reçus par webhook
+            update.update({
+                'status': NotificationStatus.SENT,
+                'sent_at': now,
+                'error_message': None,
+                'provider_message_id': provider_message_id
+            })
+        elif notification.attempts >= self.max_attempts:
+            update.update({'status': NotificationStatus.DEAD_LETTER, 'error_message': error})
+        else:
+            update.update({
+                'status': NotificationStatus.PENDING,
+                'error_message': error,
+                'next_attempt_at': now + timedelta(seconds=self.retry_delay(notification.attempts))
+            })
+        return update
+
+    def retry_delay(self, attempts: int) -> float:
+        """
+        Délai avant la tentative suivante: base * 2^(n-1), plafonné, avec ±20 % d'aléa
+        """
+        delay = min(self.max_delay_seconds, self.base_delay_seconds * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.8, 1.2)
+
+    def sweep_dead_letters(self) -> int:
+        """
+        Passer en DEAD_LETTER les notifications dont le bail a expiré à la dernière tentative
+        """
+        count = CartRecoveryNotification.query.filter(
+            CartRecoveryNotification.status == NotificationStatus.PROCESSING,
+            CartRecoveryNotification.locked_until < datetime.utcnow(),
+            CartRecoveryNotification.attempts >= self.max_attempts
+        ).update(
+            {
+                'status': NotificationStatus.DEAD_LETTER,
+                'claimed_by': None,
+                'locked_until': None,
+                'error_message': 'Envoi interrompu à la dernière tentative'
+            },
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        if count:
+            with self.lock:
+                self.stats['dead_lettered'] += count
+        return count
+
+    def list_dead_letters(self, limit: int = 50) -> List[Dict[str, Any]]:
+        notifications = CartRecoveryNotification.query.filter_by(status=NotificationStatus.DEAD_LETTER)\
+            .order_by(CartRecoveryNotification.created_at.desc()).limit(limit).all()
+        return [notification.to_dict() for notification in notifications]
+
+    def requeue_dead_letters(self, notification_ids: Optional[List[int]] = None) -> int:
+        """
+        Remettre en file des notifications en DEAD_LETTER (toutes si aucun identifiant)
+        """
+        query = CartRecoveryNotification.query.filter_by(status=NotificationStatus.DEAD_LETTER)
+        if notification_ids:
+            query = query.filter(CartRecoveryNotification.id.in_(notification_ids))
+
+        count = query.update(
+            {
+                'status': NotificationStatus.PENDING,
+                'attempts': 0,
+                'next_attempt_at': datetime.utcnow(),
+                'error_message': None
+            },
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        if count:
+            self.wake()
+        return count
+
+    def get_stats(self) -> Dict[str, Any]:
+        counts = dict(
+            db.session.query(CartRecoveryNotification.status, db.func.count(CartRecoveryNotification.id))
+            .group_by(CartRecoveryNotification.status).all()
+        )
+        oldest_due = db.session.query(db.func.min(CartRecoveryNotification.next_attempt_at)).filter(
+            CartRecoveryNotification.status == NotificationStatus.PENDING
+        ).scalar()
+
+        with self.lock:
+            stats = dict(self.stats)
+
+        return {
+            'by_status': {status.value: counts.get(status, 0) for status in NotificationStatus},
+            'oldest_pending_at': oldest_due.isoformat() if oldest_due else None,
+            'workers': len([worker for worker in self.workers if worker.is_alive()]) if self.pid == os.getpid() else 0,
+            'max_attempts': self.max_attempts,
+            'processed': stats
+        }
+
+    def _ensure_started(self):
+        """
+        Démarrer les workers dans ce processus (les threads ne survivent pas au fork)
+        """
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.wakeup = threading.Event()
+            self.workers = [
+                threading.Thread(target=self._worker_loop, name=f'notification-outbox-{index}', daemon=True)
+                for index in range(self.max_workers)
+            ]
+            for worker in self.workers:
+                worker.start()
+            self.pid = os.getpid()
+
+    def _worker_loop(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    processed = self.process_batch()
+                    if not processed:
+                        self.sweep_dead_letters()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Erreur file de notifications: {e}")
+                    processed = 0
+
+            # Lot plein: enchaîner; sinon attendre un signal ou le prochain passage
+            if processed < self.batch_size:
+                self.wakeup.wait(self.poll_interval_seconds)
+                self.wakeup.clear()
+
+
+_notification_outbox = None
+_notification_outbox_lock = threading.Lock()
+
+
+def get_notification_outbox() -> NotificationOutbox:
+    """
+    File d'envoi partagée du processus
+    """
+    global _notification_outbox
+    if _notification_outbox is None:
+        with _notification_outbox_lock:
+            if _notification_outbox is None:
+                _notification_outbox = NotificationOutbox()
+    return _notification_outbox
@@ -1,9 +1,32 @@
-import smtplib
-import requests
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Optional, List, Callable, Tuple
 import os
+import threading
+from src.services.smtp_pool import get_smtp_pool
+from src.services.http_client import get_http_client
+from src.services.message_scheduler import ProviderThrottled, get_message_scheduler
+from src.services.message_templates import get_message_template_engine
+
+_fan_out_pool = None
+_fan_out_pid = None
+_fan_out_lock = threading.Lock()
+
+def _get_fan_out_pool() -> ThreadPoolExecutor:
+    """
+    Pool partagé des envois à plusieurs destinataires (recréé après un fork)
+    """
+    global _fan_out_pool, _fan_out_pid
+    if _fan_out_pid != os.getpid():
+        with _fan_out_lock:
+            if _fan_out_pid != os.getpid():
+                _fan_out_pool = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('NOTIFICATION_FAN_OUT_WORKERS', 8)),
+                    thread_name_prefix='notification-fan-out'
+                )
+                _fan_out_pid = os.getpid()
+    return _fan_out_pool
 
 class NotificationService:
     """
@@ -18,6 +41,12 @@ class NotificationService:
         self.smtp_password = os.getenv('SMTP_PASSWORD', '')
         self.from_email = os.getenv('FROM_EMAIL', 'noreply@retailbot.com')
         
+        # Lien de récupération des anciens messages ([lien] / [Finaliser ma commande])
+        self.recovery_link_base = os.getenv('RECOVERY_LINK_BASE', 'https://votre-site.com/recover-cart')
+        
+        # Connexions SMTP authentifiées partagées entre les envois (et les instances)
+        self.smtp_pool = get_smtp_pool()
+        
         # Configuration SMS (exemple avec un service générique)
         self.sms_api_url = os.getenv('SMS_API_URL', '')
         self.sms_api_key = os.getenv('SMS_API_KEY', '')
@@ -25,46 +54,135 @@ class NotificationService:
         # Configuration WhatsApp Business API
         self.whatsapp_api_url = os.getenv('WHATSAPP_API_URL', '')
         self.whatsapp_token = os.getenv('WHATSAPP_TOKEN', '')
+        
+        # Sessions HTTP persistantes vers les fournisseurs SMS / WhatsApp
+        self.http = get_http_client()
+        
+        # Débit SMS / WhatsApp sous les limites des fournisseurs (priorités, clients, expéditeurs)
+        self.scheduler = get_message_scheduler()
+        self.sms_sender = os.getenv('SMS_SENDER_ID', 'default')
+        self.whatsapp_sender = os.getenv('WHATSAPP_PHONE_NUMBER_ID', 'default')
+        self.queue_timeout = float(os.getenv('MESSAGE_QUEUE_TIMEOUT', 120))
+        
+        # Gabarits compilés des messages (objet, canal, langue, client)
+        self.templates = get_message_template_engine()
+        
+        # Destinataires par transaction SMTP pour les envois groupés
+        self.email_batch_size = int(os.getenv('EMAIL_BATCH_SIZE', 50))
     
     def send_notification(self, channel: str, recipient: str, subject: Optional[str], 
-                         message: str, cart_id: Optional[int] = None) -> bool:
+                         message: str, cart_id: Optional[int] = None, timeout: float = 30,
+                         priority: str = 'recovery', tenant: str = 'default', html: Optional[str] = None) -> bool:
         """
-        Envoyer une notification via le canal spécifié
+        Envoyer une notification via le canal spécifié (timeout en secondes pour les API SMS/WhatsApp)
+        
+        priority ('otp', 'alert', 'recovery') et tenant déterminent l'ordre de passage
+        des SMS / WhatsApp quand le débit du fournisseur est atteint. html est la
+        variante HTML d'un email (sinon dérivée du texte).
+        """
+        return self.deliver(channel, recipient, subject, message, cart_id, timeout, priority, tenant, html)['success']
+    
+    def deliver(self, channel: str, recipient: str, subject: Optional[str], message: str,
+                cart_id: Optional[int] = None, timeout: float = 30, priority: str = 'recovery',
+                tenant: str = 'default', html: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Comme send_notification, avec l'identifiant du message chez le fournisseur
+        
+        Renvoie {'success', 'provider_message_id', 'error'}; l'identifiant sert à
+        rapprocher les statuts de livraison reçus par webhook.
         """
         try:
             if channel == 'email':
-                return self._send_email(recipient, subject, message, cart_id)
+                success = self._send_email(recipient, subject, message, cart_id, html)
+                return {'success': success, 'provider_message_id': None, 'error': None if success else "Échec de l'envoi"}
             elif channel == 'sms':
-                return self._send_sms(recipient, message, cart_id)
+                return self._send_paced(
+                    'sms', lambda: self._send_sms(recipient, message, cart_id, timeout),
+                    priority, tenant, self.sms_sender, timeout
+                )
             elif channel == 'whatsapp':
-                return self._send_whatsapp(recipient, message, cart_id)
+                return self._send_paced(
+                    'whatsapp', lambda: self._send_whatsapp(recipient, message, cart_id, timeout),
+                    priority, tenant, self.whatsapp_sender, timeout
+                )
             else:
                 print(f"Canal de notification non supporté: {channel}")
-                return False
+                return self._failure(f"Canal non supporté: {channel}")
                 
         except Exception as e:
             print(f"Erreur lors de l'envoi de notification {channel}: {e}")
-            return False
+            return self._failure(str(e))
+    
+    @staticmethod
+    def _failure(error: str) -> Dict[str, Any]:
+        return {'success': False, 'provider_message_id': None, 'error': error}
     
-    def _send_email(self, recipient: str, subject: str, message: str, cart_id: Optional[int] = None) -> bool:
+    def _send_paced(self, provider: str, send: Callable[[], Dict[str, Any]], priority: str, tenant: str,
+                    sender: str, timeout: float) -> Dict[str, Any]:
+        """
+        Passer l'envoi par l'ordonnanceur de débit et attendre son résultat
+        """
+        try:
+            return self.scheduler.run(provider, send, priority, tenant, sender, timeout=self.queue_timeout + timeout)
+        except ProviderThrottled:
+            print(f"Limite de débit {provider} toujours atteinte après plusieurs essais")
+            return self._failure('Limite de débit du fournisseur atteinte')
+        except FutureTimeoutError:
+            print(f"Envoi {provider} non effectué: file d'attente saturée")
+            return self._failure("File d'attente saturée")
+    
+    @staticmethod
+    def _provider_message_id(response) -> Optional[str]:
+        """
+        Identifiant du message renvoyé par le fournisseur (WhatsApp: messages[0].id)
+        """
+        try:
+            data = response.json()
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        if data.get('messages'):
+            return data['messages'][0].get('id')
+        return data.get('message_id') or data.get('id')
+    
+    def _recovery_link(self, cart_id: int) -> str:
+        return f"{self.recovery_link_base}/{cart_id}"
+    
+    @staticmethod
+    def _retry_after(response) -> float:
+        try:
+            return max(0.1, float(response.headers.get('Retry-After', 1)))
+        except (TypeError, ValueError):
+            return 1.0
+    
+    def _send_email(self, recipient: str, subject: str, message: str, cart_id: Optional[int] = None,
+                    html: Optional[str] = None) -> bool:
         """
         Envoyer un email
         """
+        # Message enregistré avant les gabarits (html_message NULL): liens à insérer
+        if cart_id and html is None:
+            recovery_link = self._recovery_link(cart_id)
+            message = message.replace('[Finaliser ma commande]', f'<a href="{recovery_link}">Finaliser ma commande</a>')
+            message = message.replace('[lien]', recovery_link)
+        return self._send_email_to_many([recipient], subject, message, cart_id, html)[recipient]
+    
+    def _send_email_to_many(self, recipients: List[str], subject: str, message: str,
+                            cart_id: Optional[int] = None, html: Optional[str] = None) -> Dict[str, bool]:
+        """
+        Envoyer un même email à plusieurs destinataires en une seule transaction SMTP
+        """
         try:
             # Créer le message email
             msg = MIMEMultipart('alternative')
             msg['Subject'] = subject
             msg['From'] = self.from_email
-            msg['To'] = recipient
-            
-            # Ajouter le lien de récupération si cart_id est fourni
-            if cart_id:
-                recovery_link = f"https://votre-site.com/recover-cart/{cart_id}"
-                message = message.replace('[Finaliser ma commande]', f'<a href="{recovery_link}">Finaliser ma commande</a>')
-                message = message.replace('[lien]', recovery_link)
+            # Lot: destinataires dans l'enveloppe SMTP seulement, jamais visibles entre eux
+            msg['To'] = recipients[0] if len(recipients) == 1 else 'undisclosed-recipients:;'
             
-            # Version HTML du message
-            html_message = f"""
+            # Version HTML du message (variante du gabarit, sinon dérivée du texte)
+            html_message = html or f"""
             <html>
                 <body>
                     <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
@@ -81,35 +199,33 @@ class NotificationService:
             msg.attach(text_part)
             msg.attach(html_part)
             
-            # Envoyer l'email
+            # Envoyer l'email sur une connexion du pool (pas de nouvelle poignée de main)
             if self.smtp_username and self.smtp_password:
-                server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-                server.starttls()
-                server.login(self.smtp_username, self.smtp_password)
-                server.send_message(msg)
-                server.quit()
-                return True
+                refused = self.smtp_pool.send(msg, to_addrs=recipients, from_addr=self.from_email)
+                for recipient, error in refused.items():
+                    print(f"Destinataire refusé {recipient}: {error}")
+                return {recipient: recipient not in refused for recipient in recipients}
             else:
                 print("Configuration SMTP manquante")
-                return False
+                return {recipient: False for recipient in recipients}
                 
         except Exception as e:
             print(f"Erreur envoi email: {e}")
-            return False
+            return {recipient: False for recipient in recipients}
     
-    def _send_sms(self, recipient: str, message: str, cart_id: Optional[int] = None) -> bool:
+    def _send_sms(self, recipient: str, message: str, cart_id: Optional[int] = None,
+                  timeout: float = 30) -> Dict[str, Any]:
         """
         Envoyer un SMS
         """
         try:
             if not self.sms_api_url or not self.sms_api_key:
                 print("Configuration SMS manquante")
-                return False
+                return self._failure('Configuration SMS manquante')
             
-            # Ajouter le lien de récupération si cart_id est fourni
+            # Ajouter le lien de récupération des anciens messages si cart_id est fourni
             if cart_id:
-                recovery_link = f"https://votre-site.com/recover-cart/{cart_id}"
-                message = message.replace('[lien]', recovery_link)
+                message = message.replace('[lien]', self._recovery_link(cart_id))
             
             # Préparer les données pour l'API SMS
             data = {
@@ -119,31 +235,35 @@ class NotificationService:
             }
             
             # Envoyer la requête
-            response = requests.post(self.sms_api_url, json=data, timeout=30)
+            response = self.http.post(self.sms_api_url, json=data, timeout=timeout)
             
             if response.status_code == 200:
-                return True
+                return {'success': True, 'provider_message_id': self._provider_message_id(response), 'error': None}
+            elif response.status_code == 429:
+                raise ProviderThrottled(self._retry_after(response))
             else:
                 print(f"Erreur API SMS: {response.status_code} - {response.text}")
-                return False
+                return self._failure(f"Erreur API SMS: {response.status_code}")
                 
+        except ProviderThrottled:
+            raise
         except Exception as e:
             print(f"Erreur envoi SMS: {e}")
-            return False
+            return self._failure(str(e))
     
-    def _send_whatsapp(self, recipient: str, message: str, cart_id: Optional[int] = None) -> bool:
+    def _send_whatsapp(self, recipient: str, message: str, cart_id: Optional[int] = None,
+                       timeout: float = 30) -> Dict[str, Any]:
         """
         Envoyer un message WhatsApp Business
         """
         try:
             if not self.whatsapp_api_url or not self.whatsapp_token:
                 print("Configuration WhatsApp manquante")
-                return False
+                return self._failure('Configuration WhatsApp manquante')
             
-            # Ajouter le lien de récupération si cart_id est fourni
+            # Ajouter le lien de récupération des anciens messages si cart_id est fourni
             if cart_id:
-                recovery_link = f"https://votre-site.com/recover-cart/{cart_id}"
-                message = message.replace('[lien]', recovery_link)
+                message = message.replace('[lien]', self._recovery_link(cart_id))
             
             # Headers pour l'API WhatsApp
             headers = {
@@ -162,90 +282,132 @@ class NotificationService:
             }
             
             # Envoyer la requête
-            response = requests.post(self.whatsapp_api_url, json=data, headers=headers, timeout=30)
+            response = self.http.post(self.whatsapp_api_url, json=data, headers=headers, timeout=timeout)
             
             if response.status_code == 200:
-                return True
+                return {'success': True, 'provider_message_id': self._provider_message_id(response), 'error': None}
+            elif response.status_code == 429:
+                raise ProviderThrottled(self._retry_after(response))
             else:
                 print(f"Erreur API WhatsApp: {response.status_code} - {response.text}")
-                return False
+                return self._failure(f"Erreur API WhatsApp: {response.status_code}")
                 
+        except ProviderThrottled:
+            raise
         except Exception as e:
             print(f"Erreur envoi WhatsApp: {e}")
-            return False
+            return self._failure(str(e))
     
     def send_inventory_alert(self, recipients: list, alert_type: str, item_name: str, 
                            current_stock: int, threshold: int) -> Dict[str, bool]:
         """
         Envoyer une alerte d'inventaire
         """
-        results = {}
-        
-        # Générer le message d'alerte
-        if alert_type == 'low_stock':
-            subject = f"🚨 Alerte Stock Faible - {item_name}"
-            message = f"""
-            Alerte Stock Faible
-            
-            Produit: {item_name}
-            Stock actuel: {current_stock}
-            Seuil minimum: {threshold}
-            
-            Action requise: Réapprovisionner le stock
-            
-            RetailBot Factory
-            """
-        elif alert_type == 'out_of_stock':
-            subject = f"🔴 Rupture de Stock - {item_name}"
-            message = f"""
-            Rupture de Stock
-            
-            Produit: {item_name}
-            Stock actuel: {current_stock}
-            
-            Action urgente: Réapprovisionner immédiatement
-            
-            RetailBot Factory
-            """
-        else:
-            subject = f"📦 Alerte Inventaire - {item_name}"
-            message = f"""
-            Alerte Inventaire
-            
-            Produit: {item_name}
-            Stock actuel: {current_stock}
-            
-            Veuillez vérifier le stock
-            
-            RetailBot Factory
-            """
+        subject, message = self.inventory_alert_content(alert_type, item_name, current_stock, threshold)
+        return self.send_to_many(recipients, subject, message)
+    
+    def inventory_alert_content(self, alert_type: str, item_name: str, current_stock: int,
+                                threshold: int) -> Tuple[str, str]:
+        """
+        Sujet et message d'une alerte d'inventaire
+        """
+        purpose = f'inventory_alert.{alert_type}'
+        if not self.templates.has(purpose, 'email'):
+            purpose = 'inventory_alert.default'
         
-        # Envoyer à tous les destinataires
-        for recipient in recipients:
-            if '@' in recipient:  # Email
-                results[recipient] = self._send_email(recipient, subject, message)
-            else:  # SMS/WhatsApp (numéro de téléphone)
-                results[recipient] = self._send_sms(recipient, message)
+        rendered = self.templates.render(purpose, 'email', {
+            'item_name': item_name,
+            'current_stock': current_stock,
+            'threshold': threshold
+        })
         
-        return results
+        return rendered['subject'], rendered['text']
     
-    def send_cod_verification(self, phone: str, order_id: str, customer_name: str) -> bool:
+    def inventory_digest_content(self, alerts: List[Dict[str, Any]], max_lines: int = 25) -> Tuple[str, str, str]:
         """
-        Envoyer une notification de vérification COD
+        Sujet, message email et message SMS d'un récapitulatif de plusieurs alertes d'inventaire
         """
-        message = f"""
-        🔔 Vérification de Commande
+        counts: Dict[str, int] = {}
+        for alert in alerts:
+            counts[alert['alert_type']] = counts.get(alert['alert_type'], 0) + 1
         
-        Bonjour {customer_name},
+        labels = {
+            'out_of_stock': 'rupture(s) de stock',
+            'low_stock': 'stock(s) faible(s)',
+            'overstock': 'surstock(s)',
+            'reorder_needed': 'réapprovisionnement(s) à prévoir'
+        }
+        summary = ', '.join(
+            f"{count} {labels.get(alert_type, alert_type)}"
+            for alert_type, count in sorted(counts.items(), key=lambda entry: -entry[1])
+        )
         
-        Votre commande #{order_id} nécessite une vérification.
+        # Ruptures d'abord, puis les stocks les plus bas
+        ordered = sorted(alerts, key=lambda alert: (alert['alert_type'] != 'out_of_stock', alert.get('current_stock') or 0))
+        lines = [
+            f"- {alert['item_name']} ({alert.get('sku') or 'sans SKU'}): stock {alert.get('current_stock')}"
+            for alert in ordered[:max_lines]
+        ]
+        if len(alerts) > max_lines:
+            lines.append(f"... et {len(alerts) - max_lines} autre(s) alerte(s)")
         
-        Merci de confirmer votre commande en répondant OUI à ce message.
+        values = {
+            'alert_count': len(alerts),
+            'summary': summary,
+            'items': '\n'.join(lines),
+            'top_items': ', '.join(alert['item_name'] for alert in ordered[:5]) + ('...' if len(alerts) > 5 else '')
+        }
+        email = self.templates.render('inventory_digest', 'email', values)
+        sms = self.templates.render('inventory_digest', 'sms', values)
         
-        RetailBot Factory
+        return email['subject'], email['text'], sms['text']
+    
+    def send_to_many(self, recipients: List[str], subject: str, message: str, sms_message: Optional[str] = None,
+                     priority: str = 'alert') -> Dict[str, bool]:
         """
+        Envoyer un même contenu à plusieurs destinataires en parallèle
+        
+        Les emails partent par lots de destinataires (une transaction SMTP par lot),
+        les SMS un par numéro; le tout dans un pool de threads borné. Renvoie le
+        résultat par destinataire.
+        """
+        email_recipients = [recipient for recipient in recipients if '@' in recipient]
+        phone_recipients = [recipient for recipient in recipients if '@' not in recipient]
+        pool = _get_fan_out_pool()
+        
+        futures = []
+        for start in range(0, len(email_recipients), self.email_batch_size):
+            chunk = email_recipients[start:start + self.email_batch_size]
+            futures.append((chunk, pool.submit(self._send_email_to_many, chunk, subject, message)))
+        for phone in phone_recipients:
+            futures.append(([phone], pool.submit(
+                self.send_notification, 'sms', phone, None, sms_message or message, None, 30, priority
+            )))
+        
+        results = {}
+        for chunk, future in futures:
+            try:
+                outcome = future.result()
+            except Exception as e:
+                print(f"Erreur envoi groupé: {e}")
+                outcome = False
+            if isinstance(outcome, dict):
+                results.update(outcome)
+            else:
+                results.update({recipient: bool(outcome) for recipient in chunk})
         
-        return self._send_sms(phone, message)
+        return results
+    
+    def send_cod_verification(self, phone: str, order_id: str, customer_name: str) -> bool:
+        """
+        Envoyer une notification de vérification COD
+        """
+        message = self.templates.render('cod_verification.notice', 'sms', {
+            'customer_name': customer_name,
+            'order_id': order_id
+        })['text']
+        
+        return self._send_paced('sms', lambda: self._send_sms(phone, message), 'otp', 'default', self.sms_sender, 30)['success']
     
     def test_configuration(self) -> Dict[str, bool]:
         """
@@ -259,14 +421,7 @@ class NotificationService:
         
         # Test email
         if self.smtp_username and self.smtp_password:
-            try:
-                server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-                server.starttls()
-                server.login(self.smtp_username, self.smtp_password)
-                server.quit()
-                results['email'] = True
-            except:
-                results['email'] = False
+            results['email'] = self.smtp_pool.check()
         
         # Test SMS
         if self.sms_api_url and self.sms_api_key:
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import time
+from typing import Dict, Any
+from src.services.smtp_benchmark import StubSMTPServer
+from src.services.stub_provider import StubProviderServer
+
+
+class ProviderSimulator:
+    """
+    Fournisseurs simulés en local: SMTP, API SMS générique et API WhatsApp Cloud
+
+    Permet de tester la charge des notifications sans écrire à de vrais clients.
+    env() donne les variables à exporter pour que NotificationService, le pool
+    SMTP et l'ordonnanceur de débit visent le simulateur plutôt que les vrais
+    fournisseurs (à appliquer avant leur première utilisation: elles sont lues
+    une fois par processus).
+    """
+
+    def __init__(self, host: str = '127.0.0.1', http_port: int = 0, smtp_port: int = 0, latency_ms: float = 50.0,
+                 failure_rate: float = 0.0, rate_limit: float = 0.0, smtp_handshake_ms: float = 30.0,
+                 smtp_latency_ms: float = 5.0, smtp_failure_rate: float = 0.0, webhook_url: str = '',
+                 webhook_delay_ms: float = 200.0, delivery_failure_rate: float = 0.0, read_rate: float = 0.5,
+                 seed: int = 7):
+        self.http = StubProviderServer(
+            host=host, port=http_port, latency_ms=latency_ms, failure_rate=failure_rate, seed=seed,
+            rate_limit=rate_limit, webhook_url=webhook_url, webhook_delay_ms=webhook_delay_ms,
+            delivery_failure_rate=delivery_failure_rate, read_rate=read_rate
+        )
+        self.smtp = StubSMTPServer(
+            host=host, port=smtp_port, handshake_delay_ms=smtp_handshake_ms, message_delay_ms=smtp_latency_ms,
+            failure_rate=smtp_failure_rate, seed=seed
+        )
+
+    def start(self) -> 'ProviderSimulator':
+        self.http.start()
+        self.smtp.start()
+        return self
+
+    def stop(self):
+        self.http.stop()
+        self.smtp.stop()
+
+    def set_webhook_url(self, url: str):
+        """
+        Adresse du webhook des statuts WhatsApp (souvent connue après le démarrage de l'application)
+        """
+        self.http.webhook_url = url
+
+    def env(self) -> Dict[str, str]:
+        smtp_host, smtp_port = self.smtp.server_address[:2]
+        return {
+            'SMTP_SERVER': smtp_host,
+            'SMTP_PORT': str(smtp_port),
+            'SMTP_USE_TLS': 'false',
+            'SMTP_USERNAME': 'simulator',
+            'SMTP_PASSWORD': 'simulator',
+            'SMS_API_URL': f'{self.http.url}/sms',
+            'SMS_API_KEY': 'simulator',
+            'WHATSAPP_API_URL': f'{self.http.url}/whatsapp',
+            'WHATSAPP_TOKEN': 'simulator'
+        }
+
+    def apply_env(self) -> Dict[str, str]:
+        env = self.env()
+        os.environ.update(env)
+        return env
+
+    def stats(self) -> Dict[str, Any]:
+        with self.smtp.lock:
+            smtp = {
+                'messages': self.smtp.messages,
+                'recipients': self.smtp.recipients,
+                'failures': self.smtp.failures
+            }
+        return {'http': self.http.stats(), 'smtp': smtp}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fournisseurs SMTP / SMS / WhatsApp simulés pour les tests de charge')
+    parser.add_argument('--http-port', type=int, default=8099)
+    parser.add_argument('--smtp-port', type=int, default=8025)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Requêtes par seconde et par API (0: illimité)')
+    parser.add_argument('--smtp-handshake-ms', type=float, default=30.0)
+    parser.add_argument('--smtp-latency-ms', type=float, default=5.0)
+    parser.add_argument('--smtp-failure-rate', type=float, default=0.0)
+    parser.add_argument('--webhook-url', default='', help='Webhook des statuts WhatsApp (ex. http://127.0.0.1:5000/api/integrations/whatsapp/webhook)')
+    parser.add_argument('--webhook-delay-ms', type=float, default=200.0)
+    parser.add_argument('--delivery-failure-rate', type=float, default=0.0)
+    parser.add_argument('--read-rate', type=float, default=0.5)
+    args = parser.parse_args()
+
+    simulator = ProviderSimulator(
+        http_port=args.http_port, smtp_port=args.smtp_port, latency_ms=args.latency_ms,
+        failure_rate=args.failure_rate, rate_limit=args.rate_limit, smtp_handshake_ms=args.smtp_handshake_ms,
+        smtp_latency_ms=args.smtp_latency_ms, smtp_failure_rate=args.smtp_failure_rate,
+        webhook_url=args.webhook_url, webhook_delay_ms=args.webhook_delay_ms,
+        delivery_failure_rate=args.delivery_failure_rate, read_rate=args.read_rate
+    ).start()
+
+    print('Fournisseurs simulés démarrés; variables à exporter pour l\'application:')
+    for key, value in simulator.env().items():
+        print(f'export {key}={value}')
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(json.dumps(simulator.stats(), indent=2))
+        simulator.stop()
@@ -0,0 +1,221 @@
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """
+    Limiteur de débit à jetons (rate jetons par seconde, rafale jusqu'à capacity)
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1.0))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """
+        Attendre qu'un jeton soit disponible (False si le délai est dépassé)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                wait = (tokens - self.tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """
+        Secondes avant que tokens jetons soient disponibles (0 si déjà disponibles)
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def refund(self, tokens: float = 1.0):
+        """
+        Rendre des jetons pris mais non utilisés
+        """
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def pause(self, seconds: float):
+        """
+        Suspendre le débit (réponse 429 du fournisseur): le seau passe en dette de seconds
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def set_rate(self, rate: float, capacity: Optional[float] = None):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+            self.capacity = float(capacity if capacity is not None else max(rate, 1.0))
+            self.tokens = min(self.tokens, self.capacity)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Seau de jetons partagé par tous les workers de la machine (fichier mappé en mémoire)
+
+    L'état (débit, capacité, jetons, dernière mise à jour) vit dans le segment:
+    le débit est donc global, pas multiplié par le nombre de workers, et une
+    pause (429) ou un changement de débit s'applique à tous. Chaque opération
+    prend le verrou fcntl du fichier, charge l'état, le modifie et l'écrit
+    (mêmes calculs que TokenBucket). time.monotonic() est commun aux processus
+    sous Linux.
+
+    Le débit de démarrage (base_rate) est enregistré: un débit modifié à chaud
+    survit aux nouveaux workers, mais pas à un changement de configuration.
+    """
+
+    STATE = struct.Struct('<8sddddd')
+    MAGIC = b'RBRATE01'
+
+    def __init__(self, path: str, rate: float, capacity: Optional[float] = None):
+        self.path = path
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1.0))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.thread_lock = threading.Lock()
+        self.lock = _SharedBucketLock(self)
+        self.pid = None
+        self.fd = None
+        self.buffer = None
+        self._open()
+
+    def _open(self):
+        """
+        Ouvrir (ou initialiser) le segment; rouvert après un fork pour que le verrou fcntl soit propre au processus
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != self.STATE.size:
+                os.ftruncate(fd, self.STATE.size)
+            buffer = mmap.mmap(fd, self.STATE.size)
+            magic, base_rate = self.STATE.unpack_from(buffer, 0)[:2]
+            if magic != self.MAGIC or base_rate != self.base_rate:
+                self.STATE.pack_into(buffer, 0, self.MAGIC, self.base_rate, self.rate, self.capacity,
+                                     self.tokens, self.updated_at)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+        self.fd = fd
+        self.buffer = buffer
+        self.pid = os.getpid()
+
+
+class _SharedBucketLock:
+    """
+    Verrou d'un seau partagé: threads puis processus; l'état est chargé à l'entrée et écrit à la sortie
+    """
+
+    def __init__(self, bucket: SharedTokenBucket):
+        self.bucket = bucket
+
+    def __enter__(self):
+        bucket = self.bucket
+        bucket.thread_lock.acquire()
+        try:
+            if bucket.pid != os.getpid():
+                bucket._open()
+            fcntl.flock(bucket.fd, fcntl.LOCK_EX)
+        except Exception:
+            bucket.thread_lock.release()
+            raise
+        _, _, bucket.rate, bucket.capacity, bucket.tokens, bucket.updated_at = bucket.STATE.unpack_from(bucket.buffer, 0)
+
+    def __exit__(self, *exc):
+        bucket = self.bucket
+        try:
+            bucket.STATE.pack_into(bucket.buffer, 0, bucket.MAGIC, bucket.base_rate, bucket.rate, bucket.capacity,
+                                   bucket.tokens, bucket.updated_at)
+        finally:
+            fcntl.flock(bucket.fd, fcntl.LOCK_UN)
+            bucket.thread_lock.release()
+
+
+def shared_rate_dir() -> Optional[str]:
+    """
+    Répertoire des seaux partagés entre workers (RATE_LIMIT_SHARED_DIR, 'none' pour des seaux par processus)
+    """
+    directory = os.getenv('RATE_LIMIT_SHARED_DIR')
+    if directory is None:
+        return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    if directory.lower() in ('', 'none'):
+        return None
+    return directory
+
+
+def make_bucket(name: str, rate: float, capacity: Optional[float] = None,
+                shared_dir: Optional[str] = None) -> TokenBucket:
+    """
+    Seau partagé entre workers si shared_dir est donné, sinon propre au processus
+    """
+    if shared_dir:
+        return SharedTokenBucket(os.path.join(shared_dir, f'retailbot_rate_{name}'), rate, capacity)
+    return TokenBucket(rate, capacity)
+
+
+class ProviderRateLimits:
+    """
+    Un seau de jetons par fournisseur (canal), partagé par tous les envois du processus
+
+    Avec shared_dir, les seaux sont communs à tous les workers de la machine.
+    """
+
+    def __init__(self, rates: Dict[str, float], shared_dir: Optional[str] = None, name: str = 'limits'):
+        self.shared_dir = shared_dir
+        self.name = name
+        self.buckets = {provider: self._bucket(provider, rate) for provider, rate in rates.items()}
+
+    def _bucket(self, provider: str, rate: float) -> TokenBucket:
+        return make_bucket(f'{self.name}_{provider}', rate, shared_dir=self.shared_dir)
+
+    def acquire(self, provider: str, timeout: Optional[float] = None) -> bool:
+        bucket = self.buckets.get(provider)
+        return bucket.acquire(timeout=timeout) if bucket else True
+
+    def configure(self, rates: Dict[str, float]):
+        for provider, rate in rates.items():
+            if provider in self.buckets:
+                self.buckets[provider].set_rate(rate)
+            else:
+                self.buckets[provider] = self._bucket(provider, rate)
+
+    def rates(self) -> Dict[str, float]:
+        return {provider: bucket.rate for provider, bucket in self.buckets.items()}
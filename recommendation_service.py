@@ -1,20 +1,71 @@
-import random
+from collections import Counter
 from typing import List, Dict, Any, Optional
 from src.models.conversation import Product, UserProfile, Message, Conversation, db
-from sqlalchemy import func, and_
+from src.services.cooccurrence_service import CooccurrenceService, get_cooccurrence_service
+from src.services.content_similarity_service import ContentSimilarityService, get_content_index
+from src.services.trending_service import get_trending_service
+from src.services.candidate_pool_service import get_candidate_pool
+from sqlalchemy import and_
 
 class RecommendationService:
     """
     Service de recommandation de produits basé sur l'IA
     """
     
-    def __init__(self):
+    def __init__(self, cooccurrence: Optional[CooccurrenceService] = None,
+                 content_index: Optional[ContentSimilarityService] = None):
         self.recommendation_strategies = [
             'collaborative_filtering',
             'content_based',
+            'content_embedding',
             'popularity_based',
-            'category_based'
+            'category_based',
+            'cooccurrence',
+            'cross_sell_fallback'
         ]
+        
+        # Table d'associations précalculée à partir des paniers (construite au démarrage)
+        self.cooccurrence = cooccurrence or get_cooccurrence_service()
+        
+        # Index vectoriel du catalogue (nom, description, catégorie), construit au démarrage
+        self.content_index = content_index or get_content_index()
+        
+        # Compteurs de tendance partagés (impressions, paniers, ventes)
+        self.trending = get_trending_service()
+        
+        # Pools de candidats par catégorie (tirage aléatoire, optionnellement pondéré)
+        self.candidate_pool = get_candidate_pool()
+        self.category_sampling_weighting = None  # None, 'popularity' ou 'margin'
+        
+        # Poids de confiance par stratégie: score = poids x signal de la stratégie (0-1)
+        self.strategy_weights = {
+            'cooccurrence': 1.0,
+            'content_embedding': 0.9,
+            'collaborative_filtering': 0.85,
+            'content_based': 0.75,
+            'popularity_based': 0.6,
+            'cross_sell_fallback': 0.55,
+            'category_based': 0.5
+        }
+        
+        self.recommendation_reasons = {
+            'cooccurrence': "Clients ayant acheté des produits similaires",
+            'content_embedding': "Similaire aux produits consultés",
+            'collaborative_filtering': "Basé sur vos recherches récentes",
+            'content_based': "Produit de la même catégorie ou marque",
+            'popularity_based': "Tendance du moment",
+            'category_based': "Produit populaire dans cette catégorie",
+            'cross_sell_fallback': "Produit de la même catégorie dans une gamme de prix proche"
+        }
+    
+    def rebuild_indexes(self) -> Dict[str, Any]:
+        """
+        Reconstruire les structures précalculées (tâche batch)
+        """
+        return {
+            'cooccurrence': self.cooccurrence.build_from_database(),
+            'content_embedding': self.content_index.build_from_database()
+        }
     
     def get_recommendations(self, user_id: Optional[str] = None, 
                           product_ids: List[int] = None, 
@@ -32,6 +83,9 @@ class RecommendationService:
         
         # Stratégie 2: Recommandations basées sur les produits consultés
         if product_ids:
+            embedding_recommendations = self._get_embedding_recommendations(product_ids, limit)
+            recommendations.extend(embedding_recommendations)
+            
             product_recommendations = self._get_product_based_recommendations(product_ids, limit)
             recommendations.extend(product_recommendations)
         
@@ -45,19 +99,20 @@ class RecommendationService:
             popular_recommendations = self._get_popular_products(limit)
             recommendations.extend(popular_recommendations)
         
-        # Supprimer les doublons et limiter
-        seen_ids = set()
-        unique_recommendations = []
+        # Supprimer les doublons (meilleur score conservé) et trier de façon stable
+        best_by_id = {}
         
         for rec in recommendations:
-            if rec['id'] not in seen_ids:
-                seen_ids.add(rec['id'])
-                unique_recommendations.append(rec)
-                
-                if len(unique_recommendations) >= limit:
-                    break
+            current = best_by_id.get(rec['id'])
+            if current is None or rec['recommendation_score'] > current['recommendation_score']:
+                best_by_id[rec['id']] = rec
+        
+        unique_recommendations = sorted(
+            best_by_id.values(),
+            key=lambda rec: (-rec['recommendation_score'], rec['id'])
+        )
         
-        return unique_recommendations
+        return unique_recommendations[:limit]
     
     def _get_user_based_recommendations(self, user_id: str, limit: int) -> List[Dict[str, Any]]:
         """
@@ -82,15 +137,21 @@ class RecommendationService:
             # Recommander des produits basés sur les intérêts
             recommendations = []
             
-            for interest in interests:
+            top_count = interests[0][1] if interests else 1
+            
+            for interest, count in interests:
                 products = Product.query.filter(
                     and_(
                         Product.is_active == True,
                         Product.category.contains(interest) | Product.name.contains(interest)
                     )
-                ).limit(2).all()
+                ).order_by(Product.id).limit(2).all()
                 
-                recommendations.extend([self._product_to_recommendation(p) for p in products])
+                # Signal: fréquence de l'intérêt relativement au plus fréquent
+                recommendations.extend([
+                    self._product_to_recommendation(p, 'collaborative_filtering', count / top_count)
+                    for p in products
+                ])
             
             return recommendations[:limit]
             
@@ -119,9 +180,14 @@ class RecommendationService:
                         Product.id != product.id,
                         Product.category == product.category
                     )
-                ).limit(3).all()
+                ).order_by(Product.id).limit(3).all()
                 
-                recommendations.extend([self._product_to_recommendation(p) for p in similar_products])
+                recommendations.extend([
+                    self._product_to_recommendation(
+                        p, 'content_based', 1.0 if product.brand and p.brand == product.brand else 0.8
+                    )
+                    for p in similar_products
+                ])
                 
                 # Ajouter des produits de la même marque
                 if product.brand:
@@ -131,9 +197,11 @@ class RecommendationService:
                             Product.id != product.id,
                             Product.brand == product.brand
                         )
-                    ).limit(2).all()
+                    ).order_by(Product.id).limit(2).all()
                     
-                    recommendations.extend([self._product_to_recommendation(p) for p in brand_products])
+                    recommendations.extend([
+                        self._product_to_recommendation(p, 'content_based', 0.6) for p in brand_products
+                    ])
             
             return recommendations[:limit]
             
@@ -141,19 +209,60 @@ class RecommendationService:
             print(f"Erreur dans les recommandations produit: {e}")
             return []
     
-    def _get_category_recommendations(self, category: str, limit: int) -> List[Dict[str, Any]]:
+    def _get_embedding_recommendations(self, product_ids: List[int], limit: int) -> List[Dict[str, Any]]:
         """
-        Recommandations par catégorie
+        Recommandations par similarité de contenu (index vectoriel)
         """
         try:
-            products = Product.query.filter(
+            # Index construit au démarrage ou par la route de reconstruction, jamais dans la requête
+            if not self.content_index.is_built:
+                return []
+            
+            # Fusionner les voisins de chaque produit de référence
+            best_scores = {}
+            for neighbours in self.content_index.search_many(product_ids, limit + len(product_ids)):
+                for neighbour_id, score in neighbours:
+                    if neighbour_id not in product_ids and score > best_scores.get(neighbour_id, 0.0):
+                        best_scores[neighbour_id] = score
+            
+            ranked = sorted(best_scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+            return self._hydrate_products(ranked, 'content_embedding')
+            
+        except Exception as e:
+            print(f"Erreur dans les recommandations par similarité: {e}")
+            return []
+    
+    def _hydrate_products(self, ranked: List[tuple], strategy: str) -> List[Dict[str, Any]]:
+        """
+        Charger en une requête les produits classés (product_id, signal) en gardant l'ordre
+        """
+        if not ranked:
+            return []
+        
+        products_by_id = {
+            p.id: p for p in Product.query.filter(
                 and_(
                     Product.is_active == True,
-                    Product.category == category
+                    Product.id.in_([product_id for product_id, _ in ranked])
                 )
-            ).order_by(func.random()).limit(limit).all()
+            ).all()
+        }
+        
+        return [
+            self._product_to_recommendation(products_by_id[product_id], strategy, signal)
+            for product_id, signal in ranked
+            if product_id in products_by_id
+        ]
+    
+    def _get_category_recommendations(self, category: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        Recommandations par catégorie
+        """
+        try:
+            # Tirage en O(k) dans le pool de la catégorie, puis chargement des seuls produits tirés
+            product_ids = self.candidate_pool.sample(category, limit, self.category_sampling_weighting)
             
-            return [self._product_to_recommendation(p) for p in products]
+            return self._hydrate_products([(product_id, 1.0) for product_id in product_ids], 'category_based')
             
         except Exception as e:
             print(f"Erreur dans les recommandations par catégorie: {e}")
@@ -164,38 +273,34 @@ class RecommendationService:
         Recommandations basées sur la popularité
         """
         try:
-            # Pour l'instant, on simule la popularité avec un ordre aléatoire
-            # Dans une vraie implémentation, on utiliserait des métriques de vente
-            products = Product.query.filter(Product.is_active == True)\
-                                  .order_by(func.random())\
-                                  .limit(limit).all()
-            
-            return [self._product_to_recommendation(p) for p in products]
+            # Popularité mesurée par les compteurs de tendance
+            return self.get_trending_products(limit=limit)
             
         except Exception as e:
             print(f"Erreur dans les recommandations populaires: {e}")
             return []
     
-    def _analyze_user_interests(self, conversations: List[Conversation]) -> List[str]:
+    def _analyze_user_interests(self, conversations: List[Conversation]) -> List[tuple]:
         """
         Analyser les intérêts de l'utilisateur à partir de ses conversations
         """
-        interests = []
+        interests = Counter()
         
         for conversation in conversations:
             for message in conversation.messages:
                 if message.sender_type == 'user' and message.entities:
                     # Extraire les catégories et noms de produits mentionnés
                     if 'category' in message.entities:
-                        interests.append(message.entities['category'])
+                        interests[message.entities['category']] += 1
                     
                     if 'product_name' in message.entities:
-                        interests.append(message.entities['product_name'])
+                        interests[message.entities['product_name']] += 1
         
-        # Retourner les intérêts uniques
-        return list(set(interests))
+        # Intérêts uniques, du plus fréquent au moins fréquent (ordre stable)
+        return sorted(interests.items(), key=lambda item: (-item[1], item[0]))
     
-    def _product_to_recommendation(self, product: Product) -> Dict[str, Any]:
+    def _product_to_recommendation(self, product: Product, strategy: str,
+                                   signal: float = 1.0) -> Dict[str, Any]:
         """
         Convertir un produit en format de recommandation
         """
@@ -208,55 +313,77 @@ class RecommendationService:
             'category': product.category,
             'brand': product.brand,
             'image_url': product.image_url,
-            'recommendation_score': random.uniform(0.7, 1.0),  # Score simulé
-            'recommendation_reason': self._get_recommendation_reason(product)
+            'recommendation_score': self._score(strategy, signal),
+            'recommendation_reason': self._get_recommendation_reason(strategy),
+            'recommendation_strategy': strategy
         }
     
-    def _get_recommendation_reason(self, product: Product) -> str:
+    def _score(self, strategy: str, signal: float) -> float:
         """
-        Générer une raison pour la recommandation
+        Score déterministe: poids de la stratégie x signal borné à [0, 1]
         """
-        reasons = [
-            "Produit populaire dans cette catégorie",
-            "Basé sur vos recherches récentes",
-            "Clients ayant acheté des produits similaires",
-            "Nouvelle arrivée recommandée",
-            "Excellent rapport qualité-prix"
-        ]
-        
-        return random.choice(reasons)
+        return round(self.strategy_weights.get(strategy, 0.5) * min(max(signal, 0.0), 1.0), 4)
+    
+    def _get_recommendation_reason(self, strategy: str) -> str:
+        """
+        Raison de la recommandation associée à la stratégie
+        """
+        return self.recommendation_reasons.get(strategy, "Produit recommandé")
     
     def get_trending_products(self, category: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
         """
         Obtenir les produits tendance
         """
         try:
+            trending = self.trending.get_trending(limit, category)
+            
+            if trending:
+                top_score = trending[0][1] or 1.0
+                ranked = [(int(key), score / top_score) for key, score in trending if key.isdigit()]
+                recommendations = self._hydrate_products(ranked, 'popularity_based')
+                
+                if recommendations:
+                    return recommendations
+            
+            # Démarrage à froid: aucun événement enregistré, produits les plus récents
             query = Product.query.filter(Product.is_active == True)
             
             if category:
                 query = query.filter(Product.category == category)
             
-            # Simuler les tendances avec un ordre aléatoire
-            # Dans une vraie implémentation, on utiliserait des métriques de vente récentes
-            products = query.order_by(func.random()).limit(limit).all()
+            products = query.order_by(Product.id.desc()).limit(limit).all()
             
-            return [self._product_to_recommendation(p) for p in products]
+            return [self._product_to_recommendation(p, 'popularity_based', 0.0) for p in products]
             
         except Exception as e:
             print(f"Erreur dans les produits tendance: {e}")
             return []
     
+    def get_similar_products(self, product_id: int, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Produits similaires à un produit donné (« similaire à celui-ci »)
+        """
+        return self._get_embedding_recommendations([product_id], limit)
+    
     def get_cross_sell_recommendations(self, product_id: int, limit: int = 5) -> List[Dict[str, Any]]:
         """
         Recommandations de vente croisée pour un produit donné
         """
         try:
+            # Associations observées dans les paniers (table précalculée hors requête)
+            associations = self.cooccurrence.get_associated_products(product_id, limit)
+            ranked = [(int(key), confidence) for key, _, confidence, _ in associations if key.isdigit()]
+            recommendations = self._hydrate_products(ranked, 'cooccurrence')
+            
+            if recommendations:
+                return recommendations
+            
             product = Product.query.get(product_id)
             
             if not product:
                 return []
             
-            # Logique de vente croisée basée sur la catégorie et le prix
+            # Repli sans associations de paniers: même catégorie, prix proche
             cross_sell_products = Product.query.filter(
                 and_(
                     Product.is_active == True,
@@ -265,9 +392,15 @@ class RecommendationService:
                     Product.price <= product.price * 1.5,  # Prix similaire ou légèrement supérieur
                     Product.price >= product.price * 0.5
                 )
-            ).limit(limit).all()
+            ).order_by(Product.id).limit(limit).all()
             
-            return [self._product_to_recommendation(p) for p in cross_sell_products]
+            # Signal: proximité de prix avec le produit de référence
+            return [
+                self._product_to_recommendation(
+                    p, 'cross_sell_fallback', 1.0 - abs(p.price - product.price) / product.price if product.price else 0.0
+                )
+                for p in cross_sell_products
+            ]
             
         except Exception as e:
             print(f"Erreur dans les recommandations de vente croisée: {e}")
@@ -1,6 +1,8 @@
 from src.models.base import db
 from src.models.conversation import Conversation, Message
 from src.models.management import AbandonedCart, AbandonedCartItem, CODOrder, InventoryItem, InventoryAlert
+from src.services.customer_history_service import CustomerHistoryService
+from src.services.city_risk_service import get_city_risk_service
 from datetime import datetime, timedelta
 import random
 
@@ -136,6 +138,10 @@ def create_sample_data():
                 db.session.add(alert)
         
         db.session.commit()
+        
+        # Recalculer les agrégats d'historique client des commandes COD
+        CustomerHistoryService().rebuild()
+        get_city_risk_service().rebuild()
         print("Données d'exemple créées avec succès!")
         
     except Exception as e:
@@ -0,0 +1,136 @@
+from typing import Callable, Dict, List, Set
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from src.models.management import db
+
+
+# Colonnes ajoutées à des tables créées par une version précédente (nullables)
+ADDED_COLUMNS = [
+    ('cod_orders', 'client_fingerprint'),
+    ('cod_orders', 'risk_rules_version'),
+    ('cod_orders', 'rule_risk_score'),
+    ('cart_recovery_notifications', 'attempts'),
+    ('cart_recovery_notifications', 'next_attempt_at'),
+    ('cart_recovery_notifications', 'claimed_by'),
+    ('cart_recovery_notifications', 'locked_until'),
+    ('cart_recovery_notifications', 'html_message'),
+    ('cart_recovery_notifications', 'read_at'),
+    ('cart_recovery_notifications', 'provider_message_id')
+]
+
+# Valeur donnée aux lignes existantes pour une colonne ajoutée (expression SQL)
+BACKFILLS = {
+    ('cart_recovery_notifications', 'attempts'): '0',
+    ('cart_recovery_notifications', 'next_attempt_at'): 'created_at'
+}
+
+# Index ajoutés sur des tables créées par une version précédente (noms des index des modèles)
+ADDED_INDEXES = [
+    'ix_cod_orders_customer_phone',
+    'ix_cart_recovery_notifications_status_next_attempt_at',
+    'ix_cart_recovery_notifications_provider_message_id'
+]
+
+# Colonnes d'énumération dont des valeurs ont été ajoutées (types natifs PostgreSQL et MySQL)
+EXTENDED_ENUMS = [
+    ('cart_recovery_notifications', 'status')  # NotificationStatus: PROCESSING, DEAD_LETTER
+]
+
+
+def upgrade_schema() -> List[str]:
+    """
+    Mettre à niveau une base créée par une version précédente de l'application
+
+    db.create_all() crée les tables absentes mais ne modifie jamais une table
+    existante. Lancée par `flask upgrade-schema`, une fois par déploiement et
+    avant de démarrer les workers, cette mise à niveau applique seulement ce
+    qui manque à la base (une seconde exécution ne fait rien):
+    - ajoute les colonnes de ADDED_COLUMNS (puis BACKFILLS),
+    - ajoute les nouvelles valeurs des énumérations de EXTENDED_ENUMS,
+    - crée les index de ADDED_INDEXES.
+
+    Renvoie les modifications effectuées.
+    """
+    engine = db.engine
+    applied: List[str] = []
+
+    # ALTER TYPE ... ADD VALUE ne s'exécute pas dans une transaction (PostgreSQL < 12)
+    if engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            _add_postgresql_enum_values(connection, applied.append)
+
+    with engine.begin() as connection:
+        def run(statement: str):
+            connection.execute(text(statement))
+            applied.append(statement)
+
+        inspector = inspect(connection)
+        _add_missing_columns(connection, inspector, run)
+        if connection.dialect.name == 'mysql':
+            _widen_mysql_enums(connection, inspector, run)
+        _add_missing_indexes(connection, inspector, run)
+
+    return applied
+
+
+def _add_missing_columns(connection, inspector, run: Callable[[str], None]):
+    preparer = connection.dialect.identifier_preparer
+    existing: Dict[str, Set[str]] = {}
+
+    for table_name, column_name in ADDED_COLUMNS:
+        if table_name not in existing:
+            existing[table_name] = {row['name'] for row in inspector.get_columns(table_name)}
+        if column_name in existing[table_name]:
+            continue
+
+        column = db.metadata.tables[table_name].c[column_name]
+        quoted_table = preparer.format_table(column.table)
+        quoted_column = preparer.format_column(column)
+        run(f"ALTER TABLE {quoted_table} ADD COLUMN {quoted_column} {column.type.compile(dialect=connection.dialect)}")
+
+        backfill = BACKFILLS.get((table_name, column_name))
+        if backfill:
+            run(f"UPDATE {quoted_table} SET {quoted_column} = {backfill} WHERE {quoted_column} IS NULL")
+
+
+def _add_postgresql_enum_values(connection, applied: Callable[[str], None]):
+    for table_name, column_name in EXTENDED_ENUMS:
+        enum_type = db.metadata.tables[table_name].c[column_name].type
+        labels = set(connection.execute(text(
+            "SELECT e.enumlabel FROM pg_enum e JOIN pg_type t ON t.oid = e.enumtypid WHERE t.typname = :name"
+        ), {'name': enum_type.name}).scalars())
+        # Type absent: créé par create_all avec toutes ses valeurs
+        if not labels:
+            continue
+
+        for label in enum_type.enums:
+            if label not in labels:
+                statement = f"ALTER TYPE {enum_type.name} ADD VALUE IF NOT EXISTS '{label}'"
+                connection.execute(text(statement))
+                applied(statement)
+
+
+def _widen_mysql_enums(connection, inspector, run: Callable[[str], None]):
+    preparer = connection.dialect.identifier_preparer
+    for table_name, column_name in EXTENDED_ENUMS:
+        column = db.metadata.tables[table_name].c[column_name]
+        current = next(row for row in inspector.get_columns(table_name) if row['name'] == column_name)
+        if not set(column.type.enums) - set(getattr(current['type'], 'enums', ())):
+            continue
+
+        nullability = 'NULL' if column.nullable else 'NOT NULL'
+        run(f"ALTER TABLE {preparer.format_table(column.table)} MODIFY {preparer.format_column(column)} "
+            f"{column.type.compile(dialect=connection.dialect)} {nullability}")
+
+
+def _add_missing_indexes(connection, inspector, run: Callable[[str], None]):
+    indexes = {index.name: index for table in db.metadata.sorted_tables for index in table.indexes}
+    existing: Dict[str, Set[str]] = {}
+
+    for name in ADDED_INDEXES:
+        index = indexes[name]
+        table_name = index.table.name
+        if table_name not in existing:
+            existing[table_name] = {row['name'] for row in inspector.get_indexes(table_name)}
+        if name not in existing[table_name]:
+            run(str(CreateIndex(index).compile(dialect=connection.dialect)))
@@ -1,4 +1,4 @@
-import requests
+from src.services.http_client import get_http_client
 import json
 from datetime import datetime
 from typing import Dict, List, Optional
@@ -16,13 +16,16 @@ class ShopifyIntegration:
             'X-Shopify-Access-Token': access_token,
             'Content-Type': 'application/json'
         }
+        
+        # Session HTTP partagée (connexions persistantes vers l'API)
+        self.http = get_http_client()
     
     def test_connection(self) -> Dict:
         """
         Tester la connexion à l'API Shopify
         """
         try:
-            response = requests.get(f"{self.base_url}/shop.json", headers=self.headers)
+            response = self.http.get(f"{self.base_url}/shop.json", headers=self.headers)
             if response.status_code == 200:
                 shop_data = response.json()['shop']
                 return {
@@ -47,7 +50,7 @@ class ShopifyIntegration:
         Récupérer la liste des produits
         """
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/products.json",
                 headers=self.headers,
                 params={'limit': limit}
@@ -78,7 +81,7 @@ class ShopifyIntegration:
         Rechercher des produits par nom
         """
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/products.json",
                 headers=self.headers,
                 params={'title': query}
@@ -108,7 +111,7 @@ class ShopifyIntegration:
         Récupérer les détails d'une commande
         """
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/orders/{order_id}.json",
                 headers=self.headers
             )
@@ -148,7 +151,7 @@ class ShopifyIntegration:
         Récupérer les paniers abandonnés
         """
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/checkouts.json",
                 headers=self.headers,
                 params={'status': 'open'}
@@ -217,7 +220,7 @@ class ShopifyIntegration:
         """
         try:
             # D'abord, récupérer l'inventory_item_id
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/variants/{variant_id}.json",
                 headers=self.headers
             )
@@ -255,7 +258,7 @@ class ShopifyIntegration:
         Récupérer un client par email
         """
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"{self.base_url}/customers/search.json",
                 headers=self.headers,
                 params={'query': f'email:{email}'}
@@ -0,0 +1,167 @@
+import argparse
+import random
+import smtplib
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+from typing import Dict, Any
+from src.services.smtp_pool import SMTPConnectionPool
+
+
+class _StubSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Sous-ensemble du protocole SMTP suffisant pour smtplib (sans TLS; AUTH accepte tout identifiant)
+    """
+
+    def handle(self):
+        server = self.server
+        # Latence de la poignée de main (TCP + STARTTLS + AUTH d'un vrai serveur)
+        time.sleep(server.handshake_delay_ms / 1000)
+        self._reply('220 stub ESMTP')
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip().upper()
+
+            if command.startswith('EHLO'):
+                self.wfile.write(b'250-stub\r\n250-PIPELINING\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+            elif command.startswith('HELO'):
+                self._reply('250 stub')
+            elif command.startswith('AUTH'):
+                self._reply('235 Authentification réussie')
+            elif command.startswith('MAIL') or command.startswith('RSET') or command.startswith('NOOP'):
+                self._reply('250 OK')
+            elif command.startswith('RCPT'):
+                with server.lock:
+                    server.recipients += 1
+                self._reply('250 OK')
+            elif command.startswith('DATA'):
+                self._reply('354 Fin par <CRLF>.<CRLF>')
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b'.\r\n', b'.\n'):
+                        break
+                time.sleep(server.message_delay_ms / 1000)
+                with server.lock:
+                    failed = server.random.random() < server.failure_rate
+                    if failed:
+                        server.failures += 1
+                    else:
+                        server.messages += 1
+                self._reply('451 Échec temporaire simulé' if failed else '250 Message accepté')
+            elif command.startswith('QUIT'):
+                self._reply('221 Au revoir')
+                return
+            else:
+                self._reply('502 Commande non supportée')
+
+    def _reply(self, text: str):
+        self.wfile.write(f'{text}\r\n'.encode('utf-8'))
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    Serveur SMTP local pour mesurer le coût des connexions
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, handshake_delay_ms: float = 30.0,
+                 message_delay_ms: float = 1.0, failure_rate: float = 0.0, seed: int = 7):
+        super().__init__((host, port), _StubSMTPHandler)
+        self.handshake_delay_ms = handshake_delay_ms
+        self.message_delay_ms = message_delay_ms
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.messages = 0
+        self.recipients = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self) -> 'StubSMTPServer':
+        self.thread = threading.Thread(target=self.serve_forever, name='stub-smtp', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _message(index: int, recipients) -> MIMEText:
+    message = MIMEText(f'Bonjour, votre panier #{index} vous attend.', 'plain', 'utf-8')
+    message['Subject'] = f'Panier #{index}'
+    message['From'] = 'noreply@retailbot.com'
+    message['To'] = ', '.join(recipients)
+    return message
+
+
+def run_benchmark(messages: int = 200, threads: int = 4, pool_size: int = 4,
+                  handshake_delay_ms: float = 30.0) -> Dict[str, Any]:
+    """
+    Comparer une connexion par email (ancien comportement) et le pool de connexions
+    """
+    server = StubSMTPServer(handshake_delay_ms=handshake_delay_ms).start()
+    host, port = server.server_address[:2]
+
+    def send_with_new_connection(index: int):
+        smtp = smtplib.SMTP(host, port, timeout=10)
+        smtp.send_message(_message(index, [f'client{index}@example.com']))
+        smtp.quit()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(send_with_new_connection, range(messages)))
+    per_message_seconds = time.perf_counter() - started
+
+    pool = SMTPConnectionPool(host, port, use_tls=False, max_size=pool_size, timeout=10)
+
+    def send_with_pool(index: int):
+        pool.send(_message(index, [f'client{index}@example.com']))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(send_with_pool, range(messages)))
+    pooled_seconds = time.perf_counter() - started
+
+    # Alerte à plusieurs destinataires: une seule transaction, un RCPT par destinataire
+    recipients = [f'stock{i}@example.com' for i in range(10)]
+    recipients_before = server.recipients
+    started = time.perf_counter()
+    pool.send_many([(_message(i, recipients), recipients, None) for i in range(messages // 10)])
+    multi_seconds = time.perf_counter() - started
+    delivered_recipients = server.recipients - recipients_before
+
+    stats = pool.get_stats()
+    pool.close_all()
+    server.stop()
+
+    return {
+        'messages': messages,
+        'threads': threads,
+        'handshake_delay_ms': handshake_delay_ms,
+        'new_connection_messages_per_second': round(messages / per_message_seconds, 1),
+        'pooled_messages_per_second': round(messages / pooled_seconds, 1),
+        'speedup': round(per_message_seconds / pooled_seconds, 1),
+        'multi_recipient_deliveries_per_second': round(delivered_recipients / multi_seconds, 1),
+        'pool_connections_created': stats['connections_created'],
+        'pool_connections_reused': stats['connections_reused']
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Banc d\'essai du pool SMTP sur un serveur local')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--handshake-delay-ms', type=float, default=30.0)
+    args = parser.parse_args()
+
+    for key, value in run_benchmark(args.messages, args.threads, args.pool_size, args.handshake_delay_ms).items():
+        print(f'{key}: {value}')
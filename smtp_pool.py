@@ -0,0 +1,302 @@
+import os
+import queue
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from email.message import Message
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """
+    Erreur après laquelle la connexion n'est plus utilisable
+
+    SMTPException hérite d'OSError: seules la déconnexion et les erreurs réseau
+    comptent, pas un destinataire refusé.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+class _PooledConnection:
+    __slots__ = ('smtp', 'created_at', 'last_used_at', 'messages_sent')
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        self.messages_sent = 0
+
+
+class SMTPConnectionPool:
+    """
+    Pool de connexions SMTP authentifiées réutilisées entre les envois
+
+    La poignée de main (connexion, STARTTLS, AUTH) n'est faite qu'à la création
+    d'une connexion. Une connexion restée inactive est vérifiée par NOOP avant
+    d'être réutilisée; une connexion coupée est remplacée et l'envoi rejoué une fois.
+    """
+
+    def __init__(self, host: str, port: int = 587, username: str = '', password: str = '',
+                 use_tls: bool = True, use_ssl: bool = False, max_size: int = 4, timeout: float = 30.0,
+                 max_idle_seconds: float = 60.0, health_check_after_seconds: float = 10.0,
+                 max_messages_per_connection: int = 500):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_after_seconds = health_check_after_seconds
+        self.max_messages_per_connection = max_messages_per_connection
+
+        # Pile LIFO: les connexions les plus récentes (encore chaudes) sont reprises en premier
+        self.idle: queue.LifoQueue = queue.LifoQueue()
+        self.open_connections = 0
+        self.lock = threading.Lock()
+        self.stats = {
+            'connections_created': 0,
+            'connections_reused': 0,
+            'connections_closed': 0,
+            'health_check_failures': 0,
+            'reconnects': 0,
+            'messages_sent': 0,
+            'send_failures': 0
+        }
+
+    def _count(self, key: str, value: int = 1):
+        with self.lock:
+            self.stats[key] += value
+
+    def _connect(self) -> _PooledConnection:
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.use_tls:
+                smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+
+        self._count('connections_created')
+        return _PooledConnection(smtp)
+
+    def _close(self, connection: _PooledConnection):
+        try:
+            connection.smtp.quit()
+        except Exception:
+            try:
+                connection.smtp.close()
+            except Exception:
+                pass
+        with self.lock:
+            self.open_connections -= 1
+            self.stats['connections_closed'] += 1
+
+    def _is_healthy(self, connection: _PooledConnection) -> bool:
+        now = time.monotonic()
+        if now - connection.last_used_at > self.max_idle_seconds:
+            return False
+        if connection.messages_sent >= self.max_messages_per_connection:
+            return False
+        if now - connection.last_used_at < self.health_check_after_seconds:
+            return True
+
+        try:
+            code, _ = connection.smtp.noop()
+            return code == 250
+        except Exception:
+            self._count('health_check_failures')
+            return False
+
+    def _acquire(self, wait_seconds: Optional[float] = None) -> _PooledConnection:
+        wait_seconds = self.timeout if wait_seconds is None else wait_seconds
+        deadline = time.monotonic() + wait_seconds
+
+        connection = None
+        while True:
+            if connection is None:
+                try:
+                    connection = self.idle.get_nowait()
+                except queue.Empty:
+                    pass
+
+            if connection is not None:
+                if self._is_healthy(connection):
+                    self._count('connections_reused')
+                    return connection
+                self._close(connection)
+                connection = None
+                continue
+
+            with self.lock:
+                can_open = self.open_connections < self.max_size
+                if can_open:
+                    self.open_connections += 1
+
+            if can_open:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self.lock:
+                        self.open_connections -= 1
+                    raise
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('Aucune connexion SMTP disponible dans le pool')
+            try:
+                # Attendre qu'une connexion soit rendue (le pool est plein)
+                connection = self.idle.get(timeout=min(remaining, 0.5))
+            except queue.Empty:
+                pass
+
+    def _release(self, connection: _PooledConnection, broken: bool = False):
+        if broken:
+            self._close(connection)
+            return
+        connection.last_used_at = time.monotonic()
+        self.idle.put(connection)
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        """
+        Emprunter une connexion (rendue au pool à la sortie, fermée si elle a échoué)
+        """
+        pooled = self._acquire()
+        try:
+            yield pooled.smtp
+        except Exception as e:
+            if is_connection_error(e):
+                self._release(pooled, broken=True)
+                raise
+            # Une erreur SMTP (destinataire refusé...) laisse la session utilisable après RSET
+            try:
+                pooled.smtp.rset()
+            except Exception:
+                self._release(pooled, broken=True)
+                raise
+            self._release(pooled)
+            raise
+        else:
+            self._release(pooled)
+
+    def send(self, message: Message, to_addrs: Optional[List[str]] = None,
+             from_addr: Optional[str] = None) -> Dict[str, Tuple[int, bytes]]:
+        """
+        Envoyer un message (tous les destinataires dans une seule transaction SMTP)
+
+        Renvoie les destinataires refusés, comme smtplib.SMTP.send_message.
+        """
+        result = self.send_many([(message, to_addrs, from_addr)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def send_many(self, messages: List[Tuple[Message, Optional[List[str]], Optional[str]]]) -> List[Any]:
+        """
+        Envoyer une série de messages sur une même connexion
+
+        Pour chaque message: destinataires refusés (dict) ou exception levée.
+        """
+        results: List[Any] = []
+        index = 0
+        reconnected = False
+
+        while index < len(messages):
+            pooled = self._acquire()
+            try:
+                while index < len(messages):
+                    message, to_addrs, from_addr = messages[index]
+                    try:
+                        refused = pooled.smtp.send_message(message, from_addr=from_addr, to_addrs=to_addrs)
+                    except smtplib.SMTPException as e:
+                        if is_connection_error(e):
+                            raise
+                        self._count('send_failures')
+                        results.append(e)
+                        index += 1
+                        # Remettre la session à zéro avant le message suivant
+                        pooled.smtp.rset()
+                        continue
+
+                    results.append(refused)
+                    pooled.messages_sent += 1
+                    self._count('messages_sent')
+                    index += 1
+                    reconnected = False
+            except Exception as e:
+                if not is_connection_error(e):
+                    self._release(pooled, broken=True)
+                    raise
+                self._release(pooled, broken=True)
+                if reconnected:
+                    # Deuxième coupure de suite sur le même message: on l'abandonne
+                    self._count('send_failures')
+                    results.append(e)
+                    index += 1
+                    reconnected = False
+                else:
+                    self._count('reconnects')
+                    reconnected = True
+                continue
+
+            self._release(pooled)
+
+        return results
+
+    def check(self) -> bool:
+        """
+        Vérifier que le serveur répond (connexion du pool ou nouvelle connexion)
+        """
+        try:
+            with self.connection() as smtp:
+                return smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def close_all(self):
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(connection)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['open_connections'] = self.open_connections
+        stats['idle_connections'] = self.idle.qsize()
+        stats['max_size'] = self.max_size
+        return stats
+
+
+_smtp_pool = None
+_smtp_pool_lock = threading.Lock()
+
+
+def get_smtp_pool() -> SMTPConnectionPool:
+    """
+    Pool partagé par toutes les instances de NotificationService (configuration SMTP_*)
+    """
+    global _smtp_pool
+    if _smtp_pool is None:
+        with _smtp_pool_lock:
+            if _smtp_pool is None:
+                port = int(os.getenv('SMTP_PORT', 587))
+                _smtp_pool = SMTPConnectionPool(
+                    host=os.getenv('SMTP_SERVER', 'smtp.gmail.com'),
+                    port=port,
+                    username=os.getenv('SMTP_USERNAME', ''),
+                    password=os.getenv('SMTP_PASSWORD', ''),
+                    use_tls=os.getenv('SMTP_USE_TLS', 'true').lower() == 'true',
+                    use_ssl=port == 465,
+                    max_size=int(os.getenv('SMTP_POOL_SIZE', 4))
+                )
+    return _smtp_pool
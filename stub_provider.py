@@ -0,0 +1,238 @@
+import argparse
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple
+from src.services.rate_limiter import TokenBucket
+
+
+class StubProviderServer:
+    """
+    Fournisseur SMS / WhatsApp local pour les tests de charge
+
+    Accepte toute requête POST, attend une latence simulée puis répond 200
+    (ou 503 selon le taux d'échec). Avec rate_limit, chaque chemin accepte au
+    plus rate_limit requêtes par seconde et répond 429 au-delà, comme une
+    passerelle SMS ou l'API WhatsApp Cloud. À utiliser avec SMS_API_URL et
+    WHATSAPP_API_URL pointant sur http://127.0.0.1:<port>/sms et /whatsapp.
+
+    Chaque envoi accepté reçoit un identifiant (messages[0].id comme l'API
+    WhatsApp, message_id pour le SMS). Avec webhook_url, les statuts des
+    messages WhatsApp (sent, delivered ou failed, puis read) sont renvoyés au
+    format des webhooks Meta après webhook_delay_ms, regroupés par envoi.
+    """
+
+    # Statuts regroupés dans un même appel du webhook, comme Meta
+    WEBHOOK_BATCH_SIZE = 50
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8099, latency_ms: float = 20.0,
+                 failure_rate: float = 0.0, seed: int = 7, rate_limit: float = 0.0,
+                 webhook_url: str = '', webhook_delay_ms: float = 200.0, delivery_failure_rate: float = 0.0,
+                 read_rate: float = 0.5):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.rate_limit = rate_limit
+        self.webhook_url = webhook_url
+        self.webhook_delay_ms = webhook_delay_ms
+        self.delivery_failure_rate = delivery_failure_rate
+        self.read_rate = read_rate
+        self.limits: Dict[str, TokenBucket] = {}
+        self.random = random.Random(seed)
+        self.counters: Dict[str, int] = {}
+        self.message_ids = itertools.count(1)
+        # Statuts à renvoyer: (échéance, ordre, statut)
+        self.callbacks: List[Tuple[float, int, Dict[str, Any]]] = []
+        self.callback_order = itertools.count()
+        self.callback_condition = threading.Condition()
+        self.callback_thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                stub._respond(self, self.rfile.read(length))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _within_limit(self, path: str) -> bool:
+        if not self.rate_limit:
+            return True
+        with self.lock:
+            bucket = self.limits.get(path)
+            if bucket is None:
+                bucket = TokenBucket(self.rate_limit)
+                self.limits[path] = bucket
+        return bucket.try_acquire()
+
+    def _count(self, key: str, value: int = 1):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def _respond(self, handler: BaseHTTPRequestHandler, payload: bytes = b''):
+        path = handler.path.strip('/') or 'root'
+        if not self._within_limit(path):
+            with self.lock:
+                self.counters[f'{path}.throttled'] = self.counters.get(f'{path}.throttled', 0) + 1
+            body = json.dumps({'status': 'throttled'}).encode('utf-8')
+            handler.send_response(429)
+            handler.send_header('Retry-After', '1')
+            handler.send_header('Content-Type', 'application/json')
+            handler.send_header('Content-Length', str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+            return
+
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+        with self.lock:
+            failed = self.random.random() < self.failure_rate
+            key = f"{path}.{'failed' if failed else 'sent'}"
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+        if failed:
+            status, response = 503, {'status': 'failed'}
+        elif 'whatsapp' in path:
+            message_id = f'wamid.stub{next(self.message_ids)}'
+            status, response = 200, {'messaging_product': 'whatsapp', 'messages': [{'id': message_id}]}
+            self._schedule_statuses(message_id, payload)
+        else:
+            status, response = 200, {'status': 'queued', 'message_id': f'sms-stub{next(self.message_ids)}'}
+
+        body = json.dumps(response).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _schedule_statuses(self, message_id: str, payload: bytes):
+        """
+        Programmer les statuts de livraison d'un message WhatsApp accepté
+        """
+        if not self.webhook_url:
+            return
+
+        try:
+            recipient = json.loads(payload or b'{}').get('to')
+        except ValueError:
+            recipient = None
+
+        with self.lock:
+            undelivered = self.random.random() < self.delivery_failure_rate
+            read = not undelivered and self.random.random() < self.read_rate
+
+        delay = self.webhook_delay_ms / 1000
+        statuses = [('sent', 0.0), ('failed', delay) if undelivered else ('delivered', delay)]
+        if read:
+            statuses.append(('read', delay * 2))
+
+        now = time.time()
+        with self.callback_condition:
+            for kind, offset in statuses:
+                status = {
+                    'id': message_id,
+                    'status': kind,
+                    'timestamp': str(int(now + offset)),
+                    'recipient_id': recipient
+                }
+                if kind == 'failed':
+                    status['errors'] = [{'code': 131026, 'title': 'Message undeliverable'}]
+                heapq.heappush(self.callbacks, (time.monotonic() + offset, next(self.callback_order), status))
+            self.callback_condition.notify()
+
+    def _callback_loop(self):
+        while True:
+            with self.callback_condition:
+                while not self.callbacks or self.callbacks[0][0] > time.monotonic():
+                    timeout = self.callbacks[0][0] - time.monotonic() if self.callbacks else None
+                    self.callback_condition.wait(timeout)
+                # Les statuts dus dans les 50 ms suivantes partent dans le même appel
+                horizon = time.monotonic() + 0.05
+                due = []
+                while self.callbacks and self.callbacks[0][0] <= horizon and len(due) < self.WEBHOOK_BATCH_SIZE:
+                    due.append(heapq.heappop(self.callbacks)[2])
+
+            self._post_statuses(due)
+
+    def _post_statuses(self, statuses: List[Dict[str, Any]]):
+        payload = {
+            'object': 'whatsapp_business_account',
+            'entry': [{
+                'id': 'stub',
+                'changes': [{'field': 'messages', 'value': {'messaging_product': 'whatsapp', 'statuses': statuses}}]
+            }]
+        }
+        request = urllib.request.Request(
+            self.webhook_url, data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+            self._count('webhook.calls')
+            self._count('webhook.statuses', len(statuses))
+        except Exception:
+            self._count('webhook.failed')
+
+    def start(self) -> 'StubProviderServer':
+        self.thread = threading.Thread(target=self.server.serve_forever, name='stub-provider', daemon=True)
+        self.thread.start()
+        self.callback_thread = threading.Thread(target=self._callback_loop, name='stub-provider-webhooks', daemon=True)
+        self.callback_thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.counters)
+        with self.callback_condition:
+            stats['webhook.pending'] = len(self.callbacks)
+        return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fournisseur SMS/WhatsApp simulé')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Requêtes par seconde et par chemin (0: illimité)')
+    parser.add_argument('--webhook-url', default='', help='Webhook des statuts WhatsApp (ex. http://127.0.0.1:5000/api/integrations/whatsapp/webhook)')
+    parser.add_argument('--webhook-delay-ms', type=float, default=200.0)
+    parser.add_argument('--delivery-failure-rate', type=float, default=0.0)
+    parser.add_argument('--read-rate', type=float, default=0.5)
+    args = parser.parse_args()
+
+    stub = StubProviderServer(port=args.port, latency_ms=args.latency_ms, failure_rate=args.failure_rate,
+                              rate_limit=args.rate_limit, webhook_url=args.webhook_url,
+                              webhook_delay_ms=args.webhook_delay_ms, delivery_failure_rate=args.delivery_failure_rate,
+                              read_rate=args.read_rate)
+    print(f'Fournisseur simulé sur {stub.url} (SMS_API_URL={stub.url}/sms, WHATSAPP_API_URL={stub.url}/whatsapp)')
+    stub.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(json.dumps(stub.stats(), indent=2))
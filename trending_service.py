@@ -0,0 +1,416 @@
+import heapq
+import math
+import os
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
+from src.models.management import TrendingCounter, db
+
+
+class DecayedCounter:
+    """
+    Compteurs à décroissance exponentielle stockés dans un tableau contigu
+
+    Les valeurs sont gardées relativement à un temps de référence (forward decay):
+    un incrément ne touche qu'une case et l'ordre des scores ne change pas avec
+    le temps, ce qui permet de maintenir un tas paresseux pour le top-K.
+    """
+
+    def __init__(self, half_life_seconds: float, reference_time: float):
+        self.decay_rate = math.log(2) / half_life_seconds
+        self.reference_time = reference_time
+
+        self.keys: List[str] = []
+        self.slots: Dict[str, int] = {}
+        self.values = array('d')
+
+        # Tas max paresseux: (-valeur, slot), les entrées obsolètes sont ignorées à la lecture
+        self.heap: List[Tuple[float, int]] = []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: str, weight: float, now: float):
+        """
+        Ajouter un poids à l'instant donné
+        """
+        exponent = self.decay_rate * (now - self.reference_time)
+        if exponent > 50:
+            self._rescale(now)
+            exponent = 0.0
+
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = len(self.keys)
+            self.slots[key] = slot
+            self.keys.append(key)
+            self.values.append(0.0)
+
+        value = self.values[slot] + weight * math.exp(exponent)
+        self.values[slot] = value
+        heapq.heappush(self.heap, (-value, slot))
+
+        if len(self.heap) > 4 * len(self.values) + 64:
+            self._compact()
+
+    def score(self, key: str, now: float) -> float:
+        """
+        Score décru d'une clé à l'instant donné
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            return 0.0
+        return self.values[slot] * math.exp(-self.decay_rate * (now - self.reference_time))
+
+    def top(self, k: int, now: float) -> List[Tuple[str, float]]:
+        """
+        Lire les K meilleures clés depuis le tas
+        """
+        factor = math.exp(-self.decay_rate * (now - self.reference_time))
+        result = []
+        valid_entries = []
+        seen = set()
+
+        while self.heap and len(result) < k:
+            entry = heapq.heappop(self.heap)
+            negative_value, slot = entry
+
+            # Entrée obsolète (valeur mise à jour depuis) ou doublon
+            if slot in seen or -negative_value != self.values[slot]:
+                continue
+
+            seen.add(slot)
+            valid_entries.append(entry)
+            result.append((self.keys[slot], -negative_value * factor))
+
+        for entry in valid_entries:
+            heapq.heappush(self.heap, entry)
+
+        return result
+
+    def items(self, now: float):
+        """
+        Parcourir toutes les clés avec leur score décru
+        """
+        factor = math.exp(-self.decay_rate * (now - self.reference_time))
+        for key, value in zip(self.keys, self.values):
+            yield key, value * factor
+
+    def _rescale(self, now: float):
+        """
+        Ramener les valeurs sur une nouvelle référence pour éviter le dépassement
+        """
+        factor = math.exp(-self.decay_rate * (now - self.reference_time))
+        for slot in range(len(self.values)):
+            self.values[slot] *= factor
+        self.reference_time = now
+        self._compact()
+
+    def _compact(self):
+        """
+        Reconstruire le tas sans les entrées obsolètes
+        """
+        self.heap = [(-value, slot) for slot, value in enumerate(self.values)]
+        heapq.heapify(self.heap)
+
+
+def normalize_product_key(product_id) -> str:
+    """
+    Clé produit commune aux sources (id du catalogue, product_id Shopify ou d'inventaire)
+
+    Les identifiants numériques sont ceux du catalogue: '0042', 42 et
+    'gid://shopify/Product/42' donnent la même clé '42'.
+    """
+    key = str(product_id).strip()
+    if key.startswith('gid://'):
+        key = key.rsplit('/', 1)[-1]
+    return str(int(key)) if key.isdigit() else key
+
+
+class TrendingService:
+    """
+    Moteur de tendances: compteurs décroissants par produit et par catégorie
+
+    Chaque processus compte ses événements en mémoire et garde à part les
+    poids ajoutés depuis son dernier checkpoint. Un thread d'arrière-plan les
+    fusionne en base par clé (score décru + poids ajouté, mise à jour
+    conditionnelle sur checkpointed_at), puis recharge la table: les workers
+    additionnent leurs événements au lieu d'écraser ceux des autres.
+    """
+
+    def __init__(self, half_life_hours: float = 6.0, checkpoint_interval_seconds: int = 300):
+        self.half_life_seconds = half_life_hours * 3600
+        self.decay_rate = math.log(2) / self.half_life_seconds
+        self.checkpoint_interval_seconds = checkpoint_interval_seconds
+
+        # Poids des événements
+        self.event_weights = {
+            'impression': 1.0,
+            'cart': 3.0,
+            'sale': 5.0
+        }
+
+        now = time.time()
+        self.products = DecayedCounter(self.half_life_seconds, now)
+        self.categories = DecayedCounter(self.half_life_seconds, now)
+        self.category_products: Dict[str, DecayedCounter] = {}
+
+        # Poids non encore fusionnés en base: (scope, clé, catégorie) -> poids relatif à pending_reference
+        self.pending: Dict[Tuple[str, str, str], float] = {}
+        self.pending_reference = now
+
+        self.app = None
+        self.thread: Optional[threading.Thread] = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.checkpoint_lock = threading.Lock()
+        self.loaded = False
+        self.last_checkpoint = now
+
+    def init_app(self, app):
+        """
+        Le thread de checkpoint ouvre son propre contexte d'application pour écrire en base
+        """
+        self.app = app
+
+    def record_event(self, product_id, category: Optional[str] = None,
+                     event_type: str = 'impression', quantity: float = 1):
+        """
+        Enregistrer un événement produit (impression, panier, vente)
+        """
+        self.record_events([(product_id, category, event_type, quantity)])
+
+    def record_events(self, events: List[Tuple[Any, Optional[str], str, float]]):
+        """
+        Enregistrer un lot d'événements (product_id, category, event_type, quantity)
+        """
+        self._ensure_loaded()
+        self._ensure_started()
+        now = time.time()
+
+        with self.lock:
+            for product_id, category, event_type, quantity in events:
+                weight = self.event_weights.get(event_type, 1.0) * quantity
+                product_key = normalize_product_key(product_id)
+                self._add(product_key, category, weight, now)
+                if self.app is not None:
+                    self._add_pending(product_key, category, weight, now)
+
+    def get_trending(self, limit: int = 10, category: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        Produits tendance (product_id, score), optionnellement dans une catégorie
+        """
+        self._ensure_loaded()
+        now = time.time()
+
+        with self.lock:
+            if category:
+                counter = self.category_products.get(category)
+                return counter.top(limit, now) if counter else []
+            return self.products.top(limit, now)
+
+    def get_trending_categories(self, limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        Catégories tendance (category, score)
+        """
+        self._ensure_loaded()
+
+        with self.lock:
+            return self.categories.top(limit, time.time())
+
+    def checkpoint(self) -> Dict[str, Any]:
+        """
+        Fusionner en base les poids ajoutés depuis le dernier checkpoint, puis recharger la table
+        """
+        with self.checkpoint_lock:
+            now = time.time()
+            checkpointed_at = datetime.utcfromtimestamp(now)
+
+            with self.lock:
+                self.last_checkpoint = now
+                pending, reference = self.pending, self.pending_reference
+                self.pending, self.pending_reference = {}, now
+
+            factor = math.exp(-self.decay_rate * (now - reference))
+            deltas = {key: value * factor for key, value in pending.items()}
+
+            try:
+                for key, delta in deltas.items():
+                    self._merge(key, delta, now, checkpointed_at)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                # Poids remis en attente pour le prochain passage
+                with self.lock:
+                    for (scope, product_key, category), delta in deltas.items():
+                        self._add_pending_value((scope, product_key, category), delta, now)
+                print(f"Erreur checkpoint des tendances: {e}")
+                return {'success': False, 'error': str(e)}
+
+            self.reload()
+
+        return {'success': True, 'counters': len(deltas), 'checkpointed_at': checkpointed_at.isoformat()}
+
+    def reload(self):
+        """
+        Reconstruire les compteurs depuis la base, plus les poids pas encore fusionnés
+        """
+        rows = db.session.query(
+            TrendingCounter.scope, TrendingCounter.key, TrendingCounter.category,
+            TrendingCounter.score, TrendingCounter.checkpointed_at
+        ).all()
+
+        now = time.time()
+        products = DecayedCounter(self.half_life_seconds, now)
+        categories = DecayedCounter(self.half_life_seconds, now)
+        category_products: Dict[str, DecayedCounter] = {}
+
+        def category_counter(category: str) -> DecayedCounter:
+            if category not in category_products:
+                category_products[category] = DecayedCounter(self.half_life_seconds, now)
+            return category_products[category]
+
+        for scope, key, category, score, checkpointed_at in rows:
+            at = self._timestamp(checkpointed_at, now)
+            if scope == 'product':
+                products.add(key, score, at)
+            elif scope == 'category':
+                categories.add(key, score, at)
+            elif scope == 'category_product' and category:
+                category_counter(category).add(key, score, at)
+
+        with self.lock:
+            factor = math.exp(-self.decay_rate * (now - self.pending_reference))
+            for (scope, key, category), value in self.pending.items():
+                if scope == 'product':
+                    products.add(key, value * factor, now)
+                elif scope == 'category':
+                    categories.add(key, value * factor, now)
+                else:
+                    category_counter(category).add(key, value * factor, now)
+
+            self.products = products
+            self.categories = categories
+            self.category_products = category_products
+            self.loaded = True
+
+    def _merge(self, key: Tuple[str, str, str], delta: float, now: float, checkpointed_at: datetime):
+        """
+        Ajouter un poids à la ligne d'une clé (décrue jusqu'à maintenant), sans écraser les autres workers
+        """
+        scope, product_key, category = key
+        condition = db.and_(
+            TrendingCounter.scope == scope,
+            TrendingCounter.key == product_key,
+            TrendingCounter.category == category
+        )
+
+        for _ in range(5):
+            row = db.session.query(TrendingCounter.id, TrendingCounter.score, TrendingCounter.checkpointed_at)\
+                            .filter(condition).first()
+
+            if row is None:
+                try:
+                    # Point de sauvegarde: un autre worker a pu insérer la même clé
+                    with db.session.begin_nested():
+                        db.session.add(TrendingCounter(
+                            scope=scope, key=product_key, category=category,
+                            score=delta, checkpointed_at=checkpointed_at
+                        ))
+                    return
+                except IntegrityError:
+                    continue
+
+            # Mise à jour conditionnelle: une fusion concurrente change checkpointed_at
+            score = row.score * math.exp(-self.decay_rate * (now - self._timestamp(row.checkpointed_at, now)))
+            updated = TrendingCounter.query.filter(
+                TrendingCounter.id == row.id,
+                TrendingCounter.checkpointed_at == row.checkpointed_at
+            ).update({'score': score + delta, 'checkpointed_at': checkpointed_at}, synchronize_session=False)
+            if updated:
+                return
+
+        raise RuntimeError(f'Fusion impossible du compteur de tendance {scope}:{product_key}')
+
+    @staticmethod
+    def _timestamp(checkpointed_at: Optional[datetime], default: float) -> float:
+        return checkpointed_at.replace(tzinfo=timezone.utc).timestamp() if checkpointed_at else default
+
+    def _ensure_loaded(self):
+        """
+        Charger les compteurs au premier usage si le démarrage ne l'a pas fait
+        """
+        if self.loaded:
+            return
+
+        with self.checkpoint_lock:
+            if self.loaded:
+                return
+            try:
+                self.reload()
+            except Exception as e:
+                self.loaded = True
+                print(f"Erreur chargement des tendances: {e}")
+
+    def _ensure_started(self):
+        """
+        Démarrer le thread de checkpoint dans ce processus (les threads ne survivent pas au fork)
+        """
+        if self.pid == os.getpid() or self.app is None:
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # Poids hérités du processus parent: déjà fusionnés par lui
+            self.pending, self.pending_reference = {}, time.time()
+            self.thread = threading.Thread(target=self._run, name='trending-checkpoint', daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.checkpoint_interval_seconds)
+            with self.app.app_context():
+                try:
+                    self.checkpoint()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Erreur checkpoint des tendances: {e}")
+
+    def _add(self, product_key: str, category: Optional[str], weight: float, now: float):
+        self.products.add(product_key, weight, now)
+        if category:
+            self.categories.add(category, weight, now)
+            self._category_counter(category).add(product_key, weight, now)
+
+    def _add_pending(self, product_key: str, category: Optional[str], weight: float, now: float):
+        self._add_pending_value(('product', product_key, ''), weight, now)
+        if category:
+            self._add_pending_value(('category', category, ''), weight, now)
+            self._add_pending_value(('category_product', product_key, category), weight, now)
+
+    def _add_pending_value(self, key: Tuple[str, str, str], weight: float, now: float):
+        self.pending[key] = self.pending.get(key, 0.0) + weight * math.exp(self.decay_rate * (now - self.pending_reference))
+
+    def _category_counter(self, category: str) -> DecayedCounter:
+        counter = self.category_products.get(category)
+        if counter is None:
+            counter = self.category_products[category] = DecayedCounter(self.half_life_seconds, time.time())
+        return counter
+
+
+_trending_service = None
+
+
+def get_trending_service() -> TrendingService:
+    """
+    Instance partagée par les blueprints du processus
+    """
+    global _trending_service
+    if _trending_service is None:
+        _trending_service = TrendingService()
+    return _trending_service
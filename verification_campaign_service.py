@@ -0,0 +1,426 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Iterator
+from src.models.management import (
+    CODOrder, CODRiskLevel, OrderStatus, VerificationCampaign, VerificationJob, db
+)
+from src.services.verification_dispatcher import get_verification_dispatcher
+from src.services.message_scheduler import get_message_scheduler
+from src.services.rate_limiter import ProviderRateLimits, shared_rate_dir
+
+
+class VerificationCampaignService:
+    """
+    Campagnes de vérification en masse des commandes COD à risque
+
+    Les commandes sont sélectionnées par filtre, un job de vérification est créé
+    pour chacune, puis les jobs sont exécutés avec une concurrence bornée et une
+    limite de débit par fournisseur. La progression est enregistrée sur la
+    campagne à intervalle régulier, avec un signe de vie (heartbeat_at): une
+    campagne dont le worker a disparu est reprise par un autre processus.
+    """
+
+    # Les SMS / WhatsApp passent par l'ordonnanceur des messages (débit commun à
+    # tous les workers); les appels ont un plafond commun propre aux campagnes.
+    # Les limites d'une campagne ne font que la ralentir sous ces plafonds.
+    CHANNELS = ('sms', 'whatsapp', 'phone_call')
+    CALL_RATE_LIMITS = {
+        'phone_call': float(os.getenv('CAMPAIGN_RATE_PHONE_CALL', 5))
+    }
+
+    MAX_CONCURRENCY = 100
+
+    def __init__(self, progress_interval_seconds: float = 1.0, insert_batch_size: int = 500,
+                 stale_after_seconds: float = 60.0, watchdog_interval_seconds: float = 30.0):
+        self.dispatcher = get_verification_dispatcher()
+        self.scheduler = get_message_scheduler()
+        self.rate_limits = ProviderRateLimits(self.CALL_RATE_LIMITS, shared_dir=shared_rate_dir(), name='campaign')
+        self.progress_interval_seconds = progress_interval_seconds
+        self.insert_batch_size = insert_batch_size
+        self.stale_after_seconds = stale_after_seconds
+        self.watchdog_interval_seconds = watchdog_interval_seconds
+
+        self.app = None
+        self.cancelled = set()
+        self.watchdog: Optional[threading.Thread] = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    def start(self):
+        """
+        Surveiller les campagnes orphelines dans ce processus (les threads ne survivent pas au fork)
+        """
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.watchdog = threading.Thread(target=self._watchdog_loop, name='verification-campaigns', daemon=True)
+            self.watchdog.start()
+            self.pid = os.getpid()
+
+    def recover(self) -> List[int]:
+        """
+        Reprendre les campagnes sans signe de vie récent (worker arrêté ou recyclé)
+
+        La reprise est une mise à jour conditionnelle: un seul processus reprend
+        une campagne donnée. Ses jobs restés 'running' sont remis en file.
+        """
+        stale_before = datetime.utcnow() - timedelta(seconds=self.stale_after_seconds)
+        orphaned = db.or_(
+            db.and_(
+                VerificationCampaign.status == 'running',
+                db.or_(VerificationCampaign.heartbeat_at.is_(None), VerificationCampaign.heartbeat_at < stale_before)
+            ),
+            db.and_(VerificationCampaign.status == 'queued', VerificationCampaign.created_at < stale_before)
+        )
+        candidates = [row[0] for row in db.session.query(VerificationCampaign.id).filter(orphaned).all()]
+
+        resumed = []
+        for campaign_id in candidates:
+            claimed = VerificationCampaign.query.filter(VerificationCampaign.id == campaign_id, orphaned).update(
+                {'status': 'running', 'heartbeat_at': datetime.utcnow()}, synchronize_session=False
+            )
+            if not claimed:
+                continue
+
+            VerificationJob.query.filter_by(campaign_id=campaign_id, status='running').update(
+                {'status': 'queued', 'started_at': None}, synchronize_session=False
+            )
+            db.session.commit()
+            self._launch(campaign_id, resumed=True)
+            resumed.append(campaign_id)
+
+        db.session.commit()
+        return resumed
+
+    def select_orders(self, filters: Dict[str, Any]):
+        """
+        Requête des commandes éligibles: vérification requise, en attente, sans job en cours
+        """
+        risk_levels = [CODRiskLevel(level) for level in filters.get('risk_levels', ['high', 'very_high'])]
+
+        query = CODOrder.query.filter(
+            CODOrder.verification_required == True,
+            CODOrder.status == OrderStatus.PENDING,
+            CODOrder.verification_status.in_(filters.get('verification_statuses', ['pending'])),
+            CODOrder.risk_level.in_(risk_levels)
+        )
+
+        if filters.get('city'):
+            query = query.filter(CODOrder.city == filters['city'])
+        if filters.get('min_risk_score') is not None:
+            query = query.filter(CODOrder.risk_score >= float(filters['min_risk_score']))
+        if filters.get('days'):
+            query = query.filter(CODOrder.created_at >= datetime.utcnow() - timedelta(days=int(filters['days'])))
+
+        active_jobs = db.session.query(VerificationJob.order_id).filter(
+            VerificationJob.status.in_(['queued', 'running'])
+        )
+        query = query.filter(~CODOrder.id.in_(active_jobs))
+
+        query = query.order_by(CODOrder.risk_score.desc(), CODOrder.id)
+        if filters.get('limit'):
+            query = query.limit(int(filters['limit']))
+        return query
+
+    def preview(self, filters: Dict[str, Any]) -> Dict[str, Any]:
+        return {'matching_orders': self.select_orders(filters).count(), 'filters': filters}
+
+    def create_campaign(self, filters: Dict[str, Any], method: str = 'sms', failover: bool = True,
+                        concurrency: int = 20, rate_limits: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """
+        Créer la campagne et ses jobs (insertion par lots), puis la lancer en arrière-plan
+        """
+        if method not in self.dispatcher.CHANNELS:
+            return {'success': False, 'error': 'Méthode de vérification non supportée'}
+
+        campaign_limits = {
+            provider: float(rate) for provider, rate in (rate_limits or {}).items()
+            if provider in self.CHANNELS and float(rate) > 0
+        }
+
+        order_ids = [row[0] for row in self.select_orders(filters).with_entities(CODOrder.id).all()]
+        if not order_ids:
+            return {'success': False, 'error': 'Aucune commande à vérifier pour ces filtres'}
+
+        campaign = VerificationCampaign(
+            status='queued',
+            filters=filters,
+            method=method,
+            failover=failover,
+            concurrency=max(1, min(int(concurrency), self.MAX_CONCURRENCY)),
+            rate_limits=campaign_limits or None,
+            total_orders=len(order_ids)
+        )
+        db.session.add(campaign)
+        db.session.flush()
+
+        channels = self.dispatcher.channels_for(method, failover)
+        now = datetime.utcnow()
+        for start in range(0, len(order_ids), self.insert_batch_size):
+            chunk = order_ids[start:start + self.insert_batch_size]
+            db.session.bulk_insert_mappings(VerificationJob, [
+                {
+                    'order_id': order_id,
+                    'campaign_id': campaign.id,
+                    'status': 'queued',
+                    'channels': channels,
+                    'attempts': [],
+                    'created_at': now
+                }
+                for order_id in chunk
+            ])
+            CODOrder.query.filter(CODOrder.id.in_(chunk)).update(
+                {
+                    'verification_status': 'in_progress',
+                    'verification_attempts': CODOrder.verification_attempts + 1,
+                    'updated_at': now
+                },
+                synchronize_session=False
+            )
+        db.session.commit()
+
+        self._launch(campaign.id)
+
+        result = campaign.to_dict()
+        result['success'] = True
+        result['rate_limits'] = self.effective_rate_limits(campaign_limits)
+        return result
+
+    def effective_rate_limits(self, campaign_limits: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+        rates = {
+            provider: rate for provider, rate in self.scheduler.provider_rates.items()
+            if provider in self.CHANNELS and rate
+        }
+        rates.update(self.rate_limits.rates())
+        for provider, rate in (campaign_limits or {}).items():
+            rates[provider] = min(rates.get(provider, rate), rate)
+        return rates
+
+    def cancel_campaign(self, campaign_id: int) -> Dict[str, Any]:
+        """
+        Annuler une campagne: les jobs non démarrés sont abandonnés, les commandes repassent en attente
+        """
+        campaign = VerificationCampaign.query.get(campaign_id)
+        if not campaign:
+            return {'success': False, 'error': 'Campagne non trouvée'}
+        if campaign.status not in ('queued', 'running'):
+            return {'success': False, 'error': f'Campagne déjà terminée ({campaign.status})'}
+
+        with self.lock:
+            self.cancelled.add(campaign_id)
+
+        campaign.status = 'cancelled'
+        db.session.commit()
+        cancelled_jobs = self._cancel_queued_jobs(campaign_id)
+
+        return {'success': True, 'cancelled_jobs': cancelled_jobs, 'campaign': campaign.to_dict()}
+
+    def get_campaign(self, campaign_id: int) -> Optional[Dict[str, Any]]:
+        campaign = VerificationCampaign.query.get(campaign_id)
+        return campaign.to_dict() if campaign else None
+
+    def list_campaigns(self, limit: int = 20) -> List[Dict[str, Any]]:
+        campaigns = VerificationCampaign.query.order_by(VerificationCampaign.created_at.desc()).limit(limit).all()
+        return [campaign.to_dict() for campaign in campaigns]
+
+    def stream_progress(self, campaign_id: int, interval_seconds: float = 1.0) -> Iterator[str]:
+        """
+        Progression au format Server-Sent Events, jusqu'à la fin de la campagne
+        """
+        while True:
+            db.session.expire_all()
+            campaign = self.get_campaign(campaign_id)
+            if campaign is None:
+                yield 'event: error\ndata: {"error": "Campagne non trouvée"}\n\n'
+                return
+
+            yield f'event: progress\ndata: {json.dumps(campaign)}\n\n'
+            if campaign['status'] not in ('queued', 'running'):
+                yield f'event: done\ndata: {json.dumps(campaign)}\n\n'
+                return
+
+            time.sleep(interval_seconds)
+
+    def run_campaign(self, campaign_id: int, resumed: bool = False):
+        """
+        Exécuter les jobs de la campagne (concurrence bornée, débit limité par fournisseur)
+
+        resumed: campagne reprise par recover(), déjà passée en 'running' par ce processus.
+        """
+        campaign = VerificationCampaign.query.get(campaign_id)
+        if not campaign or campaign.status != ('running' if resumed else 'queued'):
+            return
+
+        campaign.status = 'running'
+        campaign.started_at = campaign.started_at or datetime.utcnow()
+        campaign.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+
+        job_ids = [row[0] for row in db.session.query(VerificationJob.id).filter_by(
+            campaign_id=campaign_id, status='queued'
+        ).order_by(VerificationJob.id).all()]
+
+        # Compteurs repris des jobs déjà terminés (campagne reprise après un arrêt)
+        finished = dict(db.session.query(VerificationJob.status, db.func.count(VerificationJob.id)).filter(
+            VerificationJob.campaign_id == campaign_id,
+            VerificationJob.status.in_(['succeeded', 'failed'])
+        ).group_by(VerificationJob.status).all())
+        counters = {
+            'processed': finished.get('succeeded', 0) + finished.get('failed', 0),
+            'succeeded': finished.get('succeeded', 0),
+            'failed': finished.get('failed', 0)
+        }
+        counters_lock = threading.Lock()
+        last_flush = time.monotonic()
+
+        # Seaux propres à la campagne, en plus des plafonds communs (ordonnanceur
+        # des messages, appels): une campagne ne modifie jamais les limites des autres
+        campaign_limits = ProviderRateLimits(campaign.rate_limits or {})
+
+        def acquire(channel: str):
+            campaign_limits.acquire(channel)
+            self.rate_limits.acquire(channel)
+
+        def run_one(job_id: int):
+            with self.app.app_context():
+                try:
+                    succeeded = self.dispatcher.run_job(job_id, acquire=acquire)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Erreur job de campagne {job_id}: {e}")
+                    succeeded = False
+            if succeeded is None:
+                return
+            with counters_lock:
+                counters['processed'] += 1
+                counters['succeeded' if succeeded else 'failed'] += 1
+
+        pending = set()
+        with ThreadPoolExecutor(max_workers=campaign.concurrency, thread_name_prefix=f'campaign-{campaign_id}') as executor:
+            for job_id in job_ids:
+                # Au plus deux lots de jobs en vol: l'annulation reste réactive
+                while len(pending) >= campaign.concurrency * 2:
+                    done, pending = wait(pending, timeout=self.progress_interval_seconds, return_when=FIRST_COMPLETED)
+                    last_flush = self._maybe_flush(campaign_id, counters, counters_lock, last_flush)
+
+                if campaign_id in self.cancelled:
+                    break
+                pending.add(executor.submit(run_one, job_id))
+
+            while pending:
+                done, pending = wait(pending, timeout=self.progress_interval_seconds, return_when=FIRST_COMPLETED)
+                last_flush = self._maybe_flush(campaign_id, counters, counters_lock, last_flush)
+
+        self._flush_progress(campaign_id, counters, counters_lock, finished=True)
+
+        with self.lock:
+            self.cancelled.discard(campaign_id)
+
+    def _maybe_flush(self, campaign_id: int, counters, counters_lock, last_flush: float) -> float:
+        now = time.monotonic()
+        if now - last_flush < self.progress_interval_seconds:
+            return last_flush
+        self._flush_progress(campaign_id, counters, counters_lock)
+        return now
+
+    def _flush_progress(self, campaign_id: int, counters, counters_lock, finished: bool = False):
+        """
+        Enregistrer les compteurs sur la campagne (et détecter une annulation faite par un autre worker)
+        """
+        with counters_lock:
+            values = {
+                'processed_orders': counters['processed'],
+                'succeeded_orders': counters['succeeded'],
+                'failed_orders': counters['failed']
+            }
+
+        campaign = VerificationCampaign.query.get(campaign_id)
+        db.session.refresh(campaign)
+        for key, value in values.items():
+            setattr(campaign, key, value)
+        campaign.heartbeat_at = datetime.utcnow()
+
+        if campaign.status == 'cancelled':
+            with self.lock:
+                self.cancelled.add(campaign_id)
+        elif finished:
+            campaign.status = 'completed'
+
+        if finished:
+            campaign.finished_at = datetime.utcnow()
+        db.session.commit()
+
+        if finished and campaign.status == 'cancelled':
+            self._cancel_queued_jobs(campaign_id)
+
+    def _cancel_queued_jobs(self, campaign_id: int) -> int:
+        order_ids = [row[0] for row in db.session.query(VerificationJob.order_id).filter_by(
+            campaign_id=campaign_id, status='queued'
+        ).all()]
+
+        VerificationJob.query.filter_by(campaign_id=campaign_id, status='queued').update(
+            {'status': 'cancelled', 'finished_at': datetime.utcnow()}, synchronize_session=False
+        )
+        for start in range(0, len(order_ids), self.insert_batch_size):
+            CODOrder.query.filter(
+                CODOrder.id.in_(order_ids[start:start + self.insert_batch_size]),
+                CODOrder.verification_status == 'in_progress'
+            ).update({'verification_status': 'pending'}, synchronize_session=False)
+        db.session.commit()
+
+        return len(order_ids)
+
+    def _launch(self, campaign_id: int, resumed: bool = False):
+        thread = threading.Thread(
+            target=self._run_in_context, args=(campaign_id, resumed),
+            name=f'verification-campaign-{campaign_id}', daemon=True
+        )
+        thread.start()
+
+    def _watchdog_loop(self):
+        while True:
+            time.sleep(self.watchdog_interval_seconds)
+            with self.app.app_context():
+                try:
+                    resumed = self.recover()
+                    if resumed:
+                        print(f"Campagnes de vérification reprises: {resumed}")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Erreur reprise des campagnes de vérification: {e}")
+
+    def _run_in_context(self, campaign_id: int, resumed: bool = False):
+        with self.app.app_context():
+            try:
+                self.run_campaign(campaign_id, resumed)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Erreur campagne de vérification {campaign_id}: {e}")
+                VerificationCampaign.query.filter_by(id=campaign_id).update(
+                    {'status': 'failed', 'error': str(e), 'finished_at': datetime.utcnow()},
+                    synchronize_session=False
+                )
+                db.session.commit()
+
+
+_verification_campaign_service = None
+
+
+def get_verification_campaign_service() -> VerificationCampaignService:
+    """
+    Instance partagée du service de campagnes (limites de débit communes)
+    """
+    global _verification_campaign_service
+    if _verification_campaign_service is None:
+        _verification_campaign_service = VerificationCampaignService()
+    return _verification_campaign_service
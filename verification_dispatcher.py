@@ -0,0 +1,282 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from src.models.management import CODOrder, OrderStatus, VerificationJob, db
+from src.services.verification_service import VerificationService
+from src.services.customer_history_service import CustomerHistoryService
+from src.services.city_risk_service import get_city_risk_service
+
+
+class VerificationDispatcher:
+    """
+    Envoi asynchrone des vérifications COD avec bascule entre canaux
+
+    La requête HTTP crée un job et rend la main; un pool de threads essaie les
+    canaux dans l'ordre (SMS, WhatsApp, appel) avec un délai par canal. Les
+    résultats sont reportés sur les commandes par lots, dans un seul commit.
+    """
+
+    CHANNELS = ['sms', 'whatsapp', 'phone_call']
+
+    # Délai maximal de l'appel au fournisseur, en secondes
+    CHANNEL_TIMEOUTS = {
+        'sms': 10,
+        'whatsapp': 15,
+        'phone_call': 20
+    }
+
+    def __init__(self, max_workers: int = 4, status_batch_size: int = 50, flush_interval_seconds: float = 1.0,
+                 running_timeout_seconds: Optional[float] = None):
+        self.max_workers = max_workers
+        self.status_batch_size = status_batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        # Au-delà, un job 'running' est considéré comme abandonné par un worker arrêté
+        self.running_timeout_seconds = running_timeout_seconds or float(os.getenv('VERIFICATION_JOB_TIMEOUT_SECONDS', 600))
+
+        self.verification_service = VerificationService()
+        self.customer_history = CustomerHistoryService()
+        self.city_risk = get_city_risk_service()
+
+        self.app = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.flusher: Optional[threading.Thread] = None
+        self.pid = None
+        self.results: queue.Queue = queue.Queue()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Les threads ouvrent leur propre contexte d'application pour accéder à la base
+        """
+        self.app = app
+
+    def channels_for(self, preferred_method: Optional[str] = None, failover: bool = True) -> List[str]:
+        """
+        Ordre des canaux: le canal demandé d'abord, puis les autres si la bascule est active
+        """
+        if preferred_method not in self.CHANNELS:
+            return list(self.CHANNELS)
+        if not failover:
+            return [preferred_method]
+        return [preferred_method] + [channel for channel in self.CHANNELS if channel != preferred_method]
+
+    def enqueue(self, order: CODOrder, preferred_method: Optional[str] = None, failover: bool = True) -> Dict[str, Any]:
+        """
+        Créer un job de vérification (commit inclus) et le confier au pool de threads
+        """
+        job = VerificationJob(
+            order_id=order.id,
+            status='queued',
+            channels=self.channels_for(preferred_method, failover),
+            attempts=[]
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        self._submit(job.id)
+        return job.to_dict()
+
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        job = VerificationJob.query.get(job_id)
+        if not job:
+            return None
+
+        order = CODOrder.query.get(job.order_id)
+        result = job.to_dict()
+        result['order_verification_status'] = order.verification_status if order else None
+        return result
+
+    def recover(self) -> Dict[str, int]:
+        """
+        Reprendre après un redémarrage: jobs restés en file et résultats non reportés
+
+        Les jobs de campagne sont exclus: ils sont repris par le service de
+        campagnes, avec la concurrence et les limites de débit de la campagne.
+        Un job resté 'running' plus de running_timeout_seconds (worker arrêté en
+        cours d'envoi) est remis en file; le client peut recevoir un nouveau
+        code, qui remplace le précédent.
+        """
+        stalled = VerificationJob.query.filter(
+            VerificationJob.status == 'running',
+            VerificationJob.campaign_id.is_(None),
+            VerificationJob.started_at < datetime.utcnow() - timedelta(seconds=self.running_timeout_seconds)
+        ).update({'status': 'queued', 'started_at': None}, synchronize_session=False)
+        db.session.commit()
+
+        queued_ids = [row[0] for row in db.session.query(VerificationJob.id).filter(
+            VerificationJob.status == 'queued',
+            VerificationJob.campaign_id.is_(None)
+        ).all()]
+        for job_id in queued_ids:
+            self._submit(job_id)
+
+        unapplied = db.session.query(VerificationJob.id, VerificationJob.order_id, VerificationJob.status).filter(
+            VerificationJob.status.in_(['succeeded', 'failed']),
+            VerificationJob.applied_at.is_(None)
+        ).all()
+        for job_id, order_id, status in unapplied:
+            self._ensure_started()
+            self.results.put((job_id, order_id, status == 'succeeded'))
+
+        return {'requeued_jobs': len(queued_ids), 'stalled_jobs': stalled, 'pending_status_updates': len(unapplied)}
+
+    def run_job(self, job_id: int, acquire: Optional[Callable[[str], Any]] = None) -> Optional[bool]:
+        """
+        Exécuter un job: essayer chaque canal jusqu'au premier succès
+
+        acquire(canal) est appelé avant chaque envoi (limite de débit par fournisseur).
+        Renvoie None si le job a déjà été pris par un autre thread.
+        """
+        # Prise atomique: un job n'est exécuté qu'une fois, même s'il a été soumis deux fois
+        claimed = VerificationJob.query.filter_by(id=job_id, status='queued').update(
+            {'status': 'running', 'started_at': datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if not claimed:
+            return None
+
+        job = VerificationJob.query.get(job_id)
+        attempts = []
+        result: Dict[str, Any] = {'success': False, 'error': 'Aucun canal disponible'}
+
+        for channel in job.channels:
+            if acquire is not None:
+                acquire(channel)
+
+            started = time.perf_counter()
+            result = self.verification_service.verify_order(
+                job.order_id, channel, timeout=self.CHANNEL_TIMEOUTS.get(channel, 30)
+            )
+            attempts.append({
+                'channel': channel,
+                'success': bool(result.get('success')),
+                'error': result.get('error'),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+            })
+            if result.get('success'):
+                break
+
+        succeeded = bool(result.get('success'))
+        job.attempts = attempts
+        job.status = 'succeeded' if succeeded else 'failed'
+        job.channel = attempts[-1]['channel'] if succeeded else None
+        job.result = result
+        job.error = None if succeeded else result.get('error')
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+        self._ensure_started()
+        self.results.put((job.id, job.order_id, succeeded))
+        return succeeded
+
+    def apply_results(self, batch: List[Tuple[int, int, bool]]) -> int:
+        """
+        Reporter un lot de résultats sur les commandes (une requête, un commit)
+        """
+        if not batch:
+            return 0
+
+        now = datetime.utcnow()
+        orders = {
+            order.id: order
+            for order in CODOrder.query.filter(CODOrder.id.in_(list({order_id for _, order_id, _ in batch}))).all()
+        }
+
+        for _, order_id, succeeded in batch:
+            order = orders.get(order_id)
+            if not order:
+                continue
+
+            order.updated_at = now
+            if succeeded:
+                order.verification_status = 'verified'
+                order.verified_at = now
+                previous_status = order.status
+                order.status = OrderStatus.CONFIRMED
+                self.customer_history.record_update(order, previous_status, order.notes)
+                self.city_risk.record_update(order, previous_status, order.notes)
+            else:
+                order.verification_status = 'failed'
+
+        VerificationJob.query.filter(VerificationJob.id.in_([job_id for job_id, _, _ in batch])).update(
+            {'applied_at': now}, synchronize_session=False
+        )
+        db.session.commit()
+        return len(batch)
+
+    def _submit(self, job_id: int):
+        self._ensure_started()
+        self.executor.submit(self._run_in_context, job_id)
+
+    def _ensure_started(self):
+        """
+        Créer le pool et le thread de report dans ce processus (les threads ne survivent pas au fork)
+        """
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.results = queue.Queue()
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='verification')
+            self.flusher = threading.Thread(target=self._flush_loop, name='verification-status', daemon=True)
+            self.flusher.start()
+            self.pid = os.getpid()
+
+    def _run_in_context(self, job_id: int):
+        with self.app.app_context():
+            try:
+                self.run_job(job_id)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Erreur job de vérification {job_id}: {e}")
+                VerificationJob.query.filter_by(id=job_id).update(
+                    {'status': 'failed', 'error': str(e), 'finished_at': datetime.utcnow()},
+                    synchronize_session=False
+                )
+                db.session.commit()
+
+                job = VerificationJob.query.get(job_id)
+                if job:
+                    self.results.put((job.id, job.order_id, False))
+
+    def _flush_loop(self):
+        while True:
+            batch = [self.results.get()]
+            deadline = time.monotonic() + self.flush_interval_seconds
+
+            # Regrouper les résultats arrivés pendant l'intervalle
+            while len(batch) < self.status_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.results.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            with self.app.app_context():
+                try:
+                    self.apply_results(batch)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Erreur report des statuts de vérification: {e}")
+
+
+_verification_dispatcher = None
+
+
+def get_verification_dispatcher() -> VerificationDispatcher:
+    """
+    Instance partagée du répartiteur de vérifications
+    """
+    global _verification_dispatcher
+    if _verification_dispatcher is None:
+        _verification_dispatcher = VerificationDispatcher()
+    return _verification_dispatcher
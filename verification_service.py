@@ -3,6 +3,7 @@ import string
 from typing import Dict, Any
 from datetime import datetime, timedelta
 from src.services.notification_service import NotificationService
+from src.services.verification_store import get_verification_store, get_verification_sweeper
 
 class VerificationService:
     """
@@ -12,8 +13,10 @@ class VerificationService:
     def __init__(self):
         self.notification_service = NotificationService()
         
-        # Codes de vérification temporaires (en production, utiliser Redis ou base de données)
-        self.verification_codes = {}
+        # Codes de vérification partagés entre workers (SQLite WAL, mémoire partagée ou mémoire locale)
+        self.verification_store = get_verification_store()
+        self.sweeper = get_verification_sweeper()
+        self.max_attempts = 3
         
         # Configuration des méthodes de vérification
         self.verification_methods = {
@@ -49,13 +52,7 @@ class VerificationService:
             verification_code = self._generate_verification_code()
             
             # Stocker le code avec expiration
-            self.verification_codes[order.order_id] = {
-                'code': verification_code,
-                'created_at': datetime.utcnow(),
-                'expires_at': datetime.utcnow() + timedelta(minutes=15),
-                'attempts': 0,
-                'verified': False
-            }
+            self._store_code(order, verification_code, 'sms', 15)
             
             # Envoyer le code par SMS par défaut
             success = self._send_verification_code(order, verification_code, 'sms')
@@ -70,9 +67,9 @@ class VerificationService:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def verify_order(self, order_id: int, method: str = 'sms') -> Dict[str, Any]:
+    def verify_order(self, order_id: int, method: str = 'sms', timeout: float = 30) -> Dict[str, Any]:
         """
-        Vérifier une commande avec la méthode spécifiée
+        Vérifier une commande avec la méthode spécifiée (timeout en secondes pour l'envoi)
         """
         try:
             from src.models.management import CODOrder
@@ -84,9 +81,9 @@ class VerificationService:
             if method == 'phone_call':
                 return self._verify_by_phone_call(order)
             elif method == 'sms':
-                return self._verify_by_sms(order)
+                return self._verify_by_sms(order, timeout)
             elif method == 'whatsapp':
-                return self._verify_by_whatsapp(order)
+                return self._verify_by_whatsapp(order, timeout)
             else:
                 return {'success': False, 'error': 'Méthode de vérification non supportée'}
                 
@@ -98,27 +95,25 @@ class VerificationService:
         Vérifier un code de vérification fourni par le client
         """
         try:
-            verification_data = self.verification_codes.get(order_id)
+            # Incrémenter les tentatives (atomique: partagé entre workers)
+            verification_data = self.verification_store.increment_attempts(order_id)
             
             if not verification_data:
                 return {'success': False, 'error': 'Code de vérification non trouvé'}
             
             # Vérifier l'expiration
             if datetime.utcnow() > verification_data['expires_at']:
-                del self.verification_codes[order_id]
+                self.verification_store.delete(order_id)
                 return {'success': False, 'error': 'Code de vérification expiré'}
             
-            # Incrémenter les tentatives
-            verification_data['attempts'] += 1
-            
             # Vérifier le nombre maximum de tentatives
-            if verification_data['attempts'] > 3:
-                del self.verification_codes[order_id]
+            if verification_data['attempts'] > self.max_attempts:
+                self.verification_store.delete(order_id)
                 return {'success': False, 'error': 'Nombre maximum de tentatives dépassé'}
             
             # Vérifier le code
             if provided_code == verification_data['code']:
-                verification_data['verified'] = True
+                self.verification_store.mark_verified(order_id)
                 return {
                     'success': True,
                     'message': 'Code vérifié avec succès',
@@ -128,7 +123,7 @@ class VerificationService:
                 return {
                     'success': False, 
                     'error': 'Code incorrect',
-                    'attempts_remaining': 3 - verification_data['attempts']
+                    'attempts_remaining': self.max_attempts - verification_data['attempts']
                 }
                 
         except Exception as e:
@@ -160,7 +155,7 @@ class VerificationService:
                 'alternative': 'Essayez la vérification par SMS'
             }
     
-    def _verify_by_sms(self, order) -> Dict[str, Any]:
+    def _verify_by_sms(self, order, timeout: float = 30) -> Dict[str, Any]:
         """
         Vérification par SMS avec code
         """
@@ -168,16 +163,10 @@ class VerificationService:
         verification_code = self._generate_verification_code()
         
         # Stocker le code
-        self.verification_codes[order.order_id] = {
-            'code': verification_code,
-            'created_at': datetime.utcnow(),
-            'expires_at': datetime.utcnow() + timedelta(minutes=15),
-            'attempts': 0,
-            'verified': False
-        }
+        self._store_code(order, verification_code, 'sms', 15)
         
         # Envoyer le SMS
-        success = self._send_verification_code(order, verification_code, 'sms')
+        success = self._send_verification_code(order, verification_code, 'sms', timeout)
         
         if success:
             return {
@@ -195,7 +184,7 @@ class VerificationService:
                 'alternative': 'Essayez la vérification par appel téléphonique'
             }
     
-    def _verify_by_whatsapp(self, order) -> Dict[str, Any]:
+    def _verify_by_whatsapp(self, order, timeout: float = 30) -> Dict[str, Any]:
         """
         Vérification par message WhatsApp
         """
@@ -203,16 +192,10 @@ class VerificationService:
         verification_code = self._generate_verification_code()
         
         # Stocker le code
-        self.verification_codes[order.order_id] = {
-            'code': verification_code,
-            'created_at': datetime.utcnow(),
-            'expires_at': datetime.utcnow() + timedelta(minutes=20),
-            'attempts': 0,
-            'verified': False
-        }
+        self._store_code(order, verification_code, 'whatsapp', 20)
         
         # Envoyer le message WhatsApp
-        success = self._send_verification_code(order, verification_code, 'whatsapp')
+        success = self._send_verification_code(order, verification_code, 'whatsapp', timeout)
         
         if success:
             return {
@@ -230,53 +213,47 @@ class VerificationService:
                 'alternative': 'Essayez la vérification par SMS'
             }
     
+    def _store_code(self, order, code: str, method: str, timeout_minutes: int):
+        """
+        Enregistrer un code dans le stockage partagé (remplace le code précédent de la commande)
+        """
+        now = datetime.utcnow()
+        self.verification_store.put(order.order_id, {
+            'code': code,
+            'method': method,
+            'created_at': now,
+            'expires_at': now + timedelta(minutes=timeout_minutes),
+            'attempts': 0,
+            'verified': False
+        })
+        
+        # Les codes expirés sont supprimés en arrière-plan, pas à la lecture
+        self.sweeper.ensure_started()
+    
     def _generate_verification_code(self, length: int = 6) -> str:
         """
         Générer un code de vérification aléatoire
         """
         return ''.join(random.choices(string.digits, k=length))
     
-    def _send_verification_code(self, order, code: str, method: str) -> bool:
+    def _send_verification_code(self, order, code: str, method: str, timeout: float = 30) -> bool:
         """
         Envoyer le code de vérification via la méthode spécifiée
         """
         try:
-            if method == 'sms':
-                message = f"""
-🔐 Code de vérification RetailBot
-
-Commande: #{order.order_id}
-Code: {code}
-
-Ce code expire dans 15 minutes.
-Répondez avec ce code pour confirmer votre commande.
-                """.strip()
-                
-                return self.notification_service.send_notification(
-                    channel='sms',
-                    recipient=order.customer_phone,
-                    subject=None,
-                    message=message
-                )
-            
-            elif method == 'whatsapp':
-                message = f"""
-🔐 *Code de vérification RetailBot*
-
-Commande: #{order.order_id}
-Code: *{code}*
-
-Ce code expire dans 20 minutes.
-Répondez avec ce code pour confirmer votre commande.
-
-Merci de votre confiance ! 🛍️
-                """.strip()
+            if method in ('sms', 'whatsapp'):
+                message = self.notification_service.templates.render('cod_verification.code', method, {
+                    'order_id': order.order_id,
+                    'code': code
+                })['text']
                 
                 return self.notification_service.send_notification(
-                    channel='whatsapp',
+                    channel=method,
                     recipient=order.customer_phone,
                     subject=None,
-                    message=message
+                    message=message,
+                    timeout=timeout,
+                    priority='otp'
                 )
             
             return False
@@ -289,7 +266,7 @@ Merci de votre confiance ! 🛍️
         """
         Obtenir le statut de vérification d'une commande
         """
-        verification_data = self.verification_codes.get(order_id)
+        verification_data = self.verification_store.get(order_id)
         
         if not verification_data:
             return {
@@ -299,7 +276,7 @@ Merci de votre confiance ! 🛍️
         
         # Vérifier l'expiration
         if datetime.utcnow() > verification_data['expires_at']:
-            del self.verification_codes[order_id]
+            self.verification_store.delete(order_id)
             return {
                 'status': 'expired',
                 'message': 'Code de vérification expiré'
@@ -318,7 +295,7 @@ Merci de votre confiance ! 🛍️
             'status': 'pending',
             'message': 'En attente de vérification',
             'attempts': verification_data['attempts'],
-            'max_attempts': 3,
+            'max_attempts': self.max_attempts,
             'minutes_remaining': minutes_remaining
         }
     
@@ -326,8 +303,7 @@ Merci de votre confiance ! 🛍️
         """
         Annuler une vérification en cours
         """
-        if order_id in self.verification_codes:
-            del self.verification_codes[order_id]
+        if self.verification_store.delete(order_id):
             return {
                 'success': True,
                 'message': 'Vérification annulée'
@@ -378,6 +354,8 @@ Merci de votre confiance ! 🛍️
             'failed_verifications': failed_verifications,
             'verification_rate': round(verification_rate, 2),
             'success_rate': round(success_rate, 2),
-            'active_verifications': len(self.verification_codes)
+            'active_verifications': self.verification_store.active_count(),
+            'verification_store': self.verification_store.name,
+            'expired_codes_swept': self.sweeper.expired_total
         }
 
@@ -0,0 +1,592 @@
+import calendar
+import fcntl
+import heapq
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+
+def _to_timestamp(value: datetime) -> float:
+    # Les dates de l'application sont en UTC naïf
+    return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+
+
+def _from_timestamp(value: float) -> datetime:
+    return datetime.utcfromtimestamp(value)
+
+
+class VerificationStore(ABC):
+    """
+    Stockage des codes de vérification (interface commune aux backends)
+
+    Un enregistrement est un dictionnaire: code, method, created_at, expires_at,
+    attempts, verified. Les codes expirés restent lisibles jusqu'au passage du
+    balayeur: c'est au service de vérifier expires_at.
+    """
+
+    name = 'base'
+
+    @abstractmethod
+    def put(self, order_id: str, record: Dict[str, Any]):
+        pass
+
+    @abstractmethod
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def increment_attempts(self, order_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Incrémenter atomiquement le compteur de tentatives et renvoyer l'enregistrement
+        """
+
+    @abstractmethod
+    def mark_verified(self, order_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def delete(self, order_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def expire(self, now: datetime, batch_size: int = 500) -> int:
+        """
+        Supprimer au plus batch_size codes expirés, renvoyer le nombre supprimé
+        """
+
+    @abstractmethod
+    def active_count(self) -> int:
+        """
+        Nombre de codes stockés (compteur maintenu à l'écriture, O(1))
+        """
+
+
+class MemoryVerificationStore(VerificationStore):
+    """
+    Stockage en mémoire du processus (développement, worker unique)
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        self.records: Dict[str, Dict[str, Any]] = {}
+        # Tas (expiration, order_id) pour expirer par lots sans parcourir tous les codes
+        self.expirations = []
+        self.lock = threading.Lock()
+
+    def put(self, order_id: str, record: Dict[str, Any]):
+        with self.lock:
+            self.records[order_id] = dict(record)
+            heapq.heappush(self.expirations, (record['expires_at'], order_id))
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            record = self.records.get(order_id)
+            return dict(record) if record else None
+
+    def increment_attempts(self, order_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            record = self.records.get(order_id)
+            if not record:
+                return None
+            record['attempts'] += 1
+            return dict(record)
+
+    def mark_verified(self, order_id: str) -> bool:
+        with self.lock:
+            record = self.records.get(order_id)
+            if not record:
+                return False
+            record['verified'] = True
+            return True
+
+    def delete(self, order_id: str) -> bool:
+        with self.lock:
+            return self.records.pop(order_id, None) is not None
+
+    def expire(self, now: datetime, batch_size: int = 500) -> int:
+        removed = 0
+        with self.lock:
+            while self.expirations and removed < batch_size and self.expirations[0][0] <= now:
+                expires_at, order_id = heapq.heappop(self.expirations)
+                record = self.records.get(order_id)
+                # Entrée périmée si le code a été remplacé depuis
+                if record and record['expires_at'] == expires_at:
+                    del self.records[order_id]
+                    removed += 1
+        return removed
+
+    def active_count(self) -> int:
+        return len(self.records)
+
+
+class SQLiteVerificationStore(VerificationStore):
+    """
+    Stockage SQLite partagé entre workers (mode WAL, index sur order_id et expires_at)
+
+    Le nombre de codes est tenu à jour par des triggers dans une table de compteurs.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS verification_codes (
+            order_id TEXT PRIMARY KEY,
+            code TEXT NOT NULL,
+            method TEXT,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            verified INTEGER NOT NULL DEFAULT 0
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_verification_codes_expires_at ON verification_codes (expires_at)",
+        "CREATE TABLE IF NOT EXISTS verification_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO verification_counters (name, value) VALUES ('active', 0)",
+        """CREATE TRIGGER IF NOT EXISTS verification_codes_count_insert AFTER INSERT ON verification_codes
+           BEGIN UPDATE verification_counters SET value = value + 1 WHERE name = 'active'; END""",
+        """CREATE TRIGGER IF NOT EXISTS verification_codes_count_delete AFTER DELETE ON verification_codes
+           BEGIN UPDATE verification_counters SET value = value - 1 WHERE name = 'active'; END"""
+    ]
+
+    def __init__(self, path: str, busy_timeout_seconds: float = 5.0):
+        self.path = path
+        self.busy_timeout_seconds = busy_timeout_seconds
+        self.local = threading.local()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        connection = self._connection()
+        with connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Une connexion par thread et par processus (les connexions ne survivent pas au fork)
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout_seconds, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def put(self, order_id: str, record: Dict[str, Any]):
+        self._connection().execute(
+            """INSERT INTO verification_codes (order_id, code, method, created_at, expires_at, attempts, verified)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(order_id) DO UPDATE SET
+                   code = excluded.code, method = excluded.method, created_at = excluded.created_at,
+                   expires_at = excluded.expires_at, attempts = excluded.attempts, verified = excluded.verified""",
+            (
+                order_id,
+                record['code'],
+                record.get('method'),
+                _to_timestamp(record['created_at']),
+                _to_timestamp(record['expires_at']),
+                record.get('attempts', 0),
+                int(record.get('verified', False))
+            )
+        )
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT code, method, created_at, expires_at, attempts, verified FROM verification_codes WHERE order_id = ?",
+            (order_id,)
+        ).fetchone()
+        return self._record(row)
+
+    def increment_attempts(self, order_id: str) -> Optional[Dict[str, Any]]:
+        connection = self._connection()
+        # Transaction d'écriture immédiate: deux workers ne peuvent pas lire le même compteur
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                "UPDATE verification_codes SET attempts = attempts + 1 WHERE order_id = ?", (order_id,)
+            )
+            record = self.get(order_id)
+            connection.execute('COMMIT')
+            return record
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def mark_verified(self, order_id: str) -> bool:
+        cursor = self._connection().execute(
+            "UPDATE verification_codes SET verified = 1 WHERE order_id = ?", (order_id,)
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, order_id: str) -> bool:
+        cursor = self._connection().execute("DELETE FROM verification_codes WHERE order_id = ?", (order_id,))
+        return cursor.rowcount > 0
+
+    def expire(self, now: datetime, batch_size: int = 500) -> int:
+        cursor = self._connection().execute(
+            """DELETE FROM verification_codes WHERE order_id IN (
+                   SELECT order_id FROM verification_codes WHERE expires_at <= ? LIMIT ?
+               )""",
+            (_to_timestamp(now), batch_size)
+        )
+        return cursor.rowcount
+
+    def active_count(self) -> int:
+        row = self._connection().execute(
+            "SELECT value FROM verification_counters WHERE name = 'active'"
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _record(self, row) -> Optional[Dict[str, Any]]:
+        if not row:
+            return None
+        code, method, created_at, expires_at, attempts, verified = row
+        return {
+            'code': code,
+            'method': method,
+            'created_at': _from_timestamp(created_at),
+            'expires_at': _from_timestamp(expires_at),
+            'attempts': attempts,
+            'verified': bool(verified)
+        }
+
+
+class SharedMemoryVerificationStore(VerificationStore):
+    """
+    Table de hachage à adressage ouvert dans un fichier mappé en mémoire (/dev/shm)
+
+    Tous les workers d'une même machine partagent le même segment; les écritures
+    sont sérialisées par un verrou fcntl sur le fichier. Capacité fixe.
+
+    Sondage linéaire avec suppression par décalage arrière: une suppression
+    ramène les entrées suivantes de la chaîne vers leur position d'origine, au
+    lieu de laisser une pierre tombale. Les chaînes restent courtes même après
+    des millions d'insertions et de suppressions.
+    """
+
+    name = 'shared_memory'
+
+    HEADER = struct.Struct('<8sQq')
+    SLOT = struct.Struct('<BBxxidd8s12s64s')
+    MAGIC = b'RBVCODE1'
+
+    EMPTY, USED = 0, 1
+
+    def __init__(self, path: str, capacity: int = 16384):
+        self.path = path
+        self.capacity = capacity
+        self.size = self.HEADER.size + capacity * self.SLOT.size
+        self.thread_lock = threading.Lock()
+        self.pid = None
+        self.fd = None
+        self.buffer = None
+        self._open()
+
+    def _open(self):
+        """
+        Ouvrir (ou créer) le segment; rouvert après un fork pour que le verrou fcntl soit propre au processus
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)
+                buffer = mmap.mmap(fd, self.size)
+                self.HEADER.pack_into(buffer, 0, self.MAGIC, self.capacity, 0)
+            else:
+                buffer = mmap.mmap(fd, self.size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+        self.fd = fd
+        self.buffer = buffer
+        self.pid = os.getpid()
+
+    def _locked(self):
+        if self.pid != os.getpid():
+            self._open()
+        return _FileLock(self.thread_lock, self.fd)
+
+    def _key(self, order_id: str) -> bytes:
+        key = order_id.encode('utf-8')
+        if len(key) > 64:
+            raise ValueError('Identifiant de commande trop long pour le stockage partagé')
+        return key
+
+    def _offset(self, index: int) -> int:
+        return self.HEADER.size + index * self.SLOT.size
+
+    def _find(self, key: bytes) -> Optional[int]:
+        start = zlib.crc32(key) % self.capacity
+        for step in range(self.capacity):
+            index = (start + step) % self.capacity
+            slot = self.SLOT.unpack_from(self.buffer, self._offset(index))
+            if slot[0] == self.EMPTY:
+                return None
+            if slot[7].rstrip(b'\0') == key:
+                return index
+        return None
+
+    def _free_slot(self, key: bytes) -> int:
+        start = zlib.crc32(key) % self.capacity
+        for step in range(self.capacity):
+            index = (start + step) % self.capacity
+            if self.buffer[self._offset(index)] == self.EMPTY:
+                return index
+        raise RuntimeError('Stockage des codes de vérification plein')
+
+    def _add_active(self, delta: int):
+        magic, capacity, active = self.HEADER.unpack_from(self.buffer, 0)
+        self.HEADER.pack_into(self.buffer, 0, magic, capacity, active + delta)
+
+    def _read(self, index: int) -> Dict[str, Any]:
+        state, verified, attempts, created_at, expires_at, code, method, _ = self.SLOT.unpack_from(
+            self.buffer, self._offset(index)
+        )
+        return {
+            'code': code.rstrip(b'\0').decode('utf-8'),
+            'method': method.rstrip(b'\0').decode('utf-8') or None,
+            'created_at': _from_timestamp(created_at),
+            'expires_at': _from_timestamp(expires_at),
+            'attempts': attempts,
+            'verified': bool(verified)
+        }
+
+    def _write(self, index: int, key: bytes, record: Dict[str, Any]):
+        self.SLOT.pack_into(
+            self.buffer, self._offset(index),
+            self.USED,
+            int(record.get('verified', False)),
+            record.get('attempts', 0),
+            _to_timestamp(record['created_at']),
+            _to_timestamp(record['expires_at']),
+            record['code'].encode('utf-8'),
+            (record.get('method') or '').encode('utf-8'),
+            key
+        )
+
+    def _home(self, index: int) -> int:
+        key = self.SLOT.unpack_from(self.buffer, self._offset(index))[7].rstrip(b'\0')
+        return zlib.crc32(key) % self.capacity
+
+    def _remove(self, index: int):
+        """
+        Libérer une case et décaler vers elle les entrées suivantes qui peuvent s'en rapprocher
+        """
+        size = self.SLOT.size
+        hole = index
+        current = index
+        while True:
+            current = (current + 1) % self.capacity
+            if self.buffer[self._offset(current)] == self.EMPTY:
+                break
+
+            # L'entrée reste si sa position d'origine est entre le trou (exclu) et elle (inclus)
+            home = self._home(current)
+            if (hole < current and hole < home <= current) or (current < hole and (home > hole or home <= current)):
+                continue
+
+            source, target = self._offset(current), self._offset(hole)
+            self.buffer[target:target + size] = self.buffer[source:source + size]
+            hole = current
+
+        self.buffer[self._offset(hole)] = self.EMPTY
+        self._add_active(-1)
+
+    def put(self, order_id: str, record: Dict[str, Any]):
+        key = self._key(order_id)
+        with self._locked():
+            index = self._find(key)
+            if index is None:
+                index = self._free_slot(key)
+                self._add_active(1)
+            self._write(index, key, record)
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        key = self._key(order_id)
+        with self._locked():
+            index = self._find(key)
+            return self._read(index) if index is not None else None
+
+    def increment_attempts(self, order_id: str) -> Optional[Dict[str, Any]]:
+        key = self._key(order_id)
+        with self._locked():
+            index = self._find(key)
+            if index is None:
+                return None
+            record = self._read(index)
+            record['attempts'] += 1
+            self._write(index, key, record)
+            return record
+
+    def mark_verified(self, order_id: str) -> bool:
+        key = self._key(order_id)
+        with self._locked():
+            index = self._find(key)
+            if index is None:
+                return False
+            record = self._read(index)
+            record['verified'] = True
+            self._write(index, key, record)
+            return True
+
+    def delete(self, order_id: str) -> bool:
+        key = self._key(order_id)
+        with self._locked():
+            index = self._find(key)
+            if index is None:
+                return False
+            self._remove(index)
+            return True
+
+    def expire(self, now: datetime, batch_size: int = 500) -> int:
+        threshold = _to_timestamp(now)
+        removed = 0
+        with self._locked():
+            # Clés relevées d'abord: une suppression décale les entrées suivantes
+            expired = []
+            for index in range(self.capacity):
+                state, _, _, _, expires_at, _, _, key = self.SLOT.unpack_from(self.buffer, self._offset(index))
+                if state == self.USED and expires_at <= threshold:
+                    expired.append(key.rstrip(b'\0'))
+                    if len(expired) >= batch_size:
+                        break
+
+            for key in expired:
+                index = self._find(key)
+                if index is not None:
+                    self._remove(index)
+                    removed += 1
+        return removed
+
+    def active_count(self) -> int:
+        return self.HEADER.unpack_from(self.buffer, 0)[2]
+
+
+class _FileLock:
+    """
+    Verrou combiné: threads du processus puis processus (fcntl)
+    """
+
+    def __init__(self, thread_lock: threading.Lock, fd: int):
+        self.thread_lock = thread_lock
+        self.fd = fd
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+
+class VerificationSweeper:
+    """
+    Thread d'arrière-plan qui supprime les codes expirés par lots
+    """
+
+    def __init__(self, store: VerificationStore, interval_seconds: float = 30.0, batch_size: int = 500):
+        self.store = store
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.thread: Optional[threading.Thread] = None
+        self.pid = None
+        self.stop_event = threading.Event()
+        self.expired_total = 0
+        self.last_run_at: Optional[datetime] = None
+        self.lock = threading.Lock()
+
+    def ensure_started(self):
+        """
+        Démarrer le thread s'il ne tourne pas dans ce processus (les threads ne survivent pas au fork)
+        """
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            return
+
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+                return
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target=self._run, name='verification-sweeper', daemon=True)
+            self.pid = os.getpid()
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def sweep(self) -> int:
+        """
+        Expirer tous les codes échus, un lot à la fois
+        """
+        now = datetime.utcnow()
+        removed = 0
+        while True:
+            batch_removed = self.store.expire(now, self.batch_size)
+            removed += batch_removed
+            if batch_removed < self.batch_size:
+                break
+
+        self.expired_total += removed
+        self.last_run_at = now
+        return removed
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval_seconds):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Erreur expiration des codes de vérification: {e}")
+
+
+def create_verification_store(backend: Optional[str] = None) -> VerificationStore:
+    """
+    Créer le backend configuré (VERIFICATION_STORE: sqlite, shared_memory ou memory)
+    """
+    backend = backend or os.environ.get('VERIFICATION_STORE', 'sqlite')
+
+    if backend == 'memory':
+        return MemoryVerificationStore()
+    if backend == 'shared_memory':
+        return SharedMemoryVerificationStore(
+            os.environ.get('VERIFICATION_STORE_PATH', '/dev/shm/retailbot_verification_codes'),
+            capacity=int(os.environ.get('VERIFICATION_STORE_CAPACITY', 16384))
+        )
+    if backend == 'sqlite':
+        return SQLiteVerificationStore(os.environ.get(
+            'VERIFICATION_STORE_PATH',
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'verification_codes.db')
+        ))
+
+    raise ValueError(f'Stockage de vérification inconnu: {backend}')
+
+
+_verification_store = None
+_verification_sweeper = None
+
+
+def get_verification_store() -> VerificationStore:
+    """
+    Stockage partagé des codes de vérification
+    """
+    global _verification_store
+    if _verification_store is None:
+        _verification_store = create_verification_store()
+    return _verification_store
+
+
+def get_verification_sweeper() -> VerificationSweeper:
+    """
+    Balayeur des codes expirés associé au stockage partagé
+    """
+    global _verification_sweeper
+    if _verification_sweeper is None:
+        _verification_sweeper = VerificationSweeper(get_verification_store())
+    return _verification_sweeper
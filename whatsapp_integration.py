@@ -1,4 +1,4 @@
-import requests
+from src.services.http_client import get_http_client
 import json
 from datetime import datetime
 from typing import Dict, List, Optional
@@ -16,13 +16,16 @@ class WhatsAppIntegration:
             'Authorization': f'Bearer {access_token}',
             'Content-Type': 'application/json'
         }
+        
+        # Session HTTP partagée (connexions persistantes vers l'API)
+        self.http = get_http_client()
     
     def test_connection(self) -> Dict:
         """
         Tester la connexion à l'API WhatsApp Business
         """
         try:
-            response = requests.get(
+            response = self.http.get(
                 f"https://graph.facebook.com/v18.0/{self.phone_number_id}",
                 headers=self.headers
             )
@@ -60,7 +63,7 @@ class WhatsAppIntegration:
                 }
             }
             
-            response = requests.post(
+            response = self.http.post(
                 f"{self.base_url}/messages",
                 headers=self.headers,
                 json=payload
@@ -110,7 +113,7 @@ class WhatsAppIntegration:
                 }
             }
             
-            response = requests.post(
+            response = self.http.post(
                 f"{self.base_url}/messages",
                 headers=self.headers,
                 json=payload
@@ -170,7 +173,7 @@ class WhatsAppIntegration:
                 }
             }
             
-            response = requests.post(
+            response = self.http.post(
                 f"{self.base_url}/messages",
                 headers=self.headers,
                 json=payload
@@ -236,7 +239,7 @@ class WhatsAppIntegration:
                 }
             }
             
-            response = requests.post(
+            response = self.http.post(
                 f"{self.base_url}/messages",
                 headers=self.headers,
                 json=payload
@@ -281,7 +284,7 @@ class WhatsAppIntegration:
                 media_type: media_object
             }
             
-            response = requests.post(
+            response = self.http.post(
                 f"{self.base_url}/messages",
                 headers=self.headers,
                 json=payload
@@ -318,7 +321,7 @@ class WhatsAppIntegration:
                 "message_id": message_id
             }
             
-            response = requests.post(
+            response = self.http.post(
                 f"{self.base_url}/messages",
                 headers=self.headers,
                 json=payload
@@ -345,40 +348,59 @@ class WhatsAppIntegration:
         """
         Traiter les données du webhook WhatsApp
         """
+        return self.parse_webhook(webhook_data)
+    
+    @classmethod
+    def parse_webhook(cls, webhook_data: Dict) -> Dict:
+        """
+        Extraire tous les messages entrants et tous les statuts de livraison d'un webhook
+        
+        Meta regroupe plusieurs statuts (sent, delivered, read, failed) dans un même
+        envoi: aucun n'est ignoré. Ne nécessite pas d'identifiants d'API.
+        """
         try:
             if 'entry' not in webhook_data:
                 return {'success': False, 'error': 'Format webhook invalide'}
             
+            messages = []
+            statuses = []
             for entry in webhook_data['entry']:
                 for change in entry.get('changes', []):
                     value = change.get('value', {})
                     
                     # Messages entrants
-                    if 'messages' in value:
-                        for message in value['messages']:
-                            return {
-                                'success': True,
-                                'type': 'message',
-                                'from': message['from'],
-                                'id': message['id'],
-                                'timestamp': message['timestamp'],
-                                'message_type': message['type'],
-                                'content': self._extract_message_content(message)
-                            }
+                    for message in value.get('messages', []):
+                        messages.append({
+                            'from': message['from'],
+                            'id': message['id'],
+                            'timestamp': message['timestamp'],
+                            'message_type': message['type'],
+                            'content': cls._extract_message_content(message)
+                        })
                     
                     # Statuts de livraison
-                    elif 'statuses' in value:
-                        for status in value['statuses']:
-                            return {
-                                'success': True,
-                                'type': 'status',
-                                'id': status['id'],
-                                'status': status['status'],
-                                'timestamp': status['timestamp'],
-                                'recipient_id': status['recipient_id']
-                            }
+                    for status in value.get('statuses', []):
+                        statuses.append({
+                            'id': status['id'],
+                            'status': status['status'],
+                            'timestamp': status['timestamp'],
+                            'recipient_id': status.get('recipient_id'),
+                            'errors': status.get('errors', [])
+                        })
             
-            return {'success': True, 'type': 'unknown'}
+            if messages:
+                webhook_type = 'message'
+            elif statuses:
+                webhook_type = 'status'
+            else:
+                webhook_type = 'unknown'
+            
+            return {
+                'success': True,
+                'type': webhook_type,
+                'messages': messages,
+                'statuses': statuses
+            }
             
         except Exception as e:
             return {
@@ -386,7 +408,8 @@ class WhatsAppIntegration:
                 'error': str(e)
             }
     
-    def _extract_message_content(self, message: Dict) -> str:
+    @staticmethod
+    def _extract_message_content(message: Dict) -> str:
         """
         Extraire le contenu d'un message selon son type
         """